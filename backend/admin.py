@@ -0,0 +1,25 @@
+import hmac
+from functools import wraps
+from flask import current_app, jsonify, request
+
+'''
+Helpers shared by the operational /admin endpoints.
+'''
+
+def admin_required(f):
+    """
+    Restrict an endpoint to operators.
+    When ADMIN_TOKEN is configured the request must send it in the X-Admin-Token header,
+    otherwise admin endpoints are only reachable in debug or testing mode.
+    """
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        token = current_app.config.get("ADMIN_TOKEN")
+        if token:
+            supplied = request.headers.get("X-Admin-Token", "")
+            if not hmac.compare_digest(supplied.encode("utf-8"), token.encode("utf-8")):
+                return jsonify({"message": "Admin token required"}), 403
+        elif not (current_app.debug or current_app.testing):
+            return jsonify({"message": "Admin endpoints are disabled"}), 403
+        return f(*args, **kwargs)
+    return decorated
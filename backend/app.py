@@ -1,14 +1,33 @@
 import os
+import json
+import time
 from flask import Flask, jsonify, request
 from flask_cors import CORS
-from pymongo import MongoClient
 from dotenv import load_dotenv
 import bcrypt
 import jwt
 import datetime
 from functools import wraps
 from bson import ObjectId 
-from search import create_search_indexes, register_search_endpoint  # Import functions from search.py
+from search import register_search_endpoint  # Import functions from search.py
+from metrics import mongo_command_listener, register_metrics
+from slow_queries import slow_query_listener, register_slow_query_endpoint
+from db_budget import request_db_listener, register_db_budget
+from profiling import register_profiling
+from json_provider import BSONJSONProvider
+from compression import register_compression
+from database import connection_manager, pool_options
+from migrations import REFERENCES_VERSION, check_schema, migrate, register_migrations, target_version
+from events import publish, CREATED, UPDATED, DELETED
+from deadlines import register_deadlines
+from references import owner, ref, set_dual_read
+from label_inheritance import note_labels, propagate_notebook, propagate_section, section_labels
+from moves import RANK_ORDER, append_rank, register_move_endpoints
+from duplication import register_duplicate_endpoint
+from attachments import referenced_files, register_attachment_endpoints, release_files
+from jobs import job_handler, public, register_jobs, submit
+from idempotency import idempotent
+from live_updates import register_live_updates
 
 '''
 The endpoints are organized and prefixed with comments mandating the inclusion of the code block
@@ -23,10 +42,89 @@ load_dotenv()
 # Initialize flask app
 app = Flask(__name__)
 CORS(app, resources={r"/*": {"origins": "*"}})
+# Serialize ObjectId and datetime values directly instead of converting each document
+app.json = BSONJSONProvider(app)
 
 # Flask configuration
 app.config["SECRET_KEY"] = os.getenv("SECRET_KEY", "your_secret_key")
 app.config["MONGO_URI"] = os.getenv("MONGO_URI", "mongodb://localhost:27017/note_app")
+app.config["ADMIN_TOKEN"] = os.getenv("ADMIN_TOKEN", "")
+# Operations slower than this are logged and explained, a negative value disables the log
+app.config["SLOW_QUERY_THRESHOLD_MS"] = float(os.getenv("SLOW_QUERY_THRESHOLD_MS", "100"))
+app.config["SLOW_QUERY_LOG"] = os.getenv(
+    "SLOW_QUERY_LOG", os.path.join(os.path.dirname(os.path.abspath(__file__)), "logs", "slow_queries.log")
+)
+# Requests using more database operations than their budget are logged as N+1 suspects
+app.config["DB_OP_BUDGET_DEFAULT"] = int(os.getenv("DB_OP_BUDGET_DEFAULT", "10"))
+app.config["DB_OP_BUDGETS"] = json.loads(os.getenv("DB_OP_BUDGETS", "{}"))
+app.config["DB_OPS_HEADER"] = os.getenv("DB_OPS_HEADER", "false").lower() == "true"
+# Sampling profiler for live requests, see profiling.py
+app.config["PROFILE_SAMPLE_RATE"] = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+app.config["PROFILE_INTERVAL_MS"] = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+app.config["PROFILE_DIR"] = os.getenv(
+    "PROFILE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "logs", "profiles")
+)
+# Response compression, bodies smaller than COMPRESS_MIN_SIZE bytes are sent as they are
+app.config["COMPRESS_ENABLED"] = os.getenv("COMPRESS_ENABLED", "true").lower() == "true"
+app.config["COMPRESS_MIN_SIZE"] = int(os.getenv("COMPRESS_MIN_SIZE", "1024"))
+app.config["COMPRESS_LEVEL"] = int(os.getenv("COMPRESS_LEVEL", "6"))
+app.config["COMPRESS_ALGORITHMS"] = tuple(os.getenv("COMPRESS_ALGORITHMS", "br,zstd,gzip").split(","))
+app.config["COMPRESS_STREAMS"] = os.getenv("COMPRESS_STREAMS", "true").lower() == "true"
+# MongoDB connection pool, unset values keep the pymongo defaults
+app.config["MONGO_MAX_POOL_SIZE"] = int(os.getenv("MONGO_MAX_POOL_SIZE")) if os.getenv("MONGO_MAX_POOL_SIZE") else None
+app.config["MONGO_MIN_POOL_SIZE"] = int(os.getenv("MONGO_MIN_POOL_SIZE")) if os.getenv("MONGO_MIN_POOL_SIZE") else None
+app.config["MONGO_WAIT_QUEUE_TIMEOUT_MS"] = (
+    int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS")) if os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS") else None
+)
+# Wire protocol compression, e.g. "zstd,snappy,zlib"
+app.config["MONGO_COMPRESSORS"] = os.getenv("MONGO_COMPRESSORS", "")
+# Search engine for text queries: "mongo" (text indexes) or "inverted" (embedded BM25 index, single process)
+app.config["SEARCH_BACKEND"] = os.getenv("SEARCH_BACKEND", "mongo")
+app.config["SEARCH_INDEX_DIR"] = os.getenv(
+    "SEARCH_INDEX_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "search_index")
+)
+# Users whose index is kept open in memory
+app.config["SEARCH_INDEX_MAX_USERS"] = int(os.getenv("SEARCH_INDEX_MAX_USERS", "32"))
+# Users whose note vectors are kept in memory for mode=semantic searches
+app.config["SEMANTIC_INDEX_MAX_USERS"] = int(os.getenv("SEMANTIC_INDEX_MAX_USERS", "16"))
+# Apply pending schema migrations on startup instead of through the CLI (always on in tests)
+app.config["AUTO_MIGRATE"] = os.getenv("AUTO_MIGRATE", "false").lower() == "true"
+# Refuse to start when the database schema does not match the code, instead of only warning
+app.config["SCHEMA_STRICT"] = os.getenv("SCHEMA_STRICT", "false").lower() == "true"
+# Longest time GET requests may spend in the database (0 disables), clients can ask for less with X-Request-Deadline
+app.config["REQUEST_DEADLINE_MS"] = float(os.getenv("REQUEST_DEADLINE_MS", "10000"))
+app.config["SEARCH_DEADLINE_MS"] = float(os.getenv("SEARCH_DEADLINE_MS", "5000"))
+# Background jobs, see jobs.py. JOB_WORKERS=0 leaves them to "flask --app app jobs work" processes
+app.config["JOB_WORKERS"] = int(os.getenv("JOB_WORKERS", "2"))
+app.config["JOB_LEASE_SECONDS"] = int(os.getenv("JOB_LEASE_SECONDS", "300"))
+# Notebooks with more notes than this are duplicated or deleted by a background job
+app.config["DUPLICATE_BACKGROUND_NOTES"] = int(os.getenv("DUPLICATE_BACKGROUND_NOTES", "1000"))
+app.config["DELETE_BACKGROUND_NOTES"] = int(os.getenv("DELETE_BACKGROUND_NOTES", "1000"))
+# Largest attachment upload in bytes, 0 for no limit
+app.config["ATTACHMENT_MAX_BYTES"] = int(os.getenv("ATTACHMENT_MAX_BYTES", str(100 * 1024 * 1024)))
+# Hours a create request's Idempotency-Key is remembered, see idempotency.py
+app.config["IDEMPOTENCY_KEY_HOURS"] = float(os.getenv("IDEMPOTENCY_KEY_HOURS", "24"))
+# Threads running the Flask endpoints when served by the ASGI app in asgi.py
+app.config["ASGI_WSGI_THREADS"] = int(os.getenv("ASGI_WSGI_THREADS", "10"))
+# Server-Sent Events change feed at /api/users/<user_id>/events, see live_updates.py
+app.config["LIVE_UPDATES_BUFFER"] = int(os.getenv("LIVE_UPDATES_BUFFER", "256"))
+app.config["LIVE_UPDATES_HEARTBEAT_SECONDS"] = float(os.getenv("LIVE_UPDATES_HEARTBEAT_SECONDS", "15"))
+app.config["LIVE_UPDATES_STREAM_SECONDS"] = float(os.getenv("LIVE_UPDATES_STREAM_SECONDS", "300"))
+# Share change events between backend processes through a MongoDB change stream (needs a replica set)
+app.config["LIVE_UPDATES_CHANGE_STREAMS"] = os.getenv("LIVE_UPDATES_CHANGE_STREAMS", "false").lower() == "true"
+
+# Request and database metrics exposed at /metrics
+register_metrics(app)
+# Slow query log exposed at /admin/slow-queries
+register_slow_query_endpoint(app)
+# Per-request database operation counts, sent as X-DB-Ops in debug mode
+register_db_budget(app)
+# Opt-in request profiling, flamegraph input listed at /admin/profiles
+register_profiling(app)
+# Registered after the metrics hooks so response sizes are recorded after compression
+register_compression(app)
+# Database deadlines for reads, answering 504 when they run out
+register_deadlines(app)
 
 # Global database variables
 db = None
@@ -36,12 +134,24 @@ sections_collection = None
 notes_collection = None
 
 # Init db function to make testing easier
-def init_db(app):
+def init_db(app, check=True):
     global db, users_collection, notebooks_collection, sections_collection, notes_collection
     
     # Get URI from app config
     mongo_uri = app.config["MONGO_URI"]
-    client = MongoClient(mongo_uri)
+
+    slow_query_log = app.config.get("SLOW_QUERY_LOG")
+    if slow_query_log:
+        os.makedirs(os.path.dirname(slow_query_log), exist_ok=True)
+    slow_query_listener.configure(app.config["SLOW_QUERY_THRESHOLD_MS"], slow_query_log)
+
+    # One client per process, reused across init_db calls and rebuilt after a fork
+    client = connection_manager.get_client(
+        mongo_uri,
+        pool_options(app.config),
+        event_listeners=[mongo_command_listener, slow_query_listener, request_db_listener],
+    )
+    slow_query_listener.attach(client)
     
     # Extract database name from URI
     db_name = mongo_uri.split("/")[-1]
@@ -53,13 +163,49 @@ def init_db(app):
     sections_collection = db["sections"]
     notes_collection = db["notes"]
     
- 
-    create_search_indexes(db)
+    # Index builds and backfills are migrations, startup only reads the schema version.
+    # The schema CLI passes check=False so it can connect to an outdated database
+    if check and (app.config.get("AUTO_MIGRATE") or app.testing):
+        migrate(db)
+        version = target_version()
+    elif check:
+        version = check_schema(db, strict=app.config.get("SCHEMA_STRICT", False))
+    else:
+        version = 0
+    # Until the references migration has run, documents may still hold string ids
+    set_dual_read(version < REFERENCES_VERSION)
     
     return db
 
+# Schema CLI: flask --app app schema migrate
+register_migrations(app, lambda: init_db(app, check=False))
+
 # Initialization calls are done at the end of the file
 
+# Forked workers inherit the parent's client, build a fresh one before the first request in the child
+@app.before_request
+def reinit_db_after_fork():
+    if connection_manager.needs_reinit():
+        init_db(app)
+
+# Search endpoint, collections are looked up per request since init_db can replace them
+register_search_endpoint(app, lambda: (notebooks_collection, sections_collection, notes_collection))
+
+# Background jobs and their status endpoint, "flask --app app jobs work" runs them in a separate process
+register_jobs(app, lambda: db, lambda: init_db(app))
+
+# Move and reorder endpoints for sections and notes, see moves.py
+register_move_endpoints(app, lambda: (notebooks_collection, sections_collection, notes_collection))
+
+# Notebook duplication inside MongoDB, see duplication.py
+register_duplicate_endpoint(app, lambda: (notebooks_collection, sections_collection, notes_collection))
+
+# Note attachments stored in GridFS, see attachments.py
+register_attachment_endpoints(app, lambda: db)
+
+# Live change events for clients over Server-Sent Events, see live_updates.py
+register_live_updates(app, lambda: db)
+
 # ------------------------------------------------------------------------------
 # API Status Endpoint
 # ------------------------------------------------------------------------------
@@ -67,6 +213,20 @@ def init_db(app):
 def api_status():
     return jsonify({"message": "API is running!"})
 
+# Readiness check, pings the database and reports connection pool usage
+@app.route("/api/health", methods=["GET"])
+def health():
+    pool = connection_manager.stats()
+    if db is None:
+        return jsonify({"status": "unavailable", "error": "Database not initialized", "pool": pool}), 503
+    started = time.perf_counter()
+    try:
+        db.command("ping")
+    except Exception as e:
+        return jsonify({"status": "unavailable", "error": str(e), "pool": pool}), 503
+    ping_ms = round((time.perf_counter() - started) * 1000, 3)
+    return jsonify({"status": "ok", "ping_ms": ping_ms, "pool": connection_manager.stats()}), 200
+
 # ------------------------------------------------------------------------------
 # User Registration & Login Endpoints
 '''
@@ -117,8 +277,6 @@ def get_user():
 @app.route("/api/users", methods=["GET"])
 def get_all_users():
     users = list(users_collection.find({}, {"password": 0}))  # Exclude password
-    for user in users:
-        user["_id"] = str(user["_id"])  # Convert ObjectId to string
     return jsonify({"users": users}), 200
 
 
@@ -132,23 +290,23 @@ FR11, FR12, FR13 located in section 4.4 of the SRS.
 # --- Notebooks Endpoints ---
 @app.route("/api/users/<user_id>/notebooks", methods=["GET"])
 def get_user_notebooks(user_id):
-    notebooks = list(notebooks_collection.find({"user_id": user_id}))
-    for nb in notebooks:
-        nb["_id"] = str(nb["_id"])
+    notebooks = list(notebooks_collection.find(owner(user_id)))
     return jsonify({"notebooks": notebooks}), 200
 
 @app.route("/api/users/<user_id>/notebooks", methods=["POST"])
+@idempotent(lambda: db)
 def create_notebook(user_id):
     data = request.get_json()
     notebook = {
-        "user_id": user_id,
+        "user_id": ref(user_id),
         "name": data.get("name", "Untitled Notebook"),
         "labels": data.get("labels", []), 
         "created_at": datetime.datetime.utcnow(),
         "updated_at": datetime.datetime.utcnow()
     }
-    result = notebooks_collection.insert_one(notebook)
-    notebook["_id"] = str(result.inserted_id)
+    # insert_one sets notebook["_id"], the JSON provider serializes the ObjectId
+    notebooks_collection.insert_one(notebook)
+    publish("notebook", CREATED, user_id, notebook["_id"], notebook)
     return jsonify({"notebook": notebook}), 201
 
 @app.route("/api/users/<user_id>/notebooks/<notebook_id>", methods=["PUT"])
@@ -162,47 +320,78 @@ def update_notebook(user_id, notebook_id):
     if "labels" in data:
         updated["labels"] = data.get("labels", [])
     result = notebooks_collection.update_one(
-        {"_id": ObjectId(notebook_id), "user_id": user_id},
+        {"_id": ObjectId(notebook_id), **owner(user_id)},
         {"$set": updated}
     )
     if result.matched_count == 0:
         return jsonify({"message": "Notebook not found"}), 404
+    if "labels" in updated:
+        propagate_notebook(sections_collection, notes_collection, user_id, notebook_id, updated["labels"])
+    publish("notebook", UPDATED, user_id, notebook_id, updated)
     return jsonify({"message": "Notebook updated successfully"}), 200
 
 @app.route("/api/users/<user_id>/notebooks/<notebook_id>", methods=["DELETE"])
 def delete_notebook(user_id, notebook_id):
-    result = notebooks_collection.delete_one({"_id": ObjectId(notebook_id), "user_id": user_id})
+    result = notebooks_collection.delete_one({"_id": ObjectId(notebook_id), **owner(user_id)})
     if result.deleted_count == 0:
         return jsonify({"message": "Notebook not found"}), 404
-    # Delete associated sections and notes
-    sections = list(sections_collection.find({"notebook_id": notebook_id, "user_id": user_id}))
-    for sec in sections:
-        sec_id = str(sec["_id"])
-        notes_collection.delete_many({"section_id": sec_id, "user_id": user_id})
-    sections_collection.delete_many({"notebook_id": notebook_id, "user_id": user_id})
+    # Delete associated sections and notes, notes carry their notebook_id so no per-section loop is needed
+    limit = app.config["DELETE_BACKGROUND_NOTES"]
+    if notes_collection.count_documents(owner(user_id, notebook_id=notebook_id), limit=limit + 1) > limit:
+        job = submit(app, "delete_notebook_contents", user_id, {"notebook_id": notebook_id})
+        publish("notebook", DELETED, user_id, notebook_id)
+        return jsonify({"message": "Notebook deleted, its sections/notes are being deleted", "job": public(job)}), 202
+    attachments = referenced_files(notes_collection, owner(user_id, notebook_id=notebook_id))
+    notes_collection.delete_many(owner(user_id, notebook_id=notebook_id))
+    sections_collection.delete_many(owner(user_id, notebook_id=notebook_id))
+    release_files(db, attachments)
+    publish("notebook", DELETED, user_id, notebook_id)
     return jsonify({"message": "Notebook and its sections/notes deleted"}), 200
 
+# Notes deleted per batch by the background delete of a large notebook
+DELETE_BATCH_SIZE = 1000
+
+@job_handler("delete_notebook_contents")
+def delete_notebook_contents(context, params):
+    """Delete the sections and notes of a deleted notebook in batches, safe to retry"""
+    notes, query = context.db["notes"], owner(context.user_id, notebook_id=params["notebook_id"])
+    total = notes.count_documents(query)
+    deleted = 0
+    while True:
+        batch = [note["_id"] for note in notes.find(query, {"_id": 1}).limit(DELETE_BATCH_SIZE)]
+        if not batch:
+            break
+        attachments = referenced_files(notes, {"_id": {"$in": batch}})
+        deleted += notes.delete_many({"_id": {"$in": batch}}).deleted_count
+        release_files(context.db, attachments)
+        context.report("Deleting notes", deleted, total)
+    context.db["sections"].delete_many(query)
+    return {"notes_deleted": deleted}
+
 # --- Sections Endpoints ---
 @app.route("/api/users/<user_id>/notebooks/<notebook_id>/sections", methods=["GET"])
 def get_sections(user_id, notebook_id):
-    sections = list(sections_collection.find({"notebook_id": notebook_id, "user_id": user_id}))
-    for sec in sections:
-        sec["_id"] = str(sec["_id"])
+    sections = list(sections_collection.find(owner(user_id, notebook_id=notebook_id)).sort(RANK_ORDER))
     return jsonify({"sections": sections}), 200
 
 @app.route("/api/users/<user_id>/notebooks/<notebook_id>/sections", methods=["POST"])
+@idempotent(lambda: db)
 def create_section(user_id, notebook_id):
     data = request.get_json()
     section = {
-        "user_id": user_id,
-        "notebook_id": notebook_id,
+        "user_id": ref(user_id),
+        "notebook_id": ref(notebook_id),
         "title": data.get("title", "New Section"),
         "labels": data.get("labels", []), 
+        # Own labels plus the notebook's, see label_inheritance.py
+        "effective_labels": section_labels(notebooks_collection, user_id, notebook_id, data.get("labels", [])),
+        # Listed after the notebook's other sections
+        "rank": append_rank(sections_collection, owner(user_id, notebook_id=notebook_id)),
         "created_at": datetime.datetime.utcnow(),
         "updated_at": datetime.datetime.utcnow()
     }
-    result = sections_collection.insert_one(section)
-    section["_id"] = str(result.inserted_id)
+    sections_collection.insert_one(section)
+    publish("section", CREATED, user_id, section["_id"], section)
     return jsonify({"section": section}), 201
 
 @app.route("/api/users/<user_id>/notebooks/<notebook_id>/sections/<section_id>", methods=["PUT"])
@@ -215,22 +404,29 @@ def update_section(user_id, notebook_id, section_id):
     # Add labels if provided
     if "labels" in data:
         updated["labels"] = data.get("labels", [])
+        updated["effective_labels"] = section_labels(notebooks_collection, user_id, notebook_id, updated["labels"])
     result = sections_collection.update_one(
-        {"_id": ObjectId(section_id), "notebook_id": notebook_id, "user_id": user_id},
+        {"_id": ObjectId(section_id), **owner(user_id, notebook_id=notebook_id)},
         {"$set": updated}
     )
     if result.matched_count == 0:
         return jsonify({"message": "Section not found"}), 404
+    if "labels" in updated:
+        propagate_section(notes_collection, user_id, section_id, updated.pop("effective_labels"))
+    publish("section", UPDATED, user_id, section_id, dict(updated, notebook_id=notebook_id))
     return jsonify({"message": "Section updated successfully"}), 200
 
 @app.route("/api/users/<user_id>/notebooks/<notebook_id>/sections/<section_id>", methods=["DELETE"])
 def delete_section(user_id, notebook_id, section_id):
     result = sections_collection.delete_one(
-        {"_id": ObjectId(section_id), "notebook_id": notebook_id, "user_id": user_id}
+        {"_id": ObjectId(section_id), **owner(user_id, notebook_id=notebook_id)}
     )
     if result.deleted_count == 0:
         return jsonify({"message": "Section not found"}), 404
-    notes_collection.delete_many({"section_id": section_id, "user_id": user_id})
+    attachments = referenced_files(notes_collection, owner(user_id, section_id=section_id))
+    notes_collection.delete_many(owner(user_id, section_id=section_id))
+    release_files(db, attachments)
+    publish("section", DELETED, user_id, section_id, {"notebook_id": notebook_id})
     return jsonify({"message": "Section and its notes deleted"}), 200
 
 '''
@@ -239,41 +435,39 @@ The following endpoints help implement FR6 and FR8 of section 4.3 Note Taking wi
 # --- Notes Endpoints ---
 @app.route("/api/users/<user_id>/notebooks/<notebook_id>/sections/<section_id>/notes", methods=["GET"])
 def get_notes(user_id, notebook_id, section_id):
-    notes = list(notes_collection.find({"section_id": section_id, "user_id": user_id}))
-    for note in notes:
-        note["_id"] = str(note["_id"])
+    notes = list(notes_collection.find(owner(user_id, section_id=section_id)).sort(RANK_ORDER))
     return jsonify({"notes": notes}), 200
 
 # get a single note
 @app.route("/api/users/<user_id>/notebooks/<notebook_id>/sections/<section_id>/notes/<note_id>", methods=["GET"])
 def get_note(user_id, notebook_id, section_id, note_id):
-    note = notes_collection.find_one({
-        "_id": ObjectId(note_id), 
-        "section_id": section_id, 
-        "user_id": user_id
-    })
+    note = notes_collection.find_one({"_id": ObjectId(note_id), **owner(user_id, section_id=section_id)})
     
     if not note:
         return jsonify({"message": "Note not found"}), 404
         
-    note["_id"] = str(note["_id"])
     return jsonify({"note": note}), 200
 
 @app.route("/api/users/<user_id>/notebooks/<notebook_id>/sections/<section_id>/notes", methods=["POST"])
+@idempotent(lambda: db)
 def create_note(user_id, notebook_id, section_id):
     data = request.get_json()
     note = {
-        "user_id": user_id,
-        "notebook_id": notebook_id,
-        "section_id": section_id,
+        "user_id": ref(user_id),
+        "notebook_id": ref(notebook_id),
+        "section_id": ref(section_id),
         "title": data.get("title", "New Note"),
         "content": data.get("content", ""),
         "labels": data.get("labels", []),
+        # Own labels plus the section's and notebook's, see label_inheritance.py
+        "effective_labels": note_labels(sections_collection, user_id, section_id, data.get("labels", [])),
+        # Listed after the section's other notes
+        "rank": append_rank(notes_collection, owner(user_id, section_id=section_id)),
         "created_at": datetime.datetime.utcnow(),
         "updated_at": datetime.datetime.utcnow()
     }
-    result = notes_collection.insert_one(note)
-    note["_id"] = str(result.inserted_id)
+    notes_collection.insert_one(note)
+    publish("note", CREATED, user_id, note["_id"], note)
     return jsonify({"note": note}), 201
 
 @app.route("/api/users/<user_id>/notebooks/<notebook_id>/sections/<section_id>/notes/<note_id>", methods=["PUT"])
@@ -286,21 +480,25 @@ def update_note(user_id, notebook_id, section_id, note_id):
     }
     if "labels" in data:
         updated["labels"] = data.get("labels", [])
+        updated["effective_labels"] = note_labels(sections_collection, user_id, section_id, updated["labels"])
     result = notes_collection.update_one(
-        {"_id": ObjectId(note_id), "section_id": section_id, "user_id": user_id},
+        {"_id": ObjectId(note_id), **owner(user_id, section_id=section_id)},
         {"$set": updated}
     )
     if result.matched_count == 0:
         return jsonify({"message": "Note not found"}), 404
+    publish("note", UPDATED, user_id, note_id, dict(updated, notebook_id=notebook_id, section_id=section_id))
     return jsonify({"message": "Note updated successfully"}), 200
 
 @app.route("/api/users/<user_id>/notebooks/<notebook_id>/sections/<section_id>/notes/<note_id>", methods=["DELETE"])
 def delete_note(user_id, notebook_id, section_id, note_id):
-    result = notes_collection.delete_one(
-        {"_id": ObjectId(note_id), "section_id": section_id, "user_id": user_id}
+    note = notes_collection.find_one_and_delete(
+        {"_id": ObjectId(note_id), **owner(user_id, section_id=section_id)}, {"attachments.file_id": 1}
     )
-    if result.deleted_count == 0:
+    if note is None:
         return jsonify({"message": "Note not found"}), 404
+    release_files(db, [attachment["file_id"] for attachment in note.get("attachments", [])])
+    publish("note", DELETED, user_id, note_id, {"notebook_id": notebook_id, "section_id": section_id})
     return jsonify({"message": "Note deleted successfully"}), 200
 
     
@@ -325,12 +523,15 @@ def update_notebook_labels(user_id, notebook_id):
     labels = data.get("labels", [])
     
     result = notebooks_collection.update_one(
-        {"_id": ObjectId(notebook_id), "user_id": user_id},
+        {"_id": ObjectId(notebook_id), **owner(user_id)},
         {"$set": {"labels": labels, "updated_at": datetime.datetime.utcnow()}}
     )
     
     if result.matched_count == 0:
         return jsonify({"message": "Notebook not found"}), 404
+    # Sections and notes inherit the notebook's labels
+    propagate_notebook(sections_collection, notes_collection, user_id, notebook_id, labels)
+    publish("notebook", UPDATED, user_id, notebook_id, {"labels": labels})
         
     return jsonify({"message": "Labels updated successfully"}), 200
 
@@ -343,14 +544,17 @@ def update_section_labels(user_id, notebook_id, section_id):
         return jsonify({"message": "Labels field is required"}), 400
         
     labels = data.get("labels", [])
+    effective = section_labels(notebooks_collection, user_id, notebook_id, labels)
     
     result = sections_collection.update_one(
-        {"_id": ObjectId(section_id), "notebook_id": notebook_id, "user_id": user_id},
-        {"$set": {"labels": labels, "updated_at": datetime.datetime.utcnow()}}
+        {"_id": ObjectId(section_id), **owner(user_id, notebook_id=notebook_id)},
+        {"$set": {"labels": labels, "effective_labels": effective, "updated_at": datetime.datetime.utcnow()}}
     )
     
     if result.matched_count == 0:
         return jsonify({"message": "Section not found"}), 404
+    propagate_section(notes_collection, user_id, section_id, effective)
+    publish("section", UPDATED, user_id, section_id, {"labels": labels, "notebook_id": notebook_id})
         
     return jsonify({"message": "Labels updated successfully"}), 200
 
@@ -363,14 +567,16 @@ def update_note_labels(user_id, notebook_id, section_id, note_id):
         return jsonify({"message": "Labels field is required"}), 400
         
     labels = data.get("labels", [])
+    effective = note_labels(sections_collection, user_id, section_id, labels)
     
     result = notes_collection.update_one(
-        {"_id": ObjectId(note_id), "section_id": section_id, "user_id": user_id},
-        {"$set": {"labels": labels, "updated_at": datetime.datetime.utcnow()}}
+        {"_id": ObjectId(note_id), **owner(user_id, section_id=section_id)},
+        {"$set": {"labels": labels, "effective_labels": effective, "updated_at": datetime.datetime.utcnow()}}
     )
     
     if result.matched_count == 0:
         return jsonify({"message": "Note not found"}), 404
+    publish("note", UPDATED, user_id, note_id, {"labels": labels, "notebook_id": notebook_id, "section_id": section_id})
         
     return jsonify({"message": "Labels updated successfully"}), 200
 
@@ -379,11 +585,11 @@ def update_note_labels(user_id, notebook_id, section_id, note_id):
 def get_all_user_labels(user_id):
     # We need to get all unique labels across the objects
     
-    notebook_labels = notebooks_collection.distinct("labels", {"user_id": user_id})
+    notebook_labels = notebooks_collection.distinct("labels", owner(user_id))
     
-    section_labels = sections_collection.distinct("labels", {"user_id": user_id})
+    section_labels = sections_collection.distinct("labels", owner(user_id))
     
-    note_labels = notes_collection.distinct("labels", {"user_id": user_id})
+    note_labels = notes_collection.distinct("labels", owner(user_id))
     
     # Combine all and remove duplicates
     all_labels = sorted(list(set(notebook_labels + section_labels + note_labels)))
@@ -399,9 +605,6 @@ def setup_app():
     with app.app_context():
         init_db(app)
     
-    # Register the search endpoint
-    register_search_endpoint(app, notebooks_collection, sections_collection, notes_collection)
-    
     return app
 
 # ------------------------------------------------------------------------------
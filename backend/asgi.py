@@ -0,0 +1,267 @@
+import asyncio
+import contextlib
+import datetime
+import json
+import time
+
+import bcrypt
+import jwt
+from a2wsgi import WSGIMiddleware
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import ExecutionTimeout
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.responses import Response
+from starlette.routing import Mount, Route
+
+from app import app as flask_app, init_db
+from database import pool_options
+from deadlines import DEADLINE_HEADER, parse_deadline
+from metrics import (http_request_duration_seconds, http_request_errors_total, http_requests_in_flight,
+                     http_requests_total, http_response_size_bytes, mongo_command_listener)
+from moves import RANK_ORDER
+from references import owner
+
+'''
+The code in this file is the async deployment of the API, run with an ASGI server:
+
+    uvicorn asgi:app --workers 4
+
+The routes are the ones defined in app.py. Endpoints that only read, and login and
+registration (which spend their time in bcrypt), have async versions below using
+Motor, so a slow query or a password hash no longer holds one of a fixed number of
+worker threads: one process serves as many concurrent requests as its event loop
+and connection pool allow. Every other endpoint, the writes with their event
+publishing, idempotency keys and search index updates among them, is served by the
+Flask app itself, mounted under the async routes and run in a thread pool.
+
+The async endpoints answer like their Flask versions (tests/test_asgi.py runs the
+Flask tests against this app), apply the same request deadlines through maxTimeMS,
+and are recorded in the same /metrics.
+'''
+
+# Flask endpoints served by the async views below, the paths come from app.py
+ASYNC_VIEWS = {}
+
+
+def async_view(endpoint):
+    """Register an async view to serve the Flask endpoint of the same name"""
+    def decorator(func):
+        ASYNC_VIEWS[endpoint] = func
+        return func
+    return decorator
+
+
+def _json(payload, status=200):
+    # Same serializer as the Flask app, ObjectIds and datetimes come out identical
+    return Response(flask_app.json.dumps(payload) + "\n", status_code=status, media_type="application/json")
+
+
+async def _body(request):
+    """The JSON body, or the error response Flask's get_json gives"""
+    if request.headers.get("content-type", "").split(";")[0].strip() != "application/json":
+        return None, _json({"message": "Request body must be JSON"}, 415)
+    try:
+        return json.loads(await request.body()), None
+    except ValueError:
+        return None, _json({"message": "Invalid JSON body"}, 400)
+
+
+def _deadline_ms(request):
+    """maxTimeMS for a GET request as register_deadlines computes it, None without a deadline"""
+    limit_ms = flask_app.config.get("REQUEST_DEADLINE_MS")
+    header = request.headers.get(DEADLINE_HEADER)
+    if header:
+        client_ms = parse_deadline(header)
+        limit_ms = min(limit_ms, client_ms) if limit_ms else client_ms
+    return int(limit_ms) if limit_ms else None
+
+
+def _endpoint(func, rule):
+    """Wrap an async view with the deadline, error and metrics handling of the Flask hooks"""
+    async def endpoint(request):
+        labels = (("route", rule), ("method", request.method))
+        started = time.perf_counter()
+        http_requests_in_flight.inc(labels)
+        try:
+            request.state.max_time_ms = _deadline_ms(request) if request.method == "GET" else None
+        except ValueError as e:
+            response = _json({"message": str(e)}, 400)
+        else:
+            try:
+                response = await func(request, **request.path_params)
+            except ExecutionTimeout:
+                response = _json({"message": "Request deadline exceeded"}, 504)
+            except Exception:
+                http_requests_in_flight.dec(labels)
+                http_requests_total.inc(labels + (("status", "500"),))
+                http_request_errors_total.inc(labels)
+                raise
+        http_requests_in_flight.dec(labels)
+        http_request_duration_seconds.observe(time.perf_counter() - started, labels)
+        http_requests_total.inc(labels + (("status", str(response.status_code)),))
+        http_response_size_bytes.observe(len(response.body), labels)
+        return response
+    return endpoint
+
+
+def _find(collection, request, query, projection=None):
+    cursor = collection.find(query, projection)
+    if request.state.max_time_ms:
+        cursor = cursor.max_time_ms(request.state.max_time_ms)
+    return cursor
+
+
+def _time_limit(request):
+    return {"maxTimeMS": request.state.max_time_ms} if request.state.max_time_ms else {}
+
+
+# ------------------------------------------------------------------------------
+# User Registration & Login Endpoints
+# ------------------------------------------------------------------------------
+@async_view("register")
+async def register(request):
+    data, error = await _body(request)
+    if error:
+        return error
+    email = data.get("email")
+    username = data.get("username")
+    password = data.get("password")
+    if not email or not username or not password:
+        return _json({"message": "Missing required fields"}, 400)
+    users = request.app.state.db["users"]
+    if await users.find_one({"$or": [{"email": email}, {"username": username}]}):
+        return _json({"message": "User already exists"}, 400)
+    # bcrypt runs for tens of milliseconds, off the event loop
+    hashed = await run_in_threadpool(bcrypt.hashpw, password.encode("utf-8"), bcrypt.gensalt())
+    user = {
+        "email": email,
+        "username": username,
+        "password": hashed,
+        "created_at": datetime.datetime.utcnow()
+    }
+    result = await users.insert_one(user)
+    return _json({"message": "User registered successfully", "user_id": str(result.inserted_id)}, 201)
+
+
+@async_view("login")
+async def login(request):
+    data, error = await _body(request)
+    if error:
+        return error
+    username = data.get("username")
+    password = data.get("password")
+    if not username or not password:
+        return _json({"message": "Missing required fields"}, 400)
+    user = await request.app.state.db["users"].find_one({"username": username})
+    if not user or not await run_in_threadpool(bcrypt.checkpw, password.encode("utf-8"), user["password"]):
+        return _json({"message": "Invalid credentials"}, 401)
+    token = jwt.encode({
+        "user_id": str(user["_id"]),
+        "exp": datetime.datetime.utcnow() + datetime.timedelta(hours=24)
+    }, flask_app.config["SECRET_KEY"], algorithm="HS256")
+    return _json({"token": token}, 200)
+
+
+@async_view("get_all_users")
+async def get_all_users(request):
+    users = await _find(request.app.state.db["users"], request, {}, {"password": 0}).to_list(None)
+    return _json({"users": users}, 200)
+
+
+# ------------------------------------------------------------------------------
+# Notebooks → Sections → Notes reads
+# ------------------------------------------------------------------------------
+@async_view("get_user_notebooks")
+async def get_user_notebooks(request, user_id):
+    notebooks = await _find(request.app.state.db["notebooks"], request, owner(user_id)).to_list(None)
+    return _json({"notebooks": notebooks}, 200)
+
+
+@async_view("get_sections")
+async def get_sections(request, user_id, notebook_id):
+    cursor = _find(request.app.state.db["sections"], request, owner(user_id, notebook_id=notebook_id))
+    sections = await cursor.sort(RANK_ORDER).to_list(None)
+    return _json({"sections": sections}, 200)
+
+
+@async_view("get_notes")
+async def get_notes(request, user_id, notebook_id, section_id):
+    cursor = _find(request.app.state.db["notes"], request, owner(user_id, section_id=section_id))
+    notes = await cursor.sort(RANK_ORDER).to_list(None)
+    return _json({"notes": notes}, 200)
+
+
+@async_view("get_note")
+async def get_note(request, user_id, notebook_id, section_id, note_id):
+    note = await request.app.state.db["notes"].find_one(
+        {"_id": ObjectId(note_id), **owner(user_id, section_id=section_id)}, max_time_ms=request.state.max_time_ms
+    )
+    if not note:
+        return _json({"message": "Note not found"}, 404)
+    return _json({"note": note}, 200)
+
+
+@async_view("get_all_user_labels")
+async def get_all_user_labels(request, user_id):
+    db = request.app.state.db
+    # The three collections are read concurrently
+    notebook_labels, section_labels, note_labels = await asyncio.gather(*(
+        db[name].distinct("labels", owner(user_id), **_time_limit(request))
+        for name in ("notebooks", "sections", "notes")
+    ))
+    all_labels = sorted(set(notebook_labels + section_labels + note_labels) - {None, ""})
+    return _json({"labels": all_labels}, 200)
+
+
+def _path(rule):
+    # Flask's /users/<user_id> is Starlette's /users/{user_id}
+    return rule.replace("<", "{").replace(">", "}")
+
+
+def routes(wsgi_app):
+    """Async views at their app.py paths, then the Flask app for everything else"""
+    # As CORS(app) does for the Flask responses, preflight requests are answered by Flask
+    middleware = [Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])]
+    if wsgi_app.config.get("COMPRESS_ENABLED"):
+        # The Flask app compresses its own responses, see compression.py
+        middleware.append(Middleware(GZipMiddleware, minimum_size=wsgi_app.config.get("COMPRESS_MIN_SIZE", 1024),
+                                     compresslevel=wsgi_app.config.get("COMPRESS_LEVEL", 6)))
+    routes = []
+    for rule in wsgi_app.url_map.iter_rules():
+        view = ASYNC_VIEWS.get(rule.endpoint)
+        if view is not None:
+            methods = sorted(rule.methods - {"HEAD", "OPTIONS"})
+            routes.append(Route(_path(rule.rule), _endpoint(view, rule.rule), methods=methods, middleware=middleware))
+    missing = set(ASYNC_VIEWS) - {rule.endpoint for rule in wsgi_app.url_map.iter_rules()}
+    if missing:
+        raise RuntimeError(f"Async views without a Flask route: {', '.join(sorted(missing))}")
+    # Methods an async path does not handle (POST /notebooks next to GET) also fall through to Flask
+    routes.append(Mount("", WSGIMiddleware(wsgi_app, workers=wsgi_app.config.get("ASGI_WSGI_THREADS", 10))))
+    return routes
+
+
+def create_app(wsgi_app=flask_app):
+    """The ASGI app serving the routes of wsgi_app"""
+
+    @contextlib.asynccontextmanager
+    async def lifespan(asgi_app):
+        # The Flask routes and the schema check use the synchronous client as before
+        await run_in_threadpool(init_db, wsgi_app)
+        mongo_uri = wsgi_app.config["MONGO_URI"]
+        client = AsyncIOMotorClient(mongo_uri, event_listeners=[mongo_command_listener],
+                                    **pool_options(wsgi_app.config))
+        asgi_app.state.db = client[mongo_uri.split("/")[-1]]
+        try:
+            yield
+        finally:
+            client.close()
+
+    return Starlette(routes=routes(wsgi_app), lifespan=lifespan)
+
+
+app = create_app()
@@ -0,0 +1,181 @@
+import hashlib
+import mimetypes
+from urllib.parse import quote
+
+import gridfs
+from bson import ObjectId
+from flask import jsonify, request
+from werkzeug.wsgi import wrap_file
+
+from references import match, match_any, owner, ref
+
+'''
+The code in this file stores files attached to notes in GridFS, outside the note
+documents. A note only holds a short reference per attachment (id, name, type,
+size), so listings, search and the text index never carry the file data.
+
+Uploads are multipart requests. Werkzeug spools the file to disk, it is hashed
+and then streamed into GridFS chunk by chunk; a file the user already uploaded
+(same SHA-256) is stored once and shared. Downloads are streamed from GridFS and
+answer Range requests and conditional requests on the content hash as ETag.
+'''
+
+BUCKET = "attachments"
+
+# Bytes read per step when hashing uploads and per GridFS chunk
+CHUNK_SIZE = 255 * 1024
+
+# Attachments never change, their id names one content for good
+CACHE_MAX_AGE = 365 * 24 * 3600
+
+
+def bucket(db):
+    return gridfs.GridFSBucket(db, bucket_name=BUCKET, chunk_size_bytes=CHUNK_SIZE)
+
+
+def _sha256(stream):
+    digest = hashlib.sha256()
+    for block in iter(lambda: stream.read(CHUNK_SIZE), b""):
+        digest.update(block)
+    stream.seek(0)
+    return digest.hexdigest()
+
+
+def _find(db, user_id, **query):
+    metadata = {f"metadata.{field}": value for field, value in query.items()}
+    return db[f"{BUCKET}.files"].find_one({"metadata.user_id": match(user_id), **metadata})
+
+
+def store(db, user_id, upload):
+    """GridFS files document of upload, stored unless the user already has the same content"""
+    sha256 = _sha256(upload.stream)
+    existing = _find(db, user_id, sha256=sha256)
+    if existing is not None:
+        return existing, False
+    content_type = upload.mimetype or mimetypes.guess_type(upload.filename or "")[0] or "application/octet-stream"
+    metadata = {"user_id": ref(user_id), "sha256": sha256, "content_type": content_type}
+    stored = bucket(db).open_upload_stream(upload.filename or "attachment", metadata=metadata)
+    try:
+        stored.write(upload.stream)
+        # Inserts the files document once every chunk is written
+        stored.close()
+    except gridfs.errors.FileExists:
+        # GridFS reports the unique index on user and hash this way: the same content was
+        # uploaded concurrently, keep that copy and delete the chunks of this one
+        stored.abort()
+        return _find(db, user_id, sha256=sha256), False
+    except Exception:
+        stored.abort()
+        raise
+    return db[f"{BUCKET}.files"].find_one({"_id": stored._id}), True
+
+
+def reference(files_doc, filename=None):
+    """What a note keeps of an attachment"""
+    return {
+        "file_id": files_doc["_id"],
+        "filename": filename or files_doc["filename"],
+        "content_type": files_doc["metadata"]["content_type"],
+        "length": files_doc["length"],
+        "sha256": files_doc["metadata"]["sha256"],
+    }
+
+
+def referenced_files(notes_collection, query):
+    """Ids of the files attached to the notes matching query, read before deleting them"""
+    return notes_collection.distinct("attachments.file_id", query)
+
+
+def release_files(db, file_ids):
+    """Delete the files among file_ids that no note refers to anymore. Returns the number deleted"""
+    file_ids = list(file_ids)
+    if not file_ids:
+        return 0
+    still_used = set(db.notes.distinct("attachments.file_id", {"attachments.file_id": {"$in": file_ids}}))
+    files = bucket(db)
+    deleted = 0
+    for file_id in file_ids:
+        if file_id not in still_used:
+            try:
+                files.delete(file_id)
+                deleted += 1
+            except gridfs.errors.NoFile:
+                pass
+    return deleted
+
+
+def register_attachment_endpoints(app, get_db):
+    """Register the attachment endpoints with the Flask app
+
+    get_db returns the database in use
+    """
+    note_url = "/api/users/<user_id>/notebooks/<notebook_id>/sections/<section_id>/notes/<note_id>"
+
+    @app.route(f"{note_url}/attachments", methods=["POST"])
+    def upload_attachment(user_id, notebook_id, section_id, note_id):
+        """Attach the multipart "file" to a note"""
+        db = get_db()
+        limit = app.config.get("ATTACHMENT_MAX_BYTES")
+        if limit and request.content_length and request.content_length > limit:
+            return jsonify({"message": f"Attachments are limited to {limit} bytes"}), 413
+        if not ObjectId.is_valid(note_id):
+            return jsonify({"message": "Note not found"}), 404
+        note_filter = {"_id": ObjectId(note_id), **owner(user_id, section_id=section_id)}
+        if db.notes.count_documents(note_filter, limit=1) == 0:
+            return jsonify({"message": "Note not found"}), 404
+        upload = request.files.get("file")
+        if upload is None:
+            return jsonify({"message": "Missing file"}), 400
+
+        files_doc, created = store(db, user_id, upload)
+        attachment = reference(files_doc, upload.filename)
+        # Attaching the same content twice to one note keeps one reference
+        db.notes.update_one({**note_filter, "attachments.file_id": {"$ne": files_doc["_id"]}},
+                            {"$push": {"attachments": attachment}})
+        return jsonify({"attachment": attachment, "deduplicated": not created}), 201
+
+    @app.route(f"{note_url}/attachments/<file_id>", methods=["DELETE"])
+    def delete_attachment(user_id, notebook_id, section_id, note_id, file_id):
+        db = get_db()
+        if not ObjectId.is_valid(note_id) or not ObjectId.is_valid(file_id):
+            return jsonify({"message": "Attachment not found"}), 404
+        result = db.notes.update_one(
+            {"_id": ObjectId(note_id), **owner(user_id, section_id=section_id), "attachments.file_id": ObjectId(file_id)},
+            {"$pull": {"attachments": {"file_id": ObjectId(file_id)}}},
+        )
+        if result.modified_count == 0:
+            return jsonify({"message": "Attachment not found"}), 404
+        release_files(db, [ObjectId(file_id)])
+        return jsonify({"message": "Attachment deleted successfully"}), 200
+
+    @app.route("/api/users/<user_id>/attachments/<file_id>", methods=["GET"])
+    def download_attachment(user_id, file_id):
+        """The attachment's content, supports Range, If-None-Match and If-Range"""
+        db = get_db()
+        if not ObjectId.is_valid(file_id):
+            return jsonify({"message": "Attachment not found"}), 404
+        try:
+            grid_out = bucket(db).open_download_stream(ObjectId(file_id))
+        except gridfs.errors.NoFile:
+            return jsonify({"message": "Attachment not found"}), 404
+        metadata = grid_out.metadata or {}
+        if metadata.get("user_id") not in match_any([user_id]):
+            grid_out.close()
+            return jsonify({"message": "Attachment not found"}), 404
+
+        response = app.response_class(wrap_file(request.environ, grid_out, CHUNK_SIZE),
+                                      mimetype=metadata.get("content_type"), direct_passthrough=True)
+        response.content_length = grid_out.length
+        response.set_etag(metadata["sha256"])
+        response.last_modified = grid_out.upload_date
+        response.cache_control.private = True
+        response.cache_control.max_age = CACHE_MAX_AGE
+        response.cache_control.immutable = True
+        filename = quote(grid_out.filename or "attachment", safe="")
+        response.headers["Content-Disposition"] = f"inline; filename*=UTF-8''{filename}"
+        # Uploaded HTML or SVG must not run as part of the app
+        response.headers["X-Content-Type-Options"] = "nosniff"
+        response.headers["Content-Security-Policy"] = "sandbox"
+        # Answers 304, 206 or 416 from the request's conditional and Range headers
+        return response.make_conditional(request, accept_ranges=True, complete_length=grid_out.length)
+
@@ -0,0 +1,4 @@
+'''
+Benchmarks for the backend endpoints against a deterministic synthetic corpus.
+Run from the backend directory with: python -m benchmarks.run --scale 1k
+'''
@@ -0,0 +1,178 @@
+import datetime
+import random
+
+from bson import ObjectId
+
+'''
+Deterministic synthetic corpus of users, notebooks, sections and notes.
+The same seed and scale always produce the same documents (including ids), so
+results from different runs and machines can be compared.
+'''
+
+# users, notebooks per user, sections per notebook, notes per section
+SCALES = {
+    "1k": (2, 5, 10, 10),
+    "100k": (10, 20, 25, 20),
+    "1m": (20, 25, 40, 50),
+}
+
+TOPICS = {
+    "biology": ["cell", "membrane", "mitochondria", "protein", "enzyme", "genome", "mutation", "osmosis",
+                "photosynthesis", "ribosome", "chromosome", "evolution", "species", "metabolism"],
+    "algorithms": ["algorithm", "complexity", "recursion", "sorting", "quicksort", "mergesort", "heap",
+                   "graph", "dijkstra", "dynamic", "programming", "memoization", "binary", "search", "tree"],
+    "databases": ["index", "query", "transaction", "isolation", "btree", "replication", "shard", "schema",
+                  "normalization", "join", "aggregation", "cursor", "collection", "document"],
+    "networks": ["packet", "router", "latency", "bandwidth", "protocol", "socket", "handshake", "tcp",
+                 "udp", "congestion", "throughput", "dns", "http", "tls"],
+    "math": ["matrix", "vector", "eigenvalue", "integral", "derivative", "probability", "theorem", "proof",
+             "lemma", "induction", "series", "limit", "gradient", "tensor"],
+}
+
+FILLER = ["the", "and", "of", "to", "is", "in", "that", "we", "for", "with", "this", "are", "as", "on",
+          "be", "by", "an", "which", "can", "it", "from", "when", "each", "so", "note", "example"]
+
+CODE_SNIPPETS = [
+    "def {name}(items):\n    return sorted(items, key=lambda item: item.{field})\n",
+    "for i in range(len({name})):\n    total += {name}[i] * weights[i]\n",
+    "class {Name}:\n    def __init__(self, {field}):\n        self.{field} = {field}\n",
+    "result = db.notes.find({{'{field}': value}}).sort('updated_at', -1)\n",
+]
+
+# Label pool, picked with a Zipf-like distribution so a few labels are very common
+LABELS = ["course", "todo", "important", "review", "exam", "lecture", "lab", "project", "draft", "reference",
+          "week1", "week2", "week3", "week4", "week5", "week6", "week7", "week8", "midterm", "final",
+          "reading", "homework", "ideas", "bugs", "meeting", "archive", "personal", "work", "research", "misc"]
+LABEL_WEIGHTS = [1.0 / (rank + 1) for rank in range(len(LABELS))]
+
+BASE_TIME = datetime.datetime(2026, 1, 1)
+
+
+def corpus_shape(scale):
+    if scale not in SCALES:
+        raise ValueError(f"Unknown scale {scale}, expected one of {', '.join(SCALES)}")
+    return SCALES[scale]
+
+
+def note_count(scale):
+    users, notebooks, sections, notes = corpus_shape(scale)
+    return users * notebooks * sections * notes
+
+
+def user_id_for(index):
+    return f"bench_user_{index:04d}"
+
+
+def _object_id(rng):
+    return ObjectId(rng.getrandbits(96).to_bytes(12, "big"))
+
+
+def _labels(rng, mean):
+    count = min(len(LABELS), int(rng.expovariate(1.0 / mean))) if mean else 0
+    return sorted(set(rng.choices(LABELS, weights=LABEL_WEIGHTS, k=count)))
+
+
+def _timestamps(rng):
+    created = BASE_TIME + datetime.timedelta(minutes=rng.randrange(0, 60 * 24 * 365))
+    updated = created + datetime.timedelta(minutes=rng.randrange(0, 60 * 24 * 30))
+    return created, updated
+
+
+def _words(rng, topic, count):
+    vocabulary = TOPICS[topic]
+    return [rng.choice(vocabulary) if rng.random() < 0.35 else rng.choice(FILLER) for _ in range(count)]
+
+
+def _note_content(rng, topic):
+    """Markdown with a heading, paragraphs, a list and sometimes a code block"""
+    parts = [f"# {' '.join(_words(rng, topic, 4)).title()}\n"]
+    # Log-normal paragraph lengths: mostly short notes with a long tail
+    for _ in range(1 + int(rng.lognormvariate(0.5, 0.6))):
+        parts.append(" ".join(_words(rng, topic, 20 + int(rng.lognormvariate(3.0, 0.7)))) + ".\n")
+    if rng.random() < 0.5:
+        parts.append("".join(f"- {' '.join(_words(rng, topic, 6))}\n" for _ in range(rng.randint(2, 6))))
+    if rng.random() < 0.4:
+        name = rng.choice(TOPICS[topic])
+        field = rng.choice(TOPICS[topic])
+        snippet = rng.choice(CODE_SNIPPETS).format(name=name, Name=name.title(), field=field)
+        parts.append(f"```python\n{snippet}```\n")
+    return "\n".join(parts)
+
+
+def generate(scale, seed=42):
+    """
+    Yield ("notebooks" | "sections" | "notes", document) for the whole corpus.
+    Each user gets its own random stream so the corpus is identical however it is consumed.
+    """
+    users, notebooks_per_user, sections_per_notebook, notes_per_section = corpus_shape(scale)
+    for user_index in range(users):
+        rng = random.Random(f"{seed}:{user_index}")
+        user_id = user_id_for(user_index)
+        for nb_index in range(notebooks_per_user):
+            topic = rng.choice(list(TOPICS))
+            created, updated = _timestamps(rng)
+            notebook_id = _object_id(rng)
+            yield "notebooks", {
+                "_id": notebook_id,
+                "user_id": user_id,
+                "name": f"{topic.title()} {' '.join(_words(rng, topic, 2))} {nb_index}",
+                "labels": _labels(rng, 1.5),
+                "created_at": created,
+                "updated_at": updated,
+            }
+            for sec_index in range(sections_per_notebook):
+                created, updated = _timestamps(rng)
+                section_id = _object_id(rng)
+                yield "sections", {
+                    "_id": section_id,
+                    "user_id": user_id,
+                    "notebook_id": notebook_id,
+                    "title": f"{' '.join(_words(rng, topic, 3)).title()} {sec_index}",
+                    "labels": _labels(rng, 1.0),
+                    "created_at": created,
+                    "updated_at": updated,
+                }
+                for note_index in range(notes_per_section):
+                    created, updated = _timestamps(rng)
+                    yield "notes", {
+                        "_id": _object_id(rng),
+                        "user_id": user_id,
+                        "notebook_id": notebook_id,
+                        "section_id": section_id,
+                        "title": f"{' '.join(_words(rng, topic, 4)).title()} {note_index}",
+                        "content": _note_content(rng, topic),
+                        "labels": _labels(rng, 1.2),
+                        "created_at": created,
+                        "updated_at": updated,
+                    }
+
+
+def load(db, scale, seed=42, batch_size=5000, progress=None):
+    """Insert the corpus into db in batches, calling progress(inserted_notes) after each notes batch"""
+    batches = {"notebooks": [], "sections": [], "notes": []}
+    inserted_notes = 0
+    for collection, document in generate(scale, seed):
+        batch = batches[collection]
+        batch.append(document)
+        if len(batch) >= batch_size:
+            db[collection].insert_many(batch, ordered=False)
+            if collection == "notes":
+                inserted_notes += len(batch)
+                if progress:
+                    progress(inserted_notes)
+            batch.clear()
+    for collection, batch in batches.items():
+        if batch:
+            db[collection].insert_many(batch, ordered=False)
+            if collection == "notes":
+                inserted_notes += len(batch)
+    if progress:
+        progress(inserted_notes)
+    return inserted_notes
+
+
+def search_terms(seed=42, count=50):
+    """Deterministic search queries drawn from the topic vocabularies"""
+    rng = random.Random(f"{seed}:queries")
+    terms = [term for vocabulary in TOPICS.values() for term in vocabulary]
+    return [rng.choice(terms) for _ in range(count)]
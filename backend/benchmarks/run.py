@@ -0,0 +1,214 @@
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+
+from pymongo import MongoClient
+
+# Allow running as a script as well as with python -m benchmarks.run
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import migrations  # noqa: E402
+from benchmarks import corpus  # noqa: E402
+from benchmarks.scenarios import SCENARIOS, AppClient, Context, HttpClient  # noqa: E402
+
+'''
+Benchmark runner. Loads (or reuses) the synthetic corpus, runs every scenario
+and reports p50/p95/p99 latency and throughput, optionally comparing them with
+a saved baseline.
+
+Examples:
+    python -m benchmarks.run --scale 1k --save-baseline benchmarks/baseline_1k.json
+    python -m benchmarks.run --scale 1k --baseline benchmarks/baseline_1k.json
+    python -m benchmarks.run --scale 100k --url http://127.0.0.1:5000 --concurrency 8
+
+The corpus database is migrated to the latest schema before the scenarios run,
+so it has the indexes the routes rely on. A server given with --url must use
+that database, or one migrated with "flask --app app schema migrate".
+'''
+
+DEFAULT_MONGO_URI = "mongodb://localhost:27017/note_app_benchmark"
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(pct * len(sorted_values) / 100.0) - 1))
+    return sorted_values[rank]
+
+
+def ensure_corpus(db, scale, seed, rebuild=False):
+    """Load the corpus unless the database already holds the same scale and seed, then migrate it"""
+    meta = db.benchmark_meta.find_one({"_id": "corpus"})
+    if meta and meta.get("scale") == scale and meta.get("seed") == seed and not rebuild:
+        print(f"Reusing {scale} corpus (seed {seed})")
+    else:
+        load_corpus(db, scale, seed)
+    applied = migrations.migrate(db, report=report_migration)
+    if applied:
+        print(f"Migrated the corpus to schema version {applied[-1]}")
+
+
+def report_migration(message, done=None, total=None):
+    # Only the steps, backfills report every batch
+    if done is None:
+        print(f"  {message}")
+
+
+def load_corpus(db, scale, seed):
+    # Dropping the collections drops their indexes, the schema version goes with them
+    for name in ("notebooks", "sections", "notes", "benchmark_meta", migrations.SCHEMA_COLLECTION):
+        db[name].drop()
+    total = corpus.note_count(scale)
+    started = time.perf_counter()
+
+    def progress(inserted):
+        elapsed = time.perf_counter() - started
+        print(f"\r  loaded {inserted:>9,}/{total:,} notes ({elapsed:.0f}s)", end="", flush=True)
+
+    print(f"Loading {scale} corpus (seed {seed})")
+    corpus.load(db, scale, seed, progress=progress)
+    print()
+    db.benchmark_meta.replace_one({"_id": "corpus"}, {"_id": "corpus", "scale": scale, "seed": seed}, upsert=True)
+
+
+def run_scenario(name, client, ctx, requests, concurrency, seed, warmup=10):
+    run, prepare = SCENARIOS[name]
+    rng = random.Random(f"{seed}:{name}:warmup")
+    for _ in range(warmup):
+        prepared = prepare(ctx, rng) if prepare else None
+        run(client, ctx, rng, prepared)
+
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    per_worker = [requests // concurrency + (1 if i < requests % concurrency else 0) for i in range(concurrency)]
+
+    def worker(index, count):
+        worker_rng = random.Random(f"{seed}:{name}:{index}")
+        local = []
+        failures = 0
+        for _ in range(count):
+            prepared = prepare(ctx, worker_rng) if prepare else None
+            start = time.perf_counter()
+            status = run(client, ctx, worker_rng, prepared)
+            local.append(time.perf_counter() - start)
+            if status >= 400:
+                failures += 1
+        with lock:
+            latencies.extend(local)
+            errors.append(failures)
+
+    threads = [threading.Thread(target=worker, args=(i, count)) for i, count in enumerate(per_worker) if count]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    # Prepare steps are excluded from latencies but not from wall time, so throughput
+    # for scenarios with a prepare step is a lower bound
+    return {
+        "requests": len(latencies),
+        "errors": sum(errors),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "throughput_rps": round(len(latencies) / wall, 2) if wall else None,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Print the change against the baseline and return the regressed scenarios"""
+    regressions = []
+    print(f"\nComparison with baseline (tolerance {tolerance:.0%}):")
+    for name, current in results["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if previous is None:
+            print(f"  {name:<16} no baseline")
+            continue
+        p95_change = current["p95_ms"] / previous["p95_ms"] - 1 if previous["p95_ms"] else 0
+        rps_change = current["throughput_rps"] / previous["throughput_rps"] - 1 if previous["throughput_rps"] else 0
+        regressed = p95_change > tolerance or rps_change < -tolerance
+        marker = "REGRESSION" if regressed else "ok"
+        print(f"  {name:<16} p95 {p95_change:+7.1%}  throughput {rps_change:+7.1%}  {marker}")
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the backend endpoints on a synthetic corpus")
+    parser.add_argument("--scale", choices=sorted(corpus.SCALES), default="1k")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--requests", type=int, default=200, help="timed requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma separated scenario names")
+    parser.add_argument("--mongo-uri", default=os.getenv("BENCHMARK_MONGO_URI", DEFAULT_MONGO_URI))
+    parser.add_argument("--url", help="benchmark a running server instead of the in-process app")
+    parser.add_argument("--rebuild", action="store_true", help="reload the corpus even if it is present")
+    parser.add_argument("--output", help="write results JSON to this file")
+    parser.add_argument("--baseline", help="compare against this results JSON")
+    parser.add_argument("--save-baseline", help="write results JSON as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression")
+    args = parser.parse_args(argv)
+
+    names = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+
+    mongo = MongoClient(args.mongo_uri)
+    db = mongo[args.mongo_uri.rsplit("/", 1)[-1]]
+    ensure_corpus(db, args.scale, args.seed, args.rebuild)
+
+    if args.url:
+        client = HttpClient(args.url)
+        target = args.url
+    else:
+        from app import app, setup_app
+        app.config["MONGO_URI"] = args.mongo_uri
+        setup_app()
+        client = AppClient(app)
+        target = "in-process"
+
+    ctx = Context(db, args.scale, args.seed)
+    results = {
+        "scale": args.scale,
+        "notes": corpus.note_count(args.scale),
+        "seed": args.seed,
+        "target": target,
+        "concurrency": args.concurrency,
+        "scenarios": {},
+    }
+    print(f"\n{'scenario':<16} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>9} {'errors':>7}")
+    for name in names:
+        stats = run_scenario(name, client, ctx, args.requests, args.concurrency, args.seed)
+        results["scenarios"][name] = stats
+        print(f"{name:<16} {stats['p50_ms']:>9.2f} {stats['p95_ms']:>9.2f} {stats['p99_ms']:>9.2f} "
+              f"{stats['throughput_rps']:>9.1f} {stats['errors']:>7}")
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w") as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("scale") != args.scale:
+            print(f"Warning: baseline was recorded at scale {baseline.get('scale')}")
+        if compare(results, baseline, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,137 @@
+import datetime
+import json
+import threading
+import urllib.error
+import urllib.request
+
+from bson import ObjectId
+
+from benchmarks import corpus
+
+'''
+Benchmark scenarios. Each scenario performs one user-visible operation through
+the real routes, either in-process with the Flask test client or over HTTP
+against a running server.
+'''
+
+
+class AppClient:
+    """Sends requests to the Flask app in-process, one test client per thread"""
+
+    def __init__(self, app):
+        self.app = app
+        self._local = threading.local()
+
+    def request(self, method, path, body=None):
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = self.app.test_client()
+            self._local.client = client
+        response = client.open(path, method=method, json=body)
+        response.get_data()
+        return response.status_code
+
+
+class HttpClient:
+    """Sends requests to a running server"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip("/")
+
+    def request(self, method, path, body=None):
+        data = json.dumps(body).encode("utf-8") if body is not None else None
+        req = urllib.request.Request(self.base_url + path, data=data, method=method)
+        req.add_header("Content-Type", "application/json")
+        try:
+            with urllib.request.urlopen(req) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+
+class Context:
+    """Ids sampled from the loaded corpus that scenarios pick their targets from"""
+
+    def __init__(self, db, scale, seed, sample_size=200):
+        self.db = db
+        self.user_ids = [corpus.user_id_for(i) for i in range(corpus.corpus_shape(scale)[0])]
+        self.notes = list(db.notes.find(
+            {"user_id": {"$in": self.user_ids}},
+            {"_id": 1, "user_id": 1, "notebook_id": 1, "section_id": 1},
+        ).limit(sample_size))
+        self.sections = list(db.sections.find(
+            {"user_id": {"$in": self.user_ids}}, {"_id": 1, "user_id": 1, "notebook_id": 1}
+        ).limit(sample_size))
+        self.terms = corpus.search_terms(seed)
+        self.labels = corpus.LABELS[:10]
+
+
+def tree_load(client, ctx, rng, prepared=None):
+    """Sidebar load: notebooks, then sections of one notebook, then notes of one section"""
+    section = rng.choice(ctx.sections)
+    user_id = section["user_id"]
+    client.request("GET", f"/api/users/{user_id}/notebooks")
+    client.request("GET", f"/api/users/{user_id}/notebooks/{section['notebook_id']}/sections")
+    return client.request("GET", f"/api/users/{user_id}/notebooks/{section['notebook_id']}/sections/{section['_id']}/notes")
+
+
+def search(client, ctx, rng, prepared=None):
+    """Free text search, sometimes narrowed by a label"""
+    user_id = rng.choice(ctx.user_ids)
+    path = f"/api/users/{user_id}/search?q={rng.choice(ctx.terms)}"
+    if rng.random() < 0.3:
+        path += f"&labels={rng.choice(ctx.labels)}"
+    return client.request("GET", path)
+
+
+def label_listing(client, ctx, rng, prepared=None):
+    """All labels of a user, loaded by the label picker"""
+    return client.request("GET", f"/api/users/{rng.choice(ctx.user_ids)}/labels")
+
+
+def autosave(client, ctx, rng, prepared=None):
+    """Editor autosave of an existing note"""
+    note = rng.choice(ctx.notes)
+    body = {
+        "title": f"Autosaved {rng.randrange(1_000_000)}",
+        "content": " ".join(rng.choice(corpus.FILLER) for _ in range(200)),
+    }
+    return client.request(
+        "PUT",
+        f"/api/users/{note['user_id']}/notebooks/{note['notebook_id']}/sections/{note['section_id']}/notes/{note['_id']}",
+        body,
+    )
+
+
+def prepare_cascade_delete(ctx, rng, sections=10, notes_per_section=20):
+    """Insert a throwaway notebook tree directly in the database, outside the timed region"""
+    user_id = rng.choice(ctx.user_ids)
+    now = datetime.datetime.utcnow()
+    notebook_id = ObjectId()
+    ctx.db.notebooks.insert_one({"_id": notebook_id, "user_id": user_id, "name": "Benchmark delete",
+                                 "labels": [], "created_at": now, "updated_at": now})
+    section_docs = [{"_id": ObjectId(), "user_id": user_id, "notebook_id": notebook_id, "title": "S",
+                     "labels": [], "created_at": now, "updated_at": now} for _ in range(sections)]
+    ctx.db.sections.insert_many(section_docs)
+    ctx.db.notes.insert_many([
+        {"user_id": user_id, "notebook_id": notebook_id, "section_id": section["_id"],
+         "title": "N", "content": "benchmark", "labels": [], "created_at": now, "updated_at": now}
+        for section in section_docs for _ in range(notes_per_section)
+    ])
+    return user_id, str(notebook_id)
+
+
+def cascade_delete(client, ctx, rng, prepared=None):
+    user_id, notebook_id = prepared
+    return client.request("DELETE", f"/api/users/{user_id}/notebooks/{notebook_id}")
+
+
+# name -> (run, prepare); prepare runs before each timed operation and is not measured
+SCENARIOS = {
+    "tree_load": (tree_load, None),
+    "search": (search, None),
+    "label_listing": (label_listing, None),
+    "autosave": (autosave, None),
+    "cascade_delete": (cascade_delete, prepare_cascade_delete),
+}
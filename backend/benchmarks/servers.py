@@ -0,0 +1,78 @@
+import argparse
+import json
+import os
+import sys
+
+from pymongo import MongoClient
+
+# Allow running as a script as well as with python -m benchmarks.servers
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from benchmarks import corpus  # noqa: E402
+from benchmarks.run import DEFAULT_MONGO_URI, ensure_corpus, run_scenario  # noqa: E402
+from benchmarks.scenarios import SCENARIOS, Context, HttpClient  # noqa: E402
+
+'''
+Compares the throughput of the sync (Flask) and async (asgi.py) servers as the
+number of concurrent connections grows. Both servers must be running on the
+benchmark database, for example:
+
+    MONGO_URI=mongodb://localhost:27017/note_app_benchmark gunicorn -w 4 --threads 8 -b :5000 app:app
+    MONGO_URI=mongodb://localhost:27017/note_app_benchmark uvicorn asgi:app --workers 4 --port 8000
+    python -m benchmarks.servers --scale 1k --sync-url http://127.0.0.1:5000 --async-url http://127.0.0.1:8000
+
+Use the same number of processes for both so the comparison is per worker.
+'''
+
+DEFAULT_SCENARIOS = "tree_load,label_listing,search"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare sync and async server throughput under concurrency")
+    parser.add_argument("--sync-url", required=True)
+    parser.add_argument("--async-url", required=True)
+    parser.add_argument("--scale", choices=sorted(corpus.SCALES), default="1k")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--requests", type=int, default=500, help="timed requests per scenario and level")
+    parser.add_argument("--concurrency", default="1,8,32,64", help="comma separated connection counts")
+    parser.add_argument("--scenarios", default=DEFAULT_SCENARIOS, help="comma separated scenario names")
+    parser.add_argument("--mongo-uri", default=os.getenv("BENCHMARK_MONGO_URI", DEFAULT_MONGO_URI))
+    parser.add_argument("--output", help="write results JSON to this file")
+    args = parser.parse_args(argv)
+
+    names = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+    levels = [int(level) for level in args.concurrency.split(",")]
+
+    mongo = MongoClient(args.mongo_uri)
+    db = mongo[args.mongo_uri.rsplit("/", 1)[-1]]
+    ensure_corpus(db, args.scale, args.seed)
+    ctx = Context(db, args.scale, args.seed)
+    servers = {"sync": HttpClient(args.sync_url), "async": HttpClient(args.async_url)}
+
+    results = {"scale": args.scale, "seed": args.seed, "sync_url": args.sync_url, "async_url": args.async_url,
+               "scenarios": {}}
+    print(f"\n{'scenario':<16} {'conns':>6} {'sync req/s':>11} {'async req/s':>12} {'speedup':>8} "
+          f"{'sync p95':>9} {'async p95':>10} {'errors':>7}")
+    for name in names:
+        results["scenarios"][name] = {}
+        for level in levels:
+            stats = {server: run_scenario(name, client, ctx, args.requests, level, args.seed)
+                     for server, client in servers.items()}
+            results["scenarios"][name][str(level)] = stats
+            sync_rps, async_rps = stats["sync"]["throughput_rps"], stats["async"]["throughput_rps"]
+            speedup = async_rps / sync_rps if sync_rps else float("nan")
+            errors = stats["sync"]["errors"] + stats["async"]["errors"]
+            print(f"{name:<16} {level:>6} {sync_rps:>11.1f} {async_rps:>12.1f} {speedup:>7.2f}x "
+                  f"{stats['sync']['p95_ms']:>9.2f} {stats['async']['p95_ms']:>10.2f} {errors:>7}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
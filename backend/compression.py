@@ -0,0 +1,171 @@
+import zlib
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # brotli is optional
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # zstandard is optional
+    zstandard = None
+
+'''
+The code in this file compresses API responses. Note listings and search
+results are mostly markdown and shrink several times with gzip or brotli.
+Small bodies are sent as they are since compressing them costs more than it saves.
+Streamed (generator) responses are compressed chunk by chunk and flushed after
+every chunk so clients still receive each chunk as soon as it is produced.
+'''
+
+COMPRESSIBLE_MIMETYPES = {
+    "application/json",
+    "text/plain",
+    "text/html",
+    "text/css",
+    "text/markdown",
+    "text/event-stream",
+    "application/javascript",
+}
+
+
+class GzipEncoder:
+    name = "gzip"
+
+    def __init__(self, level):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self._compressor.compress(data) + self._compressor.flush()
+
+    def feed(self, chunk):
+        return self._compressor.compress(chunk) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class BrotliEncoder:
+    name = "br"
+
+    def __init__(self, level):
+        # Brotli quality runs 0-11, map the shared 1-9 level onto it
+        self._compressor = brotli.Compressor(quality=min(11, max(0, level - 2)))
+
+    def compress(self, data):
+        return self._compressor.process(data) + self._compressor.finish()
+
+    def feed(self, chunk):
+        return self._compressor.process(chunk) + self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+class ZstdEncoder:
+    name = "zstd"
+
+    def __init__(self, level):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data):
+        return self._compressor.compress(data) + self._compressor.flush()
+
+    def feed(self, chunk):
+        return self._compressor.compress(chunk) + self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+def available_encoders():
+    encoders = {"gzip": GzipEncoder}
+    if brotli is not None:
+        encoders["br"] = BrotliEncoder
+    if zstandard is not None:
+        encoders["zstd"] = ZstdEncoder
+    return encoders
+
+
+def parse_accept_encoding(header):
+    """Map of accepted encodings to their q-values"""
+    accepted = {}
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name] = q
+    return accepted
+
+
+def choose_encoding(header, preference):
+    """First encoding in server preference order that the client accepts"""
+    accepted = parse_accept_encoding(header or "")
+    encoders = available_encoders()
+    for name in preference:
+        if name not in encoders:
+            continue
+        q = accepted.get(name, accepted.get("*", 0.0))
+        if q > 0:
+            return name
+    return None
+
+
+def compress_stream(chunks, encoder):
+    """Compress an iterable of chunks, flushing after each one"""
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode("utf-8")
+        data = encoder.feed(chunk)
+        if data:
+            yield data
+    tail = encoder.finish()
+    if tail:
+        yield tail
+
+
+def register_compression(app):
+    """Register the response compression hook"""
+
+    @app.after_request
+    def _compress_response(response):
+        if not app.config.get("COMPRESS_ENABLED", True):
+            return response
+        if response.mimetype not in COMPRESSIBLE_MIMETYPES:
+            return response
+        response.vary.add("Accept-Encoding")
+        if (response.status_code < 200 or response.status_code in (204, 206, 304)
+                or "Content-Encoding" in response.headers or response.direct_passthrough):
+            return response
+
+        preference = app.config.get("COMPRESS_ALGORITHMS", ("br", "zstd", "gzip"))
+        encoding = choose_encoding(request.headers.get("Accept-Encoding"), preference)
+        if encoding is None:
+            return response
+        encoder = available_encoders()[encoding](app.config.get("COMPRESS_LEVEL", 6))
+
+        if response.is_streamed:
+            if not app.config.get("COMPRESS_STREAMS", True):
+                return response
+            response.response = compress_stream(response.response, encoder)
+            response.headers.pop("Content-Length", None)
+        else:
+            data = response.get_data()
+            if len(data) < app.config.get("COMPRESS_MIN_SIZE", 1024):
+                return response
+            compressed = encoder.compress(data)
+            if len(compressed) >= len(data):
+                return response
+            response.set_data(compressed)
+        response.headers["Content-Encoding"] = encoding
+        return response
@@ -0,0 +1,231 @@
+import os
+import threading
+import time
+
+from pymongo import MongoClient, monitoring
+
+from metrics import LATENCY_BUCKETS, REGISTRY, Counter, Gauge, Histogram
+
+'''
+The code in this file owns the MongoClient of the process. init_db asks the
+manager for a client instead of creating one, so repeated calls (tests, worker
+restarts) reuse a single connection pool. After a fork the child drops the
+inherited client and builds its own on first use, since a MongoClient must not
+be shared between processes.
+'''
+
+mongodb_pool_connections = REGISTRY.register(Gauge(
+    "mongodb_pool_connections", "Open connections in the MongoDB pool.", ("address",)))
+mongodb_pool_checked_out = REGISTRY.register(Gauge(
+    "mongodb_pool_checked_out", "Connections currently checked out of the MongoDB pool.", ("address",)))
+mongodb_pool_checkouts_total = REGISTRY.register(Counter(
+    "mongodb_pool_checkouts_total", "Connection checkouts by outcome.", ("address", "status")))
+mongodb_pool_wait_seconds = REGISTRY.register(Histogram(
+    "mongodb_pool_wait_seconds", "Time spent waiting for a pooled connection.", ("address",), LATENCY_BUCKETS))
+
+
+def _address(event):
+    host, port = event.address
+    return f"{host}:{port}"
+
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    """Connection pool listener tracking utilization and checkout wait times"""
+
+    def __init__(self):
+        self._waits = threading.local()
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.connections = {}
+            self.checked_out = {}
+            self.max_checked_out = {}
+            self.max_wait_ms = {}
+            self.cleared = 0
+
+    def _labels(self, event):
+        return (("address", _address(event)),)
+
+    def _adjust(self, counts, event, amount):
+        address = _address(event)
+        with self._lock:
+            value = counts.get(address, 0) + amount
+            counts[address] = value
+            if counts is self.checked_out and value > self.max_checked_out.get(address, 0):
+                self.max_checked_out[address] = value
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self.cleared += 1
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        mongodb_pool_connections.inc(self._labels(event))
+        self._adjust(self.connections, event, 1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        mongodb_pool_connections.dec(self._labels(event))
+        self._adjust(self.connections, event, -1)
+
+    def connection_check_out_started(self, event):
+        self._waits.started = time.perf_counter()
+
+    def connection_check_out_failed(self, event):
+        mongodb_pool_checkouts_total.inc(self._labels(event) + (("status", str(event.reason)),))
+        self._record_wait(event)
+
+    def connection_checked_out(self, event):
+        labels = self._labels(event)
+        mongodb_pool_checked_out.inc(labels)
+        mongodb_pool_checkouts_total.inc(labels + (("status", "ok"),))
+        self._adjust(self.checked_out, event, 1)
+        self._record_wait(event)
+
+    def connection_checked_in(self, event):
+        mongodb_pool_checked_out.dec(self._labels(event))
+        self._adjust(self.checked_out, event, -1)
+
+    def _record_wait(self, event):
+        # pymongo 4.7+ reports the duration itself, older versions need the start time
+        wait = getattr(event, "duration", None)
+        started = getattr(self._waits, "started", None)
+        if wait is None and started is not None:
+            wait = time.perf_counter() - started
+        self._waits.started = None
+        if wait is None:
+            return
+        mongodb_pool_wait_seconds.observe(wait, self._labels(event))
+        address = _address(event)
+        with self._lock:
+            self.max_wait_ms[address] = max(self.max_wait_ms.get(address, 0.0), wait * 1000)
+
+
+def _wait_totals(address):
+    """Sum and count of the checkout wait histogram for one server"""
+    totals = {"sum": 0.0, "count": 0}
+    for name, labels, value in mongodb_pool_wait_seconds.samples():
+        if labels == (("address", address),):
+            if name.endswith("_sum"):
+                totals["sum"] = value
+            elif name.endswith("_count"):
+                totals["count"] = value
+    return totals
+
+
+def pool_options(config):
+    """MongoClient keyword arguments from the MONGO_* pool settings in app config"""
+    options = {}
+    if config.get("MONGO_MAX_POOL_SIZE") is not None:
+        options["maxPoolSize"] = config["MONGO_MAX_POOL_SIZE"]
+    if config.get("MONGO_MIN_POOL_SIZE") is not None:
+        options["minPoolSize"] = config["MONGO_MIN_POOL_SIZE"]
+    if config.get("MONGO_WAIT_QUEUE_TIMEOUT_MS") is not None:
+        options["waitQueueTimeoutMS"] = config["MONGO_WAIT_QUEUE_TIMEOUT_MS"]
+    if config.get("MONGO_COMPRESSORS"):
+        options["compressors"] = config["MONGO_COMPRESSORS"]
+    return options
+
+
+class MongoConnectionManager:
+    """Owns the single MongoClient of this process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._client = None
+        self._key = None
+        self._pid = None
+        self._options = {}
+        self._forked = False
+        self.pool_listener = PoolStatsListener()
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # The inherited client belongs to the parent; closing it here would also
+        # close sockets the parent is using, so just forget it
+        self._lock = threading.Lock()
+        self._forked = self._client is not None
+        self._client = None
+        self._key = None
+        self._pid = None
+        self.pool_listener.reset()
+
+    def get_client(self, uri, options=None, event_listeners=()):
+        """Return the process client for uri, creating it on first use or when the settings change"""
+        options = dict(options or {})
+        key = (uri, tuple(sorted((name, str(value)) for name, value in options.items())))
+        with self._lock:
+            if self._client is not None and self._key == key and self._pid == os.getpid():
+                return self._client
+            if self._client is not None and self._pid == os.getpid():
+                self._client.close()
+            self._client = MongoClient(
+                uri, event_listeners=list(event_listeners) + [self.pool_listener], **options
+            )
+            self._key = key
+            self._pid = os.getpid()
+            self._options = options
+            self._forked = False
+            return self._client
+
+    def needs_reinit(self):
+        """True in a forked child that has not built its own client yet"""
+        return self._forked
+
+    @property
+    def client(self):
+        return self._client
+
+    def stats(self):
+        """Pool configuration and utilization for the health endpoint"""
+        client = self._client
+        if client is None:
+            return {"connected": False}
+        pool = client.options.pool_options
+        max_pool_size = pool.max_pool_size
+        listener = self.pool_listener
+        with listener._lock:
+            connections = dict(listener.connections)
+            checked_out = dict(listener.checked_out)
+            max_checked_out = dict(listener.max_checked_out)
+            max_wait_ms = dict(listener.max_wait_ms)
+        servers = {}
+        for address in sorted(set(connections) | set(checked_out)):
+            waits = _wait_totals(address)
+            in_use = checked_out.get(address, 0)
+            servers[address] = {
+                "connections": connections.get(address, 0),
+                "checked_out": in_use,
+                "max_checked_out": max_checked_out.get(address, 0),
+                "utilization": round(in_use / max_pool_size, 4) if max_pool_size else None,
+                "checkouts": waits["count"],
+                "avg_wait_ms": round(waits["sum"] / waits["count"] * 1000, 3) if waits["count"] else 0.0,
+                "max_wait_ms": round(max_wait_ms.get(address, 0.0), 3),
+            }
+        return {
+            "connected": True,
+            "pid": self._pid,
+            "max_pool_size": max_pool_size,
+            "min_pool_size": pool.min_pool_size,
+            "wait_queue_timeout_ms": pool.wait_queue_timeout * 1000 if pool.wait_queue_timeout else None,
+            "compressors": self._options.get("compressors"),
+            "pool_cleared": self.pool_listener.cleared,
+            "servers": servers,
+        }
+
+
+# The connection manager of this process
+connection_manager = MongoConnectionManager()
@@ -0,0 +1,116 @@
+import contextvars
+
+import bson
+from flask import current_app, g, request
+from pymongo import monitoring
+
+'''
+The code in this file counts the database round trips made while serving each
+request. Routes that go over their configured budget are logged so queries that
+grow with the amount of data (N+1 loops) are noticed before they ship.
+'''
+
+# Stats of the request being served on the current thread, None outside requests
+_current = contextvars.ContextVar("db_request_stats", default=None)
+
+# Callbacks receiving (route, method, stats) after every request, used by the test plugin
+_observers = []
+
+
+class RequestDbStats:
+    """Database commands and bytes used by a single request"""
+
+    __slots__ = ("ops", "bytes_sent", "bytes_received", "commands", "track_bytes")
+
+    def __init__(self, track_bytes=False):
+        self.ops = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.commands = {}
+        self.track_bytes = track_bytes
+
+    @property
+    def bytes(self):
+        return self.bytes_sent + self.bytes_received
+
+
+class RequestDbListener(monitoring.CommandListener):
+    """pymongo command listener attributing commands to the current request"""
+
+    def started(self, event):
+        stats = _current.get()
+        if stats is None:
+            return
+        stats.ops += 1
+        stats.commands[event.command_name] = stats.commands.get(event.command_name, 0) + 1
+        if stats.track_bytes:
+            stats.bytes_sent += len(bson.encode(event.command))
+
+    def succeeded(self, event):
+        stats = _current.get()
+        if stats is not None and stats.track_bytes:
+            stats.bytes_received += len(bson.encode(event.reply))
+
+    def failed(self, event):
+        pass
+
+
+# Shared listener instance passed to MongoClient in init_db
+request_db_listener = RequestDbListener()
+
+
+def current_stats():
+    """Database stats of the request being served, or None"""
+    return _current.get()
+
+
+def add_observer(callback):
+    _observers.append(callback)
+
+
+def remove_observer(callback):
+    if callback in _observers:
+        _observers.remove(callback)
+
+
+def route_budget(app, method, route):
+    """Per-route budget from DB_OP_BUDGETS ("METHOD /rule" or "/rule"), else the default"""
+    budgets = app.config.get("DB_OP_BUDGETS") or {}
+    budget = budgets.get(f"{method} {route}", budgets.get(route))
+    if budget is None:
+        budget = app.config.get("DB_OP_BUDGET_DEFAULT")
+    return budget
+
+
+def register_db_budget(app):
+    """Register the hooks counting database operations per request"""
+
+    @app.before_request
+    def _db_budget_start():
+        header = app.debug or app.config.get("DB_OPS_HEADER", False)
+        g._db_stats_token = _current.set(RequestDbStats(track_bytes=header))
+
+    @app.after_request
+    def _db_budget_check(response):
+        stats = _current.get()
+        if stats is None:
+            return response
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        if stats.track_bytes:
+            response.headers["X-DB-Ops"] = str(stats.ops)
+            response.headers["X-DB-Bytes"] = str(stats.bytes)
+        budget = route_budget(current_app, request.method, route)
+        if budget is not None and stats.ops > budget:
+            current_app.logger.warning(
+                "%s %s used %d database operations (budget %d): %s",
+                request.method, route, stats.ops, budget, stats.commands,
+            )
+        for callback in list(_observers):
+            callback(route, request.method, stats)
+        return response
+
+    @app.teardown_request
+    def _db_budget_finish(exc):
+        token = g.pop("_db_stats_token", None)
+        if token is not None:
+            _current.reset(token)
@@ -0,0 +1,177 @@
+import logging
+import threading
+import time
+import uuid
+
+import pymongo
+from flask import g, has_request_context, jsonify, request
+from pymongo.errors import OperationFailure, PyMongoError
+
+from database import connection_manager
+
+'''
+The code in this file stops the server from working on reads nobody is waiting
+for anymore.
+
+Every GET request under /api/ gets a deadline: REQUEST_DEADLINE_MS (SEARCH_DEADLINE_MS
+for searches), or less when the client sends X-Request-Deadline with the number of
+milliseconds it is willing to wait. The deadline is applied with pymongo.timeout, so
+MongoDB receives it as maxTimeMS and gives up on the query itself. Requests running
+out of time answer 504.
+
+Searches also follow "latest query wins": a new search of a user supersedes the one
+they still have in flight. The superseded request stops at its next step and answers
+409, and its running MongoDB operations (tagged with a comment) are killed with killOp.
+'''
+
+logger = logging.getLogger(__name__)
+
+DEADLINE_HEADER = "X-Request-Deadline"
+
+# Error code of operations ended by killOp
+INTERRUPTED = 11601
+
+
+class QueryCancelled(Exception):
+    """The search was superseded by a newer search of the same user"""
+
+
+def parse_deadline(value):
+    """Milliseconds from the X-Request-Deadline header, ValueError if it is not a positive number"""
+    milliseconds = float(value)
+    if not milliseconds > 0 or milliseconds == float("inf"):
+        raise ValueError(f"Invalid {DEADLINE_HEADER}: {value}")
+    return milliseconds
+
+
+def remaining():
+    """Seconds left before the deadline of the current request, None without a deadline"""
+    if not has_request_context() or "_deadline_at" not in g:
+        return None
+    return max(0.0, g._deadline_at - time.monotonic())
+
+
+class SearchTicket:
+    """One in-flight search, its comment tags the MongoDB operations it runs"""
+
+    __slots__ = ("user_id", "started", "comment", "cancelled")
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.started = time.time()
+        self.comment = {"search_user": user_id, "started": self.started, "request": uuid.uuid4().hex}
+        self.cancelled = False
+
+
+class LatestQueryWins:
+    """The in-flight search of every user, a newer one cancels the previous"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._active = {}
+        self._kill_supported = True
+
+    def start(self, user_id):
+        ticket = SearchTicket(user_id)
+        with self._lock:
+            previous = self._active.get(user_id)
+            self._active[user_id] = ticket
+        if previous is not None:
+            previous.cancelled = True
+            self.kill(user_id, ticket.started)
+        return ticket
+
+    def finish(self, ticket):
+        with self._lock:
+            if self._active.get(ticket.user_id) is ticket:
+                del self._active[ticket.user_id]
+
+    def kill(self, user_id, before):
+        """Kill the user's search operations started before the given time, in any process"""
+        if not self._kill_supported or connection_manager.client is None:
+            return 0
+        # getMore operations carry the comment of the command that opened the cursor
+        match = {"$or": [
+            {"command.comment.search_user": user_id, "command.comment.started": {"$lt": before}},
+            {"cursor.originatingCommand.comment.search_user": user_id,
+             "cursor.originatingCommand.comment.started": {"$lt": before}},
+        ]}
+        admin = connection_manager.client.admin
+        try:
+            operations = admin.command({"currentOp": 1, **match}).get("inprog", [])
+            for operation in operations:
+                admin.command("killOp", op=operation["opid"])
+        except OperationFailure as e:
+            # Deployments without the inprog/killop privileges still cancel cooperatively
+            logger.warning("Cannot kill superseded searches, killOp disabled: %s", e)
+            self._kill_supported = False
+            return 0
+        except (PyMongoError, NotImplementedError):
+            logger.exception("Killing superseded searches of %s failed", user_id)
+            return 0
+        return len(operations)
+
+
+search_queries = LatestQueryWins()
+
+
+def current_ticket():
+    if not has_request_context():
+        return None
+    return g.get("search_ticket")
+
+
+def query_comment():
+    """Comment to attach to MongoDB operations of the current search, or None"""
+    ticket = current_ticket()
+    return ticket.comment if ticket is not None else None
+
+
+def check_cancelled():
+    """Stop the current search if a newer one of the same user has started"""
+    ticket = current_ticket()
+    if ticket is not None and ticket.cancelled:
+        raise QueryCancelled()
+
+
+def register_deadlines(app):
+    """Register the hooks applying request deadlines to database operations"""
+
+    @app.before_request
+    def _deadline_start():
+        if request.method != "GET" or not request.path.startswith("/api/"):
+            return None
+        is_search = request.endpoint == "search"
+        limit_ms = app.config.get("SEARCH_DEADLINE_MS" if is_search else "REQUEST_DEADLINE_MS")
+        header = request.headers.get(DEADLINE_HEADER)
+        if header:
+            try:
+                client_ms = parse_deadline(header)
+            except ValueError as e:
+                return jsonify({"message": str(e)}), 400
+            limit_ms = min(limit_ms, client_ms) if limit_ms else client_ms
+        if not limit_ms:
+            return None
+        g._deadline_at = time.monotonic() + limit_ms / 1000
+        g._deadline_timeout = pymongo.timeout(limit_ms / 1000)
+        g._deadline_timeout.__enter__()
+        return None
+
+    @app.teardown_request
+    def _deadline_finish(exc):
+        timeout = g.pop("_deadline_timeout", None)
+        if timeout is not None:
+            timeout.__exit__(None, None, None)
+
+    @app.errorhandler(PyMongoError)
+    def _database_error(error):
+        if getattr(error, "timeout", False) and "_deadline_at" in g:
+            return jsonify({"message": "Request deadline exceeded"}), 504
+        ticket = current_ticket()
+        if ticket is not None and ticket.cancelled and getattr(error, "code", None) == INTERRUPTED:
+            return jsonify({"message": "Superseded by a newer search"}), 409
+        raise error
+
+    @app.errorhandler(QueryCancelled)
+    def _query_cancelled(error):
+        return jsonify({"message": "Superseded by a newer search"}), 409
@@ -0,0 +1,163 @@
+import datetime
+
+from bson import ObjectId
+from flask import jsonify, request
+
+from events import publish, CREATED
+from jobs import job_handler, public, submit
+from references import owner, ref
+
+'''
+The code in this file duplicates notebooks inside MongoDB. The sections and
+notes are copied by aggregation pipelines ending in $merge: each copy loses its
+_id (so the server assigns a new one) and gets the new notebook_id, and notes
+find the copy of their section through a marker stored on the copied sections.
+No note content is sent to the backend.
+
+Notebooks with many notes are copied by a background job (see jobs.py). The new
+notebook is returned right away with "duplicating": true, which is removed once
+the copy is complete, along with the job to follow.
+'''
+
+# Marker on copied sections, "<copy notebook id>:<source section id>", removed after the copy
+COPY_FIELD = "_copy_of"
+
+# Set on a notebook while its contents are still being copied
+DUPLICATING_FIELD = "duplicating"
+
+
+def _marker(copy_id, field):
+    return {"$concat": [str(copy_id), ":", {"$toString": field}]}
+
+
+def _merge(collection):
+    return {"$merge": {"into": collection.name, "whenMatched": "fail", "whenNotMatched": "insert"}}
+
+
+def copy_contents(collections, user_id, source_id, copy_id, report=None):
+    """Copy the sections and notes of notebook source_id into notebook copy_id with two pipelines"""
+    report = report or (lambda message, done=None, total=None: None)
+    notebooks_collection, sections_collection, notes_collection = collections
+    copy_id = ObjectId(copy_id)
+    now = datetime.datetime.utcnow()
+    report("Copying sections", 0, 2)
+    sections_collection.aggregate([
+        {"$match": owner(user_id, notebook_id=str(source_id))},
+        {"$set": {"notebook_id": copy_id, COPY_FIELD: _marker(copy_id, "$_id"), "created_at": now, "updated_at": now}},
+        {"$project": {"_id": 0}},
+        _merge(sections_collection),
+    ])
+    report("Copying notes", 1, 2)
+    notes_collection.aggregate([
+        {"$match": owner(user_id, notebook_id=str(source_id))},
+        {"$set": {COPY_FIELD: _marker(copy_id, "$section_id")}},
+        {"$lookup": {"from": sections_collection.name, "localField": COPY_FIELD,
+                     "foreignField": COPY_FIELD, "as": "_section"}},
+        # Notes whose section no longer exists are not copied
+        {"$unwind": "$_section"},
+        {"$set": {"section_id": "$_section._id", "notebook_id": copy_id, "created_at": now, "updated_at": now}},
+        {"$project": {"_id": 0, "_section": 0, COPY_FIELD: 0}},
+        _merge(notes_collection),
+    ])
+    sections_collection.update_many({"notebook_id": copy_id, COPY_FIELD: {"$exists": True}},
+                                    {"$unset": {COPY_FIELD: ""}})
+    report("Copied", 2, 2)
+
+
+def clear_contents(collections, user_id, copy_id):
+    """Delete whatever an interrupted copy left in notebook copy_id"""
+    notebooks_collection, sections_collection, notes_collection = collections
+    notes_collection.delete_many(owner(user_id, notebook_id=str(copy_id)))
+    sections_collection.delete_many(owner(user_id, notebook_id=str(copy_id)))
+
+
+def discard_copy(collections, user_id, copy_id):
+    """Delete a notebook copy that failed, with whatever was copied"""
+    clear_contents(collections, user_id, copy_id)
+    collections[0].delete_one({"_id": ObjectId(copy_id)})
+
+
+def finish(collections, user_id, source_id, notebook):
+    """Mark a filled notebook copy as complete and announce it"""
+    if notebook.pop(DUPLICATING_FIELD, None):
+        collections[0].update_one({"_id": notebook["_id"]}, {"$unset": {DUPLICATING_FIELD: ""}})
+    # Search indexes read the copied sections and notes themselves
+    publish("notebook", CREATED, user_id, notebook["_id"], dict(notebook, copied_from=str(source_id)))
+
+
+def duplicate(collections, user_id, source_id, notebook):
+    """Fill the already inserted notebook copy, then announce it"""
+    try:
+        copy_contents(collections, user_id, source_id, notebook["_id"])
+    except Exception:
+        discard_copy(collections, user_id, notebook["_id"])
+        raise
+    finish(collections, user_id, source_id, notebook)
+
+
+@job_handler("duplicate_notebook")
+def duplicate_job(context, params):
+    """Copy a large notebook into the copy inserted by the endpoint (params: source_id, copy_id)"""
+    db = context.db
+    collections = (db.notebooks, db.sections, db.notes)
+    notebook = db.notebooks.find_one({"_id": ObjectId(params["copy_id"])})
+    if notebook is None:
+        # The copy was deleted before the job ran
+        return {"notebook_id": params["copy_id"], "cancelled": True}
+    # A retry starts over, the attempt before may have copied part of the notebook
+    clear_contents(collections, context.user_id, notebook["_id"])
+    try:
+        copy_contents(collections, context.user_id, params["source_id"], notebook["_id"], context.report)
+    except Exception:
+        if context.last_attempt:
+            discard_copy(collections, context.user_id, notebook["_id"])
+        raise
+    finish(collections, context.user_id, params["source_id"], notebook)
+    return {"notebook_id": params["copy_id"]}
+
+
+def register_duplicate_endpoint(app, get_collections):
+    """Register the notebook duplication endpoint with the Flask app
+
+    get_collections returns the (notebooks, sections, notes) collections in use
+    """
+
+    @app.route("/api/users/<user_id>/notebooks/<notebook_id>/duplicate", methods=["POST"])
+    def duplicate_notebook(user_id, notebook_id):
+        """Copy a notebook with its sections and notes (body: optional name)"""
+        collections = get_collections()
+        notebooks_collection, sections_collection, notes_collection = collections
+        data = request.get_json(silent=True) or {}
+        if not ObjectId.is_valid(notebook_id):
+            return jsonify({"message": "Notebook not found"}), 404
+        source = notebooks_collection.find_one({"_id": ObjectId(notebook_id), **owner(user_id)})
+        if source is None:
+            return jsonify({"message": "Notebook not found"}), 404
+
+        now = datetime.datetime.utcnow()
+        notebook = {key: value for key, value in source.items() if key not in ("_id", DUPLICATING_FIELD)}
+        notebook.update({
+            "user_id": ref(user_id),
+            "name": data.get("name") or f"{source.get('name', 'Untitled Notebook')} (copy)",
+            "created_at": now,
+            "updated_at": now,
+        })
+        limit = app.config.get("DUPLICATE_BACKGROUND_NOTES", 1000)
+        background = notes_collection.count_documents(owner(user_id, notebook_id=notebook_id), limit=limit + 1) > limit
+        if background:
+            notebook[DUPLICATING_FIELD] = True
+        notebooks_collection.insert_one(notebook)
+
+        if not background:
+            duplicate(collections, user_id, notebook_id, notebook)
+            return jsonify({"notebook": notebook}), 201
+
+        params = {"source_id": notebook_id, "copy_id": str(notebook["_id"])}
+        job = submit(app, "duplicate_notebook", user_id, params, request.headers.get("Idempotency-Key"))
+        if job["params"] != params:
+            # A retried request, the copy of the first one is already on its way
+            notebooks_collection.delete_one({"_id": notebook["_id"]})
+            notebook = notebooks_collection.find_one({"_id": ObjectId(job["params"]["copy_id"])}) or {}
+        response = jsonify({"notebook": notebook, "job": public(job)})
+        response.headers["Location"] = f"/api/jobs/{job['_id']}"
+        return response, 202
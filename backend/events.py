@@ -0,0 +1,60 @@
+import logging
+import time
+
+'''
+The code in this file is a small in-process publish/subscribe bus. The write
+endpoints publish an event after every change to a notebook, section or note so
+features that keep derived data (search indexes, live updates) can follow the
+writes without querying the database again. Subscribers run synchronously in the
+request that made the change; an exception in one subscriber is logged and does
+not fail the request.
+'''
+
+logger = logging.getLogger(__name__)
+
+CREATED = "created"
+UPDATED = "updated"
+DELETED = "deleted"
+
+_subscribers = []
+
+
+class Event:
+    """A change to one notebook, section or note"""
+
+    __slots__ = ("kind", "action", "user_id", "doc_id", "fields", "timestamp")
+
+    def __init__(self, kind, action, user_id, doc_id, fields=None):
+        self.kind = kind
+        self.action = action
+        self.user_id = user_id
+        self.doc_id = str(doc_id)
+        # Fields written by the change, including notebook_id/section_id for children
+        self.fields = fields or {}
+        self.timestamp = time.time()
+
+    def __repr__(self):
+        return f"Event({self.kind} {self.action} {self.doc_id} user={self.user_id})"
+
+
+def subscribe(callback):
+    """Call callback(event) for every published event"""
+    if callback not in _subscribers:
+        _subscribers.append(callback)
+    return callback
+
+
+def unsubscribe(callback):
+    if callback in _subscribers:
+        _subscribers.remove(callback)
+
+
+def publish(kind, action, user_id, doc_id, fields=None):
+    """Notify subscribers of a change, returns the event"""
+    event = Event(kind, action, user_id, doc_id, fields)
+    for callback in list(_subscribers):
+        try:
+            callback(event)
+        except Exception:
+            logger.exception("Event subscriber failed for %r", event)
+    return event
@@ -0,0 +1,227 @@
+import logging
+import threading
+from collections import OrderedDict
+
+from references import owner
+from tokenizer import tokenize
+
+'''
+The code in this file makes search tolerant to typos. The vocabulary of a user
+(every distinct term in their notes) is kept in a trigram index: a misspelled
+query term is compared only with the terms sharing enough trigrams with it,
+and those within a small edit distance become alternatives of the query term,
+weighted by how similar they are.
+'''
+
+logger = logging.getLogger(__name__)
+
+# Terms shorter than this are only matched exactly
+MIN_FUZZY_LENGTH = 4
+
+# Alternatives kept per query term
+MAX_EXPANSIONS = 5
+
+# Users with more notes than this get their vocabulary read in the background
+SYNC_BUILD_LIMIT = 2000
+
+
+def max_edits(term):
+    """Edit distance allowed for a term, longer terms tolerate more typos"""
+    if len(term) < MIN_FUZZY_LENGTH:
+        return 0
+    return 1 if len(term) <= 6 else 2
+
+
+def trigrams(term):
+    padded = f"${term}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def bounded_levenshtein(a, b, limit):
+    """Edit distance of a and b, or None when it is larger than limit"""
+    if abs(len(a) - len(b)) > limit:
+        return None
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        row_min = i
+        for j, char_b in enumerate(b, 1):
+            cost = previous[j - 1] + (char_a != char_b)
+            insert = current[j - 1] + 1
+            delete = previous[j] + 1
+            value = cost if cost < insert else insert
+            if delete < value:
+                value = delete
+            current.append(value)
+            if value < row_min:
+                row_min = value
+        # Every later row is at least as large as this row's minimum
+        if row_min > limit:
+            return None
+        previous = current
+    distance = previous[-1]
+    return distance if distance <= limit else None
+
+
+class TrigramIndex:
+    """
+    Vocabulary of terms with their occurrence counts, searchable by trigram.
+    Writes from the events bus and expansions from searches run in different
+    request threads, so both hold the index's lock.
+    """
+
+    def __init__(self, terms=()):
+        self.counts = {}
+        self.grams = {}
+        self._lock = threading.Lock()
+        for term in terms:
+            self.add(term)
+
+    def add(self, term, count=1):
+        with self._lock:
+            if term in self.counts:
+                self.counts[term] += count
+                return
+            self.counts[term] = count
+            for gram in trigrams(term):
+                self.grams.setdefault(gram, set()).add(term)
+
+    def __contains__(self, term):
+        return term in self.counts
+
+    def __len__(self):
+        return len(self.counts)
+
+    def candidates(self, term, edits):
+        """Terms that can be within edits of term, by the number of trigrams they share"""
+        grams = trigrams(term)
+        # Each edit changes at most three trigrams
+        required = len(grams) - 3 * edits
+        shared = {}
+        # Rare trigrams first, so the common ones only add to terms already seen
+        # once the remaining trigrams can no longer reach the required count
+        ordered = sorted(grams, key=lambda gram: len(self.grams.get(gram, ())))
+        for position, gram in enumerate(ordered):
+            remaining = len(ordered) - position
+            for candidate in self.grams.get(gram, ()):
+                count = shared.get(candidate)
+                if count is not None:
+                    shared[candidate] = count + 1
+                elif remaining >= required:
+                    shared[candidate] = 1
+        length = len(term)
+        return [candidate for candidate, count in shared.items()
+                if count >= required and abs(len(candidate) - length) <= edits]
+
+    def expand(self, term, limit=MAX_EXPANSIONS):
+        """
+        Vocabulary terms within the allowed edit distance of term as (term, similarity),
+        most similar (then most frequent) first. The term itself has similarity 1.
+        """
+        edits = max_edits(term)
+        if edits == 0:
+            return [(term, 1.0)] if term in self.counts else []
+        with self._lock:
+            candidates = [(candidate, self.counts[candidate]) for candidate in self.candidates(term, edits)]
+        matches = []
+        for candidate, count in candidates:
+            distance = bounded_levenshtein(term, candidate, edits)
+            if distance is not None:
+                similarity = 1.0 - distance / max(len(term), len(candidate))
+                matches.append((similarity, count, candidate))
+        matches.sort(reverse=True)
+        return [(candidate, similarity) for similarity, _, candidate in matches[:limit]]
+
+
+class VocabularyCache:
+    """Per-user vocabularies of unstemmed words, for engines without their own term index"""
+
+    FIELDS = {"notebook": ("name",), "section": ("title",), "note": ("title", "content")}
+
+    def __init__(self, max_users=32):
+        self.max_users = max_users
+        self._lock = threading.Lock()
+        self._users = OrderedDict()
+        # Per user being read, the events received meanwhile, added before the vocabulary is stored
+        self._building = {}
+
+    def get(self, user_id, collections):
+        """
+        Vocabulary of user_id, read from MongoDB the first time. None while a large
+        one is read in the background, or another request is reading it.
+        """
+        with self._lock:
+            vocabulary = self._users.get(user_id)
+            if vocabulary is not None:
+                self._users.move_to_end(user_id)
+                return vocabulary
+            if user_id in self._building:
+                return None
+            self._building[user_id] = []
+        try:
+            small = collections[2].count_documents(owner(user_id), limit=SYNC_BUILD_LIMIT + 1) <= SYNC_BUILD_LIMIT
+        except Exception:
+            self._abandon(user_id)
+            raise
+        if small:
+            return self._build(user_id, collections)
+
+        def run():
+            try:
+                self._build(user_id, collections)
+            except Exception:
+                logger.exception("Reading the vocabulary of %s failed", user_id)
+
+        threading.Thread(target=run, name="fuzzy-vocabulary-build", daemon=True).start()
+        return None
+
+    def _abandon(self, user_id):
+        with self._lock:
+            self._building.pop(user_id, None)
+
+    def _build(self, user_id, collections):
+        try:
+            vocabulary = self._read(user_id, collections)
+        except Exception:
+            self._abandon(user_id)
+            raise
+        with self._lock:
+            # Writes made while the documents were read may be missing from them
+            for event in self._building.pop(user_id, ()):
+                self._add(vocabulary, event.kind, event.fields)
+            self._users[user_id] = vocabulary
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        return vocabulary
+
+    def _read(self, user_id, collections):
+        vocabulary = TrigramIndex()
+        notebooks_collection, sections_collection, notes_collection = collections
+        sources = (("notebook", notebooks_collection), ("section", sections_collection), ("note", notes_collection))
+        for kind, collection in sources:
+            fields = self.FIELDS[kind]
+            for doc in collection.find(owner(user_id), {field: 1 for field in fields}):
+                self._add(vocabulary, kind, doc)
+        return vocabulary
+
+    def _add(self, vocabulary, kind, doc):
+        for field in self.FIELDS[kind]:
+            for word in tokenize(doc.get(field) or "", stemmed=False):
+                vocabulary.add(word)
+
+    def handle_event(self, event):
+        # Words of deleted documents stay until the vocabulary is evicted, matching
+        # them only costs a query term that finds nothing
+        if event.kind not in self.FIELDS or not event.fields:
+            return
+        with self._lock:
+            vocabulary = self._users.get(event.user_id)
+            pending = self._building.get(event.user_id)
+            if pending is not None:
+                pending.append(event)
+        if vocabulary is not None:
+            self._add(vocabulary, event.kind, event.fields)
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
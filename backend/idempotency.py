@@ -0,0 +1,126 @@
+import datetime
+import hashlib
+from functools import wraps
+
+from flask import current_app, jsonify, make_response, request
+from pymongo.errors import DuplicateKeyError
+
+from references import ref
+
+'''
+The code in this file makes create requests safe to retry. A client sends an
+Idempotency-Key header (a random id it reuses for every retry of one request),
+the first request with a key stores its response in the "idempotency_keys"
+collection and later requests with the same key get that response back instead
+of creating the document again. Checking a retry costs one lookup on the unique
+{user_id, key} index, the client no longer has to list a section to find out
+whether its first attempt went through.
+
+A key is bound to the request it was first sent with (method, path and body):
+reusing it for another request answers 422, retrying while the first request is
+still running answers 409. Keys expire through a TTL index.
+'''
+
+IDEMPOTENCY_COLLECTION = "idempotency_keys"
+
+HEADER = "Idempotency-Key"
+REPLAY_HEADER = "Idempotent-Replayed"
+
+# Keys longer than this are rejected, clients send UUIDs
+MAX_KEY_LENGTH = 255
+
+PENDING = "pending"
+COMPLETED = "completed"
+
+# A pending key older than this belongs to a request that died, a retry may take it over
+PENDING_TIMEOUT = datetime.timedelta(seconds=60)
+
+
+def _now():
+    return datetime.datetime.utcnow()
+
+
+def _fingerprint():
+    digest = hashlib.sha256(f"{request.method} {request.path}\n".encode())
+    digest.update(request.get_data())
+    return digest.hexdigest()
+
+
+def _claim(collection, user_id, key, fingerprint):
+    """(True, None) when this request got the key, else (False, the stored key document)"""
+    now = _now()
+    retention = datetime.timedelta(hours=current_app.config.get("IDEMPOTENCY_KEY_HOURS", 24))
+    try:
+        collection.insert_one({
+            "user_id": ref(user_id),
+            "key": key,
+            "fingerprint": fingerprint,
+            "status": PENDING,
+            "created_at": now,
+            "expires_at": now + retention,
+        })
+        return True, None
+    except DuplicateKeyError:
+        pass
+    stored = collection.find_one({"user_id": ref(user_id), "key": key})
+    if stored is None:
+        # Expired and removed in the meantime
+        return _claim(collection, user_id, key, fingerprint)
+    if stored["status"] == PENDING and stored["fingerprint"] == fingerprint and stored["created_at"] < now - PENDING_TIMEOUT:
+        taken = collection.update_one(
+            {"_id": stored["_id"], "status": PENDING, "created_at": stored["created_at"]},
+            {"$set": {"created_at": now}},
+        )
+        if taken.modified_count:
+            return True, None
+    return False, stored
+
+
+def idempotent(get_db):
+    """Decorator for create endpoints taking user_id, replays the stored response for a known Idempotency-Key
+
+    get_db returns the database in use
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(user_id, **kwargs):
+            key = request.headers.get(HEADER)
+            if not key:
+                return view(user_id, **kwargs)
+            if len(key) > MAX_KEY_LENGTH:
+                return jsonify({"message": f"{HEADER} is limited to {MAX_KEY_LENGTH} characters"}), 400
+
+            collection = get_db()[IDEMPOTENCY_COLLECTION]
+            fingerprint = _fingerprint()
+            claimed, stored = _claim(collection, user_id, key, fingerprint)
+            if not claimed:
+                if stored["fingerprint"] != fingerprint:
+                    return jsonify({"message": f"{HEADER} was already used for another request"}), 422
+                if stored["status"] == PENDING:
+                    response = jsonify({"message": "A request with this Idempotency-Key is still in progress"})
+                    response.headers["Retry-After"] = "1"
+                    return response, 409
+                response = current_app.response_class(stored["body"], status=stored["status_code"],
+                                                      mimetype=stored["mimetype"])
+                response.headers[REPLAY_HEADER] = "true"
+                return response
+
+            query = {"user_id": ref(user_id), "key": key}
+            try:
+                response = make_response(view(user_id, **kwargs))
+            except Exception:
+                # Nothing was stored, a retry runs the request again
+                collection.delete_one(query)
+                raise
+            if response.status_code >= 500:
+                collection.delete_one(query)
+                return response
+            collection.update_one(query, {"$set": {
+                "status": COMPLETED,
+                "status_code": response.status_code,
+                "mimetype": response.mimetype,
+                "body": response.get_data(as_text=True),
+            }})
+            return response
+        return wrapper
+    return decorator
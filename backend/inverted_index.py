@@ -0,0 +1,849 @@
+import array
+import atexit
+import hashlib
+import heapq
+import json
+import logging
+import math
+import mmap
+import os
+import queue
+import sys
+import threading
+from collections import OrderedDict
+
+from bson import ObjectId
+
+from deadlines import query_comment
+from events import DELETED
+from fuzzy import TrigramIndex
+from references import id_string, owner
+from search import (
+    NOTE_PROJECTION,
+    NOTEBOOK_PROJECTION,
+    RESULT_LIMITS,
+    SECTION_PROJECTION,
+    UNIFIED_LIMIT,
+    SearchBackend,
+    merge_ranked,
+)
+from tokenizer import tokenize
+
+'''
+The code in this file is an embedded full text search engine, an alternative
+to MongoDB text indexes selected with SEARCH_BACKEND=inverted.
+
+Every user has their own inverted index of notebooks, sections and notes, ranked
+with BM25. The tokenizer understands code: getUserName and get_user_name are
+indexed as the whole identifier and as get, user, name. New writes go into an
+in-memory segment that is written out as an immutable segment file (postings
+read through mmap) once it grows, and a background thread merges segments so
+queries only look at a few of them.
+
+Indexes are built from MongoDB on a user's first search and then follow the
+write endpoints through the events bus, so searching adds no load on MongoDB
+beyond fetching the returned documents by _id. Each process keeps its own index,
+run a single backend process when using this engine.
+'''
+
+logger = logging.getLogger(__name__)
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+# Titles count this many times as much as body text
+TITLE_WEIGHT = 2
+
+# The in-memory segment is written to disk after this many documents
+FLUSH_DOCS = 2000
+
+# More segments than this schedules a background merge
+MAX_SEGMENTS = 6
+
+# Matches per group checked against MongoDB filters of structured queries, best first
+FILTER_CANDIDATES = 10000
+
+KIND_PREFIX = {"notebook": "b", "section": "s", "note": "n"}
+PREFIX_KIND = {prefix: kind for kind, prefix in KIND_PREFIX.items()}
+GROUPS = {"notebook": "notebooks", "section": "sections", "note": "notes"}
+
+# Text fields per kind, the first one is the title
+TEXT_FIELDS = {"notebook": ("name",), "section": ("title",), "note": ("title", "content")}
+
+def document_terms(kind, doc):
+    """Weighted term frequencies and length of a notebook, section or note"""
+    frequencies = {}
+    fields = TEXT_FIELDS[kind]
+    for position, field in enumerate(fields):
+        weight = TITLE_WEIGHT if position == 0 else 1
+        for term in tokenize(doc.get(field) or ""):
+            frequencies[term] = frequencies.get(term, 0) + weight
+    return frequencies, sum(frequencies.values())
+
+
+def doc_key(kind, doc_id):
+    return f"{KIND_PREFIX[kind]}:{doc_id}"
+
+
+def _sources(collections):
+    """(kind, collection, projection) of everything a user index holds"""
+    notebooks_collection, sections_collection, notes_collection = collections
+    return (
+        ("notebook", notebooks_collection, {"name": 1, "labels": 1}),
+        ("section", sections_collection, {"title": 1, "labels": 1, "notebook_id": 1}),
+        ("note", notes_collection, {"title": 1, "content": 1, "labels": 1, "notebook_id": 1, "section_id": 1}),
+    )
+
+
+class DocInfo:
+    """Where the current version of a document lives, and what it is filtered on"""
+
+    __slots__ = ("segment", "length", "labels", "notebook_id", "section_id")
+
+    def __init__(self, segment, length, labels, notebook_id, section_id):
+        self.segment = segment
+        self.length = length
+        self.labels = labels
+        self.notebook_id = notebook_id
+        self.section_id = section_id
+
+    def meta(self):
+        return [self.length, self.labels, self.notebook_id, self.section_id]
+
+    def meta_update(self):
+        return {"labels": self.labels, "notebook_id": self.notebook_id, "section_id": self.section_id}
+
+
+class MemorySegment:
+    """Segment receiving new writes, term -> {doc key: frequency}"""
+
+    def __init__(self, segment_id):
+        self.id = segment_id
+        self.terms = {}
+        self.docs = {}
+        # Documents deleted, and label or parent changes of documents living in older segments
+        self.deleted = set()
+        self.meta_updates = {}
+
+    def add(self, key, frequencies, info):
+        self.remove(key)
+        for term, frequency in frequencies.items():
+            self.terms.setdefault(term, {})[key] = frequency
+        self.docs[key] = (frequencies, info)
+
+    def remove(self, key):
+        entry = self.docs.pop(key, None)
+        if entry is None:
+            return
+        for term in entry[0]:
+            postings = self.terms.get(term)
+            if postings is not None:
+                postings.pop(key, None)
+                if not postings:
+                    del self.terms[term]
+
+    def postings(self, term):
+        return self.terms.get(term, {}).items()
+
+    def vocabulary(self):
+        return self.terms.keys()
+
+    def __len__(self):
+        return len(self.docs)
+
+
+class DiskSegment:
+    """Immutable segment, postings are (doc number, frequency) uint32 pairs read through mmap"""
+
+    def __init__(self, segment_id, docs, terms, postings, deleted=(), meta_updates=None, mapped=None):
+        self.id = segment_id
+        self.docs = docs
+        self.terms = terms
+        self._postings = postings
+        self._mmap = mapped
+        self.deleted = set(deleted)
+        self.meta_updates = meta_updates or {}
+
+    def postings(self, term):
+        location = self.terms.get(term)
+        if location is None:
+            return ()
+        start, count = location
+        pairs = self._postings[start * 2:(start + count) * 2]
+        docs = self.docs
+        return ((docs[pairs[i]][0], pairs[i + 1]) for i in range(0, count * 2, 2))
+
+    def vocabulary(self):
+        return self.terms.keys()
+
+    @staticmethod
+    def paths(directory, segment_id):
+        base = os.path.join(directory, f"seg-{segment_id}")
+        return base + ".json", base + ".post"
+
+    @classmethod
+    def write(cls, directory, segment_id, entries, deleted=(), meta_updates=None):
+        """
+        Write a segment from (doc key, frequencies, DocInfo) entries.
+        Returns the loaded segment.
+        """
+        docs = []
+        inverted = {}
+        for number, (key, frequencies, info) in enumerate(entries):
+            docs.append([key] + info.meta())
+            for term, frequency in frequencies.items():
+                pairs = inverted.get(term)
+                if pairs is None:
+                    pairs = inverted[term] = array.array("I")
+                pairs.append(number)
+                pairs.append(frequency)
+
+        postings = array.array("I")
+        terms = {}
+        for term in sorted(inverted):
+            pairs = inverted[term]
+            terms[term] = [len(postings) // 2, len(pairs) // 2]
+            postings.extend(pairs)
+        if sys.byteorder != "little":
+            postings.byteswap()
+
+        meta_path, postings_path = cls.paths(directory, segment_id)
+        with open(postings_path + ".tmp", "wb") as f:
+            postings.tofile(f)
+        with open(meta_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({
+                "docs": docs,
+                "terms": terms,
+                "deleted": sorted(deleted),
+                "meta_updates": meta_updates or {},
+            }, f, separators=(",", ":"))
+        os.replace(postings_path + ".tmp", postings_path)
+        os.replace(meta_path + ".tmp", meta_path)
+        return cls.load(directory, segment_id)
+
+    @classmethod
+    def load(cls, directory, segment_id):
+        meta_path, postings_path = cls.paths(directory, segment_id)
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        mapped = None
+        postings = memoryview(b"").cast("I")
+        if os.path.getsize(postings_path) > 0:
+            with open(postings_path, "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            postings = memoryview(mapped).cast("I")
+            if sys.byteorder != "little":
+                postings = array.array("I", postings)
+                postings.byteswap()
+        return cls(
+            segment_id,
+            meta["docs"],
+            {term: tuple(location) for term, location in meta["terms"].items()},
+            postings,
+            meta.get("deleted", ()),
+            meta.get("meta_updates"),
+            mapped,
+        )
+
+
+class UserIndex:
+    """Inverted index of one user's notebooks, sections and notes"""
+
+    def __init__(self, user_id, directory):
+        self.user_id = user_id
+        self.directory = directory
+        self.lock = threading.RLock()
+        self.segments = []
+        self.live = None
+        self.next_id = 1
+        self.docs = {}
+        self.total_length = 0
+        self.ready = False
+        self.merging = False
+        # Set once evicted, another UserIndex may own the directory afterwards
+        self.closed = False
+        self.released = threading.Event()
+        # Evicted index of the same user still writing the directory, waited for before reading it
+        self.previous = None
+        # Trigram index of the terms, built on the first fuzzy query
+        self._vocabulary = None
+
+    # --- Persistence ---
+
+    def _manifest_path(self):
+        return os.path.join(self.directory, "manifest.json")
+
+    def _write_manifest(self, clean):
+        path = self._manifest_path()
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({
+                "segments": [segment.id for segment in self.segments],
+                "next_id": self.next_id,
+                "clean": clean,
+            }, f)
+        os.replace(path + ".tmp", path)
+
+    def _new_live(self):
+        self.live = MemorySegment(self.next_id)
+        self.next_id += 1
+
+    def exists(self):
+        return os.path.exists(self._manifest_path())
+
+    def _wait_for_previous(self):
+        if self.previous is not None:
+            self.previous.released.wait()
+            self.previous = None
+
+    def close(self):
+        """Write the memory segment and stop writing to the directory"""
+        with self.lock:
+            try:
+                if self.ready and not self.closed:
+                    self.flush(clean=True)
+            finally:
+                self.closed = True
+                self.released.set()
+
+    def load(self):
+        """Open the index written by a previous run, False when it has to be rebuilt"""
+        self._wait_for_previous()
+        try:
+            with open(self._manifest_path(), encoding="utf-8") as f:
+                manifest = json.load(f)
+            # An index not closed cleanly is missing the writes of its memory segment
+            if not manifest.get("clean"):
+                return False
+            segments = [DiskSegment.load(self.directory, segment_id) for segment_id in manifest["segments"]]
+        except (OSError, ValueError, KeyError):
+            logger.warning("Search index in %s is unreadable, rebuilding", self.directory)
+            return False
+
+        self.segments = segments
+        self.next_id = manifest["next_id"]
+        self.docs = {}
+        for segment in segments:
+            self._apply_segment(segment)
+        self.total_length = sum(info.length for info in self.docs.values())
+        self._new_live()
+        self._write_manifest(clean=False)
+        self._remove_orphans()
+        self._vocabulary = None
+        self.ready = True
+        return True
+
+    def _apply_segment(self, segment):
+        for key in segment.deleted:
+            self.docs.pop(key, None)
+        for key, length, labels, notebook_id, section_id in segment.docs:
+            self.docs[key] = DocInfo(segment.id, length, labels, notebook_id, section_id)
+        for key, update in segment.meta_updates.items():
+            info = self.docs.get(key)
+            if info is None:
+                continue
+            # Segments written before moves existed only hold the labels
+            if isinstance(update, list):
+                update = {"labels": update}
+            for field, value in update.items():
+                setattr(info, field, value)
+
+    def _remove_orphans(self):
+        keep = {name for segment in self.segments for name in map(os.path.basename, DiskSegment.paths("", segment.id))}
+        for name in os.listdir(self.directory):
+            if name.startswith("seg-") and name not in keep:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+    def build(self, collections):
+        """Index every notebook, section and note of the user from MongoDB"""
+        self._wait_for_previous()
+        os.makedirs(self.directory, exist_ok=True)
+        entries = []
+        self.docs = {}
+        self.total_length = 0
+        segment_id = self.next_id
+        self.next_id += 1
+        for kind, collection, projection in _sources(collections):
+            for doc in collection.find(owner(self.user_id), projection):
+                key, frequencies, info = self._entry(kind, doc["_id"], doc, segment_id)
+                entries.append((key, frequencies, info))
+                self.docs[key] = info
+                self.total_length += info.length
+        self.segments = [DiskSegment.write(self.directory, segment_id, entries)]
+        self._new_live()
+        self._write_manifest(clean=False)
+        self._remove_orphans()
+        self._vocabulary = None
+        self.ready = True
+
+    def add_notebook(self, collections, notebook_id):
+        """Index a notebook with its sections and notes as stored in MongoDB, for copied notebooks"""
+        for kind, collection, projection in _sources(collections):
+            query = {"_id": ObjectId(notebook_id)} if kind == "notebook" else owner(self.user_id, notebook_id=notebook_id)
+            for doc in collection.find(query, projection):
+                self.upsert(kind, str(doc["_id"]), doc)
+
+    def _entry(self, kind, doc_id, doc, segment_id):
+        frequencies, length = document_terms(kind, doc)
+        if kind == "notebook":
+            notebook_id = str(doc_id)
+        else:
+            notebook_id = id_string(doc.get("notebook_id"))
+        section_id = id_string(doc.get("section_id"))
+        info = DocInfo(segment_id, length, list(doc.get("labels") or []), notebook_id, section_id)
+        return doc_key(kind, doc_id), frequencies, info
+
+    def flush(self, clean=False):
+        """Write the memory segment to disk"""
+        live = self.live
+        if len(live) or live.deleted or live.meta_updates:
+            entries = [(key, frequencies, info) for key, (frequencies, info) in live.docs.items()]
+            self.segments.append(DiskSegment.write(
+                self.directory, live.id, entries, live.deleted, live.meta_updates
+            ))
+            self._new_live()
+        self._write_manifest(clean=clean)
+
+    # --- Writes ---
+
+    def _discard(self, key):
+        info = self.docs.pop(key, None)
+        if info is None:
+            return None
+        self.total_length -= info.length
+        self.live.remove(key)
+        self.live.deleted.add(key)
+        self.live.meta_updates.pop(key, None)
+        return info
+
+    def upsert(self, kind, doc_id, fields):
+        key = doc_key(kind, doc_id)
+        existing = self.docs.get(key)
+        text_changed = any(field in fields for field in TEXT_FIELDS[kind])
+
+        if existing is not None and not text_changed:
+            # Label change or move only, the postings stay where they are
+            previous_notebook = existing.notebook_id
+            changed = False
+            if "labels" in fields:
+                existing.labels = list(fields["labels"] or [])
+                changed = True
+            for field in ("notebook_id", "section_id"):
+                value = id_string(fields.get(field))
+                if value is not None and kind != "notebook" and value != getattr(existing, field):
+                    setattr(existing, field, value)
+                    changed = True
+            if changed and existing.segment != self.live.id:
+                self.live.meta_updates[key] = existing.meta_update()
+            if kind == "section" and existing.notebook_id != previous_notebook:
+                self._reparent_notes(str(doc_id), existing.notebook_id)
+            return
+
+        doc = dict(fields)
+        if existing is not None:
+            doc.setdefault("labels", existing.labels)
+            doc.setdefault("notebook_id", existing.notebook_id)
+            doc.setdefault("section_id", existing.section_id)
+        key, frequencies, info = self._entry(kind, doc_id, doc, self.live.id)
+        if existing is not None:
+            self.total_length -= existing.length
+        self.live.meta_updates.pop(key, None)
+        self.live.add(key, frequencies, info)
+        if self._vocabulary is not None:
+            for term in frequencies:
+                self._vocabulary.add(term)
+        self.docs[key] = info
+        self.total_length += info.length
+
+    def _reparent_notes(self, section_id, notebook_id):
+        """Notes of a section moved to another notebook"""
+        for key, info in self.docs.items():
+            if info.section_id == section_id and info.notebook_id != notebook_id:
+                info.notebook_id = notebook_id
+                if info.segment != self.live.id:
+                    self.live.meta_updates[key] = info.meta_update()
+
+    def delete(self, kind, doc_id):
+        self._discard(doc_key(kind, doc_id))
+        # Deleting a notebook or section also deletes what it contains
+        if kind == "notebook":
+            children = [key for key, info in self.docs.items() if info.notebook_id == doc_id]
+        elif kind == "section":
+            children = [key for key, info in self.docs.items() if info.section_id == doc_id]
+        else:
+            children = []
+        for key in children:
+            self._discard(key)
+
+    # --- Queries ---
+
+    def vocabulary(self):
+        """Trigram index of every term in the index, kept up to date by upsert"""
+        if self._vocabulary is None:
+            vocabulary = TrigramIndex()
+            for segment in self.segments + [self.live]:
+                for term in segment.vocabulary():
+                    vocabulary.add(term)
+            self._vocabulary = vocabulary
+        return self._vocabulary
+
+    def expand(self, terms):
+        """One clause per query term, with the vocabulary terms a typo could stand for"""
+        vocabulary = self.vocabulary()
+        return [vocabulary.expand(term) or [(term, 1.0)] for term in terms]
+
+    def _scores(self, terms, clauses):
+        """BM25 score of every document matching the query, by doc key"""
+        if clauses is None:
+            clauses = [[(term, 1.0)] for term in dict.fromkeys(terms)]
+        count = len(self.docs)
+        if not count or not clauses:
+            return {}
+        average_length = self.total_length / count or 1.0
+        docs = self.docs
+        scores = {}
+        for alternatives in clauses:
+            clause_scores = {}
+            for term, weight in alternatives:
+                matches = []
+                for segment in self.segments + [self.live]:
+                    segment_id = segment.id
+                    for key, frequency in segment.postings(term):
+                        info = docs.get(key)
+                        # Postings of replaced or deleted versions are skipped
+                        if info is not None and info.segment == segment_id:
+                            matches.append((key, frequency, info.length))
+                if not matches:
+                    continue
+                idf = math.log(1 + (count - len(matches) + 0.5) / (len(matches) + 0.5))
+                for key, frequency, length in matches:
+                    norm = frequency + K1 * (1 - B + B * length / average_length)
+                    score = weight * idf * frequency * (K1 + 1) / norm
+                    if score > clause_scores.get(key, 0.0):
+                        clause_scores[key] = score
+            for key, score in clause_scores.items():
+                scores[key] = scores.get(key, 0.0) + score
+        return scores
+
+    def _grouped(self, scores, labels, groups, allowed=None):
+        """
+        Matching (score, doc key) per group, without documents missing a label.
+        allowed ({group: doc ids}) keeps only those documents in the groups it has.
+        """
+        grouped = {group: [] for group in groups}
+        wanted = set(labels or ())
+        allowed = allowed or {}
+        docs = self.docs
+        for key, score in scores.items():
+            if wanted and not wanted.issubset(docs[key].labels):
+                continue
+            group = GROUPS[PREFIX_KIND[key[0]]]
+            if group in grouped and (group not in allowed or key[2:] in allowed[group]):
+                grouped[group].append((score, key))
+        return grouped
+
+    def matches(self, terms, labels=None, clauses=None, limit=FILTER_CANDIDATES):
+        """Best limit matches per group as {group: [(score, doc id)]}, for filtering elsewhere"""
+        grouped = self._grouped(self._scores(terms, clauses), labels, RESULT_LIMITS)
+        return {group: [(score, key[2:]) for score, key in heapq.nlargest(limit, hits)]
+                for group, hits in grouped.items()}
+
+    def search(self, terms, labels=None, limits=RESULT_LIMITS, clauses=None, allowed=None):
+        """
+        Top documents per group as {group: [(score, doc id)]}, best first.
+        clauses replaces terms with [(term, weight), ...] alternatives per query term,
+        a document scores the best weighted alternative it contains.
+        """
+        grouped = self._grouped(self._scores(terms, clauses), labels, limits, allowed)
+        return {
+            group: [(score, key[2:]) for score, key in heapq.nlargest(limits[group], hits)]
+            for group, hits in grouped.items()
+        }
+
+    def faceted_search(self, terms, labels=None, limits=RESULT_LIMITS, offsets=None, clauses=None, allowed=None):
+        """
+        Like search, skipping offsets[group] hits per group, along with the number of
+        matches per group, per label and per notebook (of matching sections and notes)
+        """
+        offsets = offsets or {}
+        grouped = self._grouped(self._scores(terms, clauses), labels, limits, allowed)
+        hits, totals, label_counts, notebook_counts = {}, {}, {}, {}
+        for group, matches in grouped.items():
+            offset = offsets.get(group, 0)
+            hits[group] = [(score, key[2:]) for score, key in heapq.nlargest(offset + limits[group], matches)[offset:]]
+            totals[group] = len(matches)
+            for _, key in matches:
+                info = self.docs[key]
+                for label in info.labels:
+                    label_counts[label] = label_counts.get(label, 0) + 1
+                if info.notebook_id:
+                    notebook_counts[info.notebook_id] = notebook_counts.get(info.notebook_id, 0) + 1
+        return hits, totals, label_counts, notebook_counts
+
+    def merge_snapshot(self):
+        """Segments to merge and the document map they are merged against"""
+        return list(self.segments), {key: info.segment for key, info in self.docs.items()}
+
+    def merge(self):
+        """Merge all disk segments into one, dropping replaced and deleted postings"""
+        with self.lock:
+            if self.closed or len(self.segments) < 2:
+                return
+            segments, owners = self.merge_snapshot()
+            segment_id = self.next_id
+            self.next_id += 1
+
+        # Segments are immutable, so the merge itself runs without the lock
+        merged_ids = {segment.id for segment in segments}
+        frequencies = {}
+        metas = {}
+        for segment in segments:
+            for key, length, labels, notebook_id, section_id in segment.docs:
+                if owners.get(key) == segment.id:
+                    frequencies[key] = {}
+                    metas[key] = (length, notebook_id, section_id)
+            for term in segment.vocabulary():
+                for key, frequency in segment.postings(term):
+                    if owners.get(key) == segment.id:
+                        frequencies[key][term] = frequency
+
+        with self.lock:
+            if self.closed:
+                # Evicted while merging, the manifest written on close does not list the merged segment
+                return
+            entries = []
+            for key, terms in frequencies.items():
+                info = self.docs.get(key)
+                length, notebook_id, section_id = metas[key]
+                # Keep the labels and parents as they are now, writes during the merge went to the memory segment
+                labels = info.labels if info is not None else []
+                if info is not None:
+                    notebook_id, section_id = info.notebook_id, info.section_id
+                entries.append((key, terms, DocInfo(segment_id, length, labels, notebook_id, section_id)))
+            merged = DiskSegment.write(self.directory, segment_id, entries)
+            for key in frequencies:
+                info = self.docs.get(key)
+                if info is not None and info.segment in merged_ids:
+                    info.segment = segment_id
+            self.segments = [merged] + [segment for segment in self.segments if segment.id not in merged_ids]
+            self._write_manifest(clean=False)
+            self._remove_orphans()
+            # Rebuilt on the next fuzzy query without the terms of deleted documents
+            self._vocabulary = None
+
+
+class InvertedIndexSearch(SearchBackend):
+    """BM25 search over per-user inverted indexes kept next to the backend"""
+
+    name = "inverted"
+
+    def __init__(self, directory, get_collections=None, max_users=32):
+        self.directory = directory
+        self.get_collections = get_collections
+        self.max_users = max_users
+        self._lock = threading.Lock()
+        self._users = OrderedDict()
+        # Evicted indexes writing their memory segment, by user
+        self._closing = {}
+        self._merges = queue.Queue()
+        self._merge_thread = threading.Thread(target=self._merge_loop, name="search-index-merge", daemon=True)
+        self._merge_thread.start()
+        atexit.register(self.close)
+
+    def _user_directory(self, user_id):
+        digest = hashlib.sha1(str(user_id).encode("utf-8")).hexdigest()[:20]
+        return os.path.join(self.directory, digest)
+
+    def _index(self, user_id, create=True):
+        """Index of user_id, loaded from disk or None when it was never built and create is False"""
+        with self._lock:
+            index = self._users.get(user_id)
+            if index is not None:
+                self._users.move_to_end(user_id)
+                return index
+            index = UserIndex(user_id, self._user_directory(user_id))
+            if not create and not index.exists():
+                return None
+            self._users[user_id] = index
+            index.previous = self._closing.get(user_id)
+            evicted = []
+            while len(self._users) > self.max_users:
+                # Indexes being merged stay until the merge is done
+                user = next((user for user, candidate in self._users.items()
+                             if not candidate.merging and candidate is not index), None)
+                if user is None:
+                    break
+                evicted.append(self._users.pop(user))
+                self._closing[user] = evicted[-1]
+        for old in evicted:
+            try:
+                old.close()
+            finally:
+                with self._lock:
+                    if self._closing.get(old.user_id) is old:
+                        del self._closing[old.user_id]
+        return index
+
+    def _ready_index(self, user_id, collections=None):
+        while True:
+            index = self._index(user_id)
+            with index.lock:
+                if index.closed:
+                    # Evicted since it was looked up, load the index replacing it
+                    continue
+                if not index.ready and not index.load():
+                    collections = collections or (self.get_collections() if self.get_collections else None)
+                    if collections is None:
+                        return None
+                    index.build(collections)
+            return index
+
+    def _allowed(self, user_id, index, terms, labels, clauses, collections, filters):
+        """
+        Ids of the matches satisfying the MongoDB filters of a structured query, per
+        filtered group. The index ranks, one query by _id per group checks the filters.
+        """
+        if not filters or not any(filters.values()):
+            return None
+        with index.lock:
+            candidates = index.matches(terms, labels, clauses)
+        allowed = {}
+        for group, collection in zip(("notebooks", "sections", "notes"), collections):
+            if not filters.get(group):
+                continue
+            ids = [ObjectId(doc_id) for _, doc_id in candidates[group] if ObjectId.is_valid(doc_id)]
+            if not ids:
+                allowed[group] = set()
+                continue
+            found = collection.find({"_id": {"$in": ids}, **owner(user_id), "$and": filters[group]},
+                                    {"_id": 1}, comment=query_comment())
+            allowed[group] = {str(doc["_id"]) for doc in found}
+        return allowed
+
+    def search(self, user_id, query, labels, collections, fuzzy=False, limits=None, filters=None):
+        terms = tokenize(query)
+        index = self._ready_index(user_id, collections)
+        with index.lock:
+            clauses = index.expand(dict.fromkeys(terms)) if fuzzy else None
+        allowed = self._allowed(user_id, index, terms, labels, clauses, collections, filters)
+        with index.lock:
+            hits = index.search(terms, labels, limits or RESULT_LIMITS, clauses=clauses, allowed=allowed)
+        return self._hydrate(user_id, hits, collections)
+
+    def unified_search(self, user_id, query, labels, collections, fuzzy=False, limit=UNIFIED_LIMIT, filters=None):
+        terms = tokenize(query)
+        index = self._ready_index(user_id, collections)
+        with index.lock:
+            clauses = index.expand(dict.fromkeys(terms)) if fuzzy else None
+        allowed = self._allowed(user_id, index, terms, labels, clauses, collections, filters)
+        with index.lock:
+            hits = index.search(terms, labels, {group: limit for group in RESULT_LIMITS}, clauses=clauses,
+                                allowed=allowed)
+        # BM25 scores share one index, so the global top is picked before fetching anything
+        best = heapq.nlargest(limit, ((score, group, doc_id) for group, ranked in hits.items()
+                                      for score, doc_id in ranked))
+        selected = {group: [] for group in hits}
+        for score, group, doc_id in best:
+            selected[group].append((score, doc_id))
+        return merge_ranked(self._hydrate(user_id, selected, collections), limit)
+
+    def faceted_search(self, user_id, query, labels, collections, fuzzy=False, limits=None, offsets=None,
+                       filters=None):
+        terms = tokenize(query)
+        index = self._ready_index(user_id, collections)
+        with index.lock:
+            clauses = index.expand(dict.fromkeys(terms)) if fuzzy else None
+        allowed = self._allowed(user_id, index, terms, labels, clauses, collections, filters)
+        with index.lock:
+            hits, totals, label_counts, notebook_counts = index.faceted_search(
+                terms, labels, limits or RESULT_LIMITS, offsets, clauses=clauses, allowed=allowed
+            )
+        return {
+            "results": self._hydrate(user_id, hits, collections),
+            "totals": totals,
+            "labels": label_counts,
+            "notebooks": notebook_counts,
+        }
+
+    def _hydrate(self, user_id, hits, collections):
+        """Fetch the ranked documents from MongoDB by _id, keeping the ranking"""
+        notebooks_collection, sections_collection, notes_collection = collections
+        sources = {
+            "notebooks": (notebooks_collection, NOTEBOOK_PROJECTION),
+            "sections": (sections_collection, SECTION_PROJECTION),
+            "notes": (notes_collection, NOTE_PROJECTION),
+        }
+        results = {}
+        for group, ranked in hits.items():
+            results[group] = []
+            if not ranked:
+                continue
+            collection, projection = sources[group]
+            ids = [ObjectId(doc_id) for _, doc_id in ranked if ObjectId.is_valid(doc_id)]
+            found = {str(doc["_id"]): doc for doc in collection.find(
+                {"_id": {"$in": ids}, **owner(user_id)}, projection, comment=query_comment()
+            )}
+            for score, doc_id in ranked:
+                doc = found.get(doc_id)
+                # Missing documents were deleted by another process since the index saw them
+                if doc is not None:
+                    doc["score"] = round(score, 4)
+                    results[group].append(doc)
+        return results
+
+    def handle_event(self, event):
+        if event.kind not in KIND_PREFIX:
+            return
+        while True:
+            # Users who never searched have no index to keep up to date
+            index = self._index(event.user_id, create=False)
+            if index is None:
+                return
+            with index.lock:
+                if index.closed:
+                    # Evicted since it was looked up, the write goes to the index loaded in its place
+                    continue
+                if not index.ready and not index.load():
+                    # Rebuilt from MongoDB on the next search, which includes this write
+                    return
+                if event.action == DELETED:
+                    index.delete(event.kind, event.doc_id)
+                elif "copied_from" in event.fields and self.get_collections is not None:
+                    # Duplicated inside MongoDB, the event does not carry the copied documents
+                    index.add_notebook(self.get_collections(), event.doc_id)
+                else:
+                    index.upsert(event.kind, event.doc_id, event.fields)
+                if len(index.live) >= FLUSH_DOCS:
+                    index.flush()
+                    if len(index.segments) > MAX_SEGMENTS and not index.merging:
+                        index.merging = True
+                        self._merges.put(index)
+            return
+
+    def _merge_loop(self):
+        while True:
+            index = self._merges.get()
+            if index is None:
+                return
+            try:
+                index.merge()
+            except Exception:
+                logger.exception("Merging search index segments in %s failed", index.directory)
+            finally:
+                index.merging = False
+
+    def close(self):
+        """Write memory segments so the next start loads the indexes instead of rebuilding them"""
+        with self._lock:
+            indexes = list(self._users.values())
+            self._users.clear()
+        for index in indexes:
+            try:
+                index.close()
+            except OSError:
+                logger.exception("Writing search index %s failed", index.directory)
+        self._merges.put(None)
+        atexit.unregister(self.close)
@@ -0,0 +1,290 @@
+import datetime
+import logging
+import os
+import threading
+import time
+
+import click
+from bson import ObjectId
+from flask import jsonify
+from flask.cli import AppGroup
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from references import id_string, ref
+
+'''
+The code in this file runs long operations (notebook copies, large cascade
+deletes) as background jobs, so a request only has to queue them. Jobs are
+documents in the "jobs" collection: any process sharing the database can run
+them, and a job survives the process that queued it.
+
+Workers claim a job by setting a lease with find_one_and_update. A job whose
+worker died is claimed again once its lease expires, a job that raised is
+retried with exponential backoff up to its handler's max_attempts. Handlers
+report progress, shown by GET /api/jobs/<job_id>, which also renews the lease.
+A job queued with an idempotency key is queued once per user and type; queueing
+it again returns the existing job.
+
+Events published by a job (search index updates) reach the subscribers of the
+process running it, the default embedded workers run in the web process.
+'''
+
+logger = logging.getLogger(__name__)
+
+JOBS_COLLECTION = "jobs"
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+# Seconds before the first retry, doubled for each further attempt
+RETRY_DELAY = 2
+
+# Finished jobs are removed by a TTL index after this long
+RETENTION = datetime.timedelta(days=7)
+
+# Registered handlers by job type
+JOB_HANDLERS = {}
+
+
+class JobHandler:
+    def __init__(self, job_type, func, max_attempts):
+        self.job_type = job_type
+        self.func = func
+        self.max_attempts = max_attempts
+
+
+def job_handler(job_type, max_attempts=3):
+    """Register func(context, params) as the handler of job_type, its return value is the job's result"""
+    def decorator(func):
+        if job_type in JOB_HANDLERS:
+            raise ValueError(f"Duplicate job type {job_type}")
+        JOB_HANDLERS[job_type] = JobHandler(job_type, func, max_attempts)
+        return func
+    return decorator
+
+
+class LeaseLost(RuntimeError):
+    """Another worker took over the job, its lease had expired"""
+
+
+class JobContext:
+    """What a handler gets to reach the database and report its progress"""
+
+    def __init__(self, db, job, token, lease):
+        self.db = db
+        self.job = job
+        self.job_id = job["_id"]
+        # As in URLs, the form events and search indexes use
+        self.user_id = id_string(job.get("user_id"))
+        self.attempt = job["attempts"]
+        self.last_attempt = job["attempts"] >= job["max_attempts"]
+        self._token = token
+        self._lease = lease
+
+    def report(self, message, done=None, total=None):
+        """Record progress and renew the lease, raises LeaseLost if the job was taken over"""
+        now = _now()
+        result = self.db[JOBS_COLLECTION].update_one(
+            {"_id": self.job_id, "worker": self._token},
+            {"$set": {"progress": {"message": message, "done": done, "total": total},
+                      "lease_until": now + self._lease, "updated_at": now}},
+        )
+        if result.matched_count == 0:
+            raise LeaseLost(f"Job {self.job_id} was taken over")
+
+
+def _now():
+    return datetime.datetime.utcnow()
+
+
+def enqueue(db, job_type, user_id, params, idempotency_key=None):
+    """Queue a job, returns its document. The same idempotency key returns the job queued first"""
+    handler = JOB_HANDLERS[job_type]
+    now = _now()
+    job = {
+        "type": job_type,
+        "user_id": ref(user_id),
+        "params": params,
+        "status": QUEUED,
+        "progress": None,
+        "result": None,
+        "error": None,
+        "attempts": 0,
+        "max_attempts": handler.max_attempts,
+        "run_after": now,
+        "created_at": now,
+        "updated_at": now,
+    }
+    if idempotency_key:
+        job["idempotency_key"] = idempotency_key
+    try:
+        db[JOBS_COLLECTION].insert_one(job)
+    except DuplicateKeyError:
+        return db[JOBS_COLLECTION].find_one(
+            {"user_id": ref(user_id), "type": job_type, "idempotency_key": idempotency_key}
+        )
+    return job
+
+
+def public(job):
+    """The fields of a job shown to clients"""
+    fields = ("_id", "type", "status", "progress", "result", "error", "attempts", "created_at", "updated_at")
+    return {field: job.get(field) for field in fields}
+
+
+class JobRunner:
+    """Worker threads claiming and running queued jobs"""
+
+    def __init__(self, get_db, workers=2, lease_seconds=300, poll_interval=1.0):
+        self.get_db = get_db
+        self.workers = workers
+        self.lease = datetime.timedelta(seconds=lease_seconds)
+        self.poll_interval = poll_interval
+        self._wake = threading.Condition()
+        self._pending = False
+        self._threads = []
+        self._pid = None
+        self._stopping = False
+
+    def claim(self, token):
+        """The next job to run, with its lease taken by token, or None"""
+        now = _now()
+        return self.get_db()[JOBS_COLLECTION].find_one_and_update(
+            {"$or": [
+                {"status": QUEUED, "run_after": {"$lte": now}},
+                # Workers that stopped renewing their lease are presumed dead
+                {"status": RUNNING, "lease_until": {"$lt": now}},
+            ]},
+            {"$set": {"status": RUNNING, "worker": token, "lease_until": now + self.lease, "updated_at": now},
+             "$inc": {"attempts": 1}},
+            sort=[("run_after", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def run_once(self, token=None):
+        """Claim and run one job, returns False when none was ready"""
+        token = token or str(ObjectId())
+        job = self.claim(token)
+        if job is None:
+            return False
+        db = self.get_db()
+        handler = JOB_HANDLERS.get(job["type"])
+        context = JobContext(db, job, token, self.lease)
+        try:
+            if handler is None:
+                raise LookupError(f"No handler for job type {job['type']}")
+            result = handler.func(context, job.get("params") or {})
+        except LeaseLost:
+            logger.warning("Job %s was taken over by another worker", job["_id"])
+            return True
+        except Exception as e:
+            logger.exception("Job %s (%s) failed, attempt %s", job["_id"], job["type"], job["attempts"])
+            now = _now()
+            if job["attempts"] < job["max_attempts"] and handler is not None:
+                update = {"status": QUEUED, "error": str(e),
+                          "run_after": now + datetime.timedelta(seconds=RETRY_DELAY * 2 ** (job["attempts"] - 1))}
+            else:
+                update = {"status": FAILED, "error": str(e), "expires_at": now + RETENTION}
+        else:
+            now = _now()
+            update = {"status": SUCCEEDED, "result": result, "error": None, "expires_at": now + RETENTION}
+        update["updated_at"] = now
+        db[JOBS_COLLECTION].update_one({"_id": job["_id"], "worker": token},
+                                       {"$set": update, "$unset": {"lease_until": ""}})
+        return True
+
+    def run_pending(self):
+        """Run jobs in the calling thread until none is ready, returns the number run"""
+        count = 0
+        while self.run_once():
+            count += 1
+        return count
+
+    def _work(self):
+        token = f"{os.getpid()}-{threading.get_ident()}"
+        while not self._stopping:
+            try:
+                if self.run_once(f"{token}-{ObjectId()}"):
+                    continue
+            except Exception:
+                logger.exception("Job worker failed to claim a job")
+            with self._wake:
+                if not self._pending:
+                    self._wake.wait(self.poll_interval)
+                self._pending = False
+
+    def start(self):
+        """Start the worker threads of this process, once (again after a fork)"""
+        if self.workers <= 0 or (self._pid == os.getpid() and self._threads):
+            return
+        self._pid = os.getpid()
+        self._stopping = False
+        self._threads = [threading.Thread(target=self._work, name=f"job-worker-{n}", daemon=True)
+                         for n in range(self.workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def wake(self):
+        """A job was queued, let an idle worker pick it up without waiting for the next poll"""
+        with self._wake:
+            self._pending = True
+            self._wake.notify()
+
+    def close(self):
+        self._stopping = True
+        with self._wake:
+            self._wake.notify_all()
+        for thread in self._threads:
+            thread.join(timeout=5)
+        self._threads = []
+
+
+def submit(app, job_type, user_id, params, idempotency_key=None):
+    """Queue a job from a request and make sure this process has workers for it"""
+    runner = app.extensions["jobs"]
+    job = enqueue(runner.get_db(), job_type, user_id, params, idempotency_key)
+    runner.start()
+    runner.wake()
+    return job
+
+
+def register_jobs(app, get_db, connect):
+    """Register the job runner, the job status endpoint and the "jobs" CLI commands
+
+    get_db returns the database in use, connect() connects the CLI and returns it
+    """
+    app.extensions["jobs"] = JobRunner(
+        get_db,
+        workers=app.config.get("JOB_WORKERS", 2),
+        lease_seconds=app.config.get("JOB_LEASE_SECONDS", 300),
+    )
+
+    @app.route("/api/jobs/<job_id>", methods=["GET"])
+    def get_job(job_id):
+        if not ObjectId.is_valid(job_id):
+            return jsonify({"message": "Job not found"}), 404
+        job = get_db()[JOBS_COLLECTION].find_one({"_id": ObjectId(job_id)})
+        if job is None:
+            return jsonify({"message": "Job not found"}), 404
+        return jsonify({"job": public(job)}), 200
+
+    jobs_cli = AppGroup("jobs", help="Background jobs.")
+
+    @jobs_cli.command("work")
+    @click.option("--workers", type=int, default=2, help="Worker threads.")
+    def work(workers):
+        """Run queued jobs until interrupted"""
+        db = connect()
+        runner = JobRunner(lambda: db, workers=workers, lease_seconds=app.config.get("JOB_LEASE_SECONDS", 300))
+        runner.start()
+        click.echo(f"Running jobs with {workers} workers")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            runner.close()
+
+    app.cli.add_command(jobs_cli)
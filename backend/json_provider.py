@@ -0,0 +1,78 @@
+import base64
+import datetime
+
+from bson import ObjectId
+from bson.decimal128 import Decimal128
+from bson.raw_bson import RawBSONDocument
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.http import http_date
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, fall back to the standard library
+    orjson = None
+
+'''
+JSON provider that serializes MongoDB documents directly, so endpoints can
+return what pymongo gives them without converting every _id to a string first.
+orjson is used when it is installed, otherwise the standard library json module.
+'''
+
+
+def encode_bson_value(obj):
+    """Convert BSON and other non-JSON types to JSON compatible values"""
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, (datetime.datetime, datetime.date)):
+        # Same RFC 822 format Flask's default provider uses, so clients see no change
+        return http_date(obj)
+    if isinstance(obj, (bytes, bytearray, memoryview)):
+        return base64.b64encode(bytes(obj)).decode("ascii")
+    if isinstance(obj, Decimal128):
+        return str(obj)
+    if isinstance(obj, RawBSONDocument):
+        # Raw batches decode lazily, field by field, while they are encoded
+        return dict(obj.items())
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _stdlib_default(obj):
+    try:
+        return encode_bson_value(obj)
+    except TypeError:
+        return DefaultJSONProvider.default(obj)
+
+
+class BSONJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider with native ObjectId, datetime and bytes support"""
+
+    default = staticmethod(_stdlib_default)
+
+    # Key order carries no meaning for the API and sorting costs time on large listings
+    sort_keys = False
+
+    def _orjson_options(self, indent=False):
+        options = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        if indent:
+            options |= orjson.OPT_INDENT_2
+        return options
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=encode_bson_value, option=self._orjson_options()).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        if orjson is None:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        body = orjson.dumps(obj, default=encode_bson_value, option=self._orjson_options(indent) | orjson.OPT_APPEND_NEWLINE)
+        return self._app.response_class(body, mimetype=self.mimetype)
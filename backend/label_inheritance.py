@@ -0,0 +1,98 @@
+from bson import ObjectId
+from pymongo import UpdateMany, UpdateOne
+
+from references import match_any, owner
+
+'''
+The code in this file keeps the effective labels of sections and notes: their own
+labels plus the labels of the notebook (and section) they are in. effective_labels
+is stored on every section and note and has a multikey index, so "all notes under
+anything labeled course" is a single indexed query instead of a lookup per level.
+
+The write endpoints keep it up to date. Creating or relabeling a section or note
+reads its parent's labels once; relabeling a notebook or section updates the
+documents below it with bulk update_many calls computed on the server.
+'''
+
+EFFECTIVE_FIELD = "effective_labels"
+
+
+def union(*label_lists):
+    """Labels of all lists without duplicates, in order of first appearance"""
+    return list(dict.fromkeys(label for labels in label_lists for label in (labels or ()) if label))
+
+
+def inherit(parent_labels):
+    """Update pipeline setting effective_labels to each document's own labels plus parent_labels"""
+    return [{"$set": {EFFECTIVE_FIELD: {"$setUnion": [{"$ifNull": ["$labels", []]}, list(parent_labels)]}}}]
+
+
+def label_field(group):
+    """Field holding the labels a search on inherited labels matches, per result group"""
+    # Notebooks are the top of the hierarchy, their own labels are all they have
+    return "labels" if group == "notebooks" else EFFECTIVE_FIELD
+
+
+def section_labels(notebooks_collection, user_id, notebook_id, labels):
+    """Effective labels of a section with the given own labels in notebook_id"""
+    notebook = None
+    if ObjectId.is_valid(notebook_id):
+        notebook = notebooks_collection.find_one({"_id": ObjectId(notebook_id), **owner(user_id)}, {"labels": 1})
+    return union(labels, notebook.get("labels") if notebook else None)
+
+
+def note_labels(sections_collection, user_id, section_id, labels):
+    """Effective labels of a note with the given own labels in section_id"""
+    section = None
+    if ObjectId.is_valid(section_id):
+        section = sections_collection.find_one({"_id": ObjectId(section_id), **owner(user_id)},
+                                               {"labels": 1, EFFECTIVE_FIELD: 1})
+    if section is None:
+        return union(labels)
+    return union(labels, section.get(EFFECTIVE_FIELD, section.get("labels")))
+
+
+def propagate_section(notes_collection, user_id, section_id, effective):
+    """Notes of a section whose effective labels became effective"""
+    return notes_collection.update_many(owner(user_id, section_id=str(section_id)), inherit(effective))
+
+
+def propagate_notebook(sections_collection, notes_collection, user_id, notebook_id, labels):
+    """
+    Sections and notes of a notebook whose labels became labels, in one bulk write
+    per collection. Returns the number of sections updated.
+    """
+    notebook_id = str(notebook_id)
+    sections = list(sections_collection.find(owner(user_id, notebook_id=notebook_id), {"labels": 1}))
+    section_ops, note_ops = [], []
+    for section in sections:
+        effective = union(section.get("labels"), labels)
+        section_ops.append(UpdateOne({"_id": section["_id"]}, {"$set": {EFFECTIVE_FIELD: effective}}))
+        note_ops.append(UpdateMany(owner(user_id, section_id=str(section["_id"])), inherit(effective)))
+    # Notes whose section no longer exists only inherit from the notebook
+    note_ops.append(UpdateMany(
+        {**owner(user_id, notebook_id=notebook_id),
+         "section_id": {"$nin": match_any(section["_id"] for section in sections)}},
+        inherit(union(labels)),
+    ))
+    if section_ops:
+        sections_collection.bulk_write(section_ops, ordered=False)
+    notes_collection.bulk_write(note_ops, ordered=False)
+    return len(section_ops)
+
+
+def backfill(notebooks_collection, sections_collection, notes_collection, report=None, batch_size=500):
+    """Compute effective_labels of every section and note, notebook by notebook"""
+    report = report or (lambda message, done=None, total=None: None)
+    total = notebooks_collection.estimated_document_count()
+    done = 0
+    for notebook in notebooks_collection.find({}, {"labels": 1, "user_id": 1}).batch_size(batch_size):
+        propagate_notebook(sections_collection, notes_collection, notebook["user_id"], notebook["_id"],
+                           notebook.get("labels") or [])
+        done += 1
+        if done % batch_size == 0:
+            report("Effective labels", done, total)
+    # Sections and notes outside any notebook keep their own labels
+    sections_collection.update_many({EFFECTIVE_FIELD: {"$exists": False}}, inherit([]))
+    notes_collection.update_many({EFFECTIVE_FIELD: {"$exists": False}}, inherit([]))
+    report("Effective labels", done, total)
@@ -0,0 +1,219 @@
+import collections
+import datetime
+import logging
+import os
+import threading
+import time
+
+from bson import ObjectId
+from flask import has_request_context, request
+
+from events import subscribe
+from references import id_string
+
+'''
+The code in this file pushes changes to clients over Server-Sent Events, so a
+window or device learns about changes made elsewhere without refetching its
+lists. GET /api/users/<user_id>/events is an EventSource stream of compact
+change events (type, action, id, parent ids, updated_at), fed by the events bus
+that every write endpoint publishes to.
+
+The last events of each user are kept in a ring buffer. A reconnecting client
+sends the id of the last event it saw (EventSource does this with Last-Event-ID)
+and gets what it missed; when that id has left the buffer it gets a "reset" event
+and refetches its lists instead. Comment lines are sent as heartbeats so proxies
+keep idle streams open, and streams end after LIVE_UPDATES_STREAM_SECONDS so they
+do not hold a worker thread for good, the client reconnects right away.
+
+With several backend processes, LIVE_UPDATES_CHANGE_STREAMS makes every process
+write its events to the live_events collection and fill its buffers from a
+change stream on it (this needs a replica set), so each stream sees the changes
+made through any process.
+'''
+
+logger = logging.getLogger(__name__)
+
+LIVE_EVENTS_COLLECTION = "live_events"
+
+# Sent by clients with their writes, echoed in the events so a window can skip its own changes
+CLIENT_HEADER = "X-Client-Id"
+
+# Milliseconds EventSource waits before reconnecting
+RETRY_MS = 1000
+
+
+def compact(event):
+    """What a client is told about an event, enough to fetch or drop the changed item"""
+    change = {"type": event.kind, "action": event.action, "id": event.doc_id}
+    for parent in ("notebook_id", "section_id"):
+        if event.fields.get(parent) is not None:
+            change[parent] = id_string(event.fields[parent])
+    updated_at = event.fields.get("updated_at")
+    if not isinstance(updated_at, datetime.datetime):
+        updated_at = datetime.datetime.utcfromtimestamp(event.timestamp)
+    change["updated_at"] = updated_at
+    if has_request_context() and request.headers.get(CLIENT_HEADER):
+        change["client_id"] = request.headers[CLIENT_HEADER]
+    return change
+
+
+class _Channel:
+    """The buffered events of one user and the streams waiting for more"""
+
+    def __init__(self, lock, size):
+        self.events = collections.deque(maxlen=size)
+        self.ready = threading.Condition(lock)
+
+
+class ChangeFeed:
+    """Per-user ring buffers of change events that streams read and wait on"""
+
+    def __init__(self, buffer_size=256, max_users=1000):
+        self.buffer_size = buffer_size
+        self.max_users = max_users
+        self._lock = threading.Lock()
+        self._channels = collections.OrderedDict()
+
+    def _channel(self, user_id):
+        channel = self._channels.get(user_id)
+        if channel is None:
+            channel = self._channels[user_id] = _Channel(self._lock, self.buffer_size)
+            if len(self._channels) > self.max_users:
+                # Streams of the dropped user find their last id gone and reset
+                self._channels.popitem(last=False)
+        self._channels.move_to_end(user_id)
+        return channel
+
+    def append(self, user_id, event_id, change):
+        with self._lock:
+            channel = self._channel(user_id)
+            channel.events.append((event_id, change))
+            channel.ready.notify_all()
+
+    def _after(self, channel, last_id):
+        """Events after last_id (all of them for None), None when last_id is no longer buffered"""
+        if last_id is None:
+            return list(channel.events)
+        for index, (event_id, _) in enumerate(channel.events):
+            if event_id == last_id:
+                return list(channel.events)[index + 1:]
+        return None
+
+    def latest(self, user_id):
+        """Id of the user's newest buffered event, where a new stream starts"""
+        with self._lock:
+            channel = self._channel(user_id)
+            return channel.events[-1][0] if channel.events else None
+
+    def wait(self, user_id, last_id, timeout):
+        """Events after last_id, waiting up to timeout seconds for one. None when last_id was dropped"""
+        with self._lock:
+            channel = self._channel(user_id)
+            events = self._after(channel, last_id)
+            if events == []:
+                channel.ready.wait(timeout)
+                # The channel may have been dropped while waiting
+                events = self._after(self._channel(user_id), last_id)
+            return events
+
+    def clear(self):
+        with self._lock:
+            self._channels.clear()
+
+
+class ChangeStreamRelay:
+    """Fills a feed from the live_events change stream, shared by all processes"""
+
+    def __init__(self, feed, get_db):
+        self.feed = feed
+        self.get_db = get_db
+        self._pid = None
+        self._thread = None
+
+    def publish(self, user_id, change):
+        self.get_db()[LIVE_EVENTS_COLLECTION].insert_one(
+            {"user_id": user_id, "change": change, "created_at": datetime.datetime.utcnow()}
+        )
+
+    def deliver(self, document):
+        self.feed.append(document["user_id"], str(document["_id"]), document["change"])
+
+    def _watch(self):
+        resume_token = None
+        while True:
+            try:
+                pipeline = [{"$match": {"operationType": "insert"}}]
+                with self.get_db()[LIVE_EVENTS_COLLECTION].watch(pipeline, resume_after=resume_token) as stream:
+                    for change in stream:
+                        resume_token = stream.resume_token
+                        self.deliver(change["fullDocument"])
+            except Exception:
+                logger.exception("Live update change stream failed, reconnecting")
+                time.sleep(1)
+
+    def start(self):
+        """Start watching in this process, once (again after a fork)"""
+        if self._pid == os.getpid() and self._thread is not None:
+            return
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._watch, name="live-updates", daemon=True)
+        self._thread.start()
+
+
+def _frame(event_id, event, data):
+    lines = f"id: {event_id}\n" if event_id else ""
+    return f"{lines}event: {event}\ndata: {data}\n\n"
+
+
+def stream(feed, user_id, last_id, dumps, heartbeat, duration):
+    """The text/event-stream body of one connection"""
+    yield f"retry: {RETRY_MS}\n\n"
+    ends = time.monotonic() + duration
+    if last_id is None:
+        last_id = feed.latest(user_id)
+    while time.monotonic() < ends:
+        events = feed.wait(user_id, last_id, min(heartbeat, max(0.0, ends - time.monotonic())))
+        if events is None:
+            # Missed events are gone, the client refetches and continues from the newest one
+            last_id = feed.latest(user_id)
+            yield _frame(last_id, "reset", "{}")
+        elif not events:
+            yield ": heartbeat\n\n"
+        for event_id, change in events or ():
+            last_id = event_id
+            yield _frame(event_id, "change", dumps(change))
+
+
+def register_live_updates(app, get_db):
+    """Register the change feed with the events bus and the SSE endpoint
+
+    get_db returns the database in use
+    """
+    feed = app.extensions["live_updates"] = ChangeFeed(
+        buffer_size=app.config.get("LIVE_UPDATES_BUFFER", 256),
+        max_users=app.config.get("LIVE_UPDATES_MAX_USERS", 1000),
+    )
+    relay = ChangeStreamRelay(feed, get_db)
+
+    @subscribe
+    def handle_event(event):
+        user_id, change = id_string(event.user_id), compact(event)
+        if app.config.get("LIVE_UPDATES_CHANGE_STREAMS"):
+            relay.publish(user_id, change)
+        else:
+            feed.append(user_id, str(ObjectId()), change)
+
+    @app.route("/api/users/<user_id>/events", methods=["GET"])
+    def change_events(user_id):
+        """Server-Sent Events stream of the user's changes, resumes after Last-Event-ID"""
+        if app.config.get("LIVE_UPDATES_CHANGE_STREAMS"):
+            relay.start()
+        last_id = request.headers.get("Last-Event-ID") or request.args.get("last_event_id")
+        body = stream(feed, id_string(user_id), last_id, app.json.dumps,
+                      heartbeat=app.config.get("LIVE_UPDATES_HEARTBEAT_SECONDS", 15),
+                      duration=app.config.get("LIVE_UPDATES_STREAM_SECONDS", 300))
+        response = app.response_class(body, mimetype="text/event-stream")
+        response.headers["Cache-Control"] = "no-cache"
+        # Proxies such as nginx must pass each event on instead of buffering the response
+        response.headers["X-Accel-Buffering"] = "no"
+        return response
@@ -0,0 +1,266 @@
+import threading
+import time
+import weakref
+from bisect import bisect_left
+
+from flask import Response, g, request
+from pymongo import monitoring
+
+'''
+The code in this file exposes Prometheus style metrics for the API so that
+slow routes and slow database operations are visible in production.
+
+Every metric keeps one shard per thread. A thread only ever writes to its own
+shard, so recording a value is a couple of dict operations with no locking.
+Shards are only summed when /metrics is scraped.
+'''
+
+# Latency buckets in seconds, tuned for an API that mostly answers in milliseconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Response size buckets in bytes
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+class _Metric:
+    """Base class holding the per-thread shards of a single metric"""
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._lock = threading.Lock()  # only taken when a thread creates its shard or on scrape
+        self._shards = []  # (weakref to owning thread, shard)
+        self._retired = {}  # values folded in from threads that have exited
+
+    def _shard(self):
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = {}
+            self._local.shard = shard
+            with self._lock:
+                self._shards.append((weakref.ref(threading.current_thread()), shard))
+        return shard
+
+    def _merge_into(self, target, shard):
+        raise NotImplementedError
+
+    def _collect(self):
+        """Sum all shards, folding shards of dead threads into the retired totals"""
+        with self._lock:
+            live = []
+            for thread_ref, shard in self._shards:
+                thread = thread_ref()
+                if thread is None or not thread.is_alive():
+                    self._merge_into(self._retired, shard)
+                else:
+                    live.append((thread_ref, shard))
+            self._shards = live
+            totals = {}
+            self._merge_into(totals, self._retired)
+            for _, shard in live:
+                self._merge_into(totals, shard)
+        return totals
+
+    def samples(self):
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Monotonically increasing counter"""
+
+    kind = "counter"
+
+    def inc(self, labels=(), amount=1):
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def _merge_into(self, target, shard):
+        for key, value in list(shard.items()):
+            target[key] = target.get(key, 0) + value
+
+    def samples(self):
+        for labels, value in sorted(self._collect().items()):
+            yield self.name, labels, value
+
+
+class Gauge(Counter):
+    """Value that can go up and down, such as the number of in-flight requests"""
+
+    kind = "gauge"
+
+    def dec(self, labels=(), amount=1):
+        self.inc(labels, -amount)
+
+
+class Histogram(_Metric):
+    """Histogram with fixed, pre-computed bucket bounds"""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, labels=()):
+        shard = self._shard()
+        counts = shard.get(labels)
+        if counts is None:
+            # One slot per bucket, one for +Inf and a trailing running sum
+            counts = [0] * (len(self.buckets) + 2)
+            shard[labels] = counts
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def _merge_into(self, target, shard):
+        for key, counts in list(shard.items()):
+            merged = target.get(key)
+            if merged is None:
+                target[key] = list(counts)
+            else:
+                for i, value in enumerate(counts):
+                    merged[i] += value
+
+    def samples(self):
+        for labels, counts in sorted(self._collect().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield self.name + "_bucket", labels + (("le", _format_value(bound)),), cumulative
+            cumulative += counts[len(self.buckets)]
+            yield self.name + "_bucket", labels + (("le", "+Inf"),), cumulative
+            yield self.name + "_sum", labels, counts[-1]
+            yield self.name + "_count", labels, cumulative
+
+
+class Registry:
+    """Collection of metrics rendered together in the text exposition format"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    pairs = []
+    for key, value in labels:
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{key}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+REGISTRY = Registry()
+
+http_requests_total = REGISTRY.register(Counter(
+    "http_requests_total", "Total HTTP requests by route, method and status.",
+    ("route", "method", "status")))
+http_request_errors_total = REGISTRY.register(Counter(
+    "http_request_errors_total", "HTTP requests that ended in a 5xx response.",
+    ("route", "method")))
+http_request_duration_seconds = REGISTRY.register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency in seconds.",
+    ("route", "method"), LATENCY_BUCKETS))
+http_response_size_bytes = REGISTRY.register(Histogram(
+    "http_response_size_bytes", "HTTP response body size in bytes.",
+    ("route", "method"), SIZE_BUCKETS))
+http_requests_in_flight = REGISTRY.register(Gauge(
+    "http_requests_in_flight", "HTTP requests currently being served.",
+    ("route", "method")))
+mongodb_commands_total = REGISTRY.register(Counter(
+    "mongodb_commands_total", "MongoDB commands by command, collection and outcome.",
+    ("command", "collection", "status")))
+mongodb_command_duration_seconds = REGISTRY.register(Histogram(
+    "mongodb_command_duration_seconds", "MongoDB command latency in seconds.",
+    ("command", "collection"), LATENCY_BUCKETS))
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """pymongo command listener feeding the mongodb_* metrics"""
+
+    def __init__(self):
+        # Collection names keyed by (connection, request id) until the command finishes
+        self._pending = {}
+
+    def started(self, event):
+        target = event.command.get(event.command_name)
+        self._pending[(event.connection_id, event.request_id)] = target if isinstance(target, str) else ""
+
+    def _finish(self, event, status):
+        collection = self._pending.pop((event.connection_id, event.request_id), "")
+        mongodb_commands_total.inc((("command", event.command_name), ("collection", collection), ("status", status)))
+        mongodb_command_duration_seconds.observe(
+            event.duration_micros / 1e6, (("command", event.command_name), ("collection", collection)))
+
+    def succeeded(self, event):
+        self._finish(event, "ok")
+
+    def failed(self, event):
+        self._finish(event, "error")
+
+
+# Shared listener instance passed to MongoClient in init_db
+mongo_command_listener = MongoCommandMetrics()
+
+
+def _route_labels():
+    # Use the URL rule rather than the raw path so ids do not explode the label space
+    route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    return (("route", route), ("method", request.method))
+
+
+def register_metrics(app):
+    """Register the request instrumentation hooks and the /metrics endpoint"""
+
+    @app.before_request
+    def _metrics_start():
+        labels = _route_labels()
+        g._metrics_labels = labels
+        g._metrics_start = time.perf_counter()
+        http_requests_in_flight.inc(labels)
+
+    @app.after_request
+    def _metrics_record(response):
+        labels = getattr(g, "_metrics_labels", None)
+        if labels is None:
+            return response
+        http_request_duration_seconds.observe(time.perf_counter() - g._metrics_start, labels)
+        http_requests_total.inc(labels + (("status", str(response.status_code)),))
+        if response.status_code >= 500:
+            http_request_errors_total.inc(labels)
+        size = response.content_length
+        if size is not None:
+            http_response_size_bytes.observe(size, labels)
+        return response
+
+    @app.teardown_request
+    def _metrics_finish(exc):
+        labels = g.pop("_metrics_labels", None)
+        if labels is not None:
+            http_requests_in_flight.dec(labels)
+
+    @app.route("/metrics", methods=["GET"])
+    def metrics():
+        return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
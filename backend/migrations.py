@@ -0,0 +1,320 @@
+import datetime
+import logging
+import time
+
+import click
+from flask.cli import AppGroup
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from label_inheritance import EFFECTIVE_FIELD, backfill
+from moves import RANK_FIELD, backfill_ranks
+from duplication import COPY_FIELD
+from attachments import BUCKET
+from jobs import JOBS_COLLECTION
+from idempotency import IDEMPOTENCY_COLLECTION
+from live_updates import LIVE_EVENTS_COLLECTION
+from references import REFERENCE_FIELDS
+from search import create_search_indexes
+
+'''
+The code in this file versions the database schema. Index builds and data
+backfills are migrations run explicitly with "flask --app app schema migrate",
+so starting a worker only reads the schema version (a single query) instead of
+issuing DDL. Each migration is a function registered with @migration and is
+applied once, in version order; the applied version is kept in the
+schema_migrations collection.
+'''
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_COLLECTION = "schema_migrations"
+SCHEMA_DOC_ID = "schema"
+
+# Registered migrations in version order
+MIGRATIONS = []
+
+# Migration storing user_id/notebook_id/section_id as ObjectIds, reads match both forms before it
+REFERENCES_VERSION = 4
+
+# Documents rewritten per bulk write by the references migration
+REFERENCE_BATCH_SIZE = 1000
+
+
+class SchemaVersionError(RuntimeError):
+    """The database schema does not match the version this code expects"""
+
+
+class MigrationLockedError(RuntimeError):
+    """Another process is already running migrations"""
+
+
+class Migration:
+    def __init__(self, version, description, func):
+        self.version = version
+        self.description = description
+        self.func = func
+
+
+def migration(version, description):
+    """Register a migration, func(db, report) applies it"""
+    def decorator(func):
+        if any(existing.version == version for existing in MIGRATIONS):
+            raise ValueError(f"Duplicate migration version {version}")
+        MIGRATIONS.append(Migration(version, description, func))
+        MIGRATIONS.sort(key=lambda m: m.version)
+        return func
+    return decorator
+
+
+def target_version():
+    """Schema version this code expects"""
+    return MIGRATIONS[-1].version if MIGRATIONS else 0
+
+
+def current_version(db):
+    """Schema version recorded in the database, 0 for a fresh database"""
+    doc = db[SCHEMA_COLLECTION].find_one({"_id": SCHEMA_DOC_ID}, {"version": 1})
+    return doc.get("version", 0) if doc else 0
+
+
+def pending_migrations(version):
+    return [m for m in MIGRATIONS if m.version > version]
+
+
+def check_schema(db, strict=False):
+    """
+    Compare the database schema version with the code, using one query.
+    Logs a warning on mismatch, or raises SchemaVersionError when strict.
+    """
+    version = current_version(db)
+    expected = target_version()
+    if version == expected:
+        return version
+    if version < expected:
+        message = (f"Database schema is at version {version} but the code expects {expected}, "
+                   f"run 'flask --app app schema migrate'")
+    else:
+        message = f"Database schema version {version} is newer than this code ({expected})"
+    if strict:
+        raise SchemaVersionError(message)
+    logger.warning(message)
+    return version
+
+
+def _acquire_lock(db):
+    try:
+        db[SCHEMA_COLLECTION].update_one(
+            {"_id": SCHEMA_DOC_ID, "locked": {"$ne": True}},
+            {"$set": {"locked": True, "locked_at": datetime.datetime.utcnow()}},
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        # The document exists and is locked, so the upsert tried to insert a second one
+        raise MigrationLockedError("Migrations are already running in another process")
+
+
+def _release_lock(db):
+    db[SCHEMA_COLLECTION].update_one({"_id": SCHEMA_DOC_ID}, {"$set": {"locked": False}})
+
+
+def migrate(db, target=None, report=None):
+    """
+    Apply pending migrations up to target (default: latest).
+    report(message, done=None, total=None) receives progress updates.
+    Returns the list of applied versions.
+    """
+    report = report or (lambda message, done=None, total=None: None)
+    if target is None:
+        target = target_version()
+
+    # Cheap check first so an up to date database costs one query
+    if current_version(db) >= target:
+        return []
+
+    _acquire_lock(db)
+    applied = []
+    try:
+        version = current_version(db)
+        for m in pending_migrations(version):
+            if m.version > target:
+                break
+            report(f"Applying {m.version}: {m.description}")
+            started = time.perf_counter()
+            m.func(db, report)
+            duration_ms = round((time.perf_counter() - started) * 1000, 3)
+            db[SCHEMA_COLLECTION].update_one(
+                {"_id": SCHEMA_DOC_ID},
+                {
+                    "$set": {"version": m.version, "updated_at": datetime.datetime.utcnow()},
+                    "$push": {"history": {
+                        "version": m.version,
+                        "description": m.description,
+                        "applied_at": datetime.datetime.utcnow(),
+                        "duration_ms": duration_ms,
+                    }},
+                },
+            )
+            report(f"Applied {m.version} in {duration_ms} ms")
+            applied.append(m.version)
+    finally:
+        _release_lock(db)
+    return applied
+
+
+def _print_progress(message, done=None, total=None):
+    if done is not None and total:
+        message = f"{message} {done}/{total} ({done * 100 // total}%)"
+    elif done is not None:
+        message = f"{message} {done}"
+    click.echo(message)
+
+
+def register_migrations(app, connect):
+    """Register the "schema" CLI commands, connect() returns the database"""
+    schema_cli = AppGroup("schema", help="Database schema migrations.")
+
+    @schema_cli.command("status")
+    def status():
+        """Show the schema version and pending migrations"""
+        db = connect()
+        version = current_version(db)
+        click.echo(f"Database version: {version}")
+        click.echo(f"Code version: {target_version()}")
+        for m in pending_migrations(version):
+            click.echo(f"Pending {m.version}: {m.description}")
+
+    @schema_cli.command("migrate")
+    @click.option("--to", "target", type=int, default=None, help="Stop at this version.")
+    def migrate_command(target):
+        """Apply pending migrations"""
+        db = connect()
+        try:
+            applied = migrate(db, target, report=_print_progress)
+        except MigrationLockedError as e:
+            raise click.ClickException(str(e))
+        if not applied:
+            click.echo(f"Database is up to date at version {current_version(db)}")
+
+    @schema_cli.command("unlock")
+    def unlock():
+        """Clear the lock left by an interrupted migration"""
+        _release_lock(connect())
+        click.echo("Migration lock released")
+
+    app.cli.add_command(schema_cli)
+
+
+# ------------------------------------------------------------------------------
+# Migrations
+# ------------------------------------------------------------------------------
+
+@migration(1, "Text, user and label indexes for search")
+def _search_indexes(db, report):
+    create_search_indexes(db)
+
+
+@migration(2, "Notebook and update time indexes for structured search filters")
+def _filter_indexes(db, report):
+    # notebook: filters and the notebook listings of sections and notes
+    db.sections.create_index([("user_id", 1), ("notebook_id", 1)])
+    db.notes.create_index([("user_id", 1), ("notebook_id", 1)])
+    # updated: ranges and label-only searches, sorted by the last update
+    for collection in (db.notebooks, db.sections, db.notes):
+        collection.create_index([("user_id", 1), ("updated_at", -1)])
+
+
+@migration(3, "Effective labels of sections and notes, inherited from their notebook and section")
+def _effective_labels(db, report):
+    backfill(db.notebooks, db.sections, db.notes, report)
+    # Multikey, one entry per inherited label
+    db.sections.create_index([("user_id", 1), (EFFECTIVE_FIELD, 1)])
+    db.notes.create_index([("user_id", 1), (EFFECTIVE_FIELD, 1)])
+
+
+def convert_references(collection, fields, report, batch_size=REFERENCE_BATCH_SIZE):
+    """
+    Rewrite hex string references of collection as ObjectIds, in _id order and
+    batches of batch_size. Converted documents no longer match, so an interrupted
+    run resumes where it stopped. Returns the number of documents converted.
+    """
+    hex_string = {"$type": "string", "$regex": "^[0-9a-fA-F]{24}$"}
+    pending = {"$or": [{field: hex_string} for field in fields]}
+    total = collection.count_documents(pending)
+    converted = 0
+    last_id = None
+    while True:
+        query = pending if last_id is None else {"$and": [pending, {"_id": {"$gt": last_id}}]}
+        docs = list(collection.find(query, {field: 1 for field in fields}).sort("_id", 1).limit(batch_size))
+        if not docs:
+            break
+        operations = []
+        for doc in docs:
+            old = {field: doc[field] for field in fields
+                   if isinstance(doc.get(field), str) and ObjectId.is_valid(doc[field])}
+            # Only if unchanged since it was read, a concurrent write already stored the new form
+            operations.append(UpdateOne({"_id": doc["_id"], **old},
+                                        {"$set": {field: ObjectId(value) for field, value in old.items()}}))
+        converted += collection.bulk_write(operations, ordered=False).modified_count
+        last_id = docs[-1]["_id"]
+        report(f"{collection.name}: references", converted, total)
+    return converted
+
+
+@migration(REFERENCES_VERSION, "Store user, notebook and section references as ObjectIds")
+def _object_id_references(db, report):
+    convert_references(db.notebooks, ("user_id",), report)
+    convert_references(db.sections, ("user_id", "notebook_id"), report)
+    convert_references(db.notes, REFERENCE_FIELDS, report)
+
+
+@migration(5, "Rank keys ordering sections in their notebook and notes in their section")
+def _rank_keys(db, report):
+    backfill_ranks(db.sections, "notebook_id", report)
+    backfill_ranks(db.notes, "section_id", report)
+    # Listings sort by rank within one parent, moves read an anchor's neighbour
+    db.sections.create_index([("user_id", 1), ("notebook_id", 1), (RANK_FIELD, 1)])
+    db.notes.create_index([("user_id", 1), ("section_id", 1), (RANK_FIELD, 1)])
+
+
+@migration(6, "Index on the marker notes of a duplicated notebook use to find their copied section")
+def _copy_marker_index(db, report):
+    # Only sections being copied have the marker
+    db.sections.create_index([(COPY_FIELD, 1)], sparse=True)
+
+
+@migration(7, "Indexes for deduplicating note attachments and finding the notes that use them")
+def _attachment_indexes(db, report):
+    # One stored copy of each content per user
+    db[f"{BUCKET}.files"].create_index([("metadata.user_id", 1), ("metadata.sha256", 1)], unique=True)
+    db.notes.create_index([("attachments.file_id", 1)], sparse=True)
+
+
+@migration(8, "Queue, idempotency and expiry indexes of background jobs")
+def _job_indexes(db, report):
+    jobs = db[JOBS_COLLECTION]
+    # Workers claim queued jobs that are due and running jobs whose lease expired
+    jobs.create_index([("status", 1), ("run_after", 1)])
+    jobs.create_index([("status", 1), ("lease_until", 1)])
+    jobs.create_index(
+        [("user_id", 1), ("type", 1), ("idempotency_key", 1)],
+        unique=True,
+        partialFilterExpression={"idempotency_key": {"$type": "string"}},
+    )
+    # Finished jobs are removed once their expires_at has passed
+    jobs.create_index([("expires_at", 1)], expireAfterSeconds=0)
+
+
+@migration(9, "Unique and expiry indexes of create request idempotency keys")
+def _idempotency_indexes(db, report):
+    keys = db[IDEMPOTENCY_COLLECTION]
+    # A retry finds the stored response with one lookup, concurrent first requests cannot both claim a key
+    keys.create_index([("user_id", 1), ("key", 1)], unique=True)
+    keys.create_index([("expires_at", 1)], expireAfterSeconds=0)
+
+
+@migration(10, "Expiry index of the live update events shared between processes")
+def _live_event_indexes(db, report):
+    # Streams only resume from recent events, older ones are removed after an hour
+    db[LIVE_EVENTS_COLLECTION].create_index([("created_at", 1)], expireAfterSeconds=3600)
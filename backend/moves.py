@@ -0,0 +1,193 @@
+from bson import ObjectId
+from flask import jsonify, request
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+
+from events import publish, UPDATED
+from label_inheritance import EFFECTIVE_FIELD, inherit, union
+from rank_keys import key_between, keys_between
+from references import owner, ref
+
+'''
+The code in this file moves notes between sections and sections between
+notebooks, and keeps the order of sections and notes. A move updates the parent
+references in place: one update of the moved document, plus one update_many of
+the notes of a section moved to another notebook, whatever the size of the notes.
+
+Order is kept in a "rank" field holding a fractional rank key (see rank_keys.py).
+Placing a document between two siblings generates a key between theirs, so a
+reorder only writes the document that moved.
+'''
+
+RANK_FIELD = "rank"
+
+# Listing order, documents created before ranks existed sort by creation
+RANK_ORDER = [(RANK_FIELD, ASCENDING), ("_id", ASCENDING)]
+
+
+class MoveError(ValueError):
+    """A move request that cannot be applied, reported as a 400"""
+
+
+def append_rank(collection, siblings):
+    """Rank placing a new document after the last of siblings (a filter)"""
+    last = collection.find_one({**siblings, RANK_FIELD: {"$exists": True}}, {RANK_FIELD: 1},
+                               sort=[(RANK_FIELD, DESCENDING)])
+    return key_between(last[RANK_FIELD] if last else None, None)
+
+
+def rank_siblings(collection, siblings):
+    """Give every document of siblings a rank, in their current order. Returns the number ranked"""
+    docs = list(collection.find(siblings, {RANK_FIELD: 1}).sort(RANK_ORDER))
+    if not docs or all(RANK_FIELD in doc for doc in docs):
+        return 0
+    operations = [UpdateOne({"_id": doc["_id"]}, {"$set": {RANK_FIELD: rank}})
+                  for doc, rank in zip(docs, keys_between(None, None, len(docs)))]
+    collection.bulk_write(operations, ordered=False)
+    return len(operations)
+
+
+def backfill_ranks(collection, parent_field, report=None):
+    """Rank the documents of every parent that has unranked ones, used by the migration"""
+    report = report or (lambda message, done=None, total=None: None)
+    parents = list(collection.aggregate([
+        {"$match": {RANK_FIELD: {"$exists": False}}},
+        {"$group": {"_id": {"user_id": "$user_id", "parent": f"${parent_field}"}}},
+    ]))
+    ranked = 0
+    for done, parent in enumerate(parents, 1):
+        siblings = {"user_id": parent["_id"]["user_id"], parent_field: parent["_id"].get("parent")}
+        ranked += rank_siblings(collection, siblings)
+        report(f"{collection.name}: ranks", done, len(parents))
+    return ranked
+
+
+def _anchor_rank(collection, siblings, anchor_id, doc_id):
+    if not ObjectId.is_valid(anchor_id):
+        raise MoveError(f"Invalid anchor id: {anchor_id}")
+    if str(anchor_id) == str(doc_id):
+        raise MoveError("Cannot move a document relative to itself")
+    query = {**siblings, "_id": ObjectId(anchor_id)}
+    anchor = collection.find_one(query, {RANK_FIELD: 1})
+    if anchor is None:
+        raise MoveError(f"Anchor {anchor_id} is not in the target")
+    if RANK_FIELD not in anchor:
+        # Siblings from before ranks existed, ranked once on first use
+        rank_siblings(collection, siblings)
+        anchor = collection.find_one(query, {RANK_FIELD: 1})
+    return anchor[RANK_FIELD]
+
+
+def position_rank(collection, siblings, doc_id, after=None, before=None):
+    """
+    Rank placing doc_id among siblings right after the sibling after, right
+    before the sibling before, or last when neither is given. Only reads the
+    anchor and its neighbour.
+    """
+    others = {**siblings, "_id": {"$ne": ObjectId(doc_id)}}
+    if after is not None:
+        lower = _anchor_rank(collection, siblings, after, doc_id)
+        upper = collection.find_one({**others, RANK_FIELD: {"$gt": lower}}, {RANK_FIELD: 1},
+                                    sort=[(RANK_FIELD, ASCENDING)])
+        return key_between(lower, upper[RANK_FIELD] if upper else None)
+    if before is not None:
+        upper = _anchor_rank(collection, siblings, before, doc_id)
+        lower = collection.find_one({**others, RANK_FIELD: {"$lt": upper}}, {RANK_FIELD: 1},
+                                    sort=[(RANK_FIELD, DESCENDING)])
+        return key_between(lower[RANK_FIELD] if lower else None, upper)
+    return append_rank(collection, others)
+
+
+def _target_id(data, field, current):
+    target = data.get(field) or current
+    if not ObjectId.is_valid(target):
+        raise MoveError(f"Invalid {field}: {target}")
+    return str(target)
+
+
+def register_move_endpoints(app, get_collections):
+    """Register the move endpoints with the Flask app
+
+    get_collections returns the (notebooks, sections, notes) collections in use
+    """
+
+    @app.errorhandler(MoveError)
+    def handle_move_error(error):
+        return jsonify({"message": str(error)}), 400
+
+    @app.route("/api/users/<user_id>/notebooks/<notebook_id>/sections/<section_id>/notes/<note_id>/move",
+               methods=["POST"])
+    def move_note(user_id, notebook_id, section_id, note_id):
+        """Move a note to another position, in its section or another one (body: section_id, after, before)"""
+        notebooks_collection, sections_collection, notes_collection = get_collections()
+        data = request.get_json(silent=True) or {}
+        if not ObjectId.is_valid(note_id):
+            return jsonify({"message": "Note not found"}), 404
+        current = {"_id": ObjectId(note_id), **owner(user_id, section_id=section_id)}
+        note = notes_collection.find_one(current, {"labels": 1, "notebook_id": 1})
+        if note is None:
+            return jsonify({"message": "Note not found"}), 404
+
+        target_section = _target_id(data, "section_id", section_id)
+        updated = {}
+        target_notebook = note.get("notebook_id")
+        if target_section != section_id:
+            section = sections_collection.find_one(
+                {"_id": ObjectId(target_section), **owner(user_id)}, {"notebook_id": 1, "labels": 1, EFFECTIVE_FIELD: 1}
+            )
+            if section is None:
+                return jsonify({"message": "Section not found"}), 404
+            target_notebook = section.get("notebook_id")
+            updated = {
+                "section_id": ref(target_section),
+                "notebook_id": ref(target_notebook),
+                # The labels inherited from the old section go, the new section's come in
+                EFFECTIVE_FIELD: union(note.get("labels"), section.get(EFFECTIVE_FIELD, section.get("labels"))),
+            }
+        updated[RANK_FIELD] = position_rank(notes_collection, owner(user_id, section_id=target_section), note_id,
+                                            data.get("after"), data.get("before"))
+
+        # Only if it is still where it was read, a concurrent move wins
+        result = notes_collection.update_one(current, {"$set": updated})
+        if result.matched_count == 0:
+            return jsonify({"message": "Note not found"}), 404
+        moved = {"notebook_id": str(target_notebook), "section_id": target_section, RANK_FIELD: updated[RANK_FIELD]}
+        publish("note", UPDATED, user_id, note_id, moved)
+        return jsonify({"message": "Note moved successfully", "note": dict(moved, _id=note_id)}), 200
+
+    @app.route("/api/users/<user_id>/notebooks/<notebook_id>/sections/<section_id>/move", methods=["POST"])
+    def move_section(user_id, notebook_id, section_id):
+        """Move a section to another position, in its notebook or another one (body: notebook_id, after, before)"""
+        notebooks_collection, sections_collection, notes_collection = get_collections()
+        data = request.get_json(silent=True) or {}
+        if not ObjectId.is_valid(section_id):
+            return jsonify({"message": "Section not found"}), 404
+        current = {"_id": ObjectId(section_id), **owner(user_id, notebook_id=notebook_id)}
+        section = sections_collection.find_one(current, {"labels": 1})
+        if section is None:
+            return jsonify({"message": "Section not found"}), 404
+
+        target_notebook = _target_id(data, "notebook_id", notebook_id)
+        updated = {}
+        if target_notebook != notebook_id:
+            notebook = notebooks_collection.find_one({"_id": ObjectId(target_notebook), **owner(user_id)}, {"labels": 1})
+            if notebook is None:
+                return jsonify({"message": "Notebook not found"}), 404
+            updated = {
+                "notebook_id": ref(target_notebook),
+                EFFECTIVE_FIELD: union(section.get("labels"), notebook.get("labels")),
+            }
+        updated[RANK_FIELD] = position_rank(sections_collection, owner(user_id, notebook_id=target_notebook),
+                                            section_id, data.get("after"), data.get("before"))
+
+        result = sections_collection.update_one(current, {"$set": updated})
+        if result.matched_count == 0:
+            return jsonify({"message": "Section not found"}), 404
+        if target_notebook != notebook_id:
+            # The notes keep their section, their denormalized notebook and inherited labels follow it
+            notes_collection.update_many(
+                owner(user_id, section_id=section_id),
+                [{"$set": {"notebook_id": ref(target_notebook)}}] + inherit(updated[EFFECTIVE_FIELD]),
+            )
+        moved = {"notebook_id": target_notebook, RANK_FIELD: updated[RANK_FIELD]}
+        publish("section", UPDATED, user_id, section_id, moved)
+        return jsonify({"message": "Section moved successfully", "section": dict(moved, _id=section_id)}), 200
@@ -0,0 +1,201 @@
+import hashlib
+import hmac
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+from flask import abort, current_app, g, jsonify, request, send_from_directory
+
+from admin import admin_required
+
+'''
+The code in this file profiles individual live requests with a sampling
+profiler. A background thread snapshots the stack of the thread serving the
+request every few milliseconds and the samples are written as collapsed stacks
+(the input format of flamegraph.pl and speedscope) to PROFILE_DIR.
+
+A request is profiled when it carries a valid signed X-Profile header, or when
+it is picked by the sample rate set in config or through /admin/profiling.
+'''
+
+PROFILE_HEADER = "X-Profile"
+
+# Runtime override of PROFILE_SAMPLE_RATE set through /admin/profiling
+_state = {"sample_rate": None}
+
+
+class SamplingProfiler:
+    """Samples the stack of one thread at a fixed interval from a background thread"""
+
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = Counter()
+        self.sample_count = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.duration = time.perf_counter() - self.started_at
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                name = getattr(code, "co_qualname", code.co_name)
+                stack.append(f"{os.path.basename(code.co_filename)}:{name}")
+                frame = frame.f_back
+            stack.reverse()
+            self.samples[";".join(stack)] += 1
+            self.sample_count += 1
+
+    def collapsed(self):
+        """Samples in collapsed stack format, one "frame;frame;frame count" line per stack"""
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+
+def sign_profile_token(secret, ttl=300):
+    """Create a value for the X-Profile header valid for ttl seconds"""
+    expires = int(time.time()) + ttl
+    signature = hmac.new(secret.encode("utf-8"), f"profile:{expires}".encode("utf-8"), hashlib.sha256).hexdigest()
+    return f"{expires}.{signature}"
+
+
+def verify_profile_token(secret, token):
+    """Check an X-Profile header value is correctly signed and not expired"""
+    expires, _, signature = token.partition(".")
+    if not expires.isdigit() or int(expires) < time.time():
+        return False
+    expected = hmac.new(secret.encode("utf-8"), f"profile:{expires}".encode("utf-8"), hashlib.sha256).hexdigest()
+    return hmac.compare_digest(signature, expected)
+
+
+def sample_rate(app):
+    if _state["sample_rate"] is not None:
+        return _state["sample_rate"]
+    return app.config.get("PROFILE_SAMPLE_RATE", 0.0)
+
+
+def should_profile(app):
+    token = request.headers.get(PROFILE_HEADER)
+    if token and verify_profile_token(app.config["SECRET_KEY"], token):
+        return True
+    rate = sample_rate(app)
+    return rate > 0 and random.random() < rate
+
+
+def list_profiles(directory):
+    """Profile files in directory, newest first"""
+    if not os.path.isdir(directory):
+        return []
+    profiles = []
+    for entry in os.scandir(directory):
+        if entry.is_file() and entry.name.endswith(".collapsed"):
+            stat = entry.stat()
+            profiles.append({"name": entry.name, "size": stat.st_size, "created_at": stat.st_mtime})
+    profiles.sort(key=lambda profile: profile["created_at"], reverse=True)
+    return profiles
+
+
+def _prune(directory, keep):
+    for profile in list_profiles(directory)[keep:]:
+        try:
+            os.remove(os.path.join(directory, profile["name"]))
+        except OSError:
+            pass
+
+
+def _write_profile(app, profiler):
+    directory = app.config["PROFILE_DIR"]
+    os.makedirs(directory, exist_ok=True)
+    route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    slug = re.sub(r"[^A-Za-z0-9]+", "_", route).strip("_") or "root"
+    stamp = time.strftime("%Y%m%dT%H%M%S", time.gmtime())
+    name = f"{stamp}_{int(time.time() * 1000) % 1000:03d}_{request.method}_{slug}_{int(profiler.duration * 1000)}ms.collapsed"
+    with open(os.path.join(directory, name), "w") as f:
+        f.write(profiler.collapsed())
+    _prune(directory, app.config.get("PROFILE_MAX_FILES", 200))
+    return name
+
+
+def register_profiling(app):
+    """Register the profiling hooks and the /admin/profiles endpoints"""
+
+    @app.before_request
+    def _profile_start():
+        if should_profile(app):
+            g._profiler = SamplingProfiler(
+                threading.get_ident(), app.config.get("PROFILE_INTERVAL_MS", 5) / 1000.0
+            ).start()
+
+    @app.teardown_request
+    def _profile_finish(exc):
+        profiler = g.pop("_profiler", None)
+        if profiler is not None:
+            profiler.stop()
+            if profiler.sample_count:
+                _write_profile(app, profiler)
+
+    @app.route("/admin/profiling", methods=["GET"])
+    @admin_required
+    def get_profiling():
+        return jsonify({
+            "sample_rate": sample_rate(app),
+            "interval_ms": app.config.get("PROFILE_INTERVAL_MS", 5),
+            "directory": app.config["PROFILE_DIR"],
+        }), 200
+
+    @app.route("/admin/profiling", methods=["PUT"])
+    @admin_required
+    def set_profiling():
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({"message": "Request body must be a JSON object"}), 400
+        if "sample_rate" not in data:
+            return jsonify({"message": "sample_rate field is required"}), 400
+        rate = data.get("sample_rate")
+        # bool is an int subclass, true would otherwise be a rate of 1
+        if rate is not None and (isinstance(rate, bool) or not (isinstance(rate, (int, float)) and 0 <= rate <= 1)):
+            return jsonify({"message": "sample_rate must be between 0 and 1"}), 400
+        # None goes back to PROFILE_SAMPLE_RATE from config
+        _state["sample_rate"] = rate
+        return jsonify({"sample_rate": sample_rate(app)}), 200
+
+    @app.route("/admin/profiling/token", methods=["POST"])
+    @admin_required
+    def create_profile_token():
+        try:
+            ttl = int(request.args.get("ttl", 300))
+        except ValueError:
+            ttl = 0
+        if ttl <= 0:
+            return jsonify({"message": "ttl must be a positive number of seconds"}), 400
+        return jsonify({"header": PROFILE_HEADER, "token": sign_profile_token(app.config["SECRET_KEY"], ttl)}), 201
+
+    @app.route("/admin/profiles", methods=["GET"])
+    @admin_required
+    def get_profiles():
+        return jsonify({"profiles": list_profiles(app.config["PROFILE_DIR"])}), 200
+
+    @app.route("/admin/profiles/<name>", methods=["GET"])
+    @admin_required
+    def get_profile(name):
+        if not name.endswith(".collapsed"):
+            abort(404)
+        return send_from_directory(os.path.abspath(current_app.config["PROFILE_DIR"]), name, mimetype="text/plain")
@@ -0,0 +1,158 @@
+'''
+The code in this file generates fractional rank keys, the strings sections and
+notes are ordered by. A key can always be generated between any two others, so
+moving a document only writes that document: its siblings keep their keys.
+
+Keys are base 62 and compare as plain strings (MongoDB's default binary order).
+They start with an integer part whose first character gives its length ("a0",
+"a1", ..., "az", "b00", ...), so appending at the end stays short, followed by
+an optional fraction that grows when keys are inserted between neighbours.
+'''
+
+DIGITS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+BASE = len(DIGITS)
+
+# The smallest integer part, nothing can be placed before a key without a fraction here
+SMALLEST_INTEGER = "A" + "0" * 26
+
+
+def _midpoint(a, b):
+    """Fraction digits strictly between fractions a and b (b None for no upper bound)"""
+    if b is not None:
+        # Skip the common prefix, treating a missing digit of a as 0
+        n = 0
+        while n < len(b) and (a[n] if n < len(a) else "0") == b[n]:
+            n += 1
+        if n > 0:
+            return b[:n] + _midpoint(a[n:], b[n:])
+    digit_a = DIGITS.index(a[0]) if a else 0
+    digit_b = DIGITS.index(b[0]) if b is not None else BASE
+    if digit_b - digit_a > 1:
+        return DIGITS[(digit_a + digit_b + 1) // 2]
+    # Consecutive digits
+    if b is not None and len(b) > 1:
+        return b[0]
+    return DIGITS[digit_a] + _midpoint(a[1:], None)
+
+
+def _integer_length(head):
+    if "a" <= head <= "z":
+        return ord(head) - ord("a") + 2
+    if "A" <= head <= "Z":
+        return ord("Z") - ord(head) + 2
+    raise ValueError(f"Invalid rank key head: {head}")
+
+
+def _integer_part(key):
+    length = _integer_length(key[0])
+    if length > len(key):
+        raise ValueError(f"Invalid rank key: {key}")
+    return key[:length]
+
+
+def validate(key):
+    """ValueError if key is not a rank key"""
+    if not isinstance(key, str) or not key or key == SMALLEST_INTEGER:
+        raise ValueError(f"Invalid rank key: {key!r}")
+    integer = _integer_part(key)
+    if any(character not in DIGITS for character in key[1:]) or key[len(integer):].endswith("0"):
+        raise ValueError(f"Invalid rank key: {key!r}")
+
+
+def _increment_integer(integer):
+    head, digits = integer[0], list(integer[1:])
+    for i in reversed(range(len(digits))):
+        value = DIGITS.index(digits[i]) + 1
+        if value < BASE:
+            digits[i] = DIGITS[value]
+            return head + "".join(digits)
+        digits[i] = "0"
+    # Carried out of the last digit, the integer part gets longer
+    if head == "Z":
+        return "a0"
+    if head == "z":
+        return None
+    head = chr(ord(head) + 1)
+    if head > "a":
+        digits.append("0")
+    else:
+        digits.pop()
+    return head + "".join(digits)
+
+
+def _decrement_integer(integer):
+    head, digits = integer[0], list(integer[1:])
+    for i in reversed(range(len(digits))):
+        value = DIGITS.index(digits[i]) - 1
+        if value >= 0:
+            digits[i] = DIGITS[value]
+            return head + "".join(digits)
+        digits[i] = DIGITS[-1]
+    if head == "a":
+        return "Z" + DIGITS[-1]
+    if head == "A":
+        return None
+    head = chr(ord(head) - 1)
+    if head < "Z":
+        digits.append(DIGITS[-1])
+    else:
+        digits.pop()
+    return head + "".join(digits)
+
+
+def key_between(a, b):
+    """A key sorting after a and before b, either can be None for the start or the end"""
+    if a is not None:
+        validate(a)
+    if b is not None:
+        validate(b)
+    if a is not None and b is not None and a >= b:
+        raise ValueError(f"Rank keys out of order: {a} >= {b}")
+    if a is None and b is None:
+        return "a0"
+    if a is None:
+        integer = _integer_part(b)
+        fraction = b[len(integer):]
+        if integer == SMALLEST_INTEGER:
+            return integer + _midpoint("", fraction)
+        if integer < b:
+            return integer
+        decremented = _decrement_integer(integer)
+        if decremented is None:
+            raise ValueError("Cannot generate a rank key before the smallest one")
+        return decremented
+    if b is None:
+        integer = _integer_part(a)
+        incremented = _increment_integer(integer)
+        return integer + _midpoint(a[len(integer):], None) if incremented is None else incremented
+    integer_a = _integer_part(a)
+    integer_b = _integer_part(b)
+    if integer_a == integer_b:
+        return integer_a + _midpoint(a[len(integer_a):], b[len(integer_b):])
+    incremented = _increment_integer(integer_a)
+    if incremented is None:
+        raise ValueError("Cannot generate a rank key after the largest one")
+    if incremented < b:
+        return incremented
+    return integer_a + _midpoint(a[len(integer_a):], None)
+
+
+def keys_between(a, b, count):
+    """count ascending keys between a and b, spread out so later inserts stay short"""
+    if count <= 0:
+        return []
+    if count == 1:
+        return [key_between(a, b)]
+    if b is None:
+        keys = [key_between(a, None)]
+        while len(keys) < count:
+            keys.append(key_between(keys[-1], None))
+        return keys
+    if a is None:
+        keys = [key_between(None, b)]
+        while len(keys) < count:
+            keys.append(key_between(None, keys[-1]))
+        return keys[::-1]
+    middle = count // 2
+    key = key_between(a, b)
+    return keys_between(a, key, middle) + [key] + keys_between(key, b, count - middle - 1)
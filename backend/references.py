@@ -0,0 +1,62 @@
+from bson import ObjectId
+
+'''
+The code in this file handles the references between documents: user_id,
+notebook_id and section_id. They used to be stored as 24 character hex strings
+and are now stored as native ObjectIds, 12 bytes compared as binary in every
+document and index. User ids that are not ObjectIds are kept as they are.
+
+Migration 4 rewrites existing documents in batches while the app keeps serving.
+Until a process starts on a database where it has completed, reads match both
+forms of every reference ("dual read"); new writes always use the native form.
+'''
+
+REFERENCE_FIELDS = ("user_id", "notebook_id", "section_id")
+
+# Whether documents may still hold string references, set by init_db from the schema version
+_dual_read = True
+
+
+def set_dual_read(enabled):
+    global _dual_read
+    _dual_read = bool(enabled)
+
+
+def dual_read():
+    return _dual_read
+
+
+def ref(value):
+    """Stored form of a reference, an ObjectId for ObjectId hex strings"""
+    if isinstance(value, str) and len(value) == 24 and ObjectId.is_valid(value):
+        return ObjectId(value)
+    return value
+
+
+def match(value):
+    """Filter value matching a reference in its stored form, or either form during the migration"""
+    stored = ref(value)
+    if _dual_read and isinstance(stored, ObjectId):
+        return {"$in": [stored, str(stored)]}
+    return stored
+
+
+def match_any(values):
+    """Values for $in/$nin matching any of the references"""
+    stored = [ref(value) for value in values]
+    if _dual_read:
+        stored += [str(value) for value in stored if isinstance(value, ObjectId)]
+    return stored
+
+
+def owner(user_id, **references):
+    """Filter for documents of user_id with the given notebook_id and section_id"""
+    query = {"user_id": match(user_id)}
+    for field, value in references.items():
+        query[field] = match(value)
+    return query
+
+
+def id_string(value):
+    """A reference read from a document as the string used in URLs and in-memory indexes"""
+    return str(value) if value is not None else None
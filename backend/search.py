@@ -1,5 +1,19 @@
-from flask import jsonify, request
+import base64
+import datetime
+import heapq
+import itertools
+import json
+import re
+
+from flask import g, jsonify, request
 from bson import ObjectId
+from deadlines import check_cancelled, query_comment, search_queries
+from events import subscribe
+from fuzzy import VocabularyCache
+from label_inheritance import label_field
+from references import owner
+from search_query import NEVER, QuerySyntaxError, compile_query, is_plain, parse_query
+from tokenizer import tokenize
 
 '''
 The code in this file is for handling FR24 in section 4.7
@@ -22,164 +36,365 @@ def create_search_indexes(db):
     db.notebooks.create_index("labels")
     db.sections.create_index("labels")
     db.notes.create_index("labels")
-    
-    print("Search indexes created successfully")
 
-def search_all_content(user_id, query, notebooks_collection, sections_collection, notes_collection, labels=None):
+# Maximum results per group
+RESULT_LIMITS = {"notebooks": 10, "sections": 10, "notes": 20}
+
+# Default and maximum number of unified results, and documents read per cursor batch for them
+UNIFIED_LIMIT = 20
+UNIFIED_MAX_LIMIT = 100
+UNIFIED_BATCH_SIZE = 10
+
+# Summed weights of the fields of each text index in create_search_indexes. textScore adds up
+# the score of every indexed field, so without dividing by this a note (title and content)
+# would outscore a notebook or section (one field) matching just as well
+TEXT_FIELD_WEIGHTS = {"notebooks": 1, "sections": 1, "notes": 2}
+
+# Parts of a $text search string: phrases and exclusions (-word, -"phrase") and plain words
+TEXT_SEARCH_PARTS = re.compile(r'-?"[^"]*"?|\S+')
+
+NOTEBOOK_PROJECTION = {"name": 1, "labels": 1, "created_at": 1, "updated_at": 1, "user_id": 1}
+SECTION_PROJECTION = {"title": 1, "labels": 1, "notebook_id": 1, "created_at": 1, "updated_at": 1, "user_id": 1}
+NOTE_PROJECTION = {
+    "title": 1,
+    "content": 1,
+    "labels": 1,
+    "section_id": 1,
+    "notebook_id": 1,
+    "created_at": 1,
+    "updated_at": 1,
+    "user_id": 1,
+}
+
+
+# Result types of each group, unified results are tagged with these
+GROUP_TYPES = {"notebooks": "notebook", "sections": "section", "notes": "note"}
+
+
+def merge_ranked(streams, limit, key=lambda doc: doc["score"]):
+    """
+    Global top limit of {group: documents sorted by key, highest first}, as one list
+    tagged with "type". Streams are consumed lazily and left alone once they cannot
+    place another document, so cursors only fetch the batches that reach the result.
+    """
+    def tagged(group, docs):
+        for doc in docs:
+            doc["type"] = GROUP_TYPES[group]
+            yield doc
+
+    merged = heapq.merge(*(tagged(group, streams[group]) for group in GROUP_TYPES), key=key, reverse=True)
+    return list(itertools.islice(merged, limit))
+
+
+def _per_field(docs, weight):
+    """Text scores of docs divided by the summed weight of their collection's indexed fields, lazily"""
+    for doc in docs:
+        doc["score"] = round(doc["score"] / weight, 4)
+        yield doc
+
+
+class SearchBackend:
+    """Interface of the engines answering text queries for the search endpoint"""
+
+    name = None
+
+    def search(self, user_id, query, labels, collections, fuzzy=False, limits=None, filters=None):
+        """
+        Ranked documents matching query, as {"notebooks": [...], "sections": [...], "notes": [...]}.
+        collections is the (notebooks, sections, notes) tuple, documents carry a "score".
+        fuzzy also matches terms within a small edit distance of the query terms.
+        limits overrides RESULT_LIMITS, the number of results per group.
+        filters ({group: [MongoDB predicates]}) are extra conditions from a structured query.
+        """
+        raise NotImplementedError
+
+    def faceted_search(self, user_id, query, labels, collections, fuzzy=False, limits=None, offsets=None,
+                       filters=None):
+        """
+        A page of search results with match counts, as {"results": {...}, "totals": {group: n},
+        "labels": {label: n}, "notebooks": {notebook id: n}}. offsets skips that many hits per group.
+        Notebooks count themselves and their matching sections and notes.
+        """
+        raise NotImplementedError
+
+    def unified_search(self, user_id, query, labels, collections, fuzzy=False, limit=UNIFIED_LIMIT, filters=None):
+        """Best limit documents of any type as one list, ranked on comparable scores"""
+        results = self.search(user_id, query, labels, collections, fuzzy=fuzzy,
+                              limits={group: limit for group in RESULT_LIMITS}, filters=filters)
+        return merge_ranked(results, limit)
+
+    def handle_event(self, event):
+        """Follow a write published on the events bus, for engines keeping their own index"""
+
+    def close(self):
+        pass
+
+
+class MongoTextSearch(SearchBackend):
+    """Search with MongoDB text indexes, also used for label-only searches"""
+
+    name = "mongo"
+
+    def __init__(self):
+        # Text indexes have no typo tolerance, fuzzy queries are corrected against this first
+        self.vocabularies = VocabularyCache()
+
+    def _find(self, collection, user_id, query, labels, projection, limit, filters=None):
+        if filters == [NEVER]:
+            return []
+        return list(self._cursor(collection, user_id, query, labels, projection, limit, filters))
+
+    def _cursor(self, collection, user_id, query, labels, projection, limit, filters=None):
+        filter_query = owner(user_id)
+        projection = dict(projection)
+
+        # Add text search if query provided
+        if query:
+            filter_query["$text"] = {"$search": query}
+            projection["score"] = {"$meta": "textScore"}
+            sort = [("score", {"$meta": "textScore"})]
+        else:
+            sort = [("updated_at", -1)]
+
+        # Add labels filter if provided
+        if labels:
+            filter_query["labels"] = {"$all": labels}
+
+        # Predicates of a structured query, most selective first
+        if filters:
+            filter_query["$and"] = filters
+
+        check_cancelled()
+        return collection.find(filter_query, projection, comment=query_comment()).sort(sort).limit(limit)
+
+    def unified_search(self, user_id, query, labels, collections, fuzzy=False, limit=UNIFIED_LIMIT, filters=None):
+        if fuzzy and query:
+            query = self.fuzzy_query(user_id, query, collections)
+        filters = filters or {}
+        projections = (NOTEBOOK_PROJECTION, SECTION_PROJECTION, NOTE_PROJECTION)
+        streams, cursors = {}, {}
+        for group, collection, projection in zip(RESULT_LIMITS, collections, projections):
+            if filters.get(group) == [NEVER]:
+                streams[group] = []
+                continue
+            # Small batches, a collection that stops contributing is not read any further
+            streams[group] = cursors[group] = self._cursor(
+                collection, user_id, query, labels, projection, limit, filters.get(group)
+            ).batch_size(UNIFIED_BATCH_SIZE)
+            if query:
+                streams[group] = _per_field(cursors[group], TEXT_FIELD_WEIGHTS[group])
+        try:
+            # Normalized text scores rank all types together, label-only results are the most recent
+            key = (lambda doc: doc["score"]) if query else (lambda doc: doc.get("updated_at") or datetime.datetime.min)
+            return merge_ranked(streams, limit, key=key)
+        finally:
+            for cursor in cursors.values():
+                cursor.close()
+
+    def _facet(self, collection, user_id, query, labels, projection, limit, offset, notebook_field, filters=None):
+        """One page of hits with the total, label and notebook counts, in a single aggregation"""
+        if filters == [NEVER]:
+            return [], 0, {}, {}
+        match = owner(user_id)
+        pipeline = [{"$match": match}]
+        projection = dict(projection)
+        if query:
+            match["$text"] = {"$search": query}
+            pipeline.append({"$addFields": {"score": {"$meta": "textScore"}}})
+            projection["score"] = 1
+            sort = {"score": -1}
+        else:
+            sort = {"updated_at": -1}
+        # Ties broken by _id so pages do not overlap
+        sort["_id"] = 1
+        if labels:
+            match["labels"] = {"$all": labels}
+        if filters:
+            match["$and"] = filters
+
+        pipeline.append({"$facet": {
+            "hits": [{"$sort": sort}, {"$skip": offset}, {"$limit": limit}, {"$project": projection}],
+            "total": [{"$count": "count"}],
+            "labels": [{"$unwind": "$labels"}, {"$group": {"_id": "$labels", "count": {"$sum": 1}}}],
+            "notebooks": [{"$group": {"_id": notebook_field, "count": {"$sum": 1}}}],
+        }})
+        check_cancelled()
+        facets = next(collection.aggregate(pipeline, comment=query_comment()))
+        total = facets["total"][0]["count"] if facets["total"] else 0
+        label_counts = {doc["_id"]: doc["count"] for doc in facets["labels"]}
+        notebook_counts = {}
+        for doc in facets["notebooks"]:
+            # Migrated and string references of the same notebook count together
+            if doc["_id"]:
+                notebook_counts[str(doc["_id"])] = notebook_counts.get(str(doc["_id"]), 0) + doc["count"]
+        return facets["hits"], total, label_counts, notebook_counts
+
+    def faceted_search(self, user_id, query, labels, collections, fuzzy=False, limits=None, offsets=None,
+                       filters=None):
+        limits = limits or RESULT_LIMITS
+        offsets = offsets or {}
+        filters = filters or {}
+        if fuzzy and query:
+            query = self.fuzzy_query(user_id, query, collections)
+        sources = zip(
+            ("notebooks", "sections", "notes"),
+            collections,
+            (NOTEBOOK_PROJECTION, SECTION_PROJECTION, NOTE_PROJECTION),
+            # A notebook counts towards itself
+            ({"$toString": "$_id"}, "$notebook_id", "$notebook_id"),
+        )
+        response = {"results": {}, "totals": {}, "labels": {}, "notebooks": {}}
+        for group, collection, projection, notebook_field in sources:
+            hits, total, label_counts, notebook_counts = self._facet(
+                collection, user_id, query, labels, projection, limits[group], offsets.get(group, 0), notebook_field,
+                filters.get(group)
+            )
+            response["results"][group] = hits
+            response["totals"][group] = total
+            for facet, counts in (("labels", label_counts), ("notebooks", notebook_counts)):
+                for key, count in counts.items():
+                    response[facet][key] = response[facet].get(key, 0) + count
+        return response
+
+    def fuzzy_query(self, user_id, query, collections):
+        """
+        query with every word replaced by the closest words the user has written.
+        Phrases and exclusions of a structured query are kept as they are.
+        """
+        vocabulary = self.vocabularies.get(user_id, collections)
+        if vocabulary is None:
+            # Read in the background, searched without corrections until then
+            return query
+        words = []
+        for part in TEXT_SEARCH_PARTS.findall(query):
+            if part.startswith(("-", '"')):
+                words.append(part)
+                continue
+            for word in tokenize(part, stemmed=False):
+                # $text cannot weight alternatives, so only the closest few are searched
+                expansions = vocabulary.expand(word)[:3]
+                if expansions:
+                    words.extend(term for term, _ in expansions)
+                else:
+                    words.append(word)
+        return " ".join(dict.fromkeys(words))
+
+    def search(self, user_id, query, labels, collections, fuzzy=False, limits=None, filters=None):
+        notebooks_collection, sections_collection, notes_collection = collections
+        limits = limits or RESULT_LIMITS
+        filters = filters or {}
+        if fuzzy and query:
+            query = self.fuzzy_query(user_id, query, collections)
+        return {
+            "notebooks": self._find(notebooks_collection, user_id, query, labels,
+                                    NOTEBOOK_PROJECTION, limits["notebooks"], filters.get("notebooks")),
+            "sections": self._find(sections_collection, user_id, query, labels,
+                                   SECTION_PROJECTION, limits["sections"], filters.get("sections")),
+            "notes": self._find(notes_collection, user_id, query, labels,
+                                NOTE_PROJECTION, limits["notes"], filters.get("notes")),
+        }
+
+
+    def handle_event(self, event):
+        self.vocabularies.handle_event(event)
+
+
+MONGO_SEARCH = MongoTextSearch()
+
+
+def content_preview(content, query):
+    """Up to 100 characters of content around the first match of query"""
+    # If there's a query, try to highlight the matching parts
+    if query:
+        query_pos = content.lower().find(query.lower())
+        
+        if query_pos >= 0:
+            start = max(0, query_pos - 50)
+            end = min(len(content), query_pos + len(query) + 50)
+            if start > 0:
+                return "..." + content[start:end] + "..."
+            return content[start:end] + "..."
+    # If query not found in content (might be in title only) or label-only search, take first 100 chars
+    return content[:100] + "..." if len(content) > 100 else content
+
+
+def encode_cursor(offsets):
+    """Opaque pagination token for the given per-group offsets"""
+    return base64.urlsafe_b64encode(json.dumps(offsets, separators=(",", ":")).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Per-group offsets of a token from encode_cursor, ValueError if it is not one"""
+    try:
+        offsets = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(offsets, dict) or not all(
+        group in RESULT_LIMITS and isinstance(offset, int) and offset >= 0 for group, offset in offsets.items()
+    ):
+        raise ValueError("Invalid cursor")
+    return offsets
+
+
+def sorted_counts(counts, key_name):
+    """Facet counts as a list, largest first"""
+    ordered = sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+    return [{key_name: key, "count": count} for key, count in ordered]
+
+
+def search_all_content(user_id, query, notebooks_collection, sections_collection, notes_collection, labels=None,
+                       backend=None, fuzzy=False, semantic=None, facets=False, offsets=None, unified=False,
+                       limit=UNIFIED_LIMIT, filters=None):
     """
     Search for query across notebooks, sections and notes
     Optional filtering by labels
+    backend is the SearchBackend ranking text queries, MongoDB text search by default
+    fuzzy tolerates typos in the query
+    semantic is a SemanticSearch blending meaning based similarity into the note ranking
+    facets adds match counts per label and per notebook, offsets ({group: n}) returns a later page.
+    Either one also adds the total matches per group and a cursor for the next page.
+    unified returns the best limit results of all types as one ranked list instead of groups
+    filters ({group: [MongoDB predicates]}) are the conditions of a structured query besides its text
     """
     # Validate input require either query or labels
-    if not query and not labels:
+    if not query and not labels and not filters:
         return {"message": "Search query or labels must be provided"}, 400
         
-    if query and len(query) < 2 and not labels:
+    if query and len(query) < 2 and not labels and not filters:
         return {"message": "Search query must be at least 2 characters"}, 400
-        
-    results = {
-        "notebooks": [],
-        "sections": [],
-        "notes": []
-    }
-    
-    # Search notebooks
-    notebook_query = {"user_id": user_id}
-    notebook_projection = {
-        "name": 1,
-        "labels": 1,
-        "created_at": 1, 
-        "updated_at": 1,
-        "user_id": 1
-    }
-    
-    # Add text search if query provided
-    if query:
-        notebook_query["$text"] = {"$search": query}
-        notebook_projection["score"] = {"$meta": "textScore"}
-        notebook_sort = [("score", {"$meta": "textScore"})]
-    else:
-        notebook_sort = [("updated_at", -1)]
-    
-    # Add labels filter if provided
-    if labels:
-        notebook_query["labels"] = {"$all": labels}
-    
-    # Execute search
-    notebook_cursor = notebooks_collection.find(
-        notebook_query,
-        notebook_projection
-    ).sort(notebook_sort).limit(10)
-    
-    for notebook in notebook_cursor:
-        notebook["_id"] = str(notebook["_id"])
-        notebook["type"] = "notebook"
-        results["notebooks"].append(notebook)
     
-    # Search sections
-    section_query = {"user_id": user_id}
-    section_projection = {
-        "title": 1,
-        "labels": 1,
-        "notebook_id": 1, 
-        "created_at": 1, 
-        "updated_at": 1,
-        "user_id": 1
-    }
-    
-    # Add text search if query provided
-    if query:
-        section_query["$text"] = {"$search": query}
-        section_projection["score"] = {"$meta": "textScore"}
-        section_sort = [("score", {"$meta": "textScore"})]
-    else:
-        section_sort = [("updated_at", -1)]
-    
-    # Add labels filter if provided
-    if labels:
-        section_query["labels"] = {"$all": labels}
-    
-    # Execute search
-    section_cursor = sections_collection.find(
-        section_query,
-        section_projection
-    ).sort(section_sort).limit(10)
-    
-    for section in section_cursor:
-        section["_id"] = str(section["_id"])
-        if "notebook_id" in section:
-            section["notebook_id"] = str(section["notebook_id"])
-        section["type"] = "section"
-        results["sections"].append(section)
-    
-    # Search notes
-    note_query = {"user_id": user_id}
-    note_projection = {
-        "title": 1, 
-        "content": 1,
-        "labels": 1,
-        "section_id": 1, 
-        "notebook_id": 1, 
-        "created_at": 1, 
-        "updated_at": 1,
-        "user_id": 1,
-    }
-    
-    # Add text search if query provided
-    if query:
-        note_query["$text"] = {"$search": query}
-        note_projection["score"] = {"$meta": "textScore"}
-        note_sort = [("score", {"$meta": "textScore"})]
+    # Label-only searches have nothing to rank and are a plain indexed filter
+    if backend is None or not query:
+        backend = MONGO_SEARCH
+    elif semantic is not None:
+        backend = semantic
+    collections = (notebooks_collection, sections_collection, notes_collection)
+    paged = None
+    if unified:
+        results = backend.unified_search(user_id, query, labels, collections, fuzzy=fuzzy, limit=limit,
+                                         filters=filters)
+        docs = results
     else:
-        note_sort = [("updated_at", -1)]
-    
-    # Add labels filter if provided
-    if labels:
-        note_query["labels"] = {"$all": labels}
+        if facets or offsets:
+            paged = backend.faceted_search(user_id, query, labels, collections, fuzzy=fuzzy, offsets=offsets,
+                                           filters=filters)
+            results = paged["results"]
+        else:
+            results = backend.search(user_id, query, labels, collections, fuzzy=fuzzy, filters=filters)
+        docs = []
+        for group, doc_type in GROUP_TYPES.items():
+            for doc in results[group]:
+                doc["type"] = doc_type
+                docs.append(doc)
     
-    # Execute search
-    note_cursor = notes_collection.find(
-        note_query,
-        note_projection
-    ).sort(note_sort).limit(20)
-    
-    for note in note_cursor:
-        note["_id"] = str(note["_id"])
-        if "notebook_id" in note:
-            note["notebook_id"] = str(note["notebook_id"])
-        if "section_id" in note:
-            note["section_id"] = str(note["section_id"])
-        note["type"] = "note"
-        
+    for doc in docs:
         # Create a content preview
-        if "content" in note and note["content"]:
-            content = note["content"]
-            
-            # If there's a query, try to highlight the matching parts
-            if query:
-                query_pos = content.lower().find(query.lower())
-                
-                if query_pos >= 0:
-                    start = max(0, query_pos - 50)
-                    end = min(len(content), query_pos + len(query) + 50)
-                    if start > 0:
-                        preview = "..." + content[start:end] + "..."
-                    else:
-                        preview = content[start:end] + "..."
-                else:
-                    # If query not found in content (might be in title only)
-                    preview = content[:100] + "..." if len(content) > 100 else content
-            else:
-                # If no query (label-only search), just take first 100 chars
-                preview = content[:100] + "..." if len(content) > 100 else content
-                
-            note["content_preview"] = preview
-            del note["content"]  # Remove full content
-            
-        results["notes"].append(note)
+        if doc["type"] == "note" and doc.get("content"):
+            doc["content_preview"] = content_preview(doc["content"], query)
+            del doc["content"]  # Remove full content
     
     # Get total results count
-    total_results = len(results["notebooks"]) + len(results["sections"]) + len(results["notes"])
+    total_results = len(docs)
     
     # Build response with metadata
     response = {
@@ -187,9 +402,30 @@ def search_all_content(user_id, query, notebooks_collection, sections_collection
         "results": results
     }
     
+    if paged is not None:
+        offsets = offsets or {}
+        next_offsets = {group: offsets.get(group, 0) + len(results[group]) for group in RESULT_LIMITS}
+        response["totals"] = paged["totals"]
+        more = any(next_offsets[group] < paged["totals"][group] for group in RESULT_LIMITS)
+        response["next_cursor"] = encode_cursor(next_offsets) if more else None
+        if facets:
+            response["facets"] = {
+                "labels": sorted_counts(paged["labels"], "label"),
+                "notebooks": sorted_counts(paged["notebooks"], "notebook_id"),
+            }
+    
+    if unified:
+        response["unified"] = True
+    
     # Include query in response if provided
     if query:
         response["query"] = query
+        if fuzzy:
+            response["fuzzy"] = True
+        if semantic is not None:
+            response["mode"] = "semantic"
+            # False while the user's vectors are built in the background, keyword ranking only
+            response["semantic_ready"] = not paged and semantic.ready(user_id)
         
     # Include labels in response if provided
     if labels:
@@ -197,32 +433,173 @@ def search_all_content(user_id, query, notebooks_collection, sections_collection
     
     return response
 
+
+def create_search_backend(app, get_collections):
+    """Search backend selected by the SEARCH_BACKEND setting"""
+    name = app.config.get("SEARCH_BACKEND", "mongo")
+    if name == "mongo":
+        return MONGO_SEARCH
+    if name == "inverted":
+        from inverted_index import InvertedIndexSearch
+        return InvertedIndexSearch(
+            app.config["SEARCH_INDEX_DIR"],
+            get_collections,
+            max_users=app.config.get("SEARCH_INDEX_MAX_USERS", 32),
+        )
+    raise ValueError(f"Unknown search backend: {name}")
+
+
+def get_search_backend(app, get_collections):
+    """The search backend of app, created on first use"""
+    backend = app.extensions.get("search_backend")
+    if backend is None:
+        backend = app.extensions["search_backend"] = create_search_backend(app, get_collections)
+    return backend
+
+
+def reset_search_backend(app):
+    """Close the current backend so the next search picks up changed settings"""
+    for key in ("search_backend", "semantic_search"):
+        backend = app.extensions.pop(key, None)
+        if backend is not None:
+            backend.close()
+
+
+def get_semantic_backend(app, get_collections):
+    """The semantic search of app, created on first use, None when numpy is not installed"""
+    import semantic
+    if not semantic.available():
+        return None
+    backend = app.extensions.get("semantic_search")
+    if backend is None:
+        backend = app.extensions["semantic_search"] = semantic.SemanticSearch(
+            lambda: get_search_backend(app, get_collections),
+            get_collections,
+            max_users=app.config.get("SEMANTIC_INDEX_MAX_USERS", 16),
+        )
+    return backend
+
+
 # Register the endpoint
-def register_search_endpoint(app, notebooks_collection, sections_collection, notes_collection):
-    """Register the search endpoint with the Flask app"""
+def register_search_endpoint(app, get_collections):
+    """Register the search endpoint with the Flask app
+
+    get_collections returns the (notebooks, sections, notes) collections in use
+    """
+    
+    # Engines with their own index follow every write
+    def handle_event(event):
+        get_search_backend(app, get_collections).handle_event(event)
+        semantic_backend = app.extensions.get("semantic_search")
+        if semantic_backend is not None:
+            semantic_backend.handle_event(event)
+
+    subscribe(handle_event)
     
     @app.route("/api/users/<user_id>/search", methods=["GET"])
     def search(user_id):
         # Get query parameters
         query = request.args.get("q", "")
         labels_param = request.args.get("labels", "")
+        fuzzy = request.args.get("fuzzy", "").lower() in ("1", "true", "yes")
+        facets = request.args.get("facets", "").lower() in ("1", "true", "yes")
+        offsets = None
+        try:
+            if request.args.get("cursor"):
+                offsets = decode_cursor(request.args["cursor"])
+            elif request.args.get("offset"):
+                offset = int(request.args["offset"])
+                if offset < 0:
+                    raise ValueError
+                offsets = {group: offset for group in RESULT_LIMITS}
+        except ValueError:
+            return jsonify({"message": "Invalid offset or cursor"}), 400
+        unified = request.args.get("unified", "").lower() in ("1", "true", "yes")
+        try:
+            limit = int(request.args.get("limit", UNIFIED_LIMIT))
+        except ValueError:
+            limit = 0
+        if unified and not 1 <= limit <= UNIFIED_MAX_LIMIT:
+            return jsonify({"message": f"limit must be between 1 and {UNIFIED_MAX_LIMIT}"}), 400
+        if unified and (facets or offsets):
+            return jsonify({"message": "Unified results do not support facets or pagination"}), 400
+        mode = request.args.get("mode", "keyword")
+        if mode not in ("keyword", "semantic"):
+            return jsonify({"message": "Search mode must be 'keyword' or 'semantic'"}), 400
+        semantic_backend = None
+        if mode == "semantic":
+            semantic_backend = get_semantic_backend(app, get_collections)
+            if semantic_backend is None:
+                return jsonify({"message": "Semantic search requires numpy"}), 400
         
         # Process labels if provided
         labels = labels_param.split(",") if labels_param and labels_param.strip() else []
         # Filter out empty labels
         labels = [label.strip() for label in labels if label.strip()]
         
-        result = search_all_content(
-            user_id, 
-            query, 
-            notebooks_collection, 
-            sections_collection, 
-            notes_collection,
-            labels
-        )
+        notebooks_collection, sections_collection, notes_collection = get_collections()
+        backend = get_search_backend(app, get_collections)
+
+        # Structured queries are compiled to the text the backend ranks and MongoDB filters
+        text, filters = query, None
+        explain = request.args.get("explain", "").lower() in ("1", "true", "yes")
+        structured = False
+        if query:
+            try:
+                tree = parse_query(query)
+            except QuerySyntaxError as e:
+                return jsonify({"message": f"Invalid search query: {e}"}), 400
+            structured = not is_plain(tree)
+            if structured or explain:
+                # Backends other than MongoDB only rank plain words
+                target = "semantic" if semantic_backend is not None else backend.name
+                compiled = compile_query(tree, user_id, notebooks_collection, target)
+                if explain:
+                    return jsonify({"query": query, "parsed": repr(tree), "plan": compiled.plan(user_id)}), 200
+                text = compiled.text
+                labels = list(dict.fromkeys(labels + compiled.labels))
+                filters = compiled.filters if any(compiled.filters.values()) else None
+
+        # Labels of a notebook or section also match everything inside it
+        inherited = request.args.get("inherited", "").lower() in ("1", "true", "yes") and bool(labels)
+        if inherited:
+            filters = filters or {}
+            filters = {
+                group: filters[group] if filters.get(group) == [NEVER]
+                else [{label_field(group): {"$all": labels}}] + filters.get(group, [])
+                for group in RESULT_LIMITS
+            }
+
+        # A newer search of this user cancels this one
+        g.search_ticket = search_queries.start(user_id)
+        try:
+            result = search_all_content(
+                user_id, 
+                text, 
+                notebooks_collection, 
+                sections_collection, 
+                notes_collection,
+                [] if inherited else labels,
+                backend=backend,
+                fuzzy=fuzzy,
+                semantic=semantic_backend,
+                facets=facets,
+                offsets=offsets,
+                unified=unified,
+                limit=limit,
+                filters=filters
+            )
+            check_cancelled()
+        finally:
+            search_queries.finish(g.search_ticket)
         
         # Check if there was an error
         if isinstance(result, tuple) and len(result) == 2 and isinstance(result[1], int):
             return jsonify(result[0]), result[1]
+        if structured:
+            result["query"] = query
+        if inherited:
+            result["labels"] = labels
+            result["inherited_labels"] = True
             
         return jsonify(result), 200
\ No newline at end of file
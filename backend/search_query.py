@@ -0,0 +1,384 @@
+import datetime
+import re
+
+from bson import ObjectId
+
+from references import match_any, owner
+
+'''
+The code in this file is the search query language. Besides plain words, q accepts
+
+    "exact phrase"              words next to each other
+    -word  -"phrase"            excluded
+    title:word  content:word    words in one field only (title is a notebook's name)
+    label:name  -label:name     labels (several are all required)
+    notebook:name               inside a notebook, by name or id
+    updated:>2026-01-01         dates, also >=, <, <=, 2026-01-01 (that day) and
+    created:2026-01..2026-03    ranges, months and years
+    (a OR b)                    alternatives, grouped with parentheses
+
+The parsed query is compiled into MongoDB filters, ordered so the predicates
+answered by the most selective index come first, and into the text the search
+backend ranks. Words and phrases outside OR groups are ranked like a normal
+search, everything else only filters.
+'''
+
+FIELDS = ("title", "content", "label", "notebook", "updated", "created")
+
+# Text fields of each group that title: and content: search
+TEXT_FIELDS = {
+    "title": {"notebooks": "name", "sections": "title", "notes": "title"},
+    "content": {"notes": "content"},
+}
+DATE_FIELDS = {"updated": "updated_at", "created": "created_at"}
+GROUPS = ("notebooks", "sections", "notes")
+
+# Predicate matching nothing, for filters a group cannot satisfy (content: on notebooks)
+NEVER = {"_id": {"$exists": False}}
+
+# Predicates by the index answering them, most selective first
+SELECTIVITY = ("_id", "notebook_id", "labels", "updated_at", "created_at", "$or", "$and")
+
+TOKEN_RE = re.compile(r'\s*(?:(\()|(\))|(-?)(?:([a-z]+):)?(?:"([^"]*)"?|([^\s()"]+)))', re.IGNORECASE)
+DATE_RE = re.compile(r"^(\d{4})(?:-(\d{1,2})(?:-(\d{1,2}))?)?$")
+
+
+class QuerySyntaxError(ValueError):
+    """The search query cannot be parsed"""
+
+
+class Term:
+    """A word or phrase, optionally limited to title: or content:"""
+
+    __slots__ = ("field", "value", "phrase", "negated")
+
+    def __init__(self, field, value, phrase=False, negated=False):
+        self.field = field
+        self.value = value
+        self.phrase = phrase
+        self.negated = negated
+
+    def __repr__(self):
+        value = f'"{self.value}"' if self.phrase else self.value
+        return f"{'-' if self.negated else ''}{self.field + ':' if self.field else ''}{value}"
+
+
+class Filter:
+    """label: or notebook: filter"""
+
+    __slots__ = ("field", "value", "negated")
+
+    def __init__(self, field, value, negated=False):
+        self.field = field
+        self.value = value
+        self.negated = negated
+
+    def __repr__(self):
+        return f"{'-' if self.negated else ''}{self.field}:{self.value}"
+
+
+class DateRange:
+    """updated: or created: range, start inclusive and end exclusive (either can be None)"""
+
+    __slots__ = ("field", "start", "end", "negated")
+
+    def __init__(self, field, start, end, negated=False):
+        self.field = field
+        self.start = start
+        self.end = end
+        self.negated = negated
+
+    def __repr__(self):
+        start = self.start.isoformat() if self.start else ""
+        end = self.end.isoformat() if self.end else ""
+        return f"{'-' if self.negated else ''}{self.field}:[{start},{end})"
+
+
+class Group:
+    """All (AND) or any (OR) of the children"""
+
+    __slots__ = ("operator", "children")
+
+    def __init__(self, operator, children):
+        self.operator = operator
+        self.children = children
+
+    def __repr__(self):
+        return "(" + f" {self.operator} ".join(repr(child) for child in self.children) + ")"
+
+
+# ------------------------------------------------------------------------------
+# Parsing
+# ------------------------------------------------------------------------------
+
+def _tokens(text):
+    position = 0
+    text = text.rstrip()
+    while position < len(text):
+        match = TOKEN_RE.match(text, position)
+        if not match or match.end() == position:
+            raise QuerySyntaxError(f"Unexpected character at position {position}: {text[position]}")
+        position = match.end()
+        opening, closing, minus, field, quoted, word = match.groups()
+        if opening:
+            yield ("(", None)
+        elif closing:
+            yield (")", None)
+        elif word == "OR" and not field and not minus:
+            yield ("OR", None)
+        else:
+            yield ("atom", (minus == "-", field.lower() if field else None, quoted, word))
+
+
+def _parse_date(value):
+    """(start, end) covering a YYYY, YYYY-MM or YYYY-MM-DD value"""
+    match = DATE_RE.match(value)
+    if not match:
+        raise QuerySyntaxError(f"Invalid date: {value}")
+    year, month, day = (int(part) if part else None for part in match.groups())
+    try:
+        if day:
+            start = datetime.datetime(year, month, day)
+            return start, start + datetime.timedelta(days=1)
+        if month:
+            start = datetime.datetime(year, month, 1)
+            return start, datetime.datetime(year + month // 12, month % 12 + 1, 1)
+        return datetime.datetime(year, 1, 1), datetime.datetime(year + 1, 1, 1)
+    except ValueError:
+        raise QuerySyntaxError(f"Invalid date: {value}")
+
+
+def _date_range(field, value, negated):
+    for operator in (">=", "<=", ">", "<"):
+        if value.startswith(operator):
+            start, end = _parse_date(value[len(operator):])
+            bounds = {">=": (start, None), ">": (end, None), "<=": (None, end), "<": (None, start)}[operator]
+            return DateRange(field, *bounds, negated=negated)
+    if ".." in value:
+        first, last = value.split("..", 1)
+        return DateRange(field, _parse_date(first)[0], _parse_date(last)[1], negated=negated)
+    return DateRange(field, *_parse_date(value), negated=negated)
+
+
+def _atom(negated, field, quoted, word):
+    value = quoted if quoted is not None else word
+    if not field and quoted is None and value.endswith(":") and value[:-1].lower() in FIELDS:
+        raise QuerySyntaxError(f"Missing value for {value[:-1].lower()}")
+    if field not in FIELDS:
+        # Not an operator (e.g. "http://..." or "c:"), search for the text as written
+        if field:
+            value = f"{field}:{value}"
+        field = None
+    if not value or not value.strip():
+        raise QuerySyntaxError(f"Missing value for {field or 'term'}")
+    if field in ("label", "notebook"):
+        return Filter(field, value, negated)
+    if field in DATE_FIELDS:
+        return _date_range(field, value, negated)
+    phrase = quoted is not None and len(value.split()) > 1
+    return Term(field, " ".join(value.split()) if quoted is not None else value, phrase, negated)
+
+
+def parse_query(text):
+    """Syntax tree of a search query, a Group of AND-ed clauses"""
+    tokens = list(_tokens(text))
+    position = 0
+
+    def sequence(closing):
+        nonlocal position
+        clauses = []
+        while position < len(tokens) and tokens[position][0] != ")":
+            alternatives = [unary()]
+            while position < len(tokens) and tokens[position][0] == "OR":
+                position += 1
+                if position >= len(tokens) or tokens[position][0] == ")":
+                    raise QuerySyntaxError("OR needs a term on both sides")
+                alternatives.append(unary())
+            clauses.append(alternatives[0] if len(alternatives) == 1 else Group("OR", alternatives))
+        if closing:
+            if position >= len(tokens):
+                raise QuerySyntaxError("Missing closing parenthesis")
+            position += 1
+        return clauses
+
+    def unary():
+        nonlocal position
+        kind, value = tokens[position]
+        position += 1
+        if kind == "(":
+            children = sequence(closing=True)
+            if not children:
+                raise QuerySyntaxError("Empty parentheses")
+            return children[0] if len(children) == 1 else Group("AND", children)
+        if kind == "OR":
+            raise QuerySyntaxError("OR needs a term on both sides")
+        return _atom(*value)
+
+    clauses = sequence(closing=False)
+    if position < len(tokens):
+        raise QuerySyntaxError("Unexpected closing parenthesis")
+    return Group("AND", clauses)
+
+
+def is_plain(tree):
+    """Whether the query is only words, searched as before the query language existed"""
+    return all(isinstance(clause, Term) and not (clause.field or clause.phrase or clause.negated)
+               for clause in tree.children)
+
+
+# ------------------------------------------------------------------------------
+# Compiling
+# ------------------------------------------------------------------------------
+
+class CompiledQuery:
+    """
+    What the search runs for a parsed query: text ranked by the backend, labels
+    required on every result, and extra MongoDB predicates per group.
+    """
+
+    def __init__(self, text, labels, filters, target):
+        self.text = text
+        self.labels = labels
+        self.filters = filters
+        self.target = target
+
+    def plan(self, user_id):
+        """The filter each collection is queried with, for explain=1"""
+        plan = {"target": self.target, "text": self.text, "labels": self.labels, "filters": {}}
+        for group in GROUPS:
+            query = owner(user_id)
+            if self.text and self.target == "mongo":
+                query["$text"] = {"$search": self.text}
+            if self.labels:
+                query["labels"] = {"$all": self.labels}
+            if self.filters.get(group):
+                query["$and"] = self.filters[group]
+            plan["filters"][group] = query
+        if self.target != "mongo":
+            plan["note"] = "text is ranked by the search backend, filters are applied to its candidates"
+        return plan
+
+
+def _regex(words):
+    """Case-insensitive regex of words next to each other, from the start of a word"""
+    return {"$regex": r"\b" + r"\s+".join(re.escape(word) for word in words), "$options": "i"}
+
+
+def _text_predicate(term, group):
+    """Predicate for a word or phrase in the searched fields of group, None when group has none"""
+    if term.field:
+        if group not in TEXT_FIELDS[term.field]:
+            return None
+        fields = [TEXT_FIELDS[term.field][group]]
+    else:
+        fields = [names[group] for names in TEXT_FIELDS.values() if group in names]
+    regex = _regex(term.value.split())
+    if len(fields) == 1:
+        return {fields[0]: regex}
+    return {"$or": [{field: regex} for field in fields]}
+
+
+def _negate(predicate):
+    return {"$nor": [predicate]}
+
+
+def _selectivity(predicate):
+    key = next(iter(predicate))
+    return SELECTIVITY.index(key) if key in SELECTIVITY else len(SELECTIVITY)
+
+
+class _Compiler:
+    def __init__(self, user_id, notebooks_collection, target):
+        self.user_id = user_id
+        self.notebooks_collection = notebooks_collection
+        self.target = target
+        self.notebook_ids = {}
+
+    def _notebooks(self, value):
+        """Ids of the user's notebooks named value (case-insensitive) or with that id"""
+        if value not in self.notebook_ids:
+            alternatives = [{"name": {"$regex": f"^{re.escape(value)}$", "$options": "i"}}]
+            if ObjectId.is_valid(value):
+                alternatives.append({"_id": ObjectId(value)})
+            found = self.notebooks_collection.find({**owner(self.user_id), "$or": alternatives}, {"_id": 1})
+            self.notebook_ids[value] = [doc["_id"] for doc in found]
+        return self.notebook_ids[value]
+
+    def predicate(self, node, group):
+        """MongoDB predicate of node for group, None for always true, NEVER for never"""
+        if isinstance(node, Group):
+            parts = [self.predicate(child, group) for child in node.children]
+            if node.operator == "AND":
+                parts = [part for part in parts if part is not None]
+                if NEVER in parts:
+                    return NEVER
+                return parts[0] if len(parts) == 1 else ({"$and": parts} if parts else None)
+            if None in parts:
+                return None
+            parts = [part for part in parts if part != NEVER]
+            return {"$or": parts} if parts else NEVER
+
+        if isinstance(node, Term):
+            predicate = _text_predicate(node, group)
+            if predicate is None:
+                predicate = NEVER
+        elif isinstance(node, Filter) and node.field == "label":
+            predicate = {"labels": node.value}
+        elif isinstance(node, Filter):
+            ids = self._notebooks(node.value)
+            if group == "notebooks":
+                predicate = {"_id": {"$in": ids}}
+            else:
+                predicate = {"notebook_id": {"$in": match_any(ids)}}
+        else:
+            bounds = {}
+            if node.start:
+                bounds["$gte"] = node.start
+            if node.end:
+                bounds["$lt"] = node.end
+            predicate = {DATE_FIELDS[node.field]: bounds}
+
+        if node.negated:
+            if predicate == NEVER:
+                return None
+            return _negate(predicate)
+        return predicate
+
+    def compile(self, tree):
+        words, labels, rest = [], [], []
+        for clause in tree.children:
+            if isinstance(clause, Term) and not clause.negated:
+                # Ranked like a normal search, and implied by the field or phrase predicate
+                words.append(f'"{clause.value}"' if clause.phrase and self.target == "mongo" else clause.value)
+                if clause.field or (clause.phrase and self.target != "mongo"):
+                    rest.append(clause)
+            elif isinstance(clause, Term) and self.target == "mongo" and not clause.field:
+                # $text understands exclusions when it has something to search for
+                rest.append(clause)
+            elif isinstance(clause, Filter) and clause.field == "label" and not clause.negated:
+                labels.append(clause.value)
+            else:
+                rest.append(clause)
+
+        filters = {group: [] for group in GROUPS}
+        for clause in rest:
+            if self.target == "mongo" and words and isinstance(clause, Term) and clause.negated and not clause.field:
+                words.append(f'-"{clause.value}"' if clause.phrase else f"-{clause.value}")
+                continue
+            for group in GROUPS:
+                predicate = self.predicate(clause, group)
+                if predicate is not None:
+                    filters[group].append(predicate)
+        for group in GROUPS:
+            if NEVER in filters[group]:
+                filters[group] = [NEVER]
+            filters[group].sort(key=_selectivity)
+        return CompiledQuery(" ".join(words), labels, filters, self.target)
+
+
+def compile_query(tree, user_id, notebooks_collection, target="mongo"):
+    """
+    Compile a parsed query. target "mongo" puts words, phrases and exclusions in
+    $text; other backends only get the words to rank and everything else as filters.
+    """
+    return _Compiler(user_id, notebooks_collection, target).compile(tree)
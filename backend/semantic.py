@@ -0,0 +1,536 @@
+import logging
+import math
+import threading
+import zlib
+from collections import OrderedDict
+from functools import lru_cache
+
+from bson import ObjectId
+
+from events import DELETED
+from references import id_string, owner
+from search import NOTE_PROJECTION, RESULT_LIMITS, SearchBackend
+from search_query import NEVER
+from tokenizer import tokenize
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional, semantic search is unavailable without it
+    np = None
+
+'''
+The code in this file adds semantic search (mode=semantic on the search
+endpoint), finding notes that are about the query even when they use other words.
+
+Notes are turned into vectors with latent semantic analysis: hashed TF-IDF term
+counts projected onto the main directions of the user's own notes (a randomized
+SVD, all in NumPy). Words used in similar notes end up close together, so
+"car" also finds notes about "vehicles" when the two appear in the same contexts.
+Vectors are stored as float16 rows, one matrix per user, and compared with the
+query by dot product; large matrices are split into clusters (an IVF index) so
+only the closest clusters are scanned.
+
+Semantic scores are blended with the keyword scores of the configured search
+backend. The vectors live in memory: they are built on a user's first semantic
+search and updated by the note endpoints through the events bus.
+'''
+
+logger = logging.getLogger(__name__)
+
+# Hashed term features and size of the semantic vectors
+BUCKETS = 2 ** 13
+DIMENSIONS = 64
+
+# Notes used to fit the projection, and when to refit as the collection grows
+FIT_SAMPLE = 2000
+REFIT_GROWTH = 2.0
+REFIT_MIN_NEW = 16
+
+# Users with more notes than this get an IVF index
+IVF_MIN_ROWS = 20000
+IVF_PROBES = 8
+
+# Users with more notes than this are indexed in the background
+SYNC_BUILD_LIMIT = 2000
+
+# Notes taken from each ranking before blending, and the weight of the keyword score
+CANDIDATES = 50
+KEYWORD_WEIGHT = 0.5
+MIN_SIMILARITY = 0.1
+
+# Vectors converted to float32 at a time when scanning, and notes transformed at a time
+ROW_CHUNK = 16384
+TRANSFORM_CHUNK = 1024
+DENSE_BLOCK = 256
+
+
+def available():
+    return np is not None
+
+
+@lru_cache(maxsize=262144)
+def _bucket(term):
+    """Hashed feature index and sign of a term, the sign keeps collisions from adding up"""
+    value = zlib.crc32(term.encode("utf-8"))
+    return value % BUCKETS, 1.0 if value & 0x80000000 else -1.0
+
+
+def hashed_features(title, content):
+    """Sparse (indices, values) of sublinear term counts, title words counted twice"""
+    counts = {}
+    for weight, text in ((2, title), (1, content)):
+        for term in tokenize(text or ""):
+            counts[term] = counts.get(term, 0) + weight
+    features = {}
+    for term, count in counts.items():
+        index, sign = _bucket(term)
+        features[index] = features.get(index, 0.0) + sign * (1.0 + math.log(count))
+    indices = np.fromiter(features.keys(), dtype=np.int32, count=len(features))
+    values = np.fromiter(features.values(), dtype=np.float32, count=len(features))
+    return indices, values
+
+
+class SparseRows:
+    """Rows of hashed features in CSR layout, multiplied in dense blocks"""
+
+    def __init__(self, rows):
+        self.count = len(rows)
+        self.lengths = np.array([len(indices) for indices, _ in rows], dtype=np.int64)
+        self.indptr = np.zeros(self.count + 1, dtype=np.int64)
+        np.cumsum(self.lengths, out=self.indptr[1:])
+        self.indices = np.concatenate([indices for indices, _ in rows]) if rows else np.zeros(0, np.int32)
+        self.values = np.concatenate([values for _, values in rows]) if rows else np.zeros(0, np.float32)
+
+    def scale_columns(self, weights):
+        self.values = self.values * weights[self.indices]
+
+    def normalize_rows(self):
+        squares = np.zeros(self.count, dtype=np.float32)
+        np.add.at(squares, np.repeat(np.arange(self.count), self.lengths), self.values ** 2)
+        norms = np.sqrt(squares)
+        norms[norms == 0] = 1.0
+        self.values = self.values / np.repeat(norms, self.lengths)
+
+    def blocks(self):
+        """(start, end, dense block) of DENSE_BLOCK rows at a time"""
+        for start in range(0, self.count, DENSE_BLOCK):
+            end = min(start + DENSE_BLOCK, self.count)
+            block = np.zeros((end - start, BUCKETS), dtype=np.float32)
+            first, last = self.indptr[start], self.indptr[end]
+            block[np.repeat(np.arange(end - start), self.lengths[start:end]), self.indices[first:last]] = \
+                self.values[first:last]
+            yield start, end, block
+
+    def dot(self, matrix):
+        """rows @ matrix, matrix has BUCKETS rows"""
+        result = np.empty((self.count, matrix.shape[1]), dtype=np.float32)
+        for start, end, block in self.blocks():
+            result[start:end] = block @ matrix
+        return result
+
+    def transpose_dot(self, matrix):
+        """rows.T @ matrix, matrix has one row per stored row"""
+        result = np.zeros((BUCKETS, matrix.shape[1]), dtype=np.float32)
+        for start, end, block in self.blocks():
+            result += block.T @ matrix[start:end]
+        return result
+
+
+class LsaModel:
+    """TF-IDF weights and SVD projection fitted on a sample of one user's notes"""
+
+    def __init__(self, idf, components):
+        self.idf = idf
+        self.components = components
+
+    @classmethod
+    def fit(cls, rows, dimensions=DIMENSIONS, seed=0):
+        sparse = SparseRows(rows)
+        document_frequency = np.bincount(sparse.indices, minlength=BUCKETS)
+        idf = (np.log((1 + sparse.count) / (1 + document_frequency)) + 1).astype(np.float32)
+        sparse.scale_columns(idf)
+        sparse.normalize_rows()
+
+        # Randomized SVD with two power iterations. Small collections get fewer
+        # dimensions, a full rank projection would only reproduce exact word matches
+        rank = max(1, min(dimensions, sparse.count, 2 * int(math.sqrt(sparse.count))))
+        rng = np.random.default_rng(seed)
+        sketch = sparse.dot(rng.standard_normal((BUCKETS, rank + 8)).astype(np.float32))
+        for _ in range(2):
+            basis, _ = np.linalg.qr(sketch)
+            basis, _ = np.linalg.qr(sparse.transpose_dot(basis))
+            sketch = sparse.dot(basis)
+        basis, _ = np.linalg.qr(sketch)
+        small = sparse.transpose_dot(basis).T
+        _, _, vt = np.linalg.svd(small, full_matrices=False)
+        return cls(idf, np.ascontiguousarray(vt[:rank].T, dtype=np.float32))
+
+    def transform(self, rows):
+        """Unit length semantic vectors (float32) of hashed feature rows"""
+        sparse = SparseRows(rows)
+        sparse.scale_columns(self.idf)
+        sparse.normalize_rows()
+        vectors = sparse.dot(self.components)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+
+class VectorIndex:
+    """float16 matrix of one user's note vectors, with an optional IVF index"""
+
+    def __init__(self, model, dimensions):
+        self.model = model
+        self.lock = threading.RLock()
+        self.vectors = np.zeros((64, dimensions), dtype=np.float16)
+        self.ids = []
+        self.parents = []
+        self.rows = {}
+        self.fitted_rows = 0
+        self.centroids = None
+        self.assignments = np.zeros(64, dtype=np.int32)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _grow(self):
+        capacity = len(self.vectors) * 2
+        vectors = np.zeros((capacity, self.vectors.shape[1]), dtype=np.float16)
+        vectors[:len(self.ids)] = self.vectors[:len(self.ids)]
+        assignments = np.zeros(capacity, dtype=np.int32)
+        assignments[:len(self.ids)] = self.assignments[:len(self.ids)]
+        self.vectors, self.assignments = vectors, assignments
+
+    def upsert(self, note_id, vector, notebook_id, section_id):
+        row = self.rows.get(note_id)
+        if row is None:
+            if len(self.ids) == len(self.vectors):
+                self._grow()
+            row = len(self.ids)
+            self.ids.append(note_id)
+            self.parents.append((notebook_id, section_id))
+            self.rows[note_id] = row
+        else:
+            previous_notebook, previous_section = self.parents[row]
+            self.parents[row] = (notebook_id or previous_notebook, section_id or previous_section)
+        self.vectors[row] = vector
+        if self.centroids is not None:
+            self.assignments[row] = int(np.argmax(self.centroids @ vector))
+
+    def remove(self, note_id):
+        row = self.rows.pop(note_id, None)
+        if row is None:
+            return
+        last = len(self.ids) - 1
+        if row != last:
+            # Move the last row into the hole so the matrix stays dense
+            moved = self.ids[last]
+            self.vectors[row] = self.vectors[last]
+            self.assignments[row] = self.assignments[last]
+            self.ids[row] = moved
+            self.parents[row] = self.parents[last]
+            self.rows[moved] = row
+        self.ids.pop()
+        self.parents.pop()
+
+    def remove_children(self, notebook_id=None, section_id=None):
+        position = 0 if notebook_id is not None else 1
+        parent = notebook_id if notebook_id is not None else section_id
+        for note_id in [self.ids[row] for row, parents in enumerate(self.parents) if parents[position] == parent]:
+            self.remove(note_id)
+
+    def reparent(self, notebook_id, section_id=None, note_id=None):
+        """New parents of a moved note, or of every note of a moved section"""
+        if note_id is not None:
+            row = self.rows.get(note_id)
+            if row is not None:
+                self.parents[row] = (notebook_id, section_id)
+            return
+        for row, parents in enumerate(self.parents):
+            if parents[1] == section_id:
+                self.parents[row] = (notebook_id, section_id)
+
+    def train_ivf(self, seed=0, iterations=8):
+        """Cluster the vectors with k-means so queries scan only the nearest clusters"""
+        count = len(self.ids)
+        lists = max(1, int(math.sqrt(count)))
+        rng = np.random.default_rng(seed)
+        sample = self.vectors[rng.choice(count, size=min(count, lists * 32), replace=False)].astype(np.float32)
+        centroids = sample[rng.choice(len(sample), size=lists, replace=False)]
+        for _ in range(iterations):
+            nearest = np.argmax(sample @ centroids.T, axis=1)
+            for cluster in range(lists):
+                members = sample[nearest == cluster]
+                if len(members):
+                    centroid = members.mean(axis=0)
+                    centroids[cluster] = centroid / (np.linalg.norm(centroid) or 1.0)
+        assignments = np.empty(count, dtype=np.int32)
+        for start in range(0, count, ROW_CHUNK):
+            chunk = self.vectors[start:min(start + ROW_CHUNK, count)].astype(np.float32)
+            assignments[start:start + ROW_CHUNK] = np.argmax(chunk @ centroids.T, axis=1)
+        self.assignments[:count] = assignments
+        self.centroids = centroids
+
+    def query(self, vector, limit):
+        """Best (similarity, note id) pairs for a unit query vector"""
+        count = len(self.ids)
+        if not count:
+            return []
+        if self.centroids is not None:
+            probes = np.argsort(self.centroids @ vector)[-IVF_PROBES:]
+            rows = np.flatnonzero(np.isin(self.assignments[:count], probes))
+            scores = self.vectors[rows].astype(np.float32) @ vector
+        else:
+            rows = None
+            # float16 arithmetic is slow on most CPUs, convert chunk by chunk
+            scores = np.concatenate([
+                self.vectors[start:min(start + ROW_CHUNK, count)].astype(np.float32) @ vector
+                for start in range(0, count, ROW_CHUNK)
+            ])
+        limit = min(limit, len(scores))
+        if not limit:
+            return []
+        best = np.argpartition(-scores, limit - 1)[:limit]
+        best = best[np.argsort(-scores[best])]
+        return [
+            (float(scores[i]), self.ids[rows[i] if rows is not None else i])
+            for i in best
+        ]
+
+
+class SemanticSearch(SearchBackend):
+    """Blends keyword results of another backend with semantic similarity of notes"""
+
+    name = "semantic"
+
+    def __init__(self, keyword_backend, get_collections=None, max_users=16):
+        # Callable returning the keyword backend, which can be replaced while running
+        self.keyword_backend = keyword_backend
+        self.get_collections = get_collections
+        self.max_users = max_users
+        self._lock = threading.Lock()
+        self._users = OrderedDict()
+        # Per user, the events received by each build in progress, replayed before it is stored
+        self._building = {}
+
+    # --- Index lifecycle ---
+
+    def _start_build(self, user_id):
+        """Buffer the user's events for a new index, call with the lock held"""
+        pending = []
+        self._building.setdefault(user_id, []).append(pending)
+        return pending
+
+    def _end_build(self, user_id, pending):
+        """Stop buffering for a build, call with the lock held"""
+        buffers = [buffer for buffer in self._building.get(user_id, ()) if buffer is not pending]
+        if buffers:
+            self._building[user_id] = buffers
+        else:
+            self._building.pop(user_id, None)
+
+    def _store(self, user_id, index, pending):
+        """
+        Replace the user's index with a new one, after applying the events that
+        arrived while its notes were read, so none are lost with the old index
+        """
+        rebuild = False
+        while True:
+            with self._lock:
+                events = pending[:]
+                del pending[:]
+                if not events:
+                    # Swapped under the same lock handle_event buffers with, no event falls in between
+                    self._end_build(user_id, pending)
+                    self._users[user_id] = index
+                    self._users.move_to_end(user_id)
+                    while len(self._users) > self.max_users:
+                        self._users.popitem(last=False)
+                    break
+            for event in events:
+                rebuild = self._apply(index, event) or rebuild
+        if rebuild:
+            self._build_in_background(user_id, self.get_collections())
+
+    def build(self, user_id, collections, pending=None):
+        """Fit the projection on the user's notes and index all of them"""
+        if pending is None:
+            with self._lock:
+                pending = self._start_build(user_id)
+        try:
+            index = self._fit(user_id, collections)
+        except Exception:
+            with self._lock:
+                self._end_build(user_id, pending)
+            raise
+        self._store(user_id, index, pending)
+        return index
+
+    def _fit(self, user_id, collections):
+        notes_collection = collections[2]
+        ids, parents, rows = [], [], []
+        for note in notes_collection.find(
+            owner(user_id), {"title": 1, "content": 1, "notebook_id": 1, "section_id": 1}
+        ):
+            ids.append(str(note["_id"]))
+            parents.append((id_string(note.get("notebook_id")), id_string(note.get("section_id"))))
+            rows.append(hashed_features(note.get("title"), note.get("content")))
+
+        sample = rows
+        if len(rows) > FIT_SAMPLE:
+            rng = np.random.default_rng(0)
+            sample = [rows[i] for i in rng.choice(len(rows), size=FIT_SAMPLE, replace=False)]
+        model = LsaModel.fit(sample) if rows else None
+        index = VectorIndex(model, model.components.shape[1] if model else DIMENSIONS)
+        for start in range(0, len(rows), TRANSFORM_CHUNK):
+            vectors = model.transform(rows[start:start + TRANSFORM_CHUNK])
+            for offset, vector in enumerate(vectors):
+                notebook_id, section_id = parents[start + offset]
+                index.upsert(ids[start + offset], vector, notebook_id, section_id)
+        index.fitted_rows = len(rows)
+        if len(rows) >= IVF_MIN_ROWS:
+            index.train_ivf()
+        return index
+
+    def _build_in_background(self, user_id, collections):
+        with self._lock:
+            if self._building.get(user_id):
+                return
+            pending = self._start_build(user_id)
+
+        def run():
+            try:
+                self.build(user_id, collections, pending)
+            except Exception:
+                logger.exception("Building semantic index for %s failed", user_id)
+
+        threading.Thread(target=run, name="semantic-index-build", daemon=True).start()
+
+    def index(self, user_id, collections, wait=False):
+        """Vector index of user_id, None while a large index is built in the background"""
+        with self._lock:
+            index = self._users.get(user_id)
+            if index is not None:
+                self._users.move_to_end(user_id)
+        if index is not None and index.model is not None:
+            # Refit once the notes have grown well past what the projection learned from,
+            # the current index keeps answering meanwhile
+            if len(index) > index.fitted_rows * REFIT_GROWTH + REFIT_MIN_NEW:
+                self._build_in_background(user_id, collections)
+            return index
+        # Users without notes when the index was built have no projection yet, build again
+        if wait or collections[2].count_documents(owner(user_id), limit=SYNC_BUILD_LIMIT + 1) <= SYNC_BUILD_LIMIT:
+            return self.build(user_id, collections)
+        self._build_in_background(user_id, collections)
+        return None
+
+    def handle_event(self, event):
+        with self._lock:
+            index = self._users.get(event.user_id)
+            # Indexes being built read a snapshot of the notes, they get the event before replacing this one
+            for pending in self._building.get(event.user_id, ()):
+                pending.append(event)
+        if index is not None and self._apply(index, event):
+            self._build_in_background(event.user_id, self.get_collections())
+
+    def _apply(self, index, event):
+        """Apply an event to index, True when it needs a rebuild from MongoDB"""
+        with index.lock:
+            if event.kind == "note":
+                if event.action == DELETED:
+                    index.remove(event.doc_id)
+                elif "title" in event.fields or "content" in event.fields:
+                    if index.model is None:
+                        # First note of the user, fitted on the next search
+                        return False
+                    fields = event.fields
+                    if ("title" not in fields or "content" not in fields) and self.get_collections is not None:
+                        # Partial update, the vector needs the whole note
+                        fields = self.get_collections()[2].find_one(
+                            {"_id": ObjectId(event.doc_id)}, {"title": 1, "content": 1}
+                        ) or fields
+                    vector = index.model.transform([hashed_features(fields.get("title"), fields.get("content"))])[0]
+                    index.upsert(event.doc_id, vector, id_string(event.fields.get("notebook_id")),
+                                 id_string(event.fields.get("section_id")))
+                elif "section_id" in event.fields:
+                    # Moved, the vector stays the same
+                    index.reparent(id_string(event.fields.get("notebook_id")),
+                                   id_string(event.fields["section_id"]), note_id=event.doc_id)
+            elif event.kind == "section" and event.action == DELETED:
+                index.remove_children(section_id=event.doc_id)
+            elif event.kind == "section" and "notebook_id" in event.fields:
+                index.reparent(id_string(event.fields["notebook_id"]), section_id=event.doc_id)
+            elif event.kind == "notebook" and event.action == DELETED:
+                index.remove_children(notebook_id=event.doc_id)
+            elif event.kind == "notebook" and "copied_from" in event.fields and self.get_collections is not None:
+                # The copied notes are only in MongoDB, the current vectors answer until the rebuild is done
+                return True
+        return False
+
+    # --- Queries ---
+
+    def search(self, user_id, query, labels, collections, fuzzy=False, limits=None, filters=None):
+        limits = limits or RESULT_LIMITS
+        keyword_limits = dict(limits, notes=max(limits["notes"], CANDIDATES))
+        results = self.keyword_backend().search(user_id, query, labels, collections, fuzzy=fuzzy,
+                                                limits=keyword_limits, filters=filters)
+        note_filters = (filters or {}).get("notes")
+
+        index = self.index(user_id, collections)
+        if index is None or index.model is None:
+            results["notes"] = results["notes"][:limits["notes"]]
+            return results
+        with index.lock:
+            vector = index.model.transform([hashed_features(query, "")])[0]
+            similar = index.query(vector, CANDIDATES)
+
+        notes = {str(note["_id"]): note for note in results["notes"]}
+        keyword_scores = {note_id: note.get("score", 0.0) for note_id, note in notes.items()}
+        top_keyword = max(
+            [doc.get("score", 0.0) for group in ("notebooks", "sections") for doc in results[group]]
+            + list(keyword_scores.values()),
+            default=0.0,
+        ) or 1.0
+        # Notebooks and sections only have a keyword score, on the same scale as the notes
+        for group in ("notebooks", "sections"):
+            for doc in results[group]:
+                doc["score"] = round(KEYWORD_WEIGHT * doc.get("score", 0.0) / top_keyword, 4)
+        similarities = {note_id: similarity for similarity, note_id in similar if similarity >= MIN_SIMILARITY}
+
+        missing = [ObjectId(note_id) for note_id in similarities if note_id not in notes and ObjectId.is_valid(note_id)]
+        if missing and note_filters != [NEVER]:
+            filter_query = {"_id": {"$in": missing}, **owner(user_id)}
+            if labels:
+                filter_query["labels"] = {"$all": labels}
+            if note_filters:
+                filter_query["$and"] = note_filters
+            for note in collections[2].find(filter_query, NOTE_PROJECTION):
+                notes[str(note["_id"])] = note
+
+        blended = []
+        for note_id, note in notes.items():
+            similarity = similarities.get(note_id, 0.0)
+            score = KEYWORD_WEIGHT * keyword_scores.get(note_id, 0.0) / top_keyword + (1 - KEYWORD_WEIGHT) * similarity
+            note["score"] = round(score, 4)
+            note["semantic_score"] = round(similarity, 4)
+            blended.append((score, note_id))
+        blended.sort(reverse=True)
+        results["notes"] = [notes[note_id] for _, note_id in blended[:limits["notes"]]]
+        return results
+
+    def ready(self, user_id):
+        """Whether searches of user_id are ranked semantically, False while the index is built"""
+        with self._lock:
+            index = self._users.get(user_id)
+        return index is not None and index.model is not None
+
+    def faceted_search(self, user_id, query, labels, collections, fuzzy=False, limits=None, offsets=None,
+                       filters=None):
+        # Counts and deeper pages are only defined for keyword matches
+        return self.keyword_backend().faceted_search(
+            user_id, query, labels, collections, fuzzy=fuzzy, limits=limits, offsets=offsets, filters=filters
+        )
+
+    def close(self):
+        with self._lock:
+            self._users.clear()
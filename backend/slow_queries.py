@@ -0,0 +1,298 @@
+import json
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict
+from logging.handlers import RotatingFileHandler
+
+from flask import jsonify
+from pymongo import monitoring
+
+from admin import admin_required
+
+'''
+The code in this file logs database operations slower than a configurable
+threshold. Each distinct query shape (the filter with its values redacted) is
+explained once in a background thread so COLLSCANs, in-memory sorts and large
+document fetches can be told apart without reproducing the request.
+'''
+
+# Commands that carry a query we can explain
+EXPLAINABLE_COMMANDS = {"find", "aggregate", "count", "distinct", "findAndModify", "update", "delete"}
+
+# Driver and session fields that must not be sent back inside an explain
+DRIVER_FIELDS = {
+    "lsid", "$db", "$clusterTime", "$readPreference", "txnNumber", "autocommit",
+    "startTransaction", "readConcern", "writeConcern", "maxTimeMS", "comment", "apiVersion",
+}
+
+# Databases whose internal traffic is never interesting
+IGNORED_DATABASES = {"admin", "config", "local"}
+
+# Command parts that describe the query shape rather than user data
+SHAPE_KEYS = {"sort", "projection", "hint"}
+
+
+def redact(value):
+    """Replace every literal in a query with "?" while keeping operators and field names"""
+    if isinstance(value, dict):
+        return {key: redact(value[key]) for key in value}
+    if isinstance(value, (list, tuple)):
+        # Collapse lists so $in with 2 or 200 values has the same shape
+        shapes = []
+        for item in value:
+            shape = redact(item)
+            if shape not in shapes:
+                shapes.append(shape)
+        return shapes
+    return "?"
+
+
+def query_shape(command_name, command):
+    """Extract the redacted parts of a command that determine how it is planned"""
+    if command_name == "find":
+        parts = {key: command.get(key) for key in ("filter", "sort", "projection", "hint")}
+    elif command_name == "aggregate":
+        parts = {"pipeline": command.get("pipeline")}
+    elif command_name in ("count", "distinct"):
+        parts = {"query": command.get("query"), "key": command.get("key")}
+    elif command_name == "findAndModify":
+        parts = {"query": command.get("query"), "sort": command.get("sort")}
+    elif command_name == "update":
+        parts = {"q": [update.get("q") for update in command.get("updates", [])]}
+    elif command_name == "delete":
+        parts = {"q": [delete.get("q") for delete in command.get("deletes", [])]}
+    else:
+        parts = {}
+    return {key: (value if key in SHAPE_KEYS else redact(value)) for key, value in parts.items() if value is not None}
+
+
+def summarize_explain(explain):
+    """Reduce explain("executionStats") output to the numbers that matter"""
+    stages = []
+
+    def walk_plan(plan):
+        if not isinstance(plan, dict):
+            return
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        walk_plan(plan.get("inputStage"))
+        for child in plan.get("inputStages", []):
+            walk_plan(child)
+        # Slot based engine plans nest the classic plan under queryPlan
+        walk_plan(plan.get("queryPlan"))
+
+    def find_key(doc, key):
+        if isinstance(doc, dict):
+            if key in doc:
+                return doc[key]
+            children = doc.values()
+        elif isinstance(doc, list):
+            children = doc
+        else:
+            return None
+        for child in children:
+            found = find_key(child, key)
+            if found is not None:
+                return found
+        return None
+
+    planner = find_key(explain, "queryPlanner") or {}
+    walk_plan(planner.get("winningPlan"))
+    stats = find_key(explain, "executionStats") or {}
+    summary = {
+        "stages": stages,
+        "collscan": "COLLSCAN" in stages,
+        "in_memory_sort": "SORT" in stages,
+        "n_returned": stats.get("nReturned"),
+        "execution_time_ms": stats.get("executionTimeMillis"),
+        "keys_examined": stats.get("totalKeysExamined"),
+        "docs_examined": stats.get("totalDocsExamined"),
+    }
+    return summary
+
+
+class SlowQueryListener(monitoring.CommandListener):
+    """pymongo command listener recording operations slower than a threshold"""
+
+    def __init__(self, threshold_ms=100, max_shapes=500):
+        self.threshold_ms = threshold_ms
+        self.max_shapes = max_shapes
+        self._client = None
+        self._pending = {}
+        self._shapes = OrderedDict()
+        self._lock = threading.Lock()
+        self._explain_queue = queue.Queue()
+        self._worker = None
+        self._logger = logging.getLogger("slow_queries")
+        self._logger.propagate = False
+        self._handler = None
+
+    def configure(self, threshold_ms, log_path=None, max_bytes=10 * 1024 * 1024, backup_count=5):
+        """Apply app configuration; a negative threshold disables the log"""
+        self.threshold_ms = threshold_ms
+        if self._handler is not None:
+            self._logger.removeHandler(self._handler)
+            self._handler.close()
+            self._handler = None
+        if log_path:
+            self._handler = RotatingFileHandler(log_path, maxBytes=max_bytes, backupCount=backup_count, delay=True)
+            self._handler.setFormatter(logging.Formatter("%(message)s"))
+            self._logger.addHandler(self._handler)
+            self._logger.setLevel(logging.INFO)
+
+    def attach(self, client):
+        """Give the listener the client used to run explains"""
+        self._client = client
+
+    def enabled(self):
+        return self.threshold_ms is not None and self.threshold_ms >= 0
+
+    # --- CommandListener interface ---
+
+    def started(self, event):
+        if not self.enabled() or event.command_name not in EXPLAINABLE_COMMANDS:
+            return
+        if event.database_name in IGNORED_DATABASES:
+            return
+        self._pending[(event.connection_id, event.request_id)] = (event.database_name, event.command)
+
+    def succeeded(self, event):
+        self._finish(event, None)
+
+    def failed(self, event):
+        self._finish(event, event.failure)
+
+    def _finish(self, event, failure):
+        pending = self._pending.pop((event.connection_id, event.request_id), None)
+        if pending is None:
+            return
+        duration_ms = event.duration_micros / 1000.0
+        if duration_ms < self.threshold_ms:
+            return
+        database, command = pending
+        self.record(database, event.command_name, command, duration_ms, failure)
+
+    # --- Recording ---
+
+    def record(self, database, command_name, command, duration_ms, failure=None):
+        collection = command.get(command_name)
+        shape = query_shape(command_name, command)
+        key = json.dumps([database, collection, command_name, shape], sort_keys=True, default=str)
+        now = time.time()
+        with self._lock:
+            entry = self._shapes.get(key)
+            first_seen = entry is None
+            if first_seen:
+                entry = {
+                    "database": database,
+                    "collection": collection,
+                    "command": command_name,
+                    "shape": shape,
+                    "count": 0,
+                    "max_ms": 0.0,
+                    "first_seen": now,
+                    "explain": None,
+                }
+                self._shapes[key] = entry
+                while len(self._shapes) > self.max_shapes:
+                    self._shapes.popitem(last=False)
+            else:
+                self._shapes.move_to_end(key)
+            entry["count"] += 1
+            entry["last_ms"] = duration_ms
+            entry["max_ms"] = max(entry["max_ms"], duration_ms)
+            entry["last_seen"] = now
+        self._write({
+            "event": "slow_query",
+            "timestamp": now,
+            "database": database,
+            "collection": collection,
+            "command": command_name,
+            "duration_ms": round(duration_ms, 3),
+            "shape": shape,
+            "error": str(failure) if failure else None,
+        })
+        if first_seen and self._client is not None:
+            self._explain_queue.put((key, database, command_name, command))
+            self._ensure_worker()
+
+    def _write(self, record):
+        if self._handler is not None:
+            self._logger.info(json.dumps(record, sort_keys=True, default=str))
+
+    # --- Background explains ---
+
+    def _ensure_worker(self):
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._explain_loop, name="slow-query-explain", daemon=True)
+                self._worker.start()
+
+    def _explain_loop(self):
+        while True:
+            key, database, command_name, command = self._explain_queue.get()
+            try:
+                self._explain(key, database, command_name, command)
+            except Exception as e:
+                self._store_explain(key, {"error": str(e)})
+            finally:
+                self._explain_queue.task_done()
+
+    def _explain(self, key, database, command_name, command):
+        if command_name == "aggregate":
+            stages = [next(iter(stage), None) for stage in command.get("pipeline", [])]
+            if "$out" in stages or "$merge" in stages:
+                self._store_explain(key, {"skipped": "pipeline writes output"})
+                return
+        target = {k: v for k, v in command.items() if k not in DRIVER_FIELDS}
+        explain = self._client[database].command({"explain": target, "verbosity": "executionStats"})
+        summary = summarize_explain(explain)
+        self._store_explain(key, summary)
+
+    def _store_explain(self, key, summary):
+        with self._lock:
+            entry = self._shapes.get(key)
+            if entry is not None:
+                entry["explain"] = summary
+                record = {k: entry[k] for k in ("database", "collection", "command", "shape")}
+            else:
+                record = {}
+        record.update({"event": "explain", "timestamp": time.time(), "explain": summary})
+        self._write(record)
+
+    def flush(self, timeout=5.0):
+        """Wait for queued explains to finish (used by tests)"""
+        deadline = time.time() + timeout
+        while self._explain_queue.unfinished_tasks and time.time() < deadline:
+            time.sleep(0.01)
+
+    def snapshot(self):
+        """Slow query shapes, most recently seen first"""
+        with self._lock:
+            entries = [dict(entry) for entry in self._shapes.values()]
+        entries.sort(key=lambda entry: entry["last_seen"], reverse=True)
+        return entries
+
+    def clear(self):
+        with self._lock:
+            self._shapes.clear()
+
+
+# Shared listener instance passed to MongoClient in init_db
+slow_query_listener = SlowQueryListener()
+
+
+def register_slow_query_endpoint(app):
+    """Register the /admin/slow-queries endpoint with the Flask app"""
+
+    @app.route("/admin/slow-queries", methods=["GET"])
+    @admin_required
+    def slow_queries():
+        return jsonify({
+            "threshold_ms": slow_query_listener.threshold_ms,
+            "slow_queries": slow_query_listener.snapshot(),
+        }), 200
@@ -1,4 +1,7 @@
 import os
 import sys
 # We add the parent directory to the path so we can import stuff
-sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
\ No newline at end of file
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+# Database round-trip recorder, see db_ops_plugin.py
+from db_ops_plugin import db_ops  # noqa: E402,F401
@@ -0,0 +1,50 @@
+# Pytest plugin catching routes whose database operation count grows with the data
+import pytest
+import db_budget
+
+
+class DbOpsRecorder:
+    """Records the database operations of every request made while a test runs"""
+
+    def __init__(self):
+        self.requests = []
+
+    def __call__(self, route, method, stats):
+        self.requests.append((f"{method} {route}", stats.ops))
+
+    def measure(self, action):
+        """Run action and return the operation count of each route it requested"""
+        start = len(self.requests)
+        action()
+        counts = {}
+        for route, ops in self.requests[start:]:
+            counts[route] = counts.get(route, 0) + ops
+        return counts
+
+    def assert_constant(self, build, sizes=(1, 5)):
+        """
+        Fail the test when a route needs more operations for a bigger fixture.
+        build(size) prepares the data and returns the action to measure.
+        """
+        measured = {}
+        for size in sizes:
+            action = build(size)
+            measured[size] = self.measure(action)
+        baseline = measured[sizes[0]]
+        for size in sizes[1:]:
+            for route, ops in measured[size].items():
+                if ops > baseline.get(route, 0):
+                    pytest.fail(
+                        f"{route} used {baseline.get(route, 0)} database operations at size {sizes[0]} "
+                        f"but {ops} at size {size}: operation count grows with the data"
+                    )
+        return measured
+
+
+@pytest.fixture
+def db_ops():
+    """Recorder of database operations per route for the duration of a test"""
+    recorder = DbOpsRecorder()
+    db_budget.add_observer(recorder)
+    yield recorder
+    db_budget.remove_observer(recorder)
@@ -0,0 +1,129 @@
+# Testing the ASGI deployment in asgi.py, the Flask tests run against it unchanged
+import pytest
+from bson import ObjectId
+from pymongo import MongoClient
+from app import app
+
+pytest.importorskip("motor")
+pytest.importorskip("a2wsgi")
+pytest.importorskip("httpx")
+starlette_testclient = pytest.importorskip("starlette.testclient")
+
+from asgi import create_app  # noqa: E402
+import test_authentication  # noqa: E402
+import test_notebooks  # noqa: E402
+
+# Use a dedicated test database
+TEST_DB_NAME = "note_app_asgi_test"
+
+USER_ID = "asgi_user"
+BASE = f"/api/users/{USER_ID}/notebooks"
+
+
+class Response:
+    """An httpx response with the attributes the Flask tests read"""
+
+    def __init__(self, response):
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.data = response.content
+        try:
+            self.json = response.json()
+        except ValueError:
+            self.json = None
+
+    def get_json(self):
+        return self.json
+
+
+class FlaskStyleClient:
+    """Starlette's TestClient behind the request methods of Flask's test client"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def open(self, path, method="GET", json=None, data=None, content_type=None, headers=None, query_string=None):
+        headers = dict(headers or {})
+        if content_type:
+            headers["Content-Type"] = content_type
+        return Response(self.client.request(method, path, json=json, content=data, headers=headers,
+                                            params=query_string))
+
+    def get(self, path, **kwargs):
+        return self.open(path, "GET", **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.open(path, "POST", **kwargs)
+
+    def put(self, path, **kwargs):
+        return self.open(path, "PUT", **kwargs)
+
+    def patch(self, path, **kwargs):
+        return self.open(path, "PATCH", **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.open(path, "DELETE", **kwargs)
+
+
+@pytest.fixture(scope="function")
+def client():
+    """ASGI test client using a real test database"""
+    # Configure app for testing
+    app.config["TESTING"] = True
+    app.config["SECRET_KEY"] = "test_secret_key"
+    app.config["MONGO_URI"] = f"mongodb://localhost:27017/{TEST_DB_NAME}"
+
+    # Clean the database before the test
+    mongo_client = MongoClient(app.config["MONGO_URI"])
+    mongo_client.drop_database(TEST_DB_NAME)
+
+    # The lifespan initializes the database
+    with starlette_testclient.TestClient(create_app(app)) as client:
+        yield FlaskStyleClient(client)
+
+    # Clean up after the test
+    mongo_client.drop_database(TEST_DB_NAME)
+    mongo_client.close()
+
+@pytest.fixture
+def flask_client(client):
+    """The Flask app on the same database, to compare answers with"""
+    with app.test_client() as flask_client:
+        yield flask_client
+
+# --- Flask Suite Tests ---
+
+# Collected here, these tests use the ASGI client fixture above
+globals().update({name: test for module in (test_authentication, test_notebooks)
+                  for name, test in vars(module).items() if name.startswith("test_")})
+
+# --- Parity Tests ---
+
+def test_async_reads_match_flask(client, flask_client):
+    """Test: the async views answer exactly like the Flask endpoints"""
+    notebook_id = client.post(BASE, json={"name": "Async", "labels": ["fast"]}).json["notebook"]["_id"]
+    sections = f"{BASE}/{notebook_id}/sections"
+    section_id = client.post(sections, json={"title": "Loops", "labels": ["io"]}).json["section"]["_id"]
+    notes = f"{sections}/{section_id}/notes"
+    for title in ("first", "second", "third"):
+        note_id = client.post(notes, json={"title": title, "content": "await", "labels": [title]}).json["note"]["_id"]
+
+    for url in (BASE, sections, notes, f"{notes}/{note_id}", f"/api/users/{USER_ID}/labels", "/api/users"):
+        response, expected = client.get(url), flask_client.get(url)
+        assert response.status_code == expected.status_code == 200
+        assert response.json == expected.json
+
+def test_async_errors_match_flask(client, flask_client):
+    """Test: missing notes and invalid deadlines are answered the same way"""
+    url = f"{BASE}/{ObjectId()}/sections/{ObjectId()}/notes/{ObjectId()}"
+    assert client.get(url).status_code == flask_client.get(url).status_code == 404
+    headers = {"X-Request-Deadline": "soon"}
+    assert client.get(BASE, headers=headers).status_code == flask_client.get(BASE, headers=headers).status_code == 400
+
+def test_other_routes_reach_flask(client):
+    """Test: endpoints without an async view, and other methods on async paths, are served by Flask"""
+    assert client.get("/api/").json == {"message": "API is running!"}
+    notebook_id = client.post(BASE, json={"name": "Moved"}).json["notebook"]["_id"]
+    assert client.put(f"{BASE}/{notebook_id}", json={"name": "Renamed"}).status_code == 200
+    assert client.get(BASE).json["notebooks"][0]["name"] == "Renamed"
+    assert client.get("/metrics").status_code == 200
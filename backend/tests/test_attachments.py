@@ -0,0 +1,177 @@
+# Testing note attachments stored in GridFS
+import io
+import pytest
+from bson import ObjectId
+from pymongo import MongoClient
+from app import app, init_db
+import app as app_module
+import attachments
+from attachments import BUCKET
+
+# Use a dedicated test database
+TEST_DB_NAME = "note_app_attachments_test"
+
+USER_ID = "attachment_user"
+BASE = f"/api/users/{USER_ID}/notebooks"
+
+# Spans several GridFS chunks
+DATA = bytes(range(256)) * 4096
+
+@pytest.fixture(scope="function")
+def client():
+    """Test client using a real test database"""
+    # Configure app for testing
+    app.config["TESTING"] = True
+    app.config["SECRET_KEY"] = "test_secret_key"
+    app.config["MONGO_URI"] = f"mongodb://localhost:27017/{TEST_DB_NAME}"
+
+    # Clean the database before the test
+    mongo_client = MongoClient(app.config["MONGO_URI"])
+    mongo_client.drop_database(TEST_DB_NAME)
+
+    # Initialize the database
+    init_db(app)
+
+    # Create test client
+    with app.test_client() as client:
+        yield client
+
+    # Clean up after the test
+    app.config["ATTACHMENT_MAX_BYTES"] = 100 * 1024 * 1024
+    mongo_client.drop_database(TEST_DB_NAME)
+    mongo_client.close()
+
+@pytest.fixture
+def section_url(client):
+    notebook_id = client.post(BASE, json={"name": "Lab"}).json["notebook"]["_id"]
+    section_id = client.post(f"{BASE}/{notebook_id}/sections", json={"title": "Results"}).json["section"]["_id"]
+    return f"{BASE}/{notebook_id}/sections/{section_id}"
+
+def create_note(client, section_url, title="Measurements"):
+    return client.post(f"{section_url}/notes", json={"title": title}).json["note"]["_id"]
+
+def upload(client, section_url, note_id, data=DATA, filename="plot.png"):
+    return client.post(f"{section_url}/notes/{note_id}/attachments",
+                       data={"file": (io.BytesIO(data), filename)}, content_type="multipart/form-data")
+
+def stored_files():
+    return app_module.db[f"{BUCKET}.files"].count_documents({})
+
+# --- Upload Tests ---
+
+def test_note_keeps_only_a_reference(client, section_url):
+    """Test: the data goes to GridFS, the note lists the attachment's id, name and size"""
+    note_id = create_note(client, section_url)
+    response = upload(client, section_url, note_id)
+    assert response.status_code == 201
+    attachment = response.json["attachment"]
+    assert attachment["filename"] == "plot.png"
+    assert attachment["content_type"] == "image/png"
+    assert attachment["length"] == len(DATA)
+    assert response.json["deduplicated"] is False
+
+    note = client.get(f"{section_url}/notes/{note_id}").json["note"]
+    assert note["attachments"] == [attachment]
+    assert note["content"] == ""
+
+def test_same_content_is_stored_once(client, section_url):
+    """Test: uploading the same bytes again shares the stored file"""
+    first, second = create_note(client, section_url, "a"), create_note(client, section_url, "b")
+    file_id = upload(client, section_url, first).json["attachment"]["file_id"]
+    response = upload(client, section_url, second, filename="copy.png")
+    assert response.json["deduplicated"] is True
+    assert response.json["attachment"]["file_id"] == file_id
+    assert response.json["attachment"]["filename"] == "copy.png"
+    # Attaching it to the same note again does not add a second reference
+    upload(client, section_url, second)
+    assert len(client.get(f"{section_url}/notes/{second}").json["note"]["attachments"]) == 1
+    assert stored_files() == 1
+
+def test_concurrent_duplicate_keeps_one_copy(client, section_url, monkeypatch):
+    """Test: an upload losing the race to store the same content leaves no chunks behind"""
+    first, second = create_note(client, section_url, "a"), create_note(client, section_url, "b")
+    file_id = upload(client, section_url, first).json["attachment"]["file_id"]
+    chunks = app_module.db[f"{BUCKET}.chunks"].count_documents({})
+
+    find, calls = attachments._find, []
+
+    def find_after_race(db, user_id, **query):
+        # The first upload is stored after the second one checked for it
+        calls.append(query)
+        return None if len(calls) == 1 else find(db, user_id, **query)
+
+    monkeypatch.setattr(attachments, "_find", find_after_race)
+    response = upload(client, section_url, second)
+    assert response.json["deduplicated"] is True
+    assert response.json["attachment"]["file_id"] == file_id
+    assert stored_files() == 1
+    assert app_module.db[f"{BUCKET}.chunks"].count_documents({}) == chunks
+
+def test_upload_errors(client, section_url):
+    """Test: missing notes and files and oversized uploads are rejected"""
+    assert upload(client, section_url, str(ObjectId())).status_code == 404
+    note_id = create_note(client, section_url)
+    response = client.post(f"{section_url}/notes/{note_id}/attachments", data={}, content_type="multipart/form-data")
+    assert response.status_code == 400
+    app.config["ATTACHMENT_MAX_BYTES"] = 1024
+    assert upload(client, section_url, note_id).status_code == 413
+    assert stored_files() == 0
+
+# --- Download Tests ---
+
+def test_download_with_caching_headers(client, section_url):
+    """Test: the file is served with a strong ETag and revalidates to 304"""
+    note_id = create_note(client, section_url)
+    file_id = upload(client, section_url, note_id).json["attachment"]["file_id"]
+    url = f"/api/users/{USER_ID}/attachments/{file_id}"
+
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.data == DATA
+    assert response.headers["Accept-Ranges"] == "bytes"
+    assert "immutable" in response.headers["Cache-Control"]
+    etag = response.headers["ETag"]
+    assert not etag.startswith("W/")
+
+    assert client.get(url, headers={"If-None-Match": etag}).status_code == 304
+    assert client.get(f"/api/users/other_user/attachments/{file_id}").status_code == 404
+    assert client.get(f"/api/users/{USER_ID}/attachments/{ObjectId()}").status_code == 404
+
+def test_download_ranges(client, section_url):
+    """Test: Range requests get exactly the requested bytes"""
+    note_id = create_note(client, section_url)
+    file_id = upload(client, section_url, note_id).json["attachment"]["file_id"]
+    url = f"/api/users/{USER_ID}/attachments/{file_id}"
+
+    # Across a chunk boundary
+    response = client.get(url, headers={"Range": "bytes=261100-261200"})
+    assert response.status_code == 206
+    assert response.data == DATA[261100:261201]
+    assert response.headers["Content-Range"] == f"bytes 261100-261200/{len(DATA)}"
+
+    assert client.get(url, headers={"Range": "bytes=-10"}).data == DATA[-10:]
+    assert client.get(url, headers={"Range": f"bytes={len(DATA)}-"}).status_code == 416
+    # A stale If-Range gets the whole file
+    response = client.get(url, headers={"Range": "bytes=0-9", "If-Range": '"outdated"'})
+    assert response.status_code == 200 and len(response.data) == len(DATA)
+
+# --- Deletion Tests ---
+
+def test_files_are_deleted_with_their_last_note(client, section_url):
+    """Test: shared files stay until no note refers to them"""
+    first, second = create_note(client, section_url, "a"), create_note(client, section_url, "b")
+    file_id = upload(client, section_url, first).json["attachment"]["file_id"]
+    upload(client, section_url, second)
+
+    assert client.delete(f"{section_url}/notes/{first}").status_code == 200
+    assert stored_files() == 1
+    assert client.delete(f"{section_url}/notes/{second}/attachments/{file_id}").status_code == 200
+    assert client.get(f"{section_url}/notes/{second}").json["note"]["attachments"] == []
+    assert stored_files() == 0
+    assert app_module.db[f"{BUCKET}.chunks"].count_documents({}) == 0
+
+def test_section_delete_releases_files(client, section_url):
+    """Test: deleting a section deletes the files of its notes"""
+    upload(client, section_url, create_note(client, section_url))
+    assert client.delete(section_url).status_code == 200
+    assert stored_files() == 0
@@ -0,0 +1,104 @@
+# Testing response compression
+import gzip
+import zlib
+import pytest
+from pymongo import MongoClient
+import compression
+from app import app, init_db
+
+# Use a dedicated test database
+TEST_DB_NAME = "note_app_compression_test"
+
+@pytest.fixture(scope="function")
+def client():
+    """Test client using a real test database"""
+    # Configure app for testing
+    app.config["TESTING"] = True
+    app.config["SECRET_KEY"] = "test_secret_key"
+    app.config["MONGO_URI"] = f"mongodb://localhost:27017/{TEST_DB_NAME}"
+
+    # Clean the database before the test
+    mongo_client = MongoClient(app.config["MONGO_URI"])
+    mongo_client.drop_database(TEST_DB_NAME)
+
+    # Initialize the database
+    init_db(app)
+
+    # Create test client
+    with app.test_client() as client:
+        yield client
+
+    # Clean up after the test
+    app.config["COMPRESS_ALGORITHMS"] = ("br", "zstd", "gzip")
+    mongo_client.drop_database(TEST_DB_NAME)
+    mongo_client.close()
+
+def create_large_section(client, user_id, notes=20):
+    """Create a section whose note listing is well above the size threshold"""
+    nb_response = client.post(f"/api/users/{user_id}/notebooks", json={"name": "Compression Notebook"})
+    notebook_id = nb_response.json["notebook"]["_id"]
+    section_response = client.post(
+        f"/api/users/{user_id}/notebooks/{notebook_id}/sections", json={"title": "Compression Section"}
+    )
+    section_id = section_response.json["section"]["_id"]
+    for i in range(notes):
+        client.post(
+            f"/api/users/{user_id}/notebooks/{notebook_id}/sections/{section_id}/notes",
+            json={"title": f"Note {i}", "content": "# Heading\n\nSome *markdown* content. " * 20}
+        )
+    return f"/api/users/{user_id}/notebooks/{notebook_id}/sections/{section_id}/notes"
+
+# --- Endpoint Tests ---
+
+def test_large_response_is_gzipped(client):
+    """Test: large responses are compressed when the client accepts gzip"""
+    app.config["COMPRESS_ALGORITHMS"] = ("gzip",)
+    url = create_large_section(client, "gzip_user")
+
+    plain = client.get(url)
+    compressed = client.get(url, headers={"Accept-Encoding": "gzip, deflate"})
+
+    assert compressed.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in compressed.headers["Vary"]
+    assert len(compressed.data) < len(plain.data) / 3
+    assert gzip.decompress(compressed.data) == plain.data
+
+def test_no_accept_encoding_is_not_compressed(client):
+    """Test: clients that do not advertise an encoding get plain responses"""
+    url = create_large_section(client, "plain_user")
+    response = client.get(url)
+    assert "Content-Encoding" not in response.headers
+    assert len(response.json["notes"]) == 20
+
+def test_small_response_is_not_compressed(client):
+    """Test: bodies under the minimum size are sent as they are"""
+    response = client.get("/api/", headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in response.headers
+    assert response.json["message"] == "API is running!"
+
+def test_brotli_preferred_when_available(client):
+    """Test: brotli is chosen over gzip when both are accepted"""
+    if compression.brotli is None:
+        pytest.skip("brotli is not installed")
+    url = create_large_section(client, "brotli_user")
+    response = client.get(url, headers={"Accept-Encoding": "gzip, br"})
+    assert response.headers["Content-Encoding"] == "br"
+    assert compression.brotli.decompress(response.data) == client.get(url).data
+
+# --- Negotiation Tests ---
+
+def test_choose_encoding_respects_q_values():
+    """Test: encodings with q=0 are never chosen"""
+    assert compression.choose_encoding("gzip;q=0, identity", ("gzip",)) is None
+    assert compression.choose_encoding("*", ("gzip",)) == "gzip"
+    assert compression.choose_encoding("", ("gzip",)) is None
+
+def test_compress_stream_flushes_each_chunk():
+    """Test: streamed chunks are decodable as they arrive and together form the full body"""
+    chunks = ["data: first\n\n", "data: second\n\n"]
+    encoder = compression.GzipEncoder(6)
+    output = list(compression.compress_stream(iter(chunks), encoder))
+
+    decoder = zlib.decompressobj(31)
+    assert decoder.decompress(output[0]) == b"data: first\n\n"
+    assert gzip.decompress(b"".join(output)) == "".join(chunks).encode("utf-8")
@@ -0,0 +1,92 @@
+# Testing the MongoDB connection manager and health endpoint
+import pytest
+from pymongo import MongoClient
+from app import app, init_db
+from database import connection_manager, pool_options
+
+# Use a dedicated test database
+TEST_DB_NAME = "note_app_database_test"
+
+@pytest.fixture(scope="function")
+def client():
+    """Test client using a real test database"""
+    # Configure app for testing
+    app.config["TESTING"] = True
+    app.config["SECRET_KEY"] = "test_secret_key"
+    app.config["MONGO_URI"] = f"mongodb://localhost:27017/{TEST_DB_NAME}"
+
+    # Clean the database before the test
+    mongo_client = MongoClient(app.config["MONGO_URI"])
+    mongo_client.drop_database(TEST_DB_NAME)
+
+    # Initialize the database
+    init_db(app)
+
+    # Create test client
+    with app.test_client() as client:
+        yield client
+
+    # Clean up after the test
+    app.config["MONGO_MAX_POOL_SIZE"] = None
+    app.config["MONGO_MIN_POOL_SIZE"] = None
+    init_db(app)
+    mongo_client.drop_database(TEST_DB_NAME)
+    mongo_client.close()
+
+# --- Client Lifecycle Tests ---
+
+def test_init_db_reuses_client(client):
+    """Test: repeated init_db calls share one MongoClient"""
+    first = connection_manager.client
+    init_db(app)
+    assert connection_manager.client is first
+
+def test_pool_settings_are_applied(client):
+    """Test: changing the pool settings replaces the client with a configured one"""
+    old = connection_manager.client
+    app.config["MONGO_MAX_POOL_SIZE"] = 7
+    app.config["MONGO_MIN_POOL_SIZE"] = 1
+    init_db(app)
+
+    pool = connection_manager.client.options.pool_options
+    assert connection_manager.client is not old
+    assert pool.max_pool_size == 7
+    assert pool.min_pool_size == 1
+
+def test_pool_options_from_config():
+    """Test: only configured settings are passed to MongoClient"""
+    assert pool_options({"MONGO_MAX_POOL_SIZE": None, "MONGO_COMPRESSORS": ""}) == {}
+    assert pool_options({"MONGO_WAIT_QUEUE_TIMEOUT_MS": 500, "MONGO_COMPRESSORS": "zlib"}) == {
+        "waitQueueTimeoutMS": 500, "compressors": "zlib"
+    }
+
+def test_client_rebuilt_after_fork(client):
+    """Test: a forked child builds its own client before serving requests"""
+    parent = connection_manager.client
+    # Simulate what os.register_at_fork runs in the child
+    connection_manager._after_fork()
+    assert connection_manager.needs_reinit()
+
+    response = client.get("/api/health")
+    assert response.status_code == 200
+    assert not connection_manager.needs_reinit()
+    assert connection_manager.client is not parent
+    parent.close()
+
+# --- Health Endpoint Tests ---
+
+def test_health_reports_pool_stats(client):
+    """Test: the health endpoint pings the database and reports pool usage"""
+    client.post("/api/users/health_user/notebooks", json={"name": "Health Notebook"})
+    response = client.get("/api/health")
+    assert response.status_code == 200
+    assert response.json["status"] == "ok"
+    assert response.json["ping_ms"] >= 0
+
+    pool = response.json["pool"]
+    assert pool["connected"] is True
+    assert pool["max_pool_size"] == connection_manager.client.options.pool_options.max_pool_size
+    server = next(iter(pool["servers"].values()))
+    assert server["connections"] >= 1
+    assert server["checkouts"] >= 1
+    assert 0 <= server["utilization"] <= 1
@@ -0,0 +1,106 @@
+# Testing per-request database operation counting and N+1 detection
+import logging
+import pytest
+from pymongo import MongoClient
+from app import app, init_db
+
+# Use a dedicated test database
+TEST_DB_NAME = "note_app_db_budget_test"
+
+@pytest.fixture(scope="function")
+def client():
+    """Test client using a real test database"""
+    # Configure app for testing
+    app.config["TESTING"] = True
+    app.config["SECRET_KEY"] = "test_secret_key"
+    app.config["MONGO_URI"] = f"mongodb://localhost:27017/{TEST_DB_NAME}"
+    app.config["DB_OPS_HEADER"] = True
+
+    # Clean the database before the test
+    mongo_client = MongoClient(app.config["MONGO_URI"])
+    mongo_client.drop_database(TEST_DB_NAME)
+
+    # Initialize the database
+    init_db(app)
+
+    # Create test client
+    with app.test_client() as client:
+        yield client
+
+    # Clean up after the test
+    app.config["DB_OPS_HEADER"] = False
+    app.config["DB_OP_BUDGETS"] = {}
+    mongo_client.drop_database(TEST_DB_NAME)
+    mongo_client.close()
+
+def create_notebook_tree(client, user_id, sections, notes_per_section=1):
+    """Create a notebook with the given number of sections and notes, returning its id"""
+    nb_response = client.post(f"/api/users/{user_id}/notebooks", json={"name": "Budget Notebook"})
+    notebook_id = nb_response.json["notebook"]["_id"]
+    for i in range(sections):
+        section_response = client.post(
+            f"/api/users/{user_id}/notebooks/{notebook_id}/sections", json={"title": f"Section {i}"}
+        )
+        section_id = section_response.json["section"]["_id"]
+        for j in range(notes_per_section):
+            client.post(
+                f"/api/users/{user_id}/notebooks/{notebook_id}/sections/{section_id}/notes",
+                json={"title": f"Note {j}", "content": "Budget content", "labels": ["budget"]}
+            )
+    return notebook_id
+
+# --- Header Tests ---
+
+def test_db_ops_header(client):
+    """Test: responses carry the database operation count when enabled"""
+    response = client.post("/api/users/header_user/notebooks", json={"name": "Header Notebook"})
+    assert response.status_code == 201
+    assert int(response.headers["X-DB-Ops"]) == 1
+    assert int(response.headers["X-DB-Bytes"]) > 0
+
+def test_db_ops_header_disabled(client):
+    """Test: the header is not sent outside debug mode"""
+    app.config["DB_OPS_HEADER"] = False
+    response = client.get("/api/users/header_user/notebooks")
+    assert "X-DB-Ops" not in response.headers
+
+def test_db_budget_warning(client, caplog):
+    """Test: a route going over its budget logs a warning"""
+    app.config["DB_OP_BUDGETS"] = {"GET /api/users/<user_id>/labels": 1}
+    with caplog.at_level(logging.WARNING):
+        client.get("/api/users/budget_user/labels")
+    assert any("budget 1" in record.getMessage() for record in caplog.records)
+
+# --- N+1 Tests ---
+
+def test_delete_notebook_ops_do_not_grow(client, db_ops):
+    """Test: deleting a notebook costs the same number of operations regardless of its size"""
+    def build(size):
+        notebook_id = create_notebook_tree(client, f"cascade_{size}", sections=size)
+        return lambda: client.delete(f"/api/users/cascade_{size}/notebooks/{notebook_id}")
+
+    db_ops.assert_constant(build, sizes=(1, 4))
+
+def test_listing_ops_do_not_grow(client, db_ops):
+    """Test: hierarchy and label listings do not issue a query per document"""
+    def build(size):
+        user_id = f"listing_{size}"
+        notebook_id = create_notebook_tree(client, user_id, sections=size, notes_per_section=size)
+
+        def action():
+            client.get(f"/api/users/{user_id}/notebooks")
+            client.get(f"/api/users/{user_id}/notebooks/{notebook_id}/sections")
+            client.get(f"/api/users/{user_id}/labels")
+        return action
+
+    db_ops.assert_constant(build, sizes=(1, 4))
+
+def test_assert_constant_detects_growth(db_ops):
+    """Test: the plugin fails a test whose operation count grows with the fixture"""
+    def build(size):
+        def action():
+            db_ops.requests.append(("GET /growing", size))
+        return action
+
+    with pytest.raises(pytest.fail.Exception):
+        db_ops.assert_constant(build, sizes=(1, 3))
@@ -0,0 +1,142 @@
+# Testing request deadlines and cancellation of superseded searches
+import pytest
+import search
+from flask import g
+from pymongo import MongoClient
+from pymongo.errors import ExecutionTimeout, OperationFailure
+from app import app, init_db
+from deadlines import INTERRUPTED, LatestQueryWins, parse_deadline, remaining, search_queries
+
+# Use a dedicated test database
+TEST_DB_NAME = "note_app_deadlines_test"
+
+USER_ID = "deadline_user"
+
+@pytest.fixture(scope="function")
+def client():
+    """Test client using a real test database"""
+    # Configure app for testing
+    app.config["TESTING"] = True
+    app.config["SECRET_KEY"] = "test_secret_key"
+    app.config["MONGO_URI"] = f"mongodb://localhost:27017/{TEST_DB_NAME}"
+
+    # Clean the database before the test
+    mongo_client = MongoClient(app.config["MONGO_URI"])
+    mongo_client.drop_database(TEST_DB_NAME)
+
+    # Initialize the database
+    init_db(app)
+
+    # Create test client
+    with app.test_client() as client:
+        yield client
+
+    # Clean up after the test
+    mongo_client.drop_database(TEST_DB_NAME)
+    mongo_client.close()
+
+# --- Deadline Tests ---
+
+def test_parse_deadline():
+    """Test: the header is a positive number of milliseconds"""
+    assert parse_deadline("250") == 250
+    assert parse_deadline("1.5") == 1.5
+    for value in ("0", "-5", "soon", "nan", "inf"):
+        with pytest.raises(ValueError):
+            parse_deadline(value)
+
+def test_client_deadline_shortens_server_deadline():
+    """Test: reads get the smaller of the client and server deadlines"""
+    with app.test_request_context(f"/api/users/{USER_ID}/notebooks", headers={"X-Request-Deadline": "200"}):
+        app.preprocess_request()
+        assert 0 < remaining() <= 0.2
+
+    with app.test_request_context(f"/api/users/{USER_ID}/notebooks", headers={"X-Request-Deadline": "600000"}):
+        app.preprocess_request()
+        assert remaining() <= app.config["REQUEST_DEADLINE_MS"] / 1000
+
+    with app.test_request_context(f"/api/users/{USER_ID}/search?q=python"):
+        app.preprocess_request()
+        assert remaining() <= app.config["SEARCH_DEADLINE_MS"] / 1000
+
+def test_writes_have_no_deadline():
+    """Test: only reads are cut short"""
+    with app.test_request_context(f"/api/users/{USER_ID}/notebooks", method="POST",
+                                  headers={"X-Request-Deadline": "200"}):
+        app.preprocess_request()
+        assert remaining() is None
+
+def test_listings_accept_deadline(client):
+    """Test: listing endpoints work with a deadline and reject malformed ones"""
+    client.post(f"/api/users/{USER_ID}/notebooks", json={"name": "Deadlines"})
+    response = client.get(f"/api/users/{USER_ID}/notebooks", headers={"X-Request-Deadline": "2000"})
+    assert response.status_code == 200
+    assert len(response.json["notebooks"]) == 1
+
+    response = client.get(f"/api/users/{USER_ID}/labels", headers={"X-Request-Deadline": "never"})
+    assert response.status_code == 400
+
+def test_expired_deadline_returns_504(client):
+    """Test: a query stopped by its time limit answers 504"""
+    with app.test_request_context(f"/api/users/{USER_ID}/notebooks", headers={"X-Request-Deadline": "100"}):
+        app.preprocess_request()
+        error = ExecutionTimeout("operation exceeded time limit", 50, {"code": 50})
+        response = app.make_response(app.handle_user_exception(error))
+        assert response.status_code == 504
+
+# --- Latest Query Wins Tests ---
+
+def test_newer_search_cancels_previous():
+    """Test: starting a search marks the user's previous one as cancelled, other users are unaffected"""
+    registry = LatestQueryWins()
+    killed = []
+    registry.kill = lambda user_id, before: killed.append((user_id, before))
+
+    first = registry.start(USER_ID)
+    other = registry.start("other_user")
+    second = registry.start(USER_ID)
+    assert first.cancelled
+    assert not second.cancelled and not other.cancelled
+    # Operations tagged before the newer search started are killed
+    assert killed == [(USER_ID, second.started)]
+    assert second.comment["search_user"] == USER_ID
+
+    registry.finish(first)
+    third = registry.start(USER_ID)
+    assert second.cancelled and not third.cancelled
+
+def test_finished_search_is_not_cancelled():
+    """Test: nothing is killed when the previous search already finished"""
+    registry = LatestQueryWins()
+    killed = []
+    registry.kill = lambda user_id, before: killed.append(user_id)
+    registry.finish(registry.start(USER_ID))
+    registry.start(USER_ID)
+    assert killed == []
+
+def test_superseded_search_returns_409(client, monkeypatch):
+    """Test: a search overtaken by a newer one of the same user answers 409"""
+    original = search.MONGO_SEARCH.search
+
+    def overtaken(*args, **kwargs):
+        # Another search of the same user arrives while this one runs
+        search_queries.finish(search_queries.start(USER_ID))
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(search.MONGO_SEARCH, "search", overtaken)
+    response = client.get(f"/api/users/{USER_ID}/search?labels=work")
+    assert response.status_code == 409
+
+    monkeypatch.setattr(search.MONGO_SEARCH, "search", original)
+    assert client.get(f"/api/users/{USER_ID}/search?labels=work").status_code == 200
+
+def test_killed_operation_returns_409(client):
+    """Test: an operation interrupted by killOp for a newer search answers 409"""
+    with app.test_request_context(f"/api/users/{USER_ID}/search?q=python"):
+        app.preprocess_request()
+        g.search_ticket = search_queries.start(USER_ID)
+        newer = search_queries.start(USER_ID)
+        error = OperationFailure("operation was interrupted", INTERRUPTED)
+        response = app.make_response(app.handle_user_exception(error))
+        assert response.status_code == 409
+        search_queries.finish(newer)
@@ -0,0 +1,126 @@
+# Testing notebook duplication inside MongoDB
+import time
+import pytest
+from bson import ObjectId
+from pymongo import MongoClient
+from app import app, init_db
+import app as app_module
+from duplication import COPY_FIELD, DUPLICATING_FIELD
+from search import reset_search_backend
+
+# Use a dedicated test database
+TEST_DB_NAME = "note_app_duplication_test"
+
+USER_ID = "duplicate_user"
+BASE = f"/api/users/{USER_ID}/notebooks"
+
+@pytest.fixture(scope="function")
+def client(tmp_path):
+    """Test client using a real test database"""
+    # Configure app for testing
+    app.config["TESTING"] = True
+    app.config["SECRET_KEY"] = "test_secret_key"
+    app.config["MONGO_URI"] = f"mongodb://localhost:27017/{TEST_DB_NAME}"
+    app.config["SEARCH_BACKEND"] = "inverted"
+    app.config["SEARCH_INDEX_DIR"] = str(tmp_path)
+    reset_search_backend(app)
+
+    # Clean the database before the test
+    mongo_client = MongoClient(app.config["MONGO_URI"])
+    mongo_client.drop_database(TEST_DB_NAME)
+
+    # Initialize the database
+    init_db(app)
+
+    # Create test client
+    with app.test_client() as client:
+        yield client
+
+    # Clean up after the test
+    app.config["DUPLICATE_BACKGROUND_NOTES"] = 1000
+    reset_search_backend(app)
+    app.config["SEARCH_BACKEND"] = "mongo"
+    mongo_client.drop_database(TEST_DB_NAME)
+    mongo_client.close()
+
+@pytest.fixture
+def notebook_id(client):
+    """A labeled notebook with two sections of two notes each"""
+    notebook_id = client.post(BASE, json={"name": "Physics", "labels": ["course"]}).json["notebook"]["_id"]
+    for section in ("mechanics", "optics"):
+        section_id = client.post(f"{BASE}/{notebook_id}/sections", json={"title": section}).json["section"]["_id"]
+        for number in (1, 2):
+            client.post(f"{BASE}/{notebook_id}/sections/{section_id}/notes",
+                        json={"title": f"{section} {number}", "content": f"{section} lecture {number}"})
+    return notebook_id
+
+def contents(notebook_id):
+    """{section title: [(note title, content)]} of a notebook, checking every note's references"""
+    tree = {}
+    for section in app_module.sections_collection.find({"notebook_id": ObjectId(notebook_id)}):
+        notes = list(app_module.notes_collection.find({"section_id": section["_id"]}).sort("rank", 1))
+        assert all(note["notebook_id"] == ObjectId(notebook_id) for note in notes)
+        tree[section["title"]] = [(note["title"], note["content"]) for note in notes]
+    return tree
+
+# --- Endpoint Tests ---
+
+def test_duplicate_copies_everything(client, notebook_id):
+    """Test: the copy has new ids, the same contents, and points at its own sections"""
+    response = client.post(f"{BASE}/{notebook_id}/duplicate")
+    assert response.status_code == 201
+    copy = response.json["notebook"]
+    assert copy["_id"] != notebook_id
+    assert copy["name"] == "Physics (copy)" and copy["labels"] == ["course"]
+
+    assert contents(copy["_id"]) == contents(notebook_id)
+    assert app_module.notes_collection.count_documents({}) == 8
+    assert app_module.sections_collection.count_documents({COPY_FIELD: {"$exists": True}}) == 0
+
+    # Both notebooks are independent afterwards
+    client.delete(f"{BASE}/{notebook_id}")
+    assert len(contents(copy["_id"])) == 2
+    assert app_module.notes_collection.count_documents({}) == 4
+
+def test_duplicate_with_name(client, notebook_id):
+    """Test: the copy can be given a name"""
+    response = client.post(f"{BASE}/{notebook_id}/duplicate", json={"name": "Physics 2027"})
+    assert response.json["notebook"]["name"] == "Physics 2027"
+
+def test_duplicate_missing_notebook(client):
+    """Test: notebooks that do not exist or belong to someone else are not found"""
+    assert client.post(f"{BASE}/{ObjectId()}/duplicate").status_code == 404
+    notebook_id = client.post(BASE, json={"name": "Private"}).json["notebook"]["_id"]
+    assert client.post(f"/api/users/other_user/notebooks/{notebook_id}/duplicate").status_code == 404
+
+def test_large_notebook_is_duplicated_in_background(client, notebook_id):
+    """Test: above the limit the copy is returned right away and completed by a job"""
+    app.config["DUPLICATE_BACKGROUND_NOTES"] = 2
+    response = client.post(f"{BASE}/{notebook_id}/duplicate", headers={"Idempotency-Key": "copy-1"})
+    assert response.status_code == 202
+    copy = response.json["notebook"]
+    assert copy[DUPLICATING_FIELD] is True
+    job_url = response.headers["Location"]
+
+    # A retried request gets the same copy and job
+    retry = client.post(f"{BASE}/{notebook_id}/duplicate", headers={"Idempotency-Key": "copy-1"})
+    assert retry.json["notebook"]["_id"] == copy["_id"]
+    assert retry.headers["Location"] == job_url
+
+    deadline = time.time() + 5
+    while client.get(job_url).json["job"]["status"] != "succeeded":
+        assert time.time() < deadline
+        time.sleep(0.01)
+    assert client.get(job_url).json["job"]["result"] == {"notebook_id": copy["_id"]}
+    assert DUPLICATING_FIELD not in client.get(BASE).json["notebooks"][1]
+    assert contents(copy["_id"]) == contents(notebook_id)
+    assert app_module.notebooks_collection.count_documents({}) == 2
+
+def test_search_finds_copied_notes(client, notebook_id):
+    """Test: the search index picks up the copied sections and notes"""
+    search = lambda: client.get(f"/api/users/{USER_ID}/search", query_string={"q": "optics"}).json["results"]
+    assert len(search()["notes"]) == 2
+    copy_id = client.post(f"{BASE}/{notebook_id}/duplicate").json["notebook"]["_id"]
+    results = search()
+    assert len(results["notes"]) == 4
+    assert sum(note["notebook_id"] == copy_id for note in results["notes"]) == 2
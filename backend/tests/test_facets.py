@@ -0,0 +1,140 @@
+# Testing faceted and paginated search
+import pytest
+from pymongo import MongoClient
+from app import app, init_db
+from search import decode_cursor, encode_cursor, reset_search_backend
+
+# Use a dedicated test database
+TEST_DB_NAME = "note_app_facets_test"
+
+USER_ID = "facets_user"
+
+@pytest.fixture(scope="function", params=["mongo", "inverted"])
+def client(request, tmp_path):
+    """Test client using a real test database, once per search backend"""
+    # Configure app for testing
+    app.config["TESTING"] = True
+    app.config["SECRET_KEY"] = "test_secret_key"
+    app.config["MONGO_URI"] = f"mongodb://localhost:27017/{TEST_DB_NAME}"
+    app.config["SEARCH_BACKEND"] = request.param
+    app.config["SEARCH_INDEX_DIR"] = str(tmp_path)
+    reset_search_backend(app)
+
+    # Clean the database before the test
+    mongo_client = MongoClient(app.config["MONGO_URI"])
+    mongo_client.drop_database(TEST_DB_NAME)
+
+    # Initialize the database
+    init_db(app)
+
+    # Create test client
+    with app.test_client() as client:
+        yield client
+
+    # Clean up after the test
+    reset_search_backend(app)
+    app.config["SEARCH_BACKEND"] = "mongo"
+    mongo_client.drop_database(TEST_DB_NAME)
+    mongo_client.close()
+
+@pytest.fixture
+def notebooks(client):
+    """Two notebooks with labelled notes about algorithms, returns the notebook ids"""
+    notebook_ids = []
+    for name, count, labels in (("Algorithms Course", 15, ["course", "cs"]), ("Side Project", 10, ["project"])):
+        nb_response = client.post(f"/api/users/{USER_ID}/notebooks", json={"name": name})
+        notebook_id = nb_response.json["notebook"]["_id"]
+        section_response = client.post(
+            f"/api/users/{USER_ID}/notebooks/{notebook_id}/sections",
+            json={"title": "Sorting algorithms", "labels": labels[:1]}
+        )
+        section_id = section_response.json["section"]["_id"]
+        for i in range(count):
+            client.post(
+                f"/api/users/{USER_ID}/notebooks/{notebook_id}/sections/{section_id}/notes",
+                json={"title": f"Algorithm {i}", "content": f"notes about algorithm number {i}", "labels": labels}
+            )
+        notebook_ids.append(notebook_id)
+    return notebook_ids
+
+def search(client, params):
+    return client.get(f"/api/users/{USER_ID}/search", query_string=params)
+
+# --- Cursor Tests ---
+
+def test_cursor_round_trip():
+    """Test: cursors decode to the offsets they were made from and reject anything else"""
+    offsets = {"notebooks": 0, "sections": 10, "notes": 20}
+    assert decode_cursor(encode_cursor(offsets)) == offsets
+    for cursor in ("not a cursor", encode_cursor({"notes": -1}), encode_cursor({"users": 1}), encode_cursor([1])):
+        with pytest.raises(ValueError):
+            decode_cursor(cursor)
+
+# --- Facet Tests ---
+
+def test_facets_count_all_matches(client, notebooks):
+    """Test: totals and facet counts cover every match, not only the returned page"""
+    response = search(client, {"q": "algorithm", "facets": "1"})
+    assert response.status_code == 200
+    data = response.json
+
+    assert len(data["results"]["notes"]) == 20
+    assert data["totals"]["notes"] == 25
+    assert data["totals"]["sections"] == 2
+
+    labels = {facet["label"]: facet["count"] for facet in data["facets"]["labels"]}
+    # Notes and sections carrying each label
+    assert labels == {"course": 16, "cs": 15, "project": 11}
+    assert data["facets"]["labels"][0] == {"label": "course", "count": 16}
+
+    by_notebook = {facet["notebook_id"]: facet["count"] for facet in data["facets"]["notebooks"]}
+    course_id, project_id = notebooks
+    assert by_notebook[course_id] == 17  # the notebook itself, its section and 15 notes
+    assert by_notebook[project_id] == 11
+
+def test_facets_follow_label_filter(client, notebooks):
+    """Test: narrowing by a label recounts the facets within it"""
+    data = search(client, {"q": "algorithm", "labels": "project", "facets": "1"}).json
+    assert data["totals"] == {"notebooks": 0, "sections": 1, "notes": 10}
+    assert [facet["notebook_id"] for facet in data["facets"]["notebooks"]] == [notebooks[1]]
+
+def test_label_only_facets(client, notebooks):
+    """Test: label-only searches also return counts"""
+    data = search(client, {"labels": "cs", "facets": "1"}).json
+    assert data["totals"]["notes"] == 15
+    assert {"label": "course", "count": 15} in data["facets"]["labels"]
+
+def test_search_without_facets_is_unchanged(client, notebooks):
+    """Test: plain searches have no counts or cursor"""
+    data = search(client, {"q": "algorithm"}).json
+    assert len(data["results"]["notes"]) == 20
+    assert "facets" not in data
+    assert "next_cursor" not in data
+
+# --- Pagination Tests ---
+
+def test_cursor_pages_through_all_results(client, notebooks):
+    """Test: following next_cursor returns every note once"""
+    first = search(client, {"q": "algorithm", "facets": "1"}).json
+    assert first["next_cursor"]
+
+    second = search(client, {"q": "algorithm", "cursor": first["next_cursor"]}).json
+    assert len(second["results"]["notes"]) == 5
+    assert second["results"]["sections"] == []
+    assert second["next_cursor"] is None
+    assert "facets" not in second
+
+    titles = [note["title"] for page in (first, second) for note in page["results"]["notes"]]
+    assert sorted(titles) == sorted([f"Algorithm {i}" for i in range(15)] + [f"Algorithm {i}" for i in range(10)])
+
+def test_offset(client, notebooks):
+    """Test: offset skips the same number of hits in every group"""
+    data = search(client, {"q": "algorithm", "offset": "18"}).json
+    assert len(data["results"]["notes"]) == 7
+    assert data["totals"]["notes"] == 25
+
+def test_invalid_pagination(client):
+    """Test: malformed offsets and cursors are rejected"""
+    assert search(client, {"q": "algorithm", "offset": "-1"}).status_code == 400
+    assert search(client, {"q": "algorithm", "offset": "ten"}).status_code == 400
+    assert search(client, {"q": "algorithm", "cursor": "garbage!"}).status_code == 400
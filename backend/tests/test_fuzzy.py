@@ -0,0 +1,185 @@
+# Testing typo tolerant search
+import threading
+import time
+import pytest
+from pymongo import MongoClient
+from app import app, init_db
+import fuzzy
+from events import Event
+from fuzzy import TrigramIndex, VocabularyCache, bounded_levenshtein
+from search import MongoTextSearch, reset_search_backend
+
+# Use a dedicated test database
+TEST_DB_NAME = "note_app_fuzzy_test"
+
+@pytest.fixture(scope="function")
+def client(tmp_path):
+    """Test client using a real test database and the inverted index backend"""
+    # Configure app for testing
+    app.config["TESTING"] = True
+    app.config["SECRET_KEY"] = "test_secret_key"
+    app.config["MONGO_URI"] = f"mongodb://localhost:27017/{TEST_DB_NAME}"
+    app.config["SEARCH_BACKEND"] = "inverted"
+    app.config["SEARCH_INDEX_DIR"] = str(tmp_path)
+    reset_search_backend(app)
+
+    # Clean the database before the test
+    mongo_client = MongoClient(app.config["MONGO_URI"])
+    mongo_client.drop_database(TEST_DB_NAME)
+
+    # Initialize the database
+    init_db(app)
+
+    # Create test client
+    with app.test_client() as client:
+        yield client
+
+    # Clean up after the test
+    reset_search_backend(app)
+    app.config["SEARCH_BACKEND"] = "mongo"
+    mongo_client.drop_database(TEST_DB_NAME)
+    mongo_client.close()
+
+def create_note(client, user_id, title, content):
+    nb_response = client.post(f"/api/users/{user_id}/notebooks", json={"name": "Fuzzy Notebook"})
+    notebook_id = nb_response.json["notebook"]["_id"]
+    section_response = client.post(f"/api/users/{user_id}/notebooks/{notebook_id}/sections", json={"title": "Fuzzy"})
+    section_id = section_response.json["section"]["_id"]
+    client.post(
+        f"/api/users/{user_id}/notebooks/{notebook_id}/sections/{section_id}/notes",
+        json={"title": title, "content": content}
+    )
+    return notebook_id, section_id
+
+def note_titles(response):
+    return [note["title"] for note in response.json["results"]["notes"]]
+
+# --- Edit Distance Tests ---
+
+def test_bounded_levenshtein():
+    """Test: distances above the limit are cut off"""
+    assert bounded_levenshtein("algoritm", "algorithm", 2) == 1
+    assert bounded_levenshtein("kitten", "sitting", 3) == 3
+    assert bounded_levenshtein("kitten", "sitting", 2) is None
+    assert bounded_levenshtein("short", "muchlongerword", 2) is None
+
+def test_trigram_expansion_ranks_by_similarity():
+    """Test: closer terms come first and short terms are only matched exactly"""
+    vocabulary = TrigramIndex(["algorithm", "algorithms", "logarithm", "rhythm", "sort"])
+    expanded = [term for term, _ in vocabulary.expand("algoritm")]
+    assert expanded[0] == "algorithm"
+    assert "logarithm" not in expanded
+    assert vocabulary.expand("srt") == []
+    assert vocabulary.expand("sort") == [("sort", 1.0)]
+
+def test_expansion_while_vocabulary_grows():
+    """Test: expanding terms while another thread adds words does not fail"""
+    vocabulary = TrigramIndex(["algorithm"])
+    errors = []
+
+    def write():
+        for number in range(20000):
+            vocabulary.add(f"algorithm{number}")
+
+    def read():
+        try:
+            for _ in range(200):
+                vocabulary.expand("algoritm")
+        except RuntimeError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=write), threading.Thread(target=read)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert vocabulary.expand("algoritm")[0][0] == "algorithm"
+
+# --- Endpoint Tests ---
+
+def test_misspelled_query_finds_notes(client):
+    """Test: fuzzy mode finds notes despite a typo, exact mode does not"""
+    user_id = "fuzzy_user"
+    create_note(client, user_id, "Sorting algorithms", "quicksort and mergesort")
+    create_note(client, user_id, "Groceries", "apples and bread")
+
+    exact = client.get(f"/api/users/{user_id}/search?q=algoritm")
+    assert exact.json["total_results"] == 0
+
+    fuzzy = client.get(f"/api/users/{user_id}/search?q=algoritm&fuzzy=1")
+    assert fuzzy.status_code == 200
+    assert fuzzy.json["fuzzy"] is True
+    assert note_titles(fuzzy) == ["Sorting algorithms"]
+
+def test_exact_matches_rank_above_fuzzy_ones(client):
+    """Test: a document with the exact term outranks one with a near miss"""
+    user_id = "rank_user"
+    create_note(client, user_id, "Graph", "graph traversal")
+    create_note(client, user_id, "Grape", "grape varieties")
+
+    response = client.get(f"/api/users/{user_id}/search?q=graph&fuzzy=1")
+    titles = note_titles(response)
+    assert titles[0] == "Graph"
+
+def test_vocabulary_follows_writes(client):
+    """Test: words of notes written after the first fuzzy search are matched"""
+    user_id = "vocab_user"
+    create_note(client, user_id, "First", "nothing special")
+    client.get(f"/api/users/{user_id}/search?q=nothing&fuzzy=1")
+
+    create_note(client, user_id, "Second", "photosynthesis in leaves")
+    response = client.get(f"/api/users/{user_id}/search?q=photosynthsis&fuzzy=1")
+    assert note_titles(response) == ["Second"]
+
+def test_mongo_backend_corrects_query(client):
+    """Test: the text index backend searches the closest words the user has written"""
+    user_id = "mongo_fuzzy_user"
+    create_note(client, user_id, "Databases", "database normalization")
+    db = init_db(app)
+    collections = (db["notebooks"], db["sections"], db["notes"])
+    words = MongoTextSearch().fuzzy_query(user_id, "databse normalisation", collections).split()
+    assert words[0] == "database"
+    assert "normalization" in words
+    assert "normalisation" not in words
+
+def test_large_vocabulary_is_read_in_the_background(client, monkeypatch):
+    """Test: a large vocabulary is read once, off the request, with the writes made meanwhile"""
+    user_id = "background_vocab_user"
+    create_note(client, user_id, "Botany", "leaves and roots")
+    db = init_db(app)
+    collections = (db["notebooks"], db["sections"], db["notes"])
+    monkeypatch.setattr(fuzzy, "SYNC_BUILD_LIMIT", 0)
+    cache, reads, release = VocabularyCache(), [], threading.Event()
+    read = cache._read
+
+    def slow_read(*args):
+        reads.append(args)
+        release.wait(5)
+        return read(*args)
+
+    monkeypatch.setattr(cache, "_read", slow_read)
+    assert cache.get(user_id, collections) is None
+    assert cache.get(user_id, collections) is None
+    # Written after the documents were read
+    cache.handle_event(Event("note", "created", user_id, "n1", {"title": "Photosynthesis"}))
+    # Searched without corrections until it is ready
+    backend = MongoTextSearch()
+    backend.vocabularies = cache
+    assert backend.fuzzy_query(user_id, "leavs", collections) == "leavs"
+    release.set()
+    deadline = time.monotonic() + 5
+    while cache.get(user_id, collections) is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    vocabulary = cache.get(user_id, collections)
+    assert len(reads) == 1
+    assert "photosynthesis" in vocabulary and "leaves" in vocabulary
+
+def test_mongo_backend_keeps_phrases_and_exclusions(client):
+    """Test: only plain words are corrected, exclusions and phrases reach $text unchanged"""
+    user_id = "mongo_structured_user"
+    create_note(client, user_id, "Searching", "algorithm for graph and binary search")
+    db = init_db(app)
+    collections = (db["notebooks"], db["sections"], db["notes"])
+    query = MongoTextSearch().fuzzy_query(user_id, 'algoritm -graph "binary search"', collections)
+    assert query == 'algorithm -graph "binary search"'
@@ -0,0 +1,123 @@
+# Testing Idempotency-Key replays of the create endpoints
+import datetime
+import pytest
+from pymongo import MongoClient
+from app import app, init_db
+import app as app_module
+from idempotency import IDEMPOTENCY_COLLECTION, PENDING, REPLAY_HEADER, _fingerprint
+
+# Use a dedicated test database
+TEST_DB_NAME = "note_app_idempotency_test"
+
+USER_ID = "idempotency_user"
+BASE = f"/api/users/{USER_ID}/notebooks"
+
+@pytest.fixture(scope="function")
+def client():
+    """Test client using a real test database"""
+    # Configure app for testing
+    app.config["TESTING"] = True
+    app.config["SECRET_KEY"] = "test_secret_key"
+    app.config["MONGO_URI"] = f"mongodb://localhost:27017/{TEST_DB_NAME}"
+
+    # Clean the database before the test
+    mongo_client = MongoClient(app.config["MONGO_URI"])
+    mongo_client.drop_database(TEST_DB_NAME)
+
+    # Initialize the database
+    init_db(app)
+
+    # Create test client
+    with app.test_client() as client:
+        yield client
+
+    # Clean up after the test
+    mongo_client.drop_database(TEST_DB_NAME)
+    mongo_client.close()
+
+@pytest.fixture
+def section_url(client):
+    notebook_id = client.post(BASE, json={"name": "Chemistry"}).json["notebook"]["_id"]
+    section_id = client.post(f"{BASE}/{notebook_id}/sections", json={"title": "Labs"}).json["section"]["_id"]
+    return f"{BASE}/{notebook_id}/sections/{section_id}"
+
+def keys():
+    return app_module.db[IDEMPOTENCY_COLLECTION]
+
+# --- Replay Tests ---
+
+def test_retried_note_is_created_once(client, section_url):
+    """Test: a retry with the same key gets the first response and creates nothing"""
+    headers = {"Idempotency-Key": "note-1"}
+    first = client.post(f"{section_url}/notes", json={"title": "Titration"}, headers=headers)
+    assert first.status_code == 201
+    assert REPLAY_HEADER not in first.headers
+
+    retry = client.post(f"{section_url}/notes", json={"title": "Titration"}, headers=headers)
+    assert retry.status_code == 201
+    assert retry.headers[REPLAY_HEADER] == "true"
+    assert retry.json == first.json
+    assert app_module.notes_collection.count_documents({}) == 1
+
+    # Without a key, or with another one, each request creates a note
+    client.post(f"{section_url}/notes", json={"title": "Titration"})
+    client.post(f"{section_url}/notes", json={"title": "Titration"}, headers={"Idempotency-Key": "note-2"})
+    assert app_module.notes_collection.count_documents({}) == 3
+
+def test_notebooks_and_sections_replay(client):
+    """Test: notebook and section creation replay the same way"""
+    headers = {"Idempotency-Key": "notebook-1"}
+    notebook = client.post(BASE, json={"name": "Biology"}, headers=headers).json["notebook"]
+    assert client.post(BASE, json={"name": "Biology"}, headers=headers).json["notebook"] == notebook
+    assert app_module.notebooks_collection.count_documents({}) == 1
+
+    url = f"{BASE}/{notebook['_id']}/sections"
+    headers = {"Idempotency-Key": "section-1"}
+    section = client.post(url, json={"title": "Cells"}, headers=headers).json["section"]
+    assert client.post(url, json={"title": "Cells"}, headers=headers).json["section"] == section
+    assert app_module.sections_collection.count_documents({}) == 1
+
+def test_keys_are_per_user(client):
+    """Test: another user's key with the same value does not replay"""
+    headers = {"Idempotency-Key": "shared"}
+    mine = client.post(BASE, json={"name": "Mine"}, headers=headers).json["notebook"]
+    theirs = client.post("/api/users/other_user/notebooks", json={"name": "Mine"}, headers=headers).json["notebook"]
+    assert theirs["_id"] != mine["_id"]
+
+# --- Error Tests ---
+
+def test_key_reused_for_another_request(client, section_url):
+    """Test: a key sent with a different body or path is rejected"""
+    headers = {"Idempotency-Key": "reused"}
+    client.post(f"{section_url}/notes", json={"title": "First"}, headers=headers)
+    assert client.post(f"{section_url}/notes", json={"title": "Second"}, headers=headers).status_code == 422
+    assert client.post(BASE, json={"title": "First"}, headers=headers).status_code == 422
+    assert app_module.notes_collection.count_documents({}) == 1
+
+def fingerprint(url, body):
+    """The fingerprint the endpoint computes for a JSON POST of body to url"""
+    with app.test_request_context(url, method="POST", json=body):
+        return _fingerprint()
+
+def test_request_in_progress(client, section_url):
+    """Test: a retry while the first request runs answers 409, a stale claim is taken over"""
+    body, now = {"title": "Slow"}, datetime.datetime.utcnow()
+    keys().insert_one({"user_id": USER_ID, "key": "slow", "fingerprint": fingerprint(f"{section_url}/notes", body),
+                       "status": PENDING, "created_at": now, "expires_at": now + datetime.timedelta(hours=1)})
+    response = client.post(f"{section_url}/notes", json=body, headers={"Idempotency-Key": "slow"})
+    assert response.status_code == 409
+    assert app_module.notes_collection.count_documents({}) == 0
+
+    # The first request died without finishing
+    keys().update_one({"key": "slow"}, {"$set": {"created_at": now - datetime.timedelta(minutes=5)}})
+    response = client.post(f"{section_url}/notes", json=body, headers={"Idempotency-Key": "slow"})
+    assert response.status_code == 201
+    assert keys().find_one({"key": "slow"})["status"] != PENDING
+
+def test_failed_request_is_not_stored(client, section_url):
+    """Test: a request that raises releases its key so a retry runs again"""
+    headers = {"Idempotency-Key": "broken"}
+    response = client.post(f"{section_url}/notes", data="not json", content_type="application/json", headers=headers)
+    assert response.status_code == 400
+    assert keys().count_documents({"key": "broken"}) == 0
+    assert client.post(f"{section_url}/notes", json={"title": "Fixed"}, headers=headers).status_code == 201
@@ -0,0 +1,228 @@
+# Testing the embedded BM25 search backend
+import pytest
+from pymongo import MongoClient
+import inverted_index
+from app import app, init_db
+from inverted_index import InvertedIndexSearch
+from tokenizer import stem, tokenize
+from search import reset_search_backend
+
+# Use a dedicated test database
+TEST_DB_NAME = "note_app_inverted_index_test"
+
+@pytest.fixture(scope="function")
+def client(tmp_path):
+    """Test client using a real test database and the inverted index backend"""
+    # Configure app for testing
+    app.config["TESTING"] = True
+    app.config["SECRET_KEY"] = "test_secret_key"
+    app.config["MONGO_URI"] = f"mongodb://localhost:27017/{TEST_DB_NAME}"
+    app.config["SEARCH_BACKEND"] = "inverted"
+    app.config["SEARCH_INDEX_DIR"] = str(tmp_path)
+    reset_search_backend(app)
+
+    # Clean the database before the test
+    mongo_client = MongoClient(app.config["MONGO_URI"])
+    mongo_client.drop_database(TEST_DB_NAME)
+
+    # Initialize the database
+    init_db(app)
+
+    # Create test client
+    with app.test_client() as client:
+        yield client
+
+    # Clean up after the test
+    reset_search_backend(app)
+    app.config["SEARCH_BACKEND"] = "mongo"
+    mongo_client.drop_database(TEST_DB_NAME)
+    mongo_client.close()
+
+def create_notebook(client, user_id, name="Notebook", labels=None):
+    response = client.post(f"/api/users/{user_id}/notebooks", json={"name": name, "labels": labels or []})
+    return response.json["notebook"]["_id"]
+
+def create_section(client, user_id, notebook_id, title="Section"):
+    response = client.post(f"/api/users/{user_id}/notebooks/{notebook_id}/sections", json={"title": title})
+    return response.json["section"]["_id"]
+
+def create_note(client, user_id, notebook_id, section_id, title, content, labels=None):
+    response = client.post(
+        f"/api/users/{user_id}/notebooks/{notebook_id}/sections/{section_id}/notes",
+        json={"title": title, "content": content, "labels": labels or []}
+    )
+    return response.json["note"]["_id"]
+
+def search(client, user_id, query, labels=""):
+    response = client.get(f"/api/users/{user_id}/search?q={query}&labels={labels}")
+    assert response.status_code == 200
+    return response.json
+
+def note_titles(result):
+    return [note["title"] for note in result["results"]["notes"]]
+
+# --- Tokenizer Tests ---
+
+def test_tokenizer_splits_identifiers():
+    """Test: camelCase and snake_case identifiers are indexed whole and by part"""
+    assert tokenize("getUserName") == ["getusername", "get", "user", "name"]
+    assert tokenize("parse_http_header") == ["parse_http_header", "pars", "http", "header"]
+    assert tokenize("HTTPServer") == ["httpserver", "http", "server"]
+
+def test_tokenizer_drops_stopwords_and_stems():
+    """Test: stopwords are skipped and plurals and verb forms share a term"""
+    assert tokenize("the notes of the meeting") == ["note", "meet"]
+    assert stem("running") == stem("run")
+    assert stem("parsed") == stem("parse") == stem("parsing") == stem("parses")
+
+# --- Ranking Tests ---
+
+def test_bm25_ranks_title_matches_first(client):
+    """Test: a title match outranks a single mention in a long body"""
+    user_id = "rank_user"
+    notebook_id = create_notebook(client, user_id)
+    section_id = create_section(client, user_id, notebook_id)
+    create_note(client, user_id, notebook_id, section_id, "Shopping", "buy milk and recursion " + "filler " * 50)
+    create_note(client, user_id, notebook_id, section_id, "Recursion", "base case and recursive step")
+    create_note(client, user_id, notebook_id, section_id, "Unrelated", "nothing to see")
+
+    result = search(client, user_id, "recursion")
+    assert note_titles(result) == ["Recursion", "Shopping"]
+    scores = [note["score"] for note in result["results"]["notes"]]
+    assert scores[0] > scores[1]
+    assert "content_preview" in result["results"]["notes"][0]
+
+def test_code_identifiers_are_searchable(client):
+    """Test: parts of identifiers match and the whole identifier matches too"""
+    user_id = "code_user"
+    notebook_id = create_notebook(client, user_id)
+    section_id = create_section(client, user_id, notebook_id)
+    create_note(client, user_id, notebook_id, section_id, "Helpers", "```python\ndef getUserName(user_id):\n```")
+
+    assert note_titles(search(client, user_id, "user name")) == ["Helpers"]
+    assert note_titles(search(client, user_id, "getUserName")) == ["Helpers"]
+
+def test_results_are_grouped_and_filtered_by_labels(client):
+    """Test: notebooks and notes are returned in their groups and labels filter them"""
+    user_id = "labels_user"
+    notebook_id = create_notebook(client, user_id, "Algorithms", labels=["cs"])
+    section_id = create_section(client, user_id, notebook_id, "Sorting")
+    create_note(client, user_id, notebook_id, section_id, "Algorithms quiz", "sorting algorithms", labels=["exam"])
+
+    result = search(client, user_id, "algorithms")
+    assert [nb["name"] for nb in result["results"]["notebooks"]] == ["Algorithms"]
+    assert note_titles(result) == ["Algorithms quiz"]
+
+    filtered = search(client, user_id, "algorithms", labels="exam")
+    assert filtered["results"]["notebooks"] == []
+    assert note_titles(filtered) == ["Algorithms quiz"]
+
+def test_other_users_are_not_searched(client):
+    """Test: every user has their own index"""
+    notebook_id = create_notebook(client, "owner")
+    section_id = create_section(client, "owner", notebook_id)
+    create_note(client, "owner", notebook_id, section_id, "Private", "secret plans")
+    assert search(client, "someone_else", "secret")["total_results"] == 0
+
+# --- Incremental Update Tests ---
+
+def test_index_follows_writes(client):
+    """Test: notes created, updated and deleted after the first search are reflected"""
+    user_id = "writes_user"
+    notebook_id = create_notebook(client, user_id)
+    section_id = create_section(client, user_id, notebook_id)
+    base = f"/api/users/{user_id}/notebooks/{notebook_id}/sections/{section_id}/notes"
+    assert search(client, user_id, "graph")["total_results"] == 0
+
+    note_id = create_note(client, user_id, notebook_id, section_id, "Graphs", "dijkstra shortest path")
+    assert note_titles(search(client, user_id, "dijkstra")) == ["Graphs"]
+
+    client.put(f"{base}/{note_id}", json={"title": "Graphs", "content": "breadth first search"})
+    assert search(client, user_id, "dijkstra")["total_results"] == 0
+    assert note_titles(search(client, user_id, "breadth")) == ["Graphs"]
+
+    client.patch(f"{base}/{note_id}/labels", json={"labels": ["algo"]})
+    assert note_titles(search(client, user_id, "breadth", labels="algo")) == ["Graphs"]
+
+    client.delete(f"{base}/{note_id}")
+    assert search(client, user_id, "breadth")["total_results"] == 0
+
+def test_deleting_notebook_removes_its_contents(client):
+    """Test: a notebook delete drops its sections and notes from the index"""
+    user_id = "cascade_user"
+    notebook_id = create_notebook(client, user_id, "Physics")
+    section_id = create_section(client, user_id, notebook_id, "Optics")
+    create_note(client, user_id, notebook_id, section_id, "Lenses", "optics refraction")
+    assert search(client, user_id, "optics")["total_results"] == 2
+
+    client.delete(f"/api/users/{user_id}/notebooks/{notebook_id}")
+    assert search(client, user_id, "optics")["total_results"] == 0
+
+# --- Segment Tests ---
+
+def test_index_is_reloaded_from_disk(client, tmp_path):
+    """Test: a closed index is loaded from its segment files instead of MongoDB"""
+    user_id = "reload_user"
+    notebook_id = create_notebook(client, user_id)
+    section_id = create_section(client, user_id, notebook_id)
+    create_note(client, user_id, notebook_id, section_id, "Before", "persisted segments")
+    search(client, user_id, "segments")
+    create_note(client, user_id, notebook_id, section_id, "After", "memory segments")
+    reset_search_backend(app)
+
+    backend = InvertedIndexSearch(str(tmp_path))
+    try:
+        index = backend._ready_index(user_id)
+        assert index is not None and index.ready
+        assert sorted(doc_id for _, doc_id in index.search(tokenize("segments"))["notes"]) == sorted(
+            note["_id"] for note in search(client, user_id, "segments")["results"]["notes"]
+        )
+    finally:
+        backend.close()
+
+def test_writes_to_an_evicted_index_are_kept(client, monkeypatch):
+    """Test: a write that looked up an index just before it was evicted reaches the reloaded index"""
+    user_id = "evicted_user"
+    notebook_id = create_notebook(client, user_id)
+    section_id = create_section(client, user_id, notebook_id)
+    search(client, user_id, "warmup")
+    backend = app.extensions["search_backend"]
+    monkeypatch.setattr(backend, "max_users", 1)
+    lookup, stale = backend._index, []
+
+    def evicted_after_lookup(looked_up, create=True):
+        index = lookup(looked_up, create)
+        if looked_up == user_id and not stale:
+            # Another user's search evicts the index between the lookup and the write
+            stale.append(index)
+            lookup("other_user")
+        return index
+
+    monkeypatch.setattr(backend, "_index", evicted_after_lookup)
+    create_note(client, user_id, notebook_id, section_id, "Evicted", "written during eviction")
+    monkeypatch.setattr(backend, "_index", lookup)
+
+    assert stale[0].closed
+    assert note_titles(search(client, user_id, "eviction")) == ["Evicted"]
+
+def test_segments_are_flushed_and_merged(client, monkeypatch):
+    """Test: the memory segment is written out and merging keeps the same results"""
+    monkeypatch.setattr(inverted_index, "FLUSH_DOCS", 2)
+    monkeypatch.setattr(inverted_index, "MAX_SEGMENTS", 100)
+    user_id = "merge_user"
+    notebook_id = create_notebook(client, user_id)
+    section_id = create_section(client, user_id, notebook_id)
+    search(client, user_id, "warmup")
+    note_ids = [create_note(client, user_id, notebook_id, section_id, f"Note {i}", f"merge topic{i}") for i in range(7)]
+    client.delete(f"/api/users/{user_id}/notebooks/{notebook_id}/sections/{section_id}/notes/{note_ids[0]}")
+
+    backend = app.extensions["search_backend"]
+    index = backend._ready_index(user_id)
+    assert len(index.segments) > 2
+    before = search(client, user_id, "merge")
+
+    index.merge()
+    assert len(index.segments) == 1
+    after = search(client, user_id, "merge")
+    assert note_titles(after) == note_titles(before)
+    assert len(note_titles(after)) == 6
@@ -0,0 +1,152 @@
+# Testing the background job runner and the job status endpoint
+import datetime
+import time
+import pytest
+from pymongo import MongoClient
+from app import app, init_db
+import app as app_module
+from jobs import FAILED, JOBS_COLLECTION, QUEUED, SUCCEEDED, JobRunner, enqueue, job_handler
+
+# Use a dedicated test database
+TEST_DB_NAME = "note_app_jobs_test"
+
+USER_ID = "jobs_user"
+
+# Calls of the test handlers, per job type
+calls = {}
+
+@job_handler("test_count", max_attempts=1)
+def count_job(context, params):
+    calls.setdefault("test_count", []).append(context.attempt)
+    for done in range(params["steps"]):
+        context.report("Counting", done + 1, params["steps"])
+    return {"counted": params["steps"]}
+
+@job_handler("test_flaky", max_attempts=2)
+def flaky_job(context, params):
+    calls.setdefault("test_flaky", []).append(context.attempt)
+    if not context.last_attempt:
+        raise RuntimeError("temporary failure")
+    return "recovered"
+
+@job_handler("test_broken", max_attempts=1)
+def broken_job(context, params):
+    raise ValueError("always fails")
+
+@pytest.fixture(scope="function")
+def client():
+    """Test client using a real test database"""
+    # Configure app for testing
+    app.config["TESTING"] = True
+    app.config["SECRET_KEY"] = "test_secret_key"
+    app.config["MONGO_URI"] = f"mongodb://localhost:27017/{TEST_DB_NAME}"
+
+    # Clean the database before the test
+    mongo_client = MongoClient(app.config["MONGO_URI"])
+    mongo_client.drop_database(TEST_DB_NAME)
+    calls.clear()
+    # Worker threads started by earlier tests would race the tests' own runner
+    app.extensions["jobs"].close()
+
+    # Initialize the database
+    init_db(app)
+
+    # Create test client
+    with app.test_client() as client:
+        yield client
+
+    # Clean up after the test
+    app.config["DELETE_BACKGROUND_NOTES"] = 1000
+    mongo_client.drop_database(TEST_DB_NAME)
+    mongo_client.close()
+
+@pytest.fixture
+def runner(client):
+    """A runner without threads, jobs run when the test calls run_pending"""
+    return JobRunner(lambda: app_module.db, workers=0, lease_seconds=60)
+
+def job(job_id):
+    return app_module.db[JOBS_COLLECTION].find_one({"_id": job_id})
+
+# --- Runner Tests ---
+
+def test_job_runs_and_reports_progress(client, runner):
+    """Test: a job's result and last progress are shown by the status endpoint"""
+    queued = enqueue(app_module.db, "test_count", USER_ID, {"steps": 3})
+    response = client.get(f"/api/jobs/{queued['_id']}")
+    assert response.json["job"]["status"] == QUEUED
+
+    assert runner.run_pending() == 1
+    response = client.get(f"/api/jobs/{queued['_id']}")
+    assert response.status_code == 200
+    assert response.json["job"]["status"] == SUCCEEDED
+    assert response.json["job"]["result"] == {"counted": 3}
+    assert response.json["job"]["progress"] == {"message": "Counting", "done": 3, "total": 3}
+    assert job(queued["_id"])["expires_at"] > datetime.datetime.utcnow()
+
+def test_failed_job_is_retried_with_backoff(client, runner):
+    """Test: a failing job is queued again for later, and fails for good after max_attempts"""
+    flaky = enqueue(app_module.db, "test_flaky", USER_ID, {})
+    broken = enqueue(app_module.db, "test_broken", USER_ID, {})
+    runner.run_pending()
+
+    retry = job(flaky["_id"])
+    assert retry["status"] == QUEUED and retry["error"] == "temporary failure"
+    assert retry["run_after"] > datetime.datetime.utcnow()
+    assert job(broken["_id"])["status"] == FAILED
+    assert job(broken["_id"])["error"] == "always fails"
+
+    # Due now, the second attempt succeeds
+    app_module.db[JOBS_COLLECTION].update_one({"_id": flaky["_id"]}, {"$set": {"run_after": datetime.datetime.utcnow()}})
+    runner.run_pending()
+    assert job(flaky["_id"])["status"] == SUCCEEDED
+    assert calls["test_flaky"] == [1, 2]
+
+def test_expired_lease_is_claimed_again(client, runner):
+    """Test: a job whose worker stopped renewing its lease is run by another worker"""
+    queued = enqueue(app_module.db, "test_count", USER_ID, {"steps": 1})
+    assert runner.claim("dead-worker")["_id"] == queued["_id"]
+    assert runner.run_pending() == 0
+
+    app_module.db[JOBS_COLLECTION].update_one(
+        {"_id": queued["_id"]}, {"$set": {"lease_until": datetime.datetime.utcnow() - datetime.timedelta(seconds=1)}}
+    )
+    assert runner.run_pending() == 1
+    assert job(queued["_id"])["status"] == SUCCEEDED
+
+def test_idempotency_key_queues_once(client):
+    """Test: the same key returns the job queued first, per user"""
+    first = enqueue(app_module.db, "test_count", USER_ID, {"steps": 1}, idempotency_key="import-7")
+    again = enqueue(app_module.db, "test_count", USER_ID, {"steps": 2}, idempotency_key="import-7")
+    other = enqueue(app_module.db, "test_count", "other_user", {"steps": 1}, idempotency_key="import-7")
+    assert again["_id"] == first["_id"] and again["params"] == {"steps": 1}
+    assert other["_id"] != first["_id"]
+
+def test_unknown_job(client):
+    """Test: the status endpoint answers 404 for unknown ids"""
+    assert client.get("/api/jobs/not-an-id").status_code == 404
+    assert client.get("/api/jobs/0123456789abcdef01234567").status_code == 404
+
+# --- Background Operation Tests ---
+
+def test_large_notebook_delete_runs_as_job(client):
+    """Test: deleting a notebook with many notes answers at once and a job deletes its notes"""
+    base = f"/api/users/{USER_ID}/notebooks"
+    notebook_id = client.post(base, json={"name": "Archive"}).json["notebook"]["_id"]
+    section_id = client.post(f"{base}/{notebook_id}/sections", json={"title": "Old"}).json["section"]["_id"]
+    for number in range(3):
+        client.post(f"{base}/{notebook_id}/sections/{section_id}/notes", json={"title": f"note {number}"})
+    app.config["DELETE_BACKGROUND_NOTES"] = 2
+
+    response = client.delete(f"{base}/{notebook_id}")
+    assert response.status_code == 202
+    assert client.get(base).json["notebooks"] == []
+
+    job_url = f"/api/jobs/{response.json['job']['_id']}"
+    deadline = time.time() + 5
+    while client.get(job_url).json["job"]["status"] != SUCCEEDED:
+        assert time.time() < deadline
+        time.sleep(0.01)
+    assert client.get(job_url).json["job"]["result"] == {"notes_deleted": 3}
+    assert app_module.notes_collection.count_documents({}) == 0
+    assert app_module.sections_collection.count_documents({}) == 0
@@ -0,0 +1,100 @@
+# Testing JSON serialization of MongoDB documents
+import datetime
+import json
+import pytest
+from bson import ObjectId
+from flask import jsonify
+from pymongo import MongoClient
+import json_provider
+from app import app, init_db
+
+# Use a dedicated test database
+TEST_DB_NAME = "note_app_json_test"
+
+@pytest.fixture(scope="function")
+def client():
+    """Test client using a real test database"""
+    # Configure app for testing
+    app.config["TESTING"] = True
+    app.config["SECRET_KEY"] = "test_secret_key"
+    app.config["MONGO_URI"] = f"mongodb://localhost:27017/{TEST_DB_NAME}"
+
+    # Clean the database before the test
+    mongo_client = MongoClient(app.config["MONGO_URI"])
+    mongo_client.drop_database(TEST_DB_NAME)
+
+    # Initialize the database
+    init_db(app)
+
+    # Create test client
+    with app.test_client() as client:
+        yield client
+
+    # Clean up after the test
+    mongo_client.drop_database(TEST_DB_NAME)
+    mongo_client.close()
+
+@pytest.fixture(params=["orjson", "stdlib"])
+def provider_backend(request, monkeypatch):
+    """Run a test with orjson and with the standard library fallback"""
+    if request.param == "stdlib":
+        monkeypatch.setattr(json_provider, "orjson", None)
+    elif json_provider.orjson is None:
+        pytest.skip("orjson is not installed")
+    return request.param
+
+DOCUMENT = {
+    "_id": ObjectId("60a5e8a7b53c143abc456789"),
+    "created_at": datetime.datetime(2026, 1, 2, 3, 4, 5),
+    "password": b"\x00\x01hash",
+    "labels": ["a", "b"],
+}
+
+# --- Serialization Tests ---
+
+def test_bson_types_are_serialized(provider_backend):
+    """Test: ObjectId, datetime and bytes are encoded natively"""
+    with app.app_context():
+        data = json.loads(jsonify({"doc": DOCUMENT}).get_data(as_text=True))
+    assert data["doc"]["_id"] == "60a5e8a7b53c143abc456789"
+    assert data["doc"]["created_at"] == "Fri, 02 Jan 2026 03:04:05 GMT"
+    assert data["doc"]["password"] == "AAFoYXNo"
+    assert data["doc"]["labels"] == ["a", "b"]
+
+def test_backends_produce_same_values():
+    """Test: orjson and the standard library give the same JSON values"""
+    if json_provider.orjson is None:
+        pytest.skip("orjson is not installed")
+    with app.app_context():
+        fast = json.loads(app.json.dumps(DOCUMENT))
+        json_provider.orjson, saved = None, json_provider.orjson
+        try:
+            slow = json.loads(app.json.dumps(DOCUMENT))
+        finally:
+            json_provider.orjson = saved
+    assert fast == slow
+
+def test_unknown_type_raises(provider_backend):
+    """Test: unsupported types still raise TypeError"""
+    with app.app_context():
+        with pytest.raises(TypeError):
+            app.json.dumps({"value": object()})
+
+def test_loads_roundtrip(provider_backend):
+    """Test: request bodies are parsed by the provider"""
+    with app.app_context():
+        assert app.json.loads('{"a": [1, 2], "b": "c"}') == {"a": [1, 2], "b": "c"}
+
+# --- Endpoint Tests ---
+
+def test_listing_ids_are_strings(client):
+    """Test: listing endpoints return string ids without per-document conversion"""
+    user_id = "json_user"
+    created = client.post(f"/api/users/{user_id}/notebooks", json={"name": "JSON Notebook"})
+    assert created.status_code == 201
+    notebook_id = created.json["notebook"]["_id"]
+    assert isinstance(notebook_id, str) and len(notebook_id) == 24
+
+    response = client.get(f"/api/users/{user_id}/notebooks")
+    assert response.json["notebooks"][0]["_id"] == notebook_id
+    assert response.json["notebooks"][0]["created_at"].endswith("GMT")
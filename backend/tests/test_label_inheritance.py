@@ -0,0 +1,128 @@
+# Testing effective labels inherited from notebooks and sections
+import pytest
+from bson import ObjectId
+from pymongo import MongoClient
+from app import app, init_db
+import app as app_module
+from label_inheritance import backfill
+from search import reset_search_backend
+
+# Use a dedicated test database
+TEST_DB_NAME = "note_app_label_inheritance_test"
+
+USER_ID = "inherit_user"
+
+@pytest.fixture(scope="function", params=["mongo", "inverted"])
+def client(request, tmp_path):
+    """Test client using a real test database, once per search backend"""
+    # Configure app for testing
+    app.config["TESTING"] = True
+    app.config["SECRET_KEY"] = "test_secret_key"
+    app.config["MONGO_URI"] = f"mongodb://localhost:27017/{TEST_DB_NAME}"
+    app.config["SEARCH_BACKEND"] = request.param
+    app.config["SEARCH_INDEX_DIR"] = str(tmp_path)
+    reset_search_backend(app)
+
+    # Clean the database before the test
+    mongo_client = MongoClient(app.config["MONGO_URI"])
+    mongo_client.drop_database(TEST_DB_NAME)
+
+    # Initialize the database
+    init_db(app)
+
+    # Create test client
+    with app.test_client() as client:
+        yield client
+
+    # Clean up after the test
+    reset_search_backend(app)
+    app.config["SEARCH_BACKEND"] = "mongo"
+    mongo_client.drop_database(TEST_DB_NAME)
+    mongo_client.close()
+
+@pytest.fixture
+def tree(client):
+    """A course notebook with a labeled section, a plain section and a note in each"""
+    base = f"/api/users/{USER_ID}/notebooks"
+    notebook_id = client.post(base, json={"name": "CS 101", "labels": ["course"]}).json["notebook"]["_id"]
+    ids = {"notebook": notebook_id}
+    for name, labels in (("lectures", ["exam"]), ("misc", [])):
+        section_id = client.post(f"{base}/{notebook_id}/sections",
+                                 json={"title": name, "labels": labels}).json["section"]["_id"]
+        note_id = client.post(f"{base}/{notebook_id}/sections/{section_id}/notes",
+                              json={"title": f"{name} note", "labels": ["draft"]}).json["note"]["_id"]
+        ids[name] = (section_id, note_id)
+    return ids
+
+def effective(collection, doc_id):
+    return sorted(collection.find_one({"_id": ObjectId(doc_id)})["effective_labels"])
+
+# --- Maintenance Tests ---
+
+def test_created_documents_inherit(client, tree):
+    """Test: new sections and notes get their own labels plus their parents'"""
+    section_id, note_id = tree["lectures"]
+    assert effective(app_module.sections_collection, section_id) == ["course", "exam"]
+    assert effective(app_module.notes_collection, note_id) == ["course", "draft", "exam"]
+    assert effective(app_module.notes_collection, tree["misc"][1]) == ["course", "draft"]
+
+def test_notebook_relabel_propagates(client, tree):
+    """Test: changing a notebook's labels updates every section and note below it"""
+    response = client.patch(f"/api/users/{USER_ID}/notebooks/{tree['notebook']}/labels", json={"labels": ["archive"]})
+    assert response.status_code == 200
+    section_id, note_id = tree["lectures"]
+    assert effective(app_module.sections_collection, section_id) == ["archive", "exam"]
+    assert effective(app_module.notes_collection, note_id) == ["archive", "draft", "exam"]
+    assert effective(app_module.notes_collection, tree["misc"][1]) == ["archive", "draft"]
+
+def test_section_relabel_propagates(client, tree):
+    """Test: changing a section's labels updates its notes and keeps the notebook's"""
+    section_id, note_id = tree["lectures"]
+    response = client.put(f"/api/users/{USER_ID}/notebooks/{tree['notebook']}/sections/{section_id}",
+                          json={"title": "lectures", "labels": ["slides"]})
+    assert response.status_code == 200
+    assert effective(app_module.notes_collection, note_id) == ["course", "draft", "slides"]
+    # The other section's note is untouched
+    assert effective(app_module.notes_collection, tree["misc"][1]) == ["course", "draft"]
+
+def test_note_relabel_keeps_inherited(client, tree):
+    """Test: changing a note's own labels keeps the inherited ones"""
+    section_id, note_id = tree["lectures"]
+    response = client.patch(
+        f"/api/users/{USER_ID}/notebooks/{tree['notebook']}/sections/{section_id}/notes/{note_id}/labels",
+        json={"labels": []}
+    )
+    assert response.status_code == 200
+    assert effective(app_module.notes_collection, note_id) == ["course", "exam"]
+
+def test_backfill(client, tree):
+    """Test: the migration backfill recomputes effective labels from scratch"""
+    app_module.sections_collection.update_many({}, {"$unset": {"effective_labels": ""}})
+    app_module.notes_collection.update_many({}, {"$unset": {"effective_labels": ""}})
+    backfill(app_module.notebooks_collection, app_module.sections_collection, app_module.notes_collection)
+    assert effective(app_module.notes_collection, tree["lectures"][1]) == ["course", "draft", "exam"]
+    assert effective(app_module.sections_collection, tree["misc"][0]) == ["course"]
+
+# --- Search Tests ---
+
+def test_search_inherited_labels(client, tree):
+    """Test: inherited=1 finds everything under a labeled notebook"""
+    response = client.get(f"/api/users/{USER_ID}/search", query_string={"labels": "course", "inherited": "1"})
+    assert response.status_code == 200
+    data = response.json
+    assert data["inherited_labels"] is True
+    assert data["labels"] == ["course"]
+    assert sorted(note["title"] for note in data["results"]["notes"]) == ["lectures note", "misc note"]
+    assert len(data["results"]["sections"]) == 2
+    assert [notebook["name"] for notebook in data["results"]["notebooks"]] == ["CS 101"]
+
+    # Own labels only without it
+    response = client.get(f"/api/users/{USER_ID}/search", query_string={"labels": "course"})
+    assert response.json["results"]["notes"] == []
+
+def test_search_inherited_labels_combined(client, tree):
+    """Test: inherited labels combine with each other and with text"""
+    response = client.get(f"/api/users/{USER_ID}/search",
+                          query_string={"labels": "course,exam", "inherited": "1"})
+    assert [note["title"] for note in response.json["results"]["notes"]] == ["lectures note"]
+    assert response.json["results"]["notebooks"] == []
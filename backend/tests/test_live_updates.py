@@ -0,0 +1,153 @@
+# Testing the Server-Sent Events change feed
+import json
+import threading
+import time
+import pytest
+from pymongo import MongoClient
+from app import app, init_db
+import app as app_module
+from live_updates import CLIENT_HEADER, LIVE_EVENTS_COLLECTION, ChangeFeed
+
+# Use a dedicated test database
+TEST_DB_NAME = "note_app_live_updates_test"
+
+USER_ID = "live_user"
+BASE = f"/api/users/{USER_ID}/notebooks"
+EVENTS = f"/api/users/{USER_ID}/events"
+
+@pytest.fixture(scope="function")
+def client():
+    """Test client using a real test database"""
+    # Configure app for testing
+    app.config["TESTING"] = True
+    app.config["SECRET_KEY"] = "test_secret_key"
+    app.config["MONGO_URI"] = f"mongodb://localhost:27017/{TEST_DB_NAME}"
+    # Short streams so reading a response ends
+    app.config["LIVE_UPDATES_STREAM_SECONDS"] = 0.3
+    app.config["LIVE_UPDATES_HEARTBEAT_SECONDS"] = 0.1
+
+    # Clean the database before the test
+    mongo_client = MongoClient(app.config["MONGO_URI"])
+    mongo_client.drop_database(TEST_DB_NAME)
+    app.extensions["live_updates"].clear()
+
+    # Initialize the database
+    init_db(app)
+
+    # Create test client
+    with app.test_client() as client:
+        yield client
+
+    # Clean up after the test
+    app.config["LIVE_UPDATES_STREAM_SECONDS"] = 300
+    app.config["LIVE_UPDATES_HEARTBEAT_SECONDS"] = 15
+    app.config["LIVE_UPDATES_CHANGE_STREAMS"] = False
+    mongo_client.drop_database(TEST_DB_NAME)
+    mongo_client.close()
+
+def frames(response):
+    """The events of an SSE response as dicts of their fields, comments as {"comment": ...}"""
+    parsed = []
+    for block in response.get_data(as_text=True).split("\n\n"):
+        if not block:
+            continue
+        frame = {}
+        for line in block.split("\n"):
+            name, _, value = line.partition(":")
+            frame[name or "comment"] = value.strip()
+        if "data" in frame:
+            frame["data"] = json.loads(frame["data"])
+        parsed.append(frame)
+    return parsed
+
+def changes(response):
+    return [frame for frame in frames(response) if frame.get("event") == "change"]
+
+# --- Stream Tests ---
+
+def test_stream_pushes_new_changes(client):
+    """Test: a connected client receives compact events for changes made while it listens"""
+    received = {}
+
+    def listen():
+        response = app.test_client().get(EVENTS)
+        # The stream only runs while its body is read
+        response.get_data()
+        received["response"] = response
+
+    reader = threading.Thread(target=listen)
+    reader.start()
+    time.sleep(0.1)
+    notebook_id = client.post(BASE, json={"name": "Live"}).json["notebook"]["_id"]
+    section_id = client.post(f"{BASE}/{notebook_id}/sections", json={"title": "Now"}).json["section"]["_id"]
+    reader.join()
+
+    response = received["response"]
+    assert response.mimetype == "text/event-stream"
+    assert response.headers["Cache-Control"] == "no-cache"
+    events = changes(response)
+    assert [(event["data"]["type"], event["data"]["action"]) for event in events] == [
+        ("notebook", "created"), ("section", "created")
+    ]
+    section = events[1]["data"]
+    assert section["id"] == section_id and section["notebook_id"] == notebook_id
+    assert "updated_at" in section and "title" not in section
+
+def test_heartbeats_keep_idle_streams_open(client):
+    """Test: an idle stream sends the reconnect delay and heartbeat comments"""
+    parsed = frames(client.get(EVENTS))
+    assert parsed[0] == {"retry": "1000"}
+    assert {"comment": "heartbeat"} in parsed
+    # A new connection starts after the changes made before it
+    client.post(BASE, json={"name": "Earlier"})
+    assert not changes(client.get(EVENTS))
+
+def test_resume_from_last_event_id(client):
+    """Test: a reconnecting client gets exactly the events after the last one it saw"""
+    notebook_id = client.post(BASE, json={"name": "Offline"}).json["notebook"]["_id"]
+    first = changes(client.get(EVENTS, headers={"Last-Event-ID": "unknown"}))
+    assert first == []
+
+    feed = app.extensions["live_updates"]
+    last_id = feed.latest(USER_ID)
+    client.put(f"{BASE}/{notebook_id}", json={"name": "Renamed"})
+    client.delete(f"{BASE}/{notebook_id}")
+
+    missed = changes(client.get(EVENTS, headers={"Last-Event-ID": last_id}))
+    assert [event["data"]["action"] for event in missed] == ["updated", "deleted"]
+    assert missed[-1]["id"] == feed.latest(USER_ID)
+    # EventSource cannot set headers on its first request, the query parameter works too
+    assert len(changes(client.get(EVENTS, query_string={"last_event_id": last_id}))) == 2
+
+def test_evicted_event_id_resets(client):
+    """Test: a client whose last event left the buffer is told to refetch"""
+    response = client.get(EVENTS, headers={"Last-Event-ID": "0123456789abcdef01234567"})
+    assert [frame.get("event") for frame in frames(response)][:2] == [None, "reset"]
+
+def test_events_are_per_user_and_carry_client_id(client):
+    """Test: streams only see their user's changes, with the id of the client that made them"""
+    client.post("/api/users/someone_else/notebooks", json={"name": "Theirs"})
+    client.post(BASE, json={"name": "Mine"}, headers={CLIENT_HEADER: "window-1"})
+    feed = app.extensions["live_updates"]
+    assert len(feed.wait(USER_ID, None, 0)) == 1
+    assert feed.wait(USER_ID, None, 0)[0][1]["client_id"] == "window-1"
+
+# --- Feed Tests ---
+
+def test_ring_buffer_keeps_the_latest_events():
+    """Test: old events leave the buffer, resuming before them answers None (reset)"""
+    feed = ChangeFeed(buffer_size=3)
+    for number in range(5):
+        feed.append("u", str(number), {"n": number})
+    assert [event_id for event_id, _ in feed.wait("u", "2", 0)] == ["3", "4"]
+    assert feed.wait("u", "0", 0) is None
+    assert feed.wait("u", "4", 0.01) == []
+
+def test_change_stream_mode_shares_events(client):
+    """Test: with change streams events go through the live_events collection"""
+    app.config["LIVE_UPDATES_CHANGE_STREAMS"] = True
+    client.post(BASE, json={"name": "Shared"})
+    document = app_module.db[LIVE_EVENTS_COLLECTION].find_one({"user_id": USER_ID})
+    assert document["change"]["type"] == "notebook"
+    # Filled by the change stream of every process
+    assert app.extensions["live_updates"].latest(USER_ID) is None
@@ -0,0 +1,121 @@
+# Testing the /metrics endpoint and the metric primitives
+import threading
+import pytest
+from pymongo import MongoClient
+from app import app, init_db
+from metrics import Counter, Histogram, Registry
+
+# Use a dedicated test database
+TEST_DB_NAME = "note_app_metrics_test"
+
+@pytest.fixture(scope="function")
+def client():
+    """Test client using a real test database"""
+    # Configure app for testing
+    app.config["TESTING"] = True
+    app.config["SECRET_KEY"] = "test_secret_key"
+    app.config["MONGO_URI"] = f"mongodb://localhost:27017/{TEST_DB_NAME}"
+
+    # Clean the database before the test
+    mongo_client = MongoClient(app.config["MONGO_URI"])
+    mongo_client.drop_database(TEST_DB_NAME)
+
+    # Initialize the database
+    init_db(app)
+
+    # Create test client
+    with app.test_client() as client:
+        yield client
+
+    # Clean up after the test
+    mongo_client.drop_database(TEST_DB_NAME)
+    mongo_client.close()
+
+def sample_value(text, line_prefix):
+    """Return the value of the first exposition line starting with line_prefix"""
+    for line in text.splitlines():
+        if line.startswith(line_prefix):
+            return float(line.rsplit(" ", 1)[1])
+    return None
+
+# --- Endpoint Tests ---
+
+def test_metrics_endpoint_format(client):
+    """Test: /metrics returns the text exposition format"""
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    body = response.get_data(as_text=True)
+    assert "# TYPE http_requests_total counter" in body
+    assert "# TYPE http_request_duration_seconds histogram" in body
+    assert "# TYPE mongodb_commands_total counter" in body
+
+def test_metrics_counts_requests_by_route_template(client):
+    """Test: requests are counted per route template, not per raw path"""
+    prefix = 'http_requests_total{route="/api/users/<user_id>/notebooks",method="GET",status="200"}'
+    before = sample_value(client.get("/metrics").get_data(as_text=True), prefix) or 0
+
+    client.get("/api/users/metrics_user_a/notebooks")
+    client.get("/api/users/metrics_user_b/notebooks")
+
+    body = client.get("/metrics").get_data(as_text=True)
+    assert sample_value(body, prefix) == before + 2
+    assert "metrics_user_a" not in body
+
+def test_metrics_latency_histogram(client):
+    """Test: latency histogram exposes buckets, sum and count"""
+    client.get("/api/")
+    body = client.get("/metrics").get_data(as_text=True)
+    labels = 'route="/api/",method="GET"'
+    assert f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}}' in body
+    count = sample_value(body, f"http_request_duration_seconds_count{{{labels}}}")
+    assert count is not None and count >= 1
+    assert sample_value(body, f"http_response_size_bytes_count{{{labels}}}") >= 1
+
+def test_metrics_unmatched_route(client):
+    """Test: unknown paths are grouped under a single label"""
+    client.get("/does/not/exist")
+    body = client.get("/metrics").get_data(as_text=True)
+    assert 'route="unmatched",method="GET",status="404"' in body
+
+def test_metrics_mongo_commands(client):
+    """Test: mongo commands are recorded by command and collection"""
+    client.post("/api/users/metrics_user/notebooks", json={"name": "Metrics Notebook"})
+    client.get("/api/users/metrics_user/notebooks")
+    body = client.get("/metrics").get_data(as_text=True)
+    assert 'mongodb_commands_total{command="insert",collection="notebooks",status="ok"}' in body
+    assert 'mongodb_commands_total{command="find",collection="notebooks",status="ok"}' in body
+
+# --- Primitive Tests ---
+
+def test_counter_sums_thread_shards():
+    """Test: counter values written from several threads are all collected"""
+    counter = Counter("test_total", "Test counter.", ("kind",))
+
+    def work():
+        for _ in range(1000):
+            counter.inc((("kind", "a"),))
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    counter.inc((("kind", "a"),))
+
+    assert list(counter.samples()) == [("test_total", (("kind", "a"),), 4001)]
+
+def test_histogram_buckets_are_cumulative():
+    """Test: histogram buckets are cumulative and include +Inf"""
+    histogram = Histogram("test_seconds", "Test histogram.", buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 5.0):
+        histogram.observe(value)
+
+    registry = Registry()
+    registry.register(histogram)
+    body = registry.render()
+    assert 'test_seconds_bucket{le="0.1"} 1' in body
+    assert 'test_seconds_bucket{le="1.0"} 3' in body
+    assert 'test_seconds_bucket{le="+Inf"} 4' in body
+    assert "test_seconds_count 4" in body
+    assert sample_value(body, "test_seconds_sum") == pytest.approx(6.05)
@@ -0,0 +1,102 @@
+# Testing schema migrations
+import logging
+import pytest
+from pymongo import MongoClient
+import db_budget
+import migrations
+from app import app, init_db
+
+# Use a dedicated test database
+TEST_DB_NAME = "note_app_migrations_test"
+
+@pytest.fixture(scope="function")
+def db():
+    """Fresh test database, migrated by init_db since the app is in testing mode"""
+    # Configure app for testing
+    app.config["TESTING"] = True
+    app.config["SECRET_KEY"] = "test_secret_key"
+    app.config["MONGO_URI"] = f"mongodb://localhost:27017/{TEST_DB_NAME}"
+
+    # Clean the database before the test
+    mongo_client = MongoClient(app.config["MONGO_URI"])
+    mongo_client.drop_database(TEST_DB_NAME)
+
+    # Initialize the database
+    yield init_db(app)
+
+    # Clean up after the test
+    mongo_client.drop_database(TEST_DB_NAME)
+    mongo_client.close()
+
+def count_ops(action):
+    """Number of database commands action sends"""
+    stats = db_budget.RequestDbStats()
+    token = db_budget._current.set(stats)
+    try:
+        action()
+    finally:
+        db_budget._current.reset(token)
+    return stats.ops
+
+# --- Migration Tests ---
+
+def test_init_db_migrates_fresh_database(db):
+    """Test: in testing mode init_db brings a fresh database to the latest version"""
+    assert migrations.current_version(db) == migrations.target_version()
+    assert "user_id_1" in db.notes.index_information()
+    history = db[migrations.SCHEMA_COLLECTION].find_one({"_id": migrations.SCHEMA_DOC_ID})["history"]
+    assert [entry["version"] for entry in history] == [m.version for m in migrations.MIGRATIONS]
+
+def test_migrate_is_idempotent(db):
+    """Test: an up to date database is checked with one query and nothing is applied"""
+    applied = []
+    assert count_ops(lambda: applied.extend(migrations.migrate(db))) == 1
+    assert applied == []
+
+def test_migrate_reports_progress(db):
+    """Test: pending migrations are applied in order with progress messages"""
+    db[migrations.SCHEMA_COLLECTION].delete_many({})
+    messages = []
+    applied = migrations.migrate(db, report=lambda message, done=None, total=None: messages.append(message))
+    assert applied == [m.version for m in migrations.MIGRATIONS]
+    assert messages[0].startswith("Applying 1:")
+    assert not db[migrations.SCHEMA_COLLECTION].find_one({"_id": migrations.SCHEMA_DOC_ID})["locked"]
+
+def test_migrate_refuses_when_locked(db):
+    """Test: a second migrator fails instead of running migrations twice"""
+    db[migrations.SCHEMA_COLLECTION].update_one(
+        {"_id": migrations.SCHEMA_DOC_ID}, {"$set": {"version": 0, "locked": True}}
+    )
+    with pytest.raises(migrations.MigrationLockedError):
+        migrations.migrate(db)
+
+# --- Startup Check Tests ---
+
+def test_check_schema_uses_one_query(db):
+    """Test: the startup check reads the version with a single query"""
+    assert count_ops(lambda: migrations.check_schema(db, strict=True)) == 1
+
+def test_check_schema_warns_on_old_version(db, caplog):
+    """Test: an outdated database logs a warning, or raises in strict mode"""
+    db[migrations.SCHEMA_COLLECTION].update_one({"_id": migrations.SCHEMA_DOC_ID}, {"$set": {"version": 0}})
+    with caplog.at_level(logging.WARNING, logger="migrations"):
+        assert migrations.check_schema(db) == 0
+    assert "schema migrate" in caplog.text
+    with pytest.raises(migrations.SchemaVersionError):
+        migrations.check_schema(db, strict=True)
+
+# --- CLI Tests ---
+
+def test_cli_status_and_migrate(db):
+    """Test: the schema commands show pending migrations and apply them"""
+    db[migrations.SCHEMA_COLLECTION].delete_many({})
+    runner = app.test_cli_runner()
+
+    status = runner.invoke(args=["schema", "status"])
+    assert "Database version: 0" in status.output
+    assert "Pending 1:" in status.output
+
+    result = runner.invoke(args=["schema", "migrate"])
+    assert result.exit_code == 0
+    assert "Applied 1" in result.output
+    assert migrations.current_version(db) == migrations.target_version()
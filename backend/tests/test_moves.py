@@ -0,0 +1,185 @@
+# Testing the move endpoints and rank key ordering of sections and notes
+import random
+import pytest
+from bson import ObjectId
+from pymongo import MongoClient
+from app import app, init_db
+import app as app_module
+from moves import backfill_ranks
+from rank_keys import key_between, keys_between
+from search import reset_search_backend
+
+# Use a dedicated test database
+TEST_DB_NAME = "note_app_moves_test"
+
+USER_ID = "move_user"
+BASE = f"/api/users/{USER_ID}/notebooks"
+
+@pytest.fixture(scope="function")
+def client(tmp_path):
+    """Test client using a real test database"""
+    # Configure app for testing
+    app.config["TESTING"] = True
+    app.config["SECRET_KEY"] = "test_secret_key"
+    app.config["MONGO_URI"] = f"mongodb://localhost:27017/{TEST_DB_NAME}"
+    app.config["SEARCH_BACKEND"] = "inverted"
+    app.config["SEARCH_INDEX_DIR"] = str(tmp_path)
+    reset_search_backend(app)
+
+    # Clean the database before the test
+    mongo_client = MongoClient(app.config["MONGO_URI"])
+    mongo_client.drop_database(TEST_DB_NAME)
+
+    # Initialize the database
+    init_db(app)
+
+    # Create test client
+    with app.test_client() as client:
+        yield client
+
+    # Clean up after the test
+    reset_search_backend(app)
+    app.config["SEARCH_BACKEND"] = "mongo"
+    mongo_client.drop_database(TEST_DB_NAME)
+    mongo_client.close()
+
+@pytest.fixture
+def tree(client):
+    """Two notebooks, the first with two sections, the first section with three notes"""
+    ids = {}
+    for name, labels in (("first", ["course"]), ("second", ["archive"])):
+        ids[name] = client.post(BASE, json={"name": name, "labels": labels}).json["notebook"]["_id"]
+    ids["sections"] = [
+        client.post(f"{BASE}/{ids['first']}/sections", json={"title": title}).json["section"]["_id"]
+        for title in ("intro", "outro")
+    ]
+    ids["notes"] = [
+        client.post(f"{BASE}/{ids['first']}/sections/{ids['sections'][0]}/notes",
+                    json={"title": title, "content": f"{title} content", "labels": ["draft"]}).json["note"]["_id"]
+        for title in ("alpha", "beta", "gamma")
+    ]
+    return ids
+
+def note_titles(client, notebook_id, section_id):
+    notes = client.get(f"{BASE}/{notebook_id}/sections/{section_id}/notes").json["notes"]
+    return [note["title"] for note in notes]
+
+def move_note(client, tree, note_id, **body):
+    url = f"{BASE}/{tree['first']}/sections/{tree['sections'][0]}/notes/{note_id}/move"
+    return client.post(url, json=body)
+
+# --- Rank Key Tests ---
+
+def test_keys_stay_ordered_under_random_inserts():
+    """Test: a key generated between two neighbours always sorts between them"""
+    keys = [key_between(None, None)]
+    rng = random.Random(7)
+    for _ in range(2000):
+        position = rng.randint(0, len(keys))
+        lower = keys[position - 1] if position > 0 else None
+        upper = keys[position] if position < len(keys) else None
+        keys.insert(position, key_between(lower, upper))
+    assert keys == sorted(keys)
+    assert len(set(keys)) == len(keys)
+
+def test_keys_between():
+    """Test: bulk keys are ordered, inside the bounds, and appending stays short"""
+    keys = keys_between("a0", "a1", 50)
+    assert keys == sorted(keys) and all("a0" < key < "a1" for key in keys)
+    assert keys_between(None, None, 3) == ["a0", "a1", "a2"]
+    assert max(len(key) for key in keys_between(None, None, 1000)) == 3
+    with pytest.raises(ValueError):
+        key_between("a1", "a0")
+
+# --- Endpoint Tests ---
+
+def test_created_documents_are_listed_in_creation_order(client, tree):
+    """Test: new sections and notes are ranked after their siblings"""
+    assert note_titles(client, tree["first"], tree["sections"][0]) == ["alpha", "beta", "gamma"]
+    sections = client.get(f"{BASE}/{tree['first']}/sections").json["sections"]
+    assert [section["title"] for section in sections] == ["intro", "outro"]
+
+def test_reorder_only_writes_the_moved_note(client, tree):
+    """Test: moving a note between two others leaves their ranks alone"""
+    alpha, beta, gamma = tree["notes"]
+    ranks = lambda: {str(note["_id"]): note["rank"] for note in app_module.notes_collection.find()}
+    before = ranks()
+
+    response = move_note(client, tree, gamma, after=alpha)
+    assert response.status_code == 200
+    assert note_titles(client, tree["first"], tree["sections"][0]) == ["alpha", "gamma", "beta"]
+    after = ranks()
+    assert after[gamma] == response.json["note"]["rank"] != before[gamma]
+    assert (after[alpha], after[beta]) == (before[alpha], before[beta])
+
+    assert move_note(client, tree, beta, before=alpha).status_code == 200
+    assert note_titles(client, tree["first"], tree["sections"][0]) == ["beta", "alpha", "gamma"]
+    # Without an anchor the note goes last
+    assert move_note(client, tree, beta).status_code == 200
+    assert note_titles(client, tree["first"], tree["sections"][0]) == ["alpha", "gamma", "beta"]
+
+def test_move_note_to_another_section(client, tree):
+    """Test: a note moved to a section of another notebook keeps its id and content"""
+    section_id = client.post(f"{BASE}/{tree['second']}/sections", json={"title": "kept"}).json["section"]["_id"]
+    note_id = tree["notes"][1]
+    response = move_note(client, tree, note_id, section_id=section_id)
+    assert response.status_code == 200
+    assert response.json["note"]["notebook_id"] == tree["second"]
+
+    note = client.get(f"{BASE}/{tree['second']}/sections/{section_id}/notes/{note_id}").json["note"]
+    assert note["content"] == "beta content"
+    assert note["notebook_id"] == tree["second"]
+    assert sorted(note["effective_labels"]) == ["archive", "draft"]
+    assert note_titles(client, tree["first"], tree["sections"][0]) == ["alpha", "gamma"]
+
+def test_move_section_updates_its_notes(client, tree):
+    """Test: the notes of a moved section follow it to the new notebook with one update"""
+    section_id = tree["sections"][0]
+    url = f"{BASE}/{tree['first']}/sections/{section_id}/move"
+    assert client.post(url, json={"notebook_id": tree["second"]}).status_code == 200
+
+    assert [section["title"] for section in client.get(f"{BASE}/{tree['second']}/sections").json["sections"]] == ["intro"]
+    notes = list(app_module.notes_collection.find({"section_id": ObjectId(section_id)}))
+    assert len(notes) == 3
+    assert all(note["notebook_id"] == ObjectId(tree["second"]) for note in notes)
+    assert all(sorted(note["effective_labels"]) == ["archive", "draft"] for note in notes)
+
+    # Reorder within the new notebook
+    other = client.post(f"{BASE}/{tree['second']}/sections", json={"title": "other"}).json["section"]["_id"]
+    url = f"{BASE}/{tree['second']}/sections/{other}/move"
+    assert client.post(url, json={"before": section_id}).status_code == 200
+    sections = client.get(f"{BASE}/{tree['second']}/sections").json["sections"]
+    assert [section["title"] for section in sections] == ["other", "intro"]
+
+def test_search_index_follows_moves(client, tree):
+    """Test: moved notes survive deleting their old notebook in the search index"""
+    assert len(client.get(f"/api/users/{USER_ID}/search", query_string={"q": "alpha"}).json["results"]["notes"]) == 1
+    url = f"{BASE}/{tree['first']}/sections/{tree['sections'][0]}/move"
+    client.post(url, json={"notebook_id": tree["second"]})
+    client.delete(f"{BASE}/{tree['first']}")
+    assert len(client.get(f"/api/users/{USER_ID}/search", query_string={"q": "alpha"}).json["results"]["notes"]) == 1
+
+def test_invalid_moves(client, tree):
+    """Test: bad anchors and targets are rejected without changing anything"""
+    alpha, beta, _ = tree["notes"]
+    assert move_note(client, tree, alpha, after=alpha).status_code == 400
+    assert move_note(client, tree, alpha, after="not-an-id").status_code == 400
+    assert move_note(client, tree, alpha, after=str(ObjectId())).status_code == 400
+    assert move_note(client, tree, alpha, section_id=str(ObjectId())).status_code == 404
+    assert move_note(client, tree, str(ObjectId())).status_code == 404
+    assert note_titles(client, tree["first"], tree["sections"][0]) == ["alpha", "beta", "gamma"]
+
+# --- Migration Tests ---
+
+def test_backfill_ranks_existing_documents(client, tree):
+    """Test: documents from before ranks existed are ranked in creation order"""
+    app_module.notes_collection.update_many({}, {"$unset": {"rank": ""}})
+    assert backfill_ranks(app_module.notes_collection, "section_id") == 3
+    assert note_titles(client, tree["first"], tree["sections"][0]) == ["alpha", "beta", "gamma"]
+    assert backfill_ranks(app_module.notes_collection, "section_id") == 0
+
+    # An unranked anchor ranks its siblings on first use
+    app_module.notes_collection.update_many({}, {"$unset": {"rank": ""}})
+    alpha, _, gamma = tree["notes"]
+    assert move_note(client, tree, alpha, after=gamma).status_code == 200
+    assert note_titles(client, tree["first"], tree["sections"][0]) == ["beta", "gamma", "alpha"]
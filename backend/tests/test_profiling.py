@@ -0,0 +1,125 @@
+# Testing the on-demand request profiler
+import pytest
+from pymongo import MongoClient
+from app import app, init_db
+from profiling import SamplingProfiler, sign_profile_token, verify_profile_token
+
+# Use a dedicated test database
+TEST_DB_NAME = "note_app_profiling_test"
+
+@pytest.fixture(scope="function")
+def client(tmp_path):
+    """Test client writing profiles to a temporary directory"""
+    # Configure app for testing
+    app.config["TESTING"] = True
+    app.config["SECRET_KEY"] = "test_secret_key"
+    app.config["MONGO_URI"] = f"mongodb://localhost:27017/{TEST_DB_NAME}"
+    app.config["PROFILE_DIR"] = str(tmp_path / "profiles")
+    app.config["PROFILE_INTERVAL_MS"] = 1
+
+    # Clean the database before the test
+    mongo_client = MongoClient(app.config["MONGO_URI"])
+    mongo_client.drop_database(TEST_DB_NAME)
+
+    # Initialize the database
+    init_db(app)
+
+    # Create test client
+    with app.test_client() as client:
+        yield client
+
+    # Clean up after the test
+    client.put("/admin/profiling", json={"sample_rate": None})
+    mongo_client.drop_database(TEST_DB_NAME)
+    mongo_client.close()
+
+def register_user(client, username, headers=None):
+    """Registration hashes the password with bcrypt, slow enough to collect samples"""
+    return client.post("/api/register", json={
+        "email": f"{username}@example.com",
+        "username": username,
+        "password": "password123"
+    }, headers=headers or {})
+
+# --- Token Tests ---
+
+def test_profile_token_roundtrip():
+    """Test: a signed token verifies with the same secret only"""
+    token = sign_profile_token("secret")
+    assert verify_profile_token("secret", token)
+    assert not verify_profile_token("other", token)
+
+def test_profile_token_expired():
+    """Test: expired tokens are rejected"""
+    token = sign_profile_token("secret", ttl=-1)
+    assert not verify_profile_token("secret", token)
+
+def test_sampling_profiler_collapsed_stacks():
+    """Test: the profiler produces collapsed stacks of the sampled thread"""
+    import threading
+    import time
+
+    def busy():
+        end = time.perf_counter() + 0.05
+        while time.perf_counter() < end:
+            pass
+
+    profiler = SamplingProfiler(threading.get_ident(), interval=0.001).start()
+    busy()
+    profiler.stop()
+    output = profiler.collapsed()
+    assert profiler.sample_count > 0
+    assert "busy" in output
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in output.splitlines())
+
+# --- Endpoint Tests ---
+
+def test_signed_header_profiles_request(client):
+    """Test: a request with a valid X-Profile header is profiled and listed"""
+    token = sign_profile_token(app.config["SECRET_KEY"])
+    response = register_user(client, "profiled_user", {"X-Profile": token})
+    assert response.status_code == 201
+
+    profiles = client.get("/admin/profiles").json["profiles"]
+    assert len(profiles) == 1
+    assert "POST_api_register" in profiles[0]["name"]
+
+    download = client.get(f"/admin/profiles/{profiles[0]['name']}")
+    assert download.status_code == 200
+    assert "app.py:register" in download.get_data(as_text=True)
+
+def test_invalid_header_is_ignored(client):
+    """Test: an unsigned X-Profile header does not trigger profiling"""
+    register_user(client, "unprofiled_user", {"X-Profile": "1.forged"})
+    assert client.get("/admin/profiles").json["profiles"] == []
+
+def test_sample_rate_toggle(client):
+    """Test: setting the sample rate to 1 profiles every request"""
+    response = client.put("/admin/profiling", json={"sample_rate": 1})
+    assert response.status_code == 200
+    assert client.get("/admin/profiling").json["sample_rate"] == 1
+
+    register_user(client, "sampled_user")
+    assert len(client.get("/admin/profiles").json["profiles"]) >= 1
+
+def test_sample_rate_invalid(client):
+    """Test: sample rates outside 0..1 are rejected"""
+    response = client.put("/admin/profiling", json={"sample_rate": 5})
+    assert response.status_code == 400
+    for rate in (True, False, "0.5"):
+        assert client.put("/admin/profiling", json={"sample_rate": rate}).status_code == 400
+    for body in ("null", "[1]", "not json"):
+        assert client.put("/admin/profiling", data=body, content_type="application/json").status_code == 400
+
+def test_profile_token_ttl_invalid(client):
+    """Test: token lifetimes that are not a positive number of seconds are rejected"""
+    for ttl in ("soon", "0", "-60"):
+        assert client.post(f"/admin/profiling/token?ttl={ttl}").status_code == 400
+    response = client.post("/admin/profiling/token?ttl=60")
+    assert response.status_code == 201
+    assert verify_profile_token(app.config["SECRET_KEY"], response.json["token"])
+
+def test_profile_download_rejects_other_files(client):
+    """Test: only profile files can be downloaded"""
+    response = client.get("/admin/profiles/..%2Fapp.py")
+    assert response.status_code == 404
@@ -0,0 +1,139 @@
+# Testing ObjectId references and the migration converting string references
+import datetime
+import pytest
+from bson import ObjectId
+from pymongo import MongoClient
+from app import app, init_db
+import app as app_module
+import migrations
+import references
+from references import match, match_any, owner, ref
+
+# Use a dedicated test database
+TEST_DB_NAME = "note_app_references_test"
+
+# A user id as issued by /api/register
+USER_ID = str(ObjectId())
+
+@pytest.fixture(scope="function")
+def client():
+    """Test client using a real test database"""
+    # Configure app for testing
+    app.config["TESTING"] = True
+    app.config["SECRET_KEY"] = "test_secret_key"
+    app.config["MONGO_URI"] = f"mongodb://localhost:27017/{TEST_DB_NAME}"
+
+    # Clean the database before the test
+    mongo_client = MongoClient(app.config["MONGO_URI"])
+    mongo_client.drop_database(TEST_DB_NAME)
+
+    # Initialize the database
+    init_db(app)
+
+    # Create test client
+    with app.test_client() as client:
+        yield client
+
+    # Clean up after the test
+    references.set_dual_read(False)
+    mongo_client.drop_database(TEST_DB_NAME)
+    mongo_client.close()
+
+def legacy_tree(user_id=USER_ID):
+    """A notebook, section and note stored with string references, as before the migration"""
+    now = datetime.datetime.utcnow()
+    notebook_id = app_module.notebooks_collection.insert_one(
+        {"user_id": user_id, "name": "Legacy", "labels": [], "created_at": now, "updated_at": now}
+    ).inserted_id
+    section_id = app_module.sections_collection.insert_one(
+        {"user_id": user_id, "notebook_id": str(notebook_id), "title": "Old section", "labels": [],
+         "created_at": now, "updated_at": now}
+    ).inserted_id
+    note_id = app_module.notes_collection.insert_one(
+        {"user_id": user_id, "notebook_id": str(notebook_id), "section_id": str(section_id), "title": "Old note",
+         "content": "written before the migration", "labels": [], "created_at": now, "updated_at": now}
+    ).inserted_id
+    return str(notebook_id), str(section_id), str(note_id)
+
+# --- Helper Tests ---
+
+def test_ref_converts_object_id_strings_only():
+    """Test: hex ids become ObjectIds, other user ids stay strings"""
+    oid = ObjectId()
+    assert ref(str(oid)) == oid
+    assert ref(oid) == oid
+    assert ref("demo_user") == "demo_user"
+    assert ref("0" * 23) == "0" * 23
+
+def test_match_during_and_after_migration():
+    """Test: dual read matches both forms, afterwards only the native one"""
+    oid = ObjectId()
+    references.set_dual_read(True)
+    try:
+        assert match(str(oid)) == {"$in": [oid, str(oid)]}
+        assert match_any([oid]) == [oid, str(oid)]
+        assert owner("demo_user") == {"user_id": "demo_user"}
+    finally:
+        references.set_dual_read(False)
+    assert match(str(oid)) == oid
+    assert owner(str(oid), notebook_id=str(oid)) == {"user_id": oid, "notebook_id": oid}
+
+# --- Endpoint Tests ---
+
+def test_new_documents_store_object_ids(client):
+    """Test: writes store native references and the API still returns strings"""
+    notebook_id = client.post(f"/api/users/{USER_ID}/notebooks", json={"name": "New"}).json["notebook"]["_id"]
+    response = client.post(f"/api/users/{USER_ID}/notebooks/{notebook_id}/sections", json={"title": "S"})
+    section = response.json["section"]
+    assert section["notebook_id"] == notebook_id
+    stored = app_module.sections_collection.find_one({"_id": ObjectId(section["_id"])})
+    assert stored["notebook_id"] == ObjectId(notebook_id)
+    assert stored["user_id"] == ObjectId(USER_ID)
+
+def test_dual_read_finds_legacy_documents(client):
+    """Test: while the migration runs, endpoints find documents in both forms"""
+    references.set_dual_read(True)
+    notebook_id, section_id, note_id = legacy_tree()
+    client.post(f"/api/users/{USER_ID}/notebooks/{notebook_id}/sections", json={"title": "New section"})
+
+    sections = client.get(f"/api/users/{USER_ID}/notebooks/{notebook_id}/sections").json["sections"]
+    assert sorted(section["title"] for section in sections) == ["New section", "Old section"]
+    response = client.get(f"/api/users/{USER_ID}/notebooks/{notebook_id}/sections/{section_id}/notes/{note_id}")
+    assert response.status_code == 200
+    assert len(client.get(f"/api/users/{USER_ID}/notebooks").json["notebooks"]) == 1
+
+    # Deleting the notebook cascades to children in both forms
+    assert client.delete(f"/api/users/{USER_ID}/notebooks/{notebook_id}").status_code == 200
+    assert app_module.sections_collection.count_documents({}) == 0
+    assert app_module.notes_collection.count_documents({}) == 0
+
+# --- Migration Tests ---
+
+def test_migration_converts_and_resumes(client):
+    """Test: string references are rewritten in batches and a rerun has nothing left to do"""
+    references.set_dual_read(True)
+    legacy = [legacy_tree() for _ in range(3)]
+    legacy_tree("demo_user")
+    messages = []
+    report = lambda message, done=None, total=None: messages.append((message, done, total))
+
+    assert migrations.convert_references(app_module.notes_collection, references.REFERENCE_FIELDS, report,
+                                         batch_size=2) == 4
+    assert messages[-1] == ("notes: references", 4, 4)
+    assert migrations.convert_references(app_module.notes_collection, references.REFERENCE_FIELDS, report) == 0
+
+    notebook_id, section_id, note_id = legacy[0]
+    note = app_module.notes_collection.find_one({"_id": ObjectId(note_id)})
+    assert note["notebook_id"] == ObjectId(notebook_id) and note["section_id"] == ObjectId(section_id)
+    assert note["user_id"] == ObjectId(USER_ID)
+    # User ids that are not ObjectIds are left alone, their other references are converted
+    demo_note = app_module.notes_collection.find_one({"user_id": "demo_user"})
+    assert isinstance(demo_note["notebook_id"], ObjectId)
+
+    # The whole migration brings every collection over
+    db = app_module.db
+    db[migrations.SCHEMA_COLLECTION].update_one({"_id": migrations.SCHEMA_DOC_ID},
+                                                {"$set": {"version": migrations.REFERENCES_VERSION - 1}})
+    assert migrations.migrate(db, target=migrations.REFERENCES_VERSION) == [migrations.REFERENCES_VERSION]
+    assert db.sections.count_documents({"notebook_id": {"$type": "string"}}) == 0
+    assert db.notebooks.count_documents({"user_id": {"$type": "string"}}) == 1
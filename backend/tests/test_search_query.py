@@ -0,0 +1,188 @@
+# Testing the structured search query language
+import datetime
+import pytest
+from pymongo import MongoClient
+from app import app, init_db
+from search import reset_search_backend
+from search_query import NEVER, DateRange, Filter, Group, QuerySyntaxError, Term, compile_query, is_plain, parse_query
+
+# Use a dedicated test database
+TEST_DB_NAME = "note_app_search_query_test"
+
+USER_ID = "query_user"
+
+@pytest.fixture(scope="function", params=["mongo", "inverted"])
+def client(request, tmp_path):
+    """Test client using a real test database, once per search backend"""
+    # Configure app for testing
+    app.config["TESTING"] = True
+    app.config["SECRET_KEY"] = "test_secret_key"
+    app.config["MONGO_URI"] = f"mongodb://localhost:27017/{TEST_DB_NAME}"
+    app.config["SEARCH_BACKEND"] = request.param
+    app.config["SEARCH_INDEX_DIR"] = str(tmp_path)
+    reset_search_backend(app)
+
+    # Clean the database before the test
+    mongo_client = MongoClient(app.config["MONGO_URI"])
+    mongo_client.drop_database(TEST_DB_NAME)
+
+    # Initialize the database
+    init_db(app)
+
+    # Create test client
+    with app.test_client() as client:
+        yield client
+
+    # Clean up after the test
+    reset_search_backend(app)
+    app.config["SEARCH_BACKEND"] = "mongo"
+    mongo_client.drop_database(TEST_DB_NAME)
+    mongo_client.close()
+
+@pytest.fixture
+def content(client):
+    """Two notebooks of python notes with different labels and wording"""
+    notebook_ids = {}
+    for name in ("Work", "Personal"):
+        response = client.post(f"/api/users/{USER_ID}/notebooks", json={"name": name})
+        notebook_ids[name] = response.json["notebook"]["_id"]
+    notes = [
+        ("Work", "Python deployment", "deploy the python service with docker", ["ops"]),
+        ("Work", "Python testing", "python unit tests with pytest fixtures", ["dev"]),
+        ("Personal", "Python games", "a snake game written in python", ["fun"]),
+        ("Personal", "Recipes", "python shaped bread, a family recipe", ["fun", "food"]),
+    ]
+    for notebook, title, body, labels in notes:
+        notebook_id = notebook_ids[notebook]
+        section_id = client.post(f"/api/users/{USER_ID}/notebooks/{notebook_id}/sections",
+                                 json={"title": f"{title} section"}).json["section"]["_id"]
+        client.post(f"/api/users/{USER_ID}/notebooks/{notebook_id}/sections/{section_id}/notes",
+                    json={"title": title, "content": body, "labels": labels})
+    return notebook_ids
+
+def note_titles(client, query, **params):
+    response = client.get(f"/api/users/{USER_ID}/search", query_string=dict(params, q=query))
+    assert response.status_code == 200, response.json
+    return sorted(note["title"] for note in response.json["results"]["notes"])
+
+# --- Parser Tests ---
+
+def test_parse_operators():
+    """Test: phrases, exclusions, fields and OR groups are parsed"""
+    tree = parse_query('"unit tests" -docker title:python label:dev (a OR b) notebook:"My Work"')
+    first, second, third, fourth, fifth, sixth = tree.children
+    assert isinstance(first, Term) and first.phrase and first.value == "unit tests"
+    assert isinstance(second, Term) and second.negated and second.value == "docker"
+    assert isinstance(third, Term) and third.field == "title"
+    assert isinstance(fourth, Filter) and fourth.field == "label" and fourth.value == "dev"
+    assert isinstance(fifth, Group) and fifth.operator == "OR" and len(fifth.children) == 2
+    assert isinstance(sixth, Filter) and sixth.value == "My Work"
+
+def test_parse_dates():
+    """Test: date comparisons, days, months and ranges become half open ranges"""
+    after = parse_query("updated:>2026-01-01").children[0]
+    assert isinstance(after, DateRange)
+    assert after.start == datetime.datetime(2026, 1, 2) and after.end is None
+    month = parse_query("created:2026-02").children[0]
+    assert (month.start, month.end) == (datetime.datetime(2026, 2, 1), datetime.datetime(2026, 3, 1))
+    december = parse_query("updated:<=2025-12").children[0]
+    assert december.start is None and december.end == datetime.datetime(2026, 1, 1)
+    span = parse_query("updated:2025..2026-06").children[0]
+    assert (span.start, span.end) == (datetime.datetime(2025, 1, 1), datetime.datetime(2026, 7, 1))
+
+def test_plain_queries_stay_plain():
+    """Test: queries without operators are searched as before, unknown prefixes are text"""
+    assert is_plain(parse_query("python decorators"))
+    assert is_plain(parse_query("c++ std::vector"))
+    assert not is_plain(parse_query("python -java"))
+
+@pytest.mark.parametrize("query", ['(python', 'python)', "a OR", "()", "updated:>tomorrow", "updated:2026-13-01",
+                                   "label:"])
+def test_syntax_errors(query):
+    """Test: malformed queries raise QuerySyntaxError"""
+    with pytest.raises(QuerySyntaxError):
+        parse_query(query)
+
+# --- Compiler Tests ---
+
+def test_compile_for_mongo_text():
+    """Test: words, phrases and exclusions go to $text, fields and dates become ordered filters"""
+    compiled = compile_query(parse_query('python "unit tests" -docker content:pytest updated:>=2026-01-01 label:dev'),
+                             USER_ID, None, "mongo")
+    assert compiled.text == 'python "unit tests" pytest -docker'
+    assert compiled.labels == ["dev"]
+    notes = compiled.filters["notes"]
+    # Indexed range first, regex last
+    assert list(notes[0]) == ["updated_at"]
+    assert notes[1] == {"content": {"$regex": r"\bpytest", "$options": "i"}}
+    # Only notes have content
+    assert compiled.filters["notebooks"] == [NEVER]
+
+def test_compile_for_other_backends():
+    """Test: backends ranking plain words get phrases and exclusions as filters"""
+    compiled = compile_query(parse_query('"unit tests" -docker'), USER_ID, None, "inverted")
+    assert compiled.text == "unit tests"
+    notes = compiled.filters["notes"]
+    assert {"$or": [{"title": {"$regex": r"\bunit\s+tests", "$options": "i"}},
+                    {"content": {"$regex": r"\bunit\s+tests", "$options": "i"}}]} in notes
+    assert {"$nor": [{"$or": [{"title": {"$regex": r"\bdocker", "$options": "i"}},
+                              {"content": {"$regex": r"\bdocker", "$options": "i"}}]}]} in notes
+
+# --- Endpoint Tests ---
+
+def test_exclusion_and_phrase(client, content):
+    """Test: excluded words remove results, phrases need the words together"""
+    assert note_titles(client, "python -docker") == ["Python games", "Python testing", "Recipes"]
+    assert note_titles(client, '"snake game"') == ["Python games"]
+
+def test_fuzzy_keeps_exclusion_and_phrase(client, content):
+    """Test: typo correction does not turn an excluded word into a searched one"""
+    assert note_titles(client, "pyton -docker", fuzzy=1) == ["Python games", "Python testing", "Recipes"]
+    assert note_titles(client, 'pyton "snake game"', fuzzy=1) == ["Python games"]
+
+def test_field_scoping(client, content):
+    """Test: title: only matches titles"""
+    assert note_titles(client, "title:python") == ["Python deployment", "Python games", "Python testing"]
+
+def test_label_and_notebook_filters(client, content):
+    """Test: labels and notebooks by name filter the results"""
+    assert note_titles(client, "python label:fun") == ["Python games", "Recipes"]
+    assert note_titles(client, "python notebook:work") == ["Python deployment", "Python testing"]
+    assert note_titles(client, "python -label:fun") == ["Python deployment", "Python testing"]
+    assert note_titles(client, "python notebook:Nowhere") == []
+
+def test_or_group(client, content):
+    """Test: OR groups match any alternative"""
+    assert note_titles(client, "python (label:ops OR label:food)") == ["Python deployment", "Recipes"]
+
+def test_date_filters(client, content):
+    """Test: updated: ranges filter on the last update"""
+    assert len(note_titles(client, "python updated:>=2000-01-01")) == 4
+    assert note_titles(client, "python updated:<2000") == []
+
+def test_filter_only_query(client, content):
+    """Test: a query of filters only lists the matching documents"""
+    response = client.get(f"/api/users/{USER_ID}/search", query_string={"q": "notebook:Personal label:fun"})
+    assert response.status_code == 200
+    assert response.json["query"] == "notebook:Personal label:fun"
+    assert sorted(note["title"] for note in response.json["results"]["notes"]) == ["Python games", "Recipes"]
+
+def test_explain(client, content):
+    """Test: explain=1 returns the compiled plan without searching"""
+    response = client.get(f"/api/users/{USER_ID}/search",
+                          query_string={"q": "python notebook:Work updated:>2026-01-01", "explain": "1"})
+    assert response.status_code == 200
+    plan = response.json["plan"]
+    assert "results" not in response.json
+    notes_filter = plan["filters"]["notes"]
+    assert notes_filter["user_id"] == USER_ID
+    # The notebook equality comes before the date range
+    assert list(notes_filter["$and"][0]) == ["notebook_id"]
+    assert list(notes_filter["$and"][1]) == ["updated_at"]
+    assert notes_filter["$and"][0]["notebook_id"]["$in"] == [content["Work"]]
+
+def test_invalid_query(client):
+    """Test: syntax errors answer 400"""
+    response = client.get(f"/api/users/{USER_ID}/search", query_string={"q": "(python"})
+    assert response.status_code == 400
+    assert "Invalid search query" in response.json["message"]
@@ -0,0 +1,212 @@
+# Testing semantic search
+import pytest
+from pymongo import MongoClient
+from app import app, init_db
+import app as app_module
+from search import reset_search_backend
+
+np = pytest.importorskip("numpy")
+
+import semantic
+from semantic import LsaModel, VectorIndex, hashed_features
+
+# Use a dedicated test database
+TEST_DB_NAME = "note_app_semantic_test"
+
+CAR_NOTES = [
+    ("Car maintenance", "change the engine oil of the car and check the tyres"),
+    ("Buying a car", "compare engine power, tyres and fuel use of each car model"),
+    ("Vehicle inspection", "the vehicle needs new tyres and an engine check"),
+    ("Road trip", "drive the car on the highway, fuel stops for the vehicle"),
+    ("Electric vehicle", "battery range of an electric vehicle versus a fuel engine"),
+    ("Garage visit", "mechanic fixed the engine and rotated the tyres"),
+]
+FOOD_NOTES = [
+    ("Pasta recipe", "boil pasta, add tomato sauce and basil"),
+    ("Baking bread", "flour, yeast, water and an oven at high heat"),
+    ("Tomato soup", "simmer tomato with onion and basil, serve with bread"),
+    ("Pizza night", "dough from flour and yeast, tomato sauce, bake in the oven"),
+    ("Salad", "lettuce, tomato, olive oil and basil"),
+    ("Risotto", "rice cooked slowly with onion and stock"),
+]
+
+@pytest.fixture(scope="function")
+def client(tmp_path):
+    """Test client using a real test database and the inverted index backend"""
+    # Configure app for testing
+    app.config["TESTING"] = True
+    app.config["SECRET_KEY"] = "test_secret_key"
+    app.config["MONGO_URI"] = f"mongodb://localhost:27017/{TEST_DB_NAME}"
+    app.config["SEARCH_BACKEND"] = "inverted"
+    app.config["SEARCH_INDEX_DIR"] = str(tmp_path)
+    reset_search_backend(app)
+
+    # Clean the database before the test
+    mongo_client = MongoClient(app.config["MONGO_URI"])
+    mongo_client.drop_database(TEST_DB_NAME)
+
+    # Initialize the database
+    init_db(app)
+
+    # Create test client
+    with app.test_client() as client:
+        yield client
+
+    # Clean up after the test
+    reset_search_backend(app)
+    app.config["SEARCH_BACKEND"] = "mongo"
+    mongo_client.drop_database(TEST_DB_NAME)
+    mongo_client.close()
+
+def create_notes(client, user_id, notes):
+    """Create notes in one section, returns (notebook_id, section_id, note ids)"""
+    nb_response = client.post(f"/api/users/{user_id}/notebooks", json={"name": "Semantic Notebook"})
+    notebook_id = nb_response.json["notebook"]["_id"]
+    section_response = client.post(f"/api/users/{user_id}/notebooks/{notebook_id}/sections", json={"title": "Topics"})
+    section_id = section_response.json["section"]["_id"]
+    note_ids = []
+    for title, content in notes:
+        response = client.post(
+            f"/api/users/{user_id}/notebooks/{notebook_id}/sections/{section_id}/notes",
+            json={"title": title, "content": content}
+        )
+        note_ids.append(response.json["note"]["_id"])
+    return notebook_id, section_id, note_ids
+
+def note_titles(response):
+    return [note["title"] for note in response.json["results"]["notes"]]
+
+def build_index(notes):
+    rows = [hashed_features(title, content) for title, content in notes]
+    model = LsaModel.fit(rows)
+    index = VectorIndex(model, model.components.shape[1])
+    for i, vector in enumerate(model.transform(rows)):
+        index.upsert(str(i), vector, "notebook", "section")
+    return model, index
+
+# --- Vector Index Tests ---
+
+def test_similar_notes_share_a_topic():
+    """Test: a query word ranks notes of its topic first, including notes without the word"""
+    notes = CAR_NOTES + FOOD_NOTES
+    model, index = build_index(notes)
+    results = index.query(model.transform([hashed_features("vehicle", "")])[0], len(notes))
+    titles = [notes[int(note_id)][0] for similarity, note_id in results if similarity > 0.3]
+    assert "Road trip" in titles
+    assert not set(titles) & {title for title, _ in FOOD_NOTES}
+
+def test_vectors_are_stored_as_float16():
+    """Test: the matrix is float16, grows with inserts and stays dense on removal"""
+    notes = (CAR_NOTES + FOOD_NOTES) * 8
+    model, index = build_index(notes)
+    assert index.vectors.dtype == np.float16
+    assert len(index) == len(notes)
+
+    index.remove("0")
+    assert len(index) == len(notes) - 1
+    assert "0" not in index.ids
+    # The last note moved into the freed row
+    assert index.ids[0] == str(len(notes) - 1)
+    assert index.rows[str(len(notes) - 1)] == 0
+
+def test_ivf_matches_brute_force():
+    """Test: the clustered index finds the same best match as a full scan"""
+    rng = np.random.default_rng(1)
+    vectors = rng.standard_normal((2000, 16)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    index = VectorIndex(None, 16)
+    for i, vector in enumerate(vectors):
+        index.upsert(str(i), vector, "notebook", "section")
+
+    query = vectors[42]
+    brute_force = index.query(query, 5)
+    index.train_ivf()
+    assert index.query(query, 5)[0][1] == brute_force[0][1] == "42"
+
+# --- Endpoint Tests ---
+
+def test_semantic_mode_finds_related_notes(client):
+    """Test: semantic mode adds notes about the query topic that keyword search misses"""
+    user_id = "semantic_user"
+    create_notes(client, user_id, CAR_NOTES + FOOD_NOTES)
+
+    keyword = client.get(f"/api/users/{user_id}/search?q=vehicle")
+    assert "Road trip" in note_titles(keyword)
+    assert "Garage visit" not in note_titles(keyword)
+
+    response = client.get(f"/api/users/{user_id}/search?q=vehicle&mode=semantic")
+    assert response.status_code == 200
+    assert response.json["mode"] == "semantic"
+    assert response.json["semantic_ready"] is True
+    titles = note_titles(response)
+    # Keyword matches stay on top, the blend only adds related notes after them
+    assert set(titles[:3]) == {"Vehicle inspection", "Road trip", "Electric vehicle"}
+    assert not set(titles) & {title for title, _ in FOOD_NOTES}
+    notes = response.json["results"]["notes"]
+    assert all("semantic_score" in note for note in notes)
+    assert notes == sorted(notes, key=lambda note: note["score"], reverse=True)
+
+def test_semantic_mode_follows_writes(client):
+    """Test: created and deleted notes are reflected without rebuilding"""
+    user_id = "semantic_writes_user"
+    notebook_id, section_id, note_ids = create_notes(client, user_id, CAR_NOTES + FOOD_NOTES)
+    client.get(f"/api/users/{user_id}/search?q=basil&mode=semantic")
+
+    client.delete(f"/api/users/{user_id}/notebooks/{notebook_id}/sections/{section_id}/notes/{note_ids[6]}")
+    client.post(
+        f"/api/users/{user_id}/notebooks/{notebook_id}/sections/{section_id}/notes",
+        json={"title": "Pesto", "content": "basil, olive oil and pine nuts with pasta"}
+    )
+    titles = note_titles(client.get(f"/api/users/{user_id}/search?q=basil&mode=semantic"))
+    assert "Pesto" in titles
+    assert "Pasta recipe" not in titles
+
+    semantic = app.extensions["semantic_search"]
+    assert len(semantic._users[user_id]) == len(CAR_NOTES + FOOD_NOTES)
+
+def test_rebuild_keeps_writes_made_while_building(client, monkeypatch):
+    """Test: writes made after a rebuild read the notes are applied to the new index"""
+    user_id = "semantic_rebuild_user"
+    notebook_id, section_id, note_ids = create_notes(client, user_id, CAR_NOTES + FOOD_NOTES)
+    notes_url = f"/api/users/{user_id}/notebooks/{notebook_id}/sections/{section_id}/notes"
+    client.get(f"/api/users/{user_id}/search?q=basil&mode=semantic")
+    search = app.extensions["semantic_search"]
+    created = []
+
+    def fit_during_writes(rows):
+        # The notes were read, these writes are not in the snapshot
+        if not created:
+            created.append(client.post(notes_url, json={"title": "Pesto", "content": "basil and pine nuts"})
+                           .json["note"]["_id"])
+            client.delete(f"{notes_url}/{note_ids[6]}")
+        return original_fit(rows)
+
+    original_fit = LsaModel.fit
+    monkeypatch.setattr(semantic.LsaModel, "fit", staticmethod(fit_during_writes))
+    collections = (app_module.notebooks_collection, app_module.sections_collection, app_module.notes_collection)
+    index = search.build(user_id, collections)
+
+    assert search._users[user_id] is index
+    assert created[0] in index.rows
+    assert note_ids[6] not in index.rows
+    assert user_id not in search._building
+
+def test_semantic_mode_respects_labels_and_users(client):
+    """Test: related notes of other users or without the requested labels are not returned"""
+    create_notes(client, "semantic_other_user", CAR_NOTES)
+    user_id = "semantic_label_user"
+    notebook_id, section_id, note_ids = create_notes(client, user_id, CAR_NOTES + FOOD_NOTES)
+    client.patch(
+        f"/api/users/{user_id}/notebooks/{notebook_id}/sections/{section_id}/notes/{note_ids[1]}/labels",
+        json={"labels": ["cars"]}
+    )
+
+    response = client.get(f"/api/users/{user_id}/search?q=engine&labels=cars&mode=semantic")
+    notes = response.json["results"]["notes"]
+    assert [note["title"] for note in notes] == ["Buying a car"]
+    assert all(note["user_id"] == user_id for note in notes)
+
+def test_invalid_mode(client):
+    """Test: unknown search modes are rejected"""
+    response = client.get("/api/users/semantic_user/search?q=vehicle&mode=neural")
+    assert response.status_code == 400
@@ -0,0 +1,98 @@
+# Testing the slow query log and its admin endpoint
+import pytest
+from pymongo import MongoClient
+from app import app, init_db
+from slow_queries import SlowQueryListener, query_shape, redact, slow_query_listener, summarize_explain
+
+# Use a dedicated test database
+TEST_DB_NAME = "note_app_slow_queries_test"
+
+@pytest.fixture(scope="function")
+def client(tmp_path):
+    """Test client logging every operation as slow"""
+    # Configure app for testing
+    app.config["TESTING"] = True
+    app.config["SECRET_KEY"] = "test_secret_key"
+    app.config["MONGO_URI"] = f"mongodb://localhost:27017/{TEST_DB_NAME}"
+    app.config["SLOW_QUERY_THRESHOLD_MS"] = 0
+    app.config["SLOW_QUERY_LOG"] = str(tmp_path / "slow_queries.log")
+
+    # Clean the database before the test
+    mongo_client = MongoClient(app.config["MONGO_URI"])
+    mongo_client.drop_database(TEST_DB_NAME)
+
+    # Initialize the database
+    init_db(app)
+    slow_query_listener.clear()
+
+    # Create test client
+    with app.test_client() as client:
+        yield client
+
+    # Clean up after the test
+    app.config["SLOW_QUERY_THRESHOLD_MS"] = 100
+    slow_query_listener.configure(100)
+    mongo_client.drop_database(TEST_DB_NAME)
+    mongo_client.close()
+
+# --- Shape Tests ---
+
+def test_redact_keeps_operators_and_fields():
+    """Test: literal values are redacted but operators and field names are kept"""
+    shape = redact({"user_id": "abc", "labels": {"$all": ["x", "y"]}, "$text": {"$search": "secret words"}})
+    assert shape == {"user_id": "?", "labels": {"$all": ["?"]}, "$text": {"$search": "?"}}
+
+def test_query_shape_same_for_different_values():
+    """Test: queries differing only in values share a shape"""
+    first = query_shape("find", {"find": "notes", "filter": {"user_id": "a", "section_id": "1"}, "sort": {"updated_at": -1}})
+    second = query_shape("find", {"find": "notes", "filter": {"user_id": "b", "section_id": "2"}, "sort": {"updated_at": -1}})
+    assert first == second
+    assert first["sort"] == {"updated_at": -1}
+
+def test_summarize_explain_detects_collscan_and_sort():
+    """Test: explain summary flags collection scans and in-memory sorts"""
+    explain = {
+        "queryPlanner": {"winningPlan": {"stage": "SORT", "inputStage": {"stage": "COLLSCAN"}}},
+        "executionStats": {"nReturned": 3, "executionTimeMillis": 12, "totalKeysExamined": 0, "totalDocsExamined": 5000},
+    }
+    summary = summarize_explain(explain)
+    assert summary["collscan"] is True
+    assert summary["in_memory_sort"] is True
+    assert summary["docs_examined"] == 5000
+
+def test_listener_groups_occurrences_by_shape():
+    """Test: repeated slow operations of one shape are counted on one entry"""
+    listener = SlowQueryListener(threshold_ms=0)
+    listener.record("db", "find", {"find": "notes", "filter": {"user_id": "a"}}, 150.0)
+    listener.record("db", "find", {"find": "notes", "filter": {"user_id": "b"}}, 250.0)
+    entries = listener.snapshot()
+    assert len(entries) == 1
+    assert entries[0]["count"] == 2
+    assert entries[0]["max_ms"] == 250.0
+
+# --- Endpoint Tests ---
+
+def test_slow_queries_endpoint_lists_explained_shapes(client):
+    """Test: slow listing queries show up with their explain summary"""
+    client.post("/api/users/slow_user/notebooks", json={"name": "Slow Notebook"})
+    client.get("/api/users/slow_user/notebooks")
+    slow_query_listener.flush()
+
+    response = client.get("/admin/slow-queries")
+    assert response.status_code == 200
+    finds = [entry for entry in response.json["slow_queries"]
+             if entry["command"] == "find" and entry["collection"] == "notebooks"]
+    assert finds
+    assert finds[0]["shape"]["filter"] == {"user_id": "?"}
+    assert finds[0]["explain"]["n_returned"] == 1
+    assert "slow_user" not in str(response.json)
+
+def test_slow_queries_endpoint_requires_admin_token(client):
+    """Test: the endpoint is protected once an admin token is configured"""
+    app.config["ADMIN_TOKEN"] = "admin-secret"
+    try:
+        assert client.get("/admin/slow-queries").status_code == 403
+        response = client.get("/admin/slow-queries", headers={"X-Admin-Token": "admin-secret"})
+        assert response.status_code == 200
+    finally:
+        app.config["ADMIN_TOKEN"] = ""
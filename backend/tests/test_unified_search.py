@@ -0,0 +1,150 @@
+# Testing unified search results ranked across notebooks, sections and notes
+import datetime
+import pytest
+from pymongo import MongoClient
+from app import app, init_db
+import app as app_module
+from search import MongoTextSearch, merge_ranked, reset_search_backend
+
+# Use a dedicated test database
+TEST_DB_NAME = "note_app_unified_search_test"
+
+USER_ID = "unified_user"
+
+@pytest.fixture(scope="function", params=["mongo", "inverted"])
+def client(request, tmp_path):
+    """Test client using a real test database, once per search backend"""
+    # Configure app for testing
+    app.config["TESTING"] = True
+    app.config["SECRET_KEY"] = "test_secret_key"
+    app.config["MONGO_URI"] = f"mongodb://localhost:27017/{TEST_DB_NAME}"
+    app.config["SEARCH_BACKEND"] = request.param
+    app.config["SEARCH_INDEX_DIR"] = str(tmp_path)
+    reset_search_backend(app)
+
+    # Clean the database before the test
+    mongo_client = MongoClient(app.config["MONGO_URI"])
+    mongo_client.drop_database(TEST_DB_NAME)
+
+    # Initialize the database
+    init_db(app)
+
+    # Create test client
+    with app.test_client() as client:
+        yield client
+
+    # Clean up after the test
+    reset_search_backend(app)
+    app.config["SEARCH_BACKEND"] = "mongo"
+    mongo_client.drop_database(TEST_DB_NAME)
+    mongo_client.close()
+
+@pytest.fixture
+def content(client):
+    """Many notebooks mentioning python once, and one note all about it"""
+    notebook_ids = []
+    for i in range(12):
+        response = client.post(f"/api/users/{USER_ID}/notebooks", json={"name": f"Python scratch notebook {i}",
+                                                                         "labels": ["misc"]})
+        notebook_ids.append(response.json["notebook"]["_id"])
+    notebook_id = notebook_ids[0]
+    section_response = client.post(f"/api/users/{USER_ID}/notebooks/{notebook_id}/sections",
+                                   json={"title": "Languages", "labels": ["misc"]})
+    section_id = section_response.json["section"]["_id"]
+    client.post(
+        f"/api/users/{USER_ID}/notebooks/{notebook_id}/sections/{section_id}/notes",
+        json={"title": "Python", "content": "python generators, python decorators and python typing",
+              "labels": ["misc"]}
+    )
+    return notebook_id, section_id
+
+def search(client, params):
+    return client.get(f"/api/users/{USER_ID}/search", query_string=params)
+
+# --- Merge Tests ---
+
+def test_merge_ranked_stops_reading_streams():
+    """Test: streams are only read as far as the global top needs"""
+    consumed = []
+
+    def stream(group, scores):
+        for score in scores:
+            consumed.append((group, score))
+            yield {"score": score}
+
+    merged = merge_ranked({
+        "notebooks": stream("notebooks", [9, 8, 7, 6, 5, 4]),
+        "sections": stream("sections", [3, 2, 1]),
+        "notes": stream("notes", [10, 1]),
+    }, 3)
+    assert [(doc["type"], doc["score"]) for doc in merged] == [("note", 10), ("notebook", 9), ("notebook", 8)]
+    # Sections were only asked for their best document
+    assert [score for group, score in consumed if group == "sections"] == [3]
+    assert len([score for group, score in consumed if group == "notebooks"]) <= 4
+
+class FakeCursor(list):
+    """Text search results of one collection, already sorted by score"""
+
+    def batch_size(self, size):
+        return self
+
+    def close(self):
+        pass
+
+def test_text_scores_are_normalized_per_field(monkeypatch):
+    """Test: a note only outranks a notebook when its match is as strong per indexed field"""
+    streams = {
+        "notebooks": [{"name": "Python", "score": 0.75}],
+        "sections": [],
+        # textScore sums the title and content scores of notes
+        "notes": [{"title": "Strong", "score": 1.8}, {"title": "Weak", "score": 1.2}],
+    }
+    collections = ("notebooks", "sections", "notes")
+    monkeypatch.setattr(MongoTextSearch, "_cursor",
+                        lambda self, collection, *args: FakeCursor(dict(doc) for doc in streams[collection]))
+    merged = MongoTextSearch().unified_search(USER_ID, "python", None, collections, limit=3)
+    assert [(doc["type"], doc["score"]) for doc in merged] == [("note", 0.9), ("notebook", 0.75), ("note", 0.6)]
+
+# --- Endpoint Tests ---
+
+def test_strong_note_outranks_weak_notebooks(client, content):
+    """Test: a note matching the query throughout comes before notebooks mentioning it once"""
+    response = search(client, {"q": "python", "unified": "1", "limit": "5"})
+    assert response.status_code == 200
+    data = response.json
+    assert data["unified"] is True
+    assert data["total_results"] == 5
+    results = data["results"]
+    assert results[0]["type"] == "note"
+    assert results[0]["title"] == "Python"
+    assert "content_preview" in results[0] and "content" not in results[0]
+    assert [doc["type"] for doc in results[1:]] == ["notebook"] * 4
+    scores = [doc["score"] for doc in results]
+    assert scores == sorted(scores, reverse=True)
+
+def test_unified_default_limit(client, content):
+    """Test: without a limit the best 20 results are returned"""
+    data = search(client, {"q": "python", "unified": "1"}).json
+    assert data["total_results"] == 13
+    assert {doc["type"] for doc in data["results"]} == {"notebook", "note"}
+
+def test_unified_label_only_is_most_recent_first(client, content):
+    """Test: label-only unified results are ordered by last update across types"""
+    # Documents created within the same millisecond would tie, spread the updates out
+    now = datetime.datetime.utcnow()
+    collections = (app_module.notebooks_collection, app_module.sections_collection, app_module.notes_collection)
+    for offset, collection in enumerate(collections):
+        # In creation order
+        for rank, doc in enumerate(collection.find({"user_id": USER_ID}).sort("_id", 1)):
+            collection.update_one({"_id": doc["_id"]},
+                                  {"$set": {"updated_at": now + datetime.timedelta(seconds=offset * 100 + rank)}})
+    data = search(client, {"labels": "misc", "unified": "1", "limit": "3"}).json
+    assert [doc["type"] for doc in data["results"]] == ["note", "section", "notebook"]
+    assert data["results"][2]["name"] == "Python scratch notebook 11"
+
+def test_unified_invalid_parameters(client):
+    """Test: limits out of range and unified pagination are rejected"""
+    for limit in ("0", "101", "many"):
+        assert search(client, {"q": "python", "unified": "1", "limit": limit}).status_code == 400
+    assert search(client, {"q": "python", "unified": "1", "facets": "1"}).status_code == 400
+    assert search(client, {"q": "python", "unified": "1", "offset": "20"}).status_code == 400
@@ -0,0 +1,81 @@
+import re
+from functools import lru_cache
+
+'''
+The code in this file splits note text into search terms. It is shared by the
+search engines so documents and queries are always tokenized the same way.
+Code is common in notes, so identifiers are indexed whole and by their parts:
+getUserName gives getusername, get, user and name.
+'''
+
+WORD_RE = re.compile(r"\w+")
+IDENTIFIER_PART_RE = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+")
+
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have he her his i if in into is it its "
+    "me my no not of on or our she so than that the their them then there these they "
+    "this to was we were what when which who will with you your".split()
+)
+
+
+def stem(term):
+    """Light English suffix stripping so notes/note and parses/parsing/parsed/parse match"""
+    if len(term) <= 3 or not term.isalpha():
+        return term
+    if term.endswith("ies") and len(term) > 4:
+        return term[:-3] + "y"
+    if term.endswith(("sses", "ches", "shes", "xes", "zes")):
+        term = term[:-2]
+    elif term.endswith("s") and not term.endswith(("ss", "us", "is")):
+        term = term[:-1]
+    else:
+        for suffix, min_length in (("ing", 6), ("ed", 5)):
+            if term.endswith(suffix) and len(term) >= min_length:
+                term = term[:-len(suffix)]
+                # running -> runn -> run
+                if len(term) > 2 and term[-1] == term[-2] and term[-1] not in "lsz":
+                    term = term[:-1]
+                break
+    # parse -> pars, so it meets parsed and parsing
+    if len(term) > 4 and term.endswith("e"):
+        term = term[:-1]
+    return term
+
+
+def _identifier_parts(word):
+    """getUserName -> get, User, Name and parse_http_header -> parse, http, header"""
+    if not word.isascii():
+        return []
+    parts = []
+    for chunk in word.split("_"):
+        parts.extend(IDENTIFIER_PART_RE.findall(chunk))
+    return parts if len(parts) > 1 else []
+
+
+@lru_cache(maxsize=65536)
+def _word_terms(word, stemmed):
+    lowered = word.lower()
+    parts = _identifier_parts(word)
+    terms = []
+    if lowered not in STOPWORDS:
+        # Identifiers are kept as written, only their parts are stemmed
+        terms.append(lowered if parts or not stemmed else stem(lowered))
+    for part in parts:
+        part = part.lower()
+        if len(part) > 1 and part not in STOPWORDS:
+            terms.append(stem(part) if stemmed else part)
+    return tuple(terms)
+
+
+def tokenize(text, stemmed=True):
+    """
+    Index terms of text, whole identifiers followed by their parts.
+    stemmed=False keeps the words as written (lowercased).
+    """
+    terms = []
+    if not text:
+        return terms
+    # Words repeat a lot across notes, so their terms are computed once
+    for word in WORD_RE.findall(text):
+        terms.extend(_word_terms(word, stemmed))
+    return terms
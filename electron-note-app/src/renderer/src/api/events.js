@@ -0,0 +1,28 @@
+import { getUserId, CLIENT_ID } from './notebook'
+const API_URL = import.meta.env.VITE_API_URL
+
+// Live changes made from other windows or devices, pushed by the server over Server-Sent Events.
+// onChange gets { type, action, id, notebook_id, section_id, updated_at } for every change,
+// onReset is called when changes were missed and the lists have to be fetched again.
+// EventSource reconnects by itself and resumes after the last event it received.
+// Returns a function that closes the connection
+export const subscribeToChanges = (onChange, onReset) => {
+  const userId = getUserId()
+  if (!userId) return () => {}
+
+  const source = new EventSource(`${API_URL}/users/${userId}/events`)
+
+  source.addEventListener('change', (event) => {
+    const change = JSON.parse(event.data)
+    if (change.client_id === CLIENT_ID) return
+    onChange(change)
+  })
+
+  source.addEventListener('reset', () => onReset())
+
+  source.onerror = () => {
+    console.log('Change feed disconnected, reconnecting...')
+  }
+
+  return () => source.close()
+}
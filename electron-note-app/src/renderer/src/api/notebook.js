@@ -1,11 +1,15 @@
 const API_URL = import.meta.env.VITE_API_URL
 
+// Identifies this window in the server's change events, so it can skip its own changes
+export const CLIENT_ID = crypto.randomUUID()
+
 // Helper to get auth headers
 export const getAuthHeaders = () => {
   const token = localStorage.getItem('token')
   return {
     'Content-Type': 'application/json',
-    Authorization: token ? `Bearer ${token}` : ''
+    Authorization: token ? `Bearer ${token}` : '',
+    'X-Client-Id': CLIENT_ID
   }
 }
 
@@ -164,13 +168,16 @@ export const updateNote = async (notebookId, sectionId, noteId, title, content)
 // Helper function
 const wait = (ms) => new Promise((resolve) => setTimeout(resolve, ms))
 
-// New create note that doesn't throw error right away because api is slow
+// New create note that doesn't throw error right away because api is slow.
+// Every attempt sends the same Idempotency-Key, so a retry after a lost response
+// gets the note created by the first attempt instead of creating a second one
 export const createNote = async (notebookId, sectionId, title, content = '') => {
   const userId = getUserId()
   if (!userId) throw new Error('User not authenticated')
 
   // Maximum retry attempts
   const MAX_RETRIES = 3
+  const idempotencyKey = crypto.randomUUID()
   let attempt = 0
 
   while (attempt < MAX_RETRIES) {
@@ -185,7 +192,7 @@ export const createNote = async (notebookId, sectionId, title, content = '') =>
         `${API_URL}/users/${userId}/notebooks/${notebookId}/sections/${sectionId}/notes`,
         {
           method: 'POST',
-          headers: getAuthHeaders(),
+          headers: { ...getAuthHeaders(), 'Idempotency-Key': idempotencyKey },
           body: JSON.stringify({ title, content }),
           signal: controller.signal
         }
@@ -196,41 +203,27 @@ export const createNote = async (notebookId, sectionId, title, content = '') =>
       // Process the response
       const data = await response.json()
 
+      // 409: the first attempt is still being processed, retry to get its result
       if (!response.ok) {
-        throw new Error(data.message || 'Failed to create note')
+        const error = new Error(data.message || 'Failed to create note')
+        error.retryable = response.status === 409 || response.status >= 500
+        throw error
       }
 
       console.log('Note created successfully')
       return data.note
     } catch (err) {
-      // Handle connection resets specially
-      if (
-        err.name === 'TypeError' &&
-        (err.message.includes('Failed to fetch') || err.message.includes('NetworkError'))
-      ) {
-        console.log('Connection reset detected, checking if note was created...')
-
-        // Wait before checking
-        await wait(2000 * attempt)
-
-        try {
-          // Try to fetch notes to see if our note was created
-          const notes = await getNotes(notebookId, sectionId)
-          const potentialNewNote = notes.find((n) => n.title === title)
-
-          if (potentialNewNote) {
-            console.log('Note was actually created despite connection reset')
-            return potentialNewNote
-          }
-        } catch (checkErr) {
-          console.error('Error checking if note was created:', checkErr)
-        }
-      }
-
       console.error(`Error creating note (attempt ${attempt}/${MAX_RETRIES}):`, err)
 
+      // Connection resets and timeouts are retried, as are errors the server marked retryable
+      const retryable =
+        err.retryable ||
+        err.name === 'AbortError' ||
+        (err.name === 'TypeError' &&
+          (err.message.includes('Failed to fetch') || err.message.includes('NetworkError')))
+
       // If we've reached max attempts, throw the error
-      if (attempt >= MAX_RETRIES) {
+      if (!retryable || attempt >= MAX_RETRIES) {
         throw err
       }
 
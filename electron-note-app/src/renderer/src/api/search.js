@@ -2,7 +2,26 @@ import { getCurrentUser } from './auth'
 
 const API_URL = import.meta.env.VITE_API_URL
 
+// How long a search may take, sent to the backend so it stops working on it too
+const SEARCH_TIMEOUT_MS = 5000
+
+// Only the latest search matters, starting a new one aborts the previous request
+let inFlight = null
+
+const supersededError = () => {
+  const error = new Error('Search superseded')
+  error.name = 'AbortError'
+  return error
+}
+
 export const searchContent = async (query, labels = []) => {
+  if (inFlight) {
+    inFlight.abort()
+  }
+  const controller = new AbortController()
+  inFlight = controller
+  const timeoutId = setTimeout(() => controller.abort(), SEARCH_TIMEOUT_MS)
+
   try {
     const user = getCurrentUser()
     if (!user) {
@@ -34,10 +53,17 @@ export const searchContent = async (query, labels = []) => {
     const response = await fetch(`${API_URL}/users/${userId}/search?${searchParams.toString()}`, {
       headers: {
         Authorization: `Bearer ${token}`,
-        'Content-Type': 'application/json'
-      }
+        'Content-Type': 'application/json',
+        'X-Request-Deadline': String(SEARCH_TIMEOUT_MS)
+      },
+      signal: controller.signal
     })
 
+    // 409: the backend dropped this search for a newer one
+    if (response.status === 409) {
+      throw supersededError()
+    }
+
     if (!response.ok) {
       throw new Error(`Search failed with status: ${response.status}`)
     }
@@ -46,7 +72,18 @@ export const searchContent = async (query, labels = []) => {
     // console.log('Search results:', data) // Log results for debugging
     return data
   } catch (error) {
+    if (error.name === 'AbortError' && inFlight !== controller) {
+      throw supersededError()
+    }
+    if (error.name === 'AbortError') {
+      throw new Error('Search timed out')
+    }
     console.error('Search API error:', error)
     throw error
+  } finally {
+    clearTimeout(timeoutId)
+    if (inFlight === controller) {
+      inFlight = null
+    }
   }
 }
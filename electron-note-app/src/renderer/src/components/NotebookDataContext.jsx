@@ -3,7 +3,7 @@ This code block is for state management.
 It keeps the state lined up with the database using the api calls we implemented
 It is necessary for keeping track of the selecte notebook, section, note and various modes
 */
-import { createContext, useContext, useState } from 'react'
+import { createContext, useContext, useEffect, useRef, useState } from 'react'
 import {
   getUserNotebooks,
   createNotebook as apiCreateNotebook,
@@ -14,6 +14,7 @@ import {
   updateNote as apiUpdateNote
 } from '../api/notebook'
 import { deleteNotebook, deleteSection, deleteNote } from '../api/delete'
+import { subscribeToChanges } from '../api/events'
 
 const NotebookDataContext = createContext()
 
@@ -26,6 +27,10 @@ export const NotebookDataProvider = ({ children }) => {
   const [isLoading, setIsLoading] = useState(false)
   const [error, setError] = useState(null)
 
+  // The notebook and section whose sections and notes are loaded, live changes to them are applied
+  const currentNotebookId = useRef(null)
+  const currentSectionId = useRef(null)
+
   const fetchNotebooks = async () => {
     setIsLoading(true)
     setError(null)
@@ -49,6 +54,7 @@ export const NotebookDataProvider = ({ children }) => {
     setError(null)
     try {
       const data = await getSections(notebookId)
+      currentNotebookId.current = notebookId
       setSections(data)
       return data
     } catch (err) {
@@ -67,6 +73,7 @@ export const NotebookDataProvider = ({ children }) => {
     setError(null)
     try {
       const data = await getNotes(notebookId, sectionId)
+      currentSectionId.current = sectionId
       setNotes(data)
       return data
     } catch (err) {
@@ -229,6 +236,59 @@ export const NotebookDataProvider = ({ children }) => {
     }
   }
 
+  // Live updates: changes made in other windows or devices are pushed by the server,
+  // only the list a change belongs to is fetched again and only if it is loaded
+  useEffect(() => {
+    const refreshNotebooks = () => getUserNotebooks().then(setNotebooks)
+    const refreshSections = () =>
+      currentNotebookId.current && getSections(currentNotebookId.current).then(setSections)
+    const refreshNotes = () =>
+      currentNotebookId.current &&
+      currentSectionId.current &&
+      getNotes(currentNotebookId.current, currentSectionId.current).then(setNotes)
+
+    const applyChange = (change) => {
+      const refresh = async () => {
+        if (change.type === 'notebook') {
+          if (change.action === 'deleted') {
+            setNotebooks((prev) => prev.filter((nb) => nb._id !== change.id))
+          } else {
+            await refreshNotebooks()
+          }
+        } else if (change.type === 'section') {
+          if (change.action === 'deleted') {
+            setSections((prev) => prev.filter((s) => s._id !== change.id))
+          } else if (change.notebook_id === currentNotebookId.current) {
+            await refreshSections()
+          } else {
+            // Moved to another notebook
+            setSections((prev) => prev.filter((s) => s._id !== change.id))
+          }
+        } else if (change.type === 'note') {
+          if (change.action === 'deleted') {
+            setNotes((prev) => prev.filter((n) => n._id !== change.id))
+          } else if (change.section_id === currentSectionId.current) {
+            await refreshNotes()
+          } else if (change.section_id) {
+            // Moved to another section
+            setNotes((prev) => prev.filter((n) => n._id !== change.id))
+          } else {
+            await refreshNotes()
+          }
+        }
+      }
+      refresh().catch((err) => console.error('Error applying live change:', err))
+    }
+
+    const reload = () => {
+      Promise.all([refreshNotebooks(), refreshSections(), refreshNotes()]).catch((err) =>
+        console.error('Error reloading after missed changes:', err)
+      )
+    }
+
+    return subscribeToChanges(applyChange, reload)
+  }, [])
+
   const value = {
     notebooks,
     sections,
@@ -186,10 +186,14 @@ const SearchBar = () => {
         DEBUG && console.log('Used tags:', selectedLabels)
         setSearchResults(apiResults)
         setOpen(true)
+        setLoading(false)
       } catch (error) {
+        // A newer search replaced this one and will update the results
+        if (error.name === 'AbortError') {
+          return
+        }
         console.error('Search API error:', error)
         setError(error.message || 'Failed to search')
-      } finally {
         setLoading(false)
       }
     }